@@ -1,18 +1,22 @@
-from ninja import Router
-from typing import List
+from ninja import Query, Router
+from typing import Any, Dict, List
 from ninja.pagination import paginate, PageNumberPagination
 
-from .schemas import PayoutCreateSchema, PayoutUpdateSchema, PayoutResponseSchema
+from .metrics import PayoutMetrics
+from .models import Status
+from .routing import queue_stats
+from .schemas import PayoutCreateSchema, PayoutUpdateSchema, PayoutResponseSchema, PayoutFilterSchema
 from .services.payout_service import PayoutService
 
 router = Router(tags=["payouts-interface"])
+metrics_router = Router(tags=["payouts-metrics"])
 
 
 @router.get("/", response=List[PayoutResponseSchema])
 @paginate(PageNumberPagination, page_size=10)
-def list_payouts(request):
-    """Список всех заявок"""
-    return PayoutService.get_list_payouts()
+def list_payouts(request, filters: Query[PayoutFilterSchema]):
+    """Список заявок с фильтрами"""
+    return PayoutService.get_list_payouts(filters=filters)
 
 
 @router.get("/{payout_id}/", response=PayoutResponseSchema)
@@ -25,10 +29,18 @@ def get_payout(request, payout_id: str):
 def create_payout(request, payload: PayoutCreateSchema):
     """Создание заявки"""
     payout = PayoutService.create_payout(payload=payload)
-    PayoutService.execute_payout(str(payout.id))
+    if payout.status == Status.PENDING and payout.execute_at is None:
+        # Запланированные выплаты отправит планировщик, возможные дубликаты ждут проверки
+        PayoutService.execute_payout(str(payout.id))
     return payout
 
 
+@router.post("/{payout_id}/approve/", response=PayoutResponseSchema)
+def approve_payout(request, payout_id: str):
+    """Подтверждение заявки, задержанной как возможный дубликат"""
+    return PayoutService.approve_payout(payout_id=payout_id)
+
+
 @router.patch("/{payout_id}/", response=PayoutResponseSchema)
 def update_payout(request, payout_id: str, payload: PayoutUpdateSchema):
     """Обновление заявки"""
@@ -38,4 +50,16 @@ def update_payout(request, payout_id: str, payload: PayoutUpdateSchema):
 @router.delete("/{payout_id}/")
 def delete_payout(request, payout_id: str):
     """Удаление заявки"""
-    return PayoutService.delete_payout(payout_id=payout_id)
\ No newline at end of file
+    return PayoutService.delete_payout(payout_id=payout_id)
+
+
+@metrics_router.get("/queues/", response=Dict[str, Dict[str, Any]])
+def get_queue_metrics(request):
+    """Глубина и задержка очередей выплат"""
+    return queue_stats()
+
+
+@metrics_router.get("/{group}/", response=Dict[str, str])
+def get_metrics(request, group: str):
+    """Метрики фоновых процессов (reaper, ...)"""
+    return PayoutMetrics(group).snapshot()
@@ -0,0 +1,332 @@
+import asyncio
+import logging
+import queue
+import signal
+import socket
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timezone as dt_timezone
+
+from asgiref.sync import sync_to_async
+from celery import current_app
+from celery.utils.time import get_exponential_backoff_interval
+from django.conf import settings
+from django.db import close_old_connections
+from django.utils import timezone
+
+from .celery_services.async_processing_service import AsyncPayoutProcessingService
+from .celery_services.fair_scheduler import FairScheduler
+from .celery_services.payout_split_service import PayoutSplitService
+from .celery_services.payout_task_proccessing_service import ProcessingInProgress, StopProcessing
+from .metrics import PayoutMetrics
+from .models import PayoutDeadLetter
+from .tasks import payout_task, payout_part_task, finalize_split_payout
+
+logger = logging.getLogger(__name__)
+
+
+class BrokerConsumer(threading.Thread):
+    """
+    Получение сообщений Celery из брокера в отдельном потоке
+
+    Канал kombu не потокобезопасен, поэтому подтверждения (ack/reject)
+    передаются в этот поток через очередь и выполняются между чтениями.
+    prefetch_count ограничивает число неподтвержденных сообщений у воркера;
+    сообщения, отложенные до eta, окно не занимают (как у воркера Celery)
+    """
+
+    def __init__(self, queues, prefetch, deliver, app=None):
+        super().__init__(name='payout-broker-consumer', daemon=True)
+        self.app = app or current_app
+        self.queue_names = list(queues)
+        self.prefetch = prefetch
+        self.deliver = deliver
+        self.ready = threading.Event()
+        self.stopping = threading.Event()
+        self._settlements = queue.SimpleQueue()
+        self._holds = queue.SimpleQueue()
+        self._held = 0
+
+    def ack(self, message) -> None:
+        self._settlements.put((message, None))
+
+    def reject(self, message, requeue=True) -> None:
+        self._settlements.put((message, requeue))
+
+    def hold(self, delta) -> None:
+        """Изменить число отложенных до eta сообщений: окно prefetch расширяется на них"""
+        self._holds.put(delta)
+
+    def stop(self) -> None:
+        self.stopping.set()
+
+    def run(self):
+        with self.app.connection_for_read() as connection:
+            queues = [self.app.amqp.queues[name] for name in self.queue_names]
+            with connection.Consumer(queues, callbacks=[self._on_message], accept=['json'],
+                                     prefetch_count=self.prefetch) as consumer:
+                self.ready.set()
+                while not self.stopping.is_set():
+                    self._settle(consumer)
+                    try:
+                        connection.drain_events(timeout=0.05)
+                    except socket.timeout:
+                        pass
+                self._settle(consumer)
+        # Неподтвержденные сообщения брокер вернет в очередь при закрытии канала
+
+    def _on_message(self, body, message):
+        self.deliver(message)
+
+    def _settle(self, consumer):
+        held = self._held
+        while True:
+            try:
+                self._held += self._holds.get_nowait()
+            except queue.Empty:
+                break
+        if self._held != held:
+            consumer.qos(prefetch_count=self.prefetch + self._held)
+        while True:
+            try:
+                message, requeue = self._settlements.get_nowait()
+            except queue.Empty:
+                return
+            if requeue is None:
+                message.ack()
+            else:
+                message.reject(requeue=requeue)
+
+
+class AsyncPayoutWorker:
+    """
+    Движок обработки выплат на asyncio - альтернатива воркеру Celery
+
+    Читает те же очереди, что и воркеры Celery, и обрабатывает payout_task
+    конвейерами AsyncPayoutProcessingService в одном цикле событий: пока
+    выплата ждет этапа, цикл ведет остальные. Одновременно обрабатывается
+    не больше concurrency выплат (столько же сообщений берется из брокера).
+    Повторы (с паузой retry_backoff; сообщение с eta ждет срока в памяти,
+    не занимая слот), dead letter, метрики задержки очереди и слоты
+    справедливого диспетчера - как у payout_task. Задачи других типов пересылаются в
+    очередь Celery по умолчанию без изменений (тело и заголовки, в том числе
+    колбэки и chord, сохраняются)
+    """
+
+    def __init__(self, queues=None, concurrency=None, app=None, service_factory=None):
+        self.queues = queues or settings.PAYOUT_ASYNC_WORKER_QUEUES
+        self.concurrency = concurrency or settings.PAYOUT_ASYNC_WORKER_CONCURRENCY
+        self.app = app or current_app
+        self.service_factory = service_factory or self._service
+        if self.app.conf.task_default_queue in self.queues:
+            # Чужие задачи пересылаются в очередь по умолчанию и вернулись бы обратно
+            raise ValueError(f"Асинхронный воркер не читает очередь по умолчанию {self.app.conf.task_default_queue}")
+        self.processed = 0
+        # Выплаты, задача которых переопубликована для повтора: слот мерчанта остается за ними
+        self._retrying = set()
+        self._stopping = None
+
+    @staticmethod
+    def _service(payout_id):
+        splitter = PayoutSplitService(part_task=payout_part_task, finalize_task=finalize_split_payout)
+        return AsyncPayoutProcessingService(payout_id, splitter=splitter)
+
+    def stop(self) -> None:
+        """Мягкая остановка: новые сообщения не берутся, начатые выплаты дорабатываются"""
+        if self._stopping is not None:
+            self._stopping.set()
+
+    async def run(self, max_messages=None) -> int:
+        """Обработка сообщений до stop() (или max_messages); возвращает число обработанных"""
+        loop = asyncio.get_running_loop()
+        # Пул для блокирующих вызовов (Redis, клиент платежной системы) по размеру конкурентности
+        loop.set_default_executor(ThreadPoolExecutor(max_workers=self.concurrency, thread_name_prefix='payout-async'))
+        self._stopping = asyncio.Event()
+        inbox = asyncio.Queue()
+        consumer = BrokerConsumer(
+            self.queues, prefetch=self.concurrency, app=self.app,
+            deliver=lambda message: loop.call_soon_threadsafe(inbox.put_nowait, message),
+        )
+        consumer.start()
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            try:
+                loop.add_signal_handler(sig, self.stop)
+            except (NotImplementedError, RuntimeError, ValueError):
+                # Не главный поток (тесты, бенчмарк): остановка через stop()
+                pass
+
+        slots = asyncio.Semaphore(self.concurrency)
+        in_flight = set()
+        logger.info(f"Асинхронный воркер: очереди {', '.join(self.queues)}, конкурентность {self.concurrency}")
+        try:
+            received = 0
+            while not self._stopping.is_set() and (max_messages is None or received < max_messages):
+                message = await self._next(inbox)
+                if message is None or self._hold_until_due(message, inbox, consumer):
+                    continue
+                received += 1
+                await slots.acquire()
+                task = asyncio.create_task(self._consume(message, consumer))
+                in_flight.add(task)
+                task.add_done_callback(lambda done: (in_flight.discard(done), slots.release()))
+            if in_flight:
+                await asyncio.gather(*in_flight, return_exceptions=True)
+        finally:
+            consumer.stop()
+            await asyncio.to_thread(consumer.join)
+        return self.processed
+
+    async def _next(self, inbox):
+        """Следующее сообщение или None, если за 0.5 с ничего не пришло (проверка остановки)"""
+        stop = asyncio.ensure_future(self._stopping.wait())
+        get = asyncio.ensure_future(inbox.get())
+        done, _ = await asyncio.wait({stop, get}, timeout=0.5, return_when=asyncio.FIRST_COMPLETED)
+        stop.cancel()
+        if get in done:
+            return get.result()
+        get.cancel()
+        return None
+
+    @staticmethod
+    def _hold_until_due(message, inbox, consumer) -> bool:
+        """Сообщение с eta в будущем возвращается в inbox к сроку; True - отложено"""
+        eta = (message.headers or {}).get('eta')
+        if not eta:
+            return False
+        eta = datetime.fromisoformat(eta)
+        if eta.tzinfo is None:
+            eta = eta.replace(tzinfo=dt_timezone.utc)
+        delay = (eta - timezone.now()).total_seconds()
+        if delay <= 0:
+            return False
+
+        def due():
+            consumer.hold(-1)
+            inbox.put_nowait(message)
+
+        consumer.hold(1)
+        asyncio.get_running_loop().call_later(delay, due)
+        return True
+
+    async def _consume(self, message, consumer):
+        headers = message.headers or {}
+        if headers.get('task') != payout_task.name:
+            await sync_to_async(self._forward, thread_sensitive=False)(message)
+            consumer.ack(message)
+            return
+
+        args, kwargs = [None], {}
+        queue_name = (message.delivery_info or {}).get('routing_key') or 'unknown'
+        try:
+            args, kwargs, _ = message.decode()
+            await sync_to_async(self._record_latency, thread_sensitive=False)(headers, queue_name)
+            result = await self.execute(
+                args[0], kwargs=kwargs, task_id=headers.get('id'),
+                retries=headers.get('retries') or 0, queue=queue_name,
+            )
+            if result is not None and headers.get('id') and not payout_task.ignore_result:
+                await sync_to_async(self.app.backend.store_result, thread_sensitive=False)(
+                    headers['id'], result, 'SUCCESS'
+                )
+        except Exception as exc:
+            logger.error(f"Асинхронный воркер: сбой обработки сообщения {headers.get('id')}: {exc}")
+        finally:
+            tenant = (kwargs or {}).get('tenant')
+            retrying = args[0] in self._retrying
+            self._retrying.discard(args[0])
+            if tenant is not None and args[0] is not None and not retrying:
+                await sync_to_async(self._release_tenant, thread_sensitive=False)(tenant, args[0])
+            await sync_to_async(close_old_connections)()
+            consumer.ack(message)
+            self.processed += 1
+
+    async def execute(self, payout_id, kwargs=None, task_id=None, retries=0, queue=None):
+        """Обработка одной выплаты с семантикой повторов payout_task; None - задача переопубликована"""
+        kwargs = kwargs or {}
+        try:
+            return await self.service_factory(payout_id).aprocess()
+
+        except ProcessingInProgress:
+            logger.info(f"Обработка выплаты {payout_id} уже выполняется, повтор через 10 секунд")
+            if retries >= payout_task.max_retries:
+                logger.error(f"Попытки обработки выплаты {payout_id} исчерпаны: выплата занята другим воркером")
+                return None
+            await self._retry(payout_id, kwargs, retries, countdown=10, queue=queue)
+            return None
+
+        except StopProcessing as exc:
+            return exc.result
+
+        except Exception as exc:
+            logger.error(f"Ошибка в задаче обработки выплаты {payout_id}: {str(exc)}")
+            attempts = [*(kwargs.get('attempts') or []), {
+                'attempt': retries + 1,
+                'error': str(exc),
+                'at': timezone.now().isoformat(),
+            }]
+            if retries >= payout_task.max_retries:
+                logger.error(f"Попытки обработки выплаты {payout_id} исчерпаны, задача перенесена в dead letter")
+                await sync_to_async(PayoutDeadLetter.objects.record)(
+                    payout_id=payout_id, task_id=task_id, error=str(exc), attempts=attempts,
+                )
+                return None
+            await self._retry(payout_id, {**kwargs, 'attempts': attempts}, retries,
+                              countdown=self._backoff(retries), queue=queue)
+            return None
+
+    @staticmethod
+    def _backoff(retries) -> int:
+        """Пауза перед повтором по правилам Celery для retry_backoff (экспонента с jitter)"""
+        if not payout_task.retry_backoff:
+            return payout_task.default_retry_delay
+        return get_exponential_backoff_interval(
+            factor=int(max(1.0, float(payout_task.retry_backoff))),
+            retries=retries,
+            maximum=getattr(payout_task, 'retry_backoff_max', None) or 600,
+            full_jitter=getattr(payout_task, 'retry_jitter', True),
+        )
+
+    async def _retry(self, payout_id, kwargs, retries, countdown, queue):
+        """Повторная публикация с теми же kwargs (tenant, история попыток)"""
+        await sync_to_async(payout_task.apply_async, thread_sensitive=False)(
+            args=[payout_id], kwargs=kwargs, countdown=countdown, retries=retries + 1, queue=queue,
+        )
+        self._retrying.add(payout_id)
+
+    def _forward(self, message):
+        """Чужая задача: исходное сообщение публикуется в очередь Celery по умолчанию без изменений"""
+        headers = message.headers or {}
+        logger.warning(f"Асинхронный воркер не выполняет {headers.get('task')}: задача переслана в очередь Celery")
+        default_queue = self.app.amqp.queues[self.app.conf.task_default_queue]
+        properties = message.properties or {}
+        with self.app.producer_or_acquire() as producer:
+            producer.publish(
+                message.body,
+                exchange=default_queue.exchange,
+                routing_key=default_queue.routing_key,
+                declare=[default_queue],
+                headers=headers,
+                content_type=message.content_type,
+                content_encoding=message.content_encoding,
+                **{key: properties[key] for key in ('correlation_id', 'reply_to', 'priority') if key in properties},
+            )
+
+    @staticmethod
+    def _record_latency(headers, queue_name):
+        enqueued_at = headers.get('enqueued_at')
+        if enqueued_at is None:
+            return
+        latency_ms = max(0, int((time.time() - enqueued_at) * 1000))
+        PayoutMetrics(f'queue:{queue_name}').record(
+            counters={'consumed': 1, 'latency_ms_total': latency_ms},
+            gauges={'last_latency_ms': latency_ms},
+        )
+
+    @staticmethod
+    def _release_tenant(tenant, payout_id):
+        try:
+            FairScheduler.release(tenant, payout_id)
+        except Exception as exc:
+            # Слот освободится сам по PAYOUT_FAIR_INFLIGHT_TTL
+            logger.warning(f"Не удалось освободить слот мерчанта {tenant}: {exc}")
@@ -0,0 +1,90 @@
+import asyncio
+import logging
+
+from asgiref.sync import sync_to_async
+
+from ..gateway.base import GatewayDeclined
+from ..models import Payout
+from ..services.ledger_service import InsufficientFunds
+from .circuit_breaker import CircuitOpen
+from .payout_task_proccessing_service import PayoutProcessingService
+from .velocity_limiter import VelocityLimitExceeded
+
+logger = logging.getLogger(__name__)
+
+
+class AsyncPayoutProcessingService(PayoutProcessingService):
+    """
+    Обработка выплаты в цикле asyncio (движок AsyncPayoutWorker)
+
+    Те же шаги и гарантии, что у PayoutProcessingService, но этапы графа -
+    задачи asyncio: этапы, которые только ждут (имитация задержки), не
+    занимают поток, а этапы с реальной работой (отправка, книга учета,
+    лимиты) и обращения к Redis выполняются в пуле потоков цикла. Запросы
+    к БД идут через асинхронный интерфейс Django (sync_to_async в потоке
+    соединения)
+    """
+
+    async def aprocess(self):
+        """Асинхронный аналог process()"""
+        try:
+            await sync_to_async(self._check_breaker, thread_sensitive=False)()
+            await sync_to_async(self._acquire_lease, thread_sensitive=False)()
+            await sync_to_async(self._claim)()
+            if self.splitter and self.splitter.needs_split(self.payout):
+                return await sync_to_async(self.splitter.split)(self.payout)
+            await sync_to_async(self._lock_fx_rate)()
+            await self._arun_stages()
+            if self.batched:
+                return self._batched_result()
+            await sync_to_async(self._complete)()
+            return self._success_result()
+
+        except Payout.DoesNotExist:
+            return self._not_found_result()
+        except CircuitOpen as exc:
+            return await sync_to_async(self._defer)(exc)
+        except (VelocityLimitExceeded, GatewayDeclined, InsufficientFunds) as exc:
+            return await sync_to_async(self._reject)(exc)
+        except Exception as exc:
+            return await sync_to_async(self._handle_error)(exc)
+        finally:
+            await sync_to_async(self.lease.release, thread_sensitive=False)()
+
+    async def _arun_stages(self):
+        """Граф этапов: этап стартует, когда завершены его зависимости"""
+        done = set(await sync_to_async(self.checkpoint.load, thread_sensitive=False)())
+        if done:
+            logger.info(f"Выплата {self.payout_id}: пропуск уже завершенных этапов {sorted(done)}")
+
+        running = {}
+        # Контрольные точки пишутся по очереди, чтобы меньший набор не перезаписал больший
+        checkpoint_lock = asyncio.Lock()
+
+        async def run(stage):
+            await asyncio.gather(*(running[key] for key in stage['depends_on']))
+            if stage['key'] in done:
+                return
+            await self._arun_stage(stage)
+            async with checkpoint_lock:
+                done.add(stage['key'])
+                await sync_to_async(self._stage_done, thread_sensitive=False)(stage, set(done))
+
+        # STAGES перечислены так, что зависимости идут раньше зависящих этапов
+        for stage in self.STAGES:
+            running[stage['key']] = asyncio.ensure_future(run(stage))
+        try:
+            await asyncio.gather(*running.values())
+        except BaseException:
+            for future in running.values():
+                future.cancel()
+            await asyncio.gather(*running.values(), return_exceptions=True)
+            raise
+
+    async def _arun_stage(self, stage):
+        logger.info(f"Этап '{stage['name']}' для выплаты {self.payout_id}")
+        handler = self._stage_handler(stage)
+        if handler is not None:
+            await sync_to_async(handler, thread_sensitive=False)()
+        elif self.latency.enabled:
+            await asyncio.sleep(self.latency.delay_for(stage))
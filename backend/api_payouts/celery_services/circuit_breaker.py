@@ -0,0 +1,173 @@
+import logging
+import time
+import uuid
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from ..metrics import PayoutMetrics
+from ..redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+CLOSED = 'closed'
+OPEN = 'open'
+HALF_OPEN = 'half_open'
+
+# Решение о пропуске вызова: closed - пропустить, probe - пробный вызов
+# в полуоткрытом состоянии (только один воркер, ключ пробы хранит его токен), open - отказ
+ALLOW_SCRIPT = """
+local state = redis.call('hget', KEYS[1], 'state') or 'closed'
+if state == 'closed' then
+    return {'closed', '0'}
+end
+local elapsed = tonumber(ARGV[1]) - tonumber(redis.call('hget', KEYS[1], 'opened_at') or '0')
+if state == 'open' and elapsed < tonumber(ARGV[2]) then
+    return {'open', tostring(tonumber(ARGV[2]) - elapsed)}
+end
+if redis.call('set', KEYS[2], ARGV[4], 'NX', 'EX', ARGV[3]) then
+    redis.call('hset', KEYS[1], 'state', 'half_open')
+    return {'probe', '0'}
+end
+return {'open', ARGV[3]}
+"""
+
+# В полуоткрытом состоянии состояние меняет только исход пробного вызова
+# (токен из ARGV совпадает с ключом пробы); исходы вызовов, начатых до
+# размыкания, игнорируются
+FAILURE_SCRIPT = """
+local state = redis.call('hget', KEYS[1], 'state') or 'closed'
+if state == 'half_open' then
+    if ARGV[4] == '' or redis.call('get', KEYS[2]) ~= ARGV[4] then
+        return 'half_open'
+    end
+    redis.call('hset', KEYS[1], 'state', 'open', 'opened_at', ARGV[1])
+    redis.call('del', KEYS[2])
+    return 'open'
+end
+if state == 'open' then
+    return 'open'
+end
+local failures = redis.call('incr', KEYS[3])
+if failures == 1 then
+    redis.call('expire', KEYS[3], ARGV[3])
+end
+if failures >= tonumber(ARGV[2]) then
+    redis.call('hset', KEYS[1], 'state', 'open', 'opened_at', ARGV[1])
+    redis.call('del', KEYS[3])
+    return 'open'
+end
+return 'closed'
+"""
+
+SUCCESS_SCRIPT = """
+if redis.call('hget', KEYS[1], 'state') == 'half_open' then
+    if ARGV[1] == '' or redis.call('get', KEYS[2]) ~= ARGV[1] then
+        return 'half_open'
+    end
+    redis.call('hset', KEYS[1], 'state', 'closed')
+    redis.call('del', KEYS[2], KEYS[3])
+    return 'closed'
+end
+return redis.call('hget', KEYS[1], 'state') or 'closed'
+"""
+
+
+class CircuitOpen(Exception):
+    """Предохранитель разомкнут: вызов не выполняется, обработку нужно отложить"""
+
+    def __init__(self, name, retry_after):
+        self.name = name
+        self.retry_after = retry_after
+        super().__init__(f"Предохранитель '{name}' разомкнут, повтор через {retry_after:.0f} с")
+
+
+class CircuitBreaker:
+    """
+    Общий для всех воркеров предохранитель с состоянием в Redis
+
+    После failure_threshold ошибок за window секунд размыкается на cooldown
+    секунд, затем пропускает один пробный вызов (half-open): успех замыкает
+    предохранитель, ошибка снова размыкает. Исход пробы передается с ее
+    токеном (его возвращает allow): успехи и ошибки других вызовов в это
+    время состояние не меняют. При недоступности Redis вызовы пропускаются
+    """
+
+    KEY_PREFIX = 'payout:breaker:'
+
+    def __init__(self, name: str):
+        self.name = name
+        self.key = f'{self.KEY_PREFIX}{name}'
+        self.probe_key = f'{self.key}:probe'
+        self.failures_key = f'{self.key}:failures'
+        self.failure_threshold = settings.PAYOUT_BREAKER_FAILURE_THRESHOLD
+        self.window = settings.PAYOUT_BREAKER_WINDOW
+        self.cooldown = settings.PAYOUT_BREAKER_COOLDOWN
+        self.probe_timeout = settings.PAYOUT_BREAKER_PROBE_TIMEOUT
+        self.metrics = PayoutMetrics(f'breaker:{name}')
+
+    def retry_after(self):
+        """Дешевая проверка без побочных эффектов: секунды до пробы, если разомкнут, иначе None"""
+        try:
+            state = get_redis().hmget(self.key, 'state', 'opened_at')
+        except RedisError as exc:
+            logger.warning(f"Не удалось прочитать предохранитель '{self.name}': {exc}")
+            return None
+        if _decode(state[0]) != OPEN:
+            return None
+        remaining = self.cooldown - (time.time() - float(state[1] or 0))
+        return remaining if remaining > 0 else None
+
+    def allow(self):
+        """
+        Разрешение на вызов; для пробного вызова - токен пробы (его нужно
+        передать в record_success/record_failure), иначе None.
+        Разомкнутый предохранитель - CircuitOpen
+        """
+        token = uuid.uuid4().hex
+        try:
+            decision = get_redis().register_script(ALLOW_SCRIPT)(
+                keys=[self.key, self.probe_key],
+                args=[time.time(), self.cooldown, self.probe_timeout, token],
+            )
+        except RedisError as exc:
+            logger.warning(f"Предохранитель '{self.name}' недоступен, вызов пропущен: {exc}")
+            return None
+
+        if _decode(decision[0]) == OPEN:
+            self.metrics.record(counters={'short_circuited': 1})
+            raise CircuitOpen(self.name, float(decision[1]))
+        if _decode(decision[0]) == 'probe':
+            self.metrics.record(counters={'probes': 1}, gauges={'state': HALF_OPEN})
+            return token
+        return None
+
+    def record_success(self, probe=None) -> None:
+        """Успешный вызов; probe - токен, если это был пробный вызов"""
+        self._record(SUCCESS_SCRIPT, [probe or ''], counter='successes')
+
+    def record_failure(self, probe=None) -> None:
+        """Ошибка вызова; probe - токен, если это был пробный вызов"""
+        self._record(
+            FAILURE_SCRIPT, [time.time(), self.failure_threshold, self.window, probe or ''], counter='failures'
+        )
+
+    def _record(self, script, args, counter):
+        try:
+            state = get_redis().register_script(script)(
+                keys=[self.key, self.probe_key, self.failures_key], args=args
+            )
+        except RedisError as exc:
+            logger.warning(f"Не удалось обновить предохранитель '{self.name}': {exc}")
+            return
+        state = _decode(state)
+        gauges = {'state': state}
+        counters = {counter: 1}
+        if counter == 'failures' and state == OPEN:
+            logger.warning(f"Предохранитель '{self.name}' разомкнут")
+            counters['opened'] = 1
+        self.metrics.record(counters=counters, gauges=gauges)
+
+
+def _decode(value):
+    return value.decode() if isinstance(value, bytes) else value
@@ -0,0 +1,139 @@
+import json
+import logging
+import time
+
+from celery import group
+from django.conf import settings
+
+from ..models import Payout
+from ..redis_client import get_redis
+from ..routing import PayoutRouter
+
+logger = logging.getLogger(__name__)
+
+# Выдача до ARGV[1] выплат мерчанта с учетом лимита одновременной обработки.
+# Записи in-flight старше TTL считаются потерянными (воркер упал) и удаляются
+POP_SCRIPT = """
+local now = tonumber(ARGV[3])
+redis.call('zremrangebyscore', KEYS[2], '-inf', now - tonumber(ARGV[4]))
+local free = tonumber(ARGV[2]) - redis.call('zcard', KEYS[2])
+local n = math.min(tonumber(ARGV[1]), free)
+if n <= 0 then
+    return {}
+end
+local items = redis.call('lpop', KEYS[1], n)
+if not items then
+    redis.call('srem', KEYS[3], ARGV[5])
+    return {}
+end
+for _, item in ipairs(items) do
+    redis.call('zadd', KEYS[2], now, cjson.decode(item)['id'])
+end
+if redis.call('llen', KEYS[1]) == 0 then
+    redis.call('srem', KEYS[3], ARGV[5])
+end
+return items
+"""
+
+
+class FairScheduler:
+    """
+    Справедливая диспетчеризация выплат по мерчантам
+
+    Выплаты попадают в очереди мерчантов в Redis, диспетчер обходит
+    активных мерчантов по кругу и за раунд выдает каждому до quantum * weight
+    задач (DRR с единичной стоимостью), не превышая лимит одновременной
+    обработки мерчанта. Поэтому большой выгруз одного мерчанта не задерживает
+    выплаты остальных
+    """
+
+    KEY_PREFIX = 'payout:fair:'
+    ACTIVE_KEY = 'payout:fair:active'
+    CURSOR_KEY = 'payout:fair:cursor'
+    DEFAULT_TENANT = '_default'
+
+    def __init__(self, task=None):
+        self.task = task
+        self.quantum = settings.PAYOUT_FAIR_QUANTUM
+        self.max_rounds = settings.PAYOUT_FAIR_MAX_ROUNDS
+        self.inflight_ttl = settings.PAYOUT_FAIR_INFLIGHT_TTL
+
+    @classmethod
+    def tenant_for(cls, merchant_id) -> str:
+        return merchant_id or cls.DEFAULT_TENANT
+
+    @classmethod
+    def queue_key(cls, tenant) -> str:
+        return f'{cls.KEY_PREFIX}queue:{tenant}'
+
+    @classmethod
+    def inflight_key(cls, tenant) -> str:
+        return f'{cls.KEY_PREFIX}inflight:{tenant}'
+
+    @staticmethod
+    def limits_for(tenant) -> dict:
+        limits = settings.PAYOUT_FAIR_TENANT_LIMITS.get(tenant, {})
+        return {
+            'concurrency': limits.get('concurrency', settings.PAYOUT_FAIR_TENANT_CONCURRENCY),
+            'weight': limits.get('weight', 1),
+        }
+
+    def enqueue(self, payout_ids) -> int:
+        """Постановка выплат в очереди мерчантов (поля читаются одним запросом)"""
+        rows = list(
+            Payout.objects.filter(id__in=list(payout_ids))
+            .values('id', 'merchant_id', 'amount', 'currency', 'priority')
+        )
+        return self.enqueue_rows(rows)
+
+    def enqueue_rows(self, rows) -> int:
+        """Постановка в очереди мерчантов строк с полями маршрутизации, одним pipeline"""
+        pipe = get_redis().pipeline(transaction=False)
+        for row in rows:
+            tenant = self.tenant_for(row.get('merchant_id'))
+            item = json.dumps({'id': str(row['id']), 'queue': PayoutRouter.queue_for(**row)})
+            pipe.rpush(self.queue_key(tenant), item)
+            pipe.sadd(self.ACTIVE_KEY, tenant)
+        pipe.execute()
+        return len(rows)
+
+    def dispatch(self) -> int:
+        """Раунды обхода мерчантов, пока есть что выдавать (не больше max_rounds)"""
+        redis = get_redis()
+        tenants = sorted(
+            member.decode() if isinstance(member, bytes) else member
+            for member in redis.smembers(self.ACTIVE_KEY)
+        )
+        if not tenants:
+            return 0
+
+        # Каждый запуск начинает обход со следующего мерчанта
+        start = redis.incr(self.CURSOR_KEY) % len(tenants)
+        tenants = tenants[start:] + tenants[:start]
+        pop = redis.register_script(POP_SCRIPT)
+
+        dispatched = 0
+        for _ in range(self.max_rounds):
+            signatures = []
+            for tenant in tenants:
+                limits = self.limits_for(tenant)
+                items = pop(
+                    keys=[self.queue_key(tenant), self.inflight_key(tenant), self.ACTIVE_KEY],
+                    args=[self.quantum * limits['weight'], limits['concurrency'], time.time(), self.inflight_ttl, tenant],
+                )
+                for raw in items:
+                    item = json.loads(raw)
+                    signatures.append(
+                        self.task.s(item['id'], tenant=tenant).set(queue=item['queue'])
+                    )
+            if not signatures:
+                break
+            group(signatures).apply_async()
+            dispatched += len(signatures)
+
+        return dispatched
+
+    @classmethod
+    def release(cls, tenant, payout_id) -> None:
+        """Освобождение слота мерчанта после завершения задачи"""
+        get_redis().zrem(cls.inflight_key(tenant), str(payout_id))
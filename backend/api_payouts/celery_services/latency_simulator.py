@@ -0,0 +1,44 @@
+import random
+import time
+
+from django.conf import settings
+
+
+class LatencySimulator:
+    """
+    Имитация задержек этапов обработки по настраиваемым распределениям
+
+    Настройка PAYOUT_STAGE_LATENCY: {'default': {...}, '<stage key>': {...}},
+    где значение - {'distribution': <имя>, ...параметры в секундах}:
+        fixed(value), uniform(low, high), normal(mean, stddev),
+        lognormal(mu, sigma), exponential(mean)
+    """
+
+    DISTRIBUTIONS = {
+        'fixed': lambda rng, p: p['value'],
+        'uniform': lambda rng, p: rng.uniform(p['low'], p['high']),
+        'normal': lambda rng, p: rng.gauss(p['mean'], p['stddev']),
+        'lognormal': lambda rng, p: rng.lognormvariate(p['mu'], p['sigma']),
+        'exponential': lambda rng, p: rng.expovariate(1 / p['mean']),
+    }
+
+    def __init__(self, config=None, enabled=None, seed=None, sleep=time.sleep):
+        self.config = settings.PAYOUT_STAGE_LATENCY if config is None else config
+        self.enabled = settings.PAYOUT_LATENCY_SIMULATION if enabled is None else enabled
+        self.rng = random.Random(seed)
+        self.sleep = sleep
+
+    def delay_for(self, stage: dict) -> float:
+        """Задержка этапа в секундах; без настройки - объявленная длительность этапа"""
+        params = self.config.get(stage['key']) or self.config.get('default')
+        if params is None:
+            return stage.get('duration', 0)
+        return max(0.0, self.DISTRIBUTIONS[params['distribution']](self.rng, params))
+
+    def wait(self, stage: dict) -> float:
+        """Подождать задержку этапа, если имитация включена"""
+        if not self.enabled:
+            return 0.0
+        delay = self.delay_for(stage)
+        self.sleep(delay)
+        return delay
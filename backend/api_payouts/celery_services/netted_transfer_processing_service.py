@@ -0,0 +1,134 @@
+import logging
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..gateway import get_gateway_client
+from ..gateway.base import GatewayDeclined
+from ..models import NettedTransfer, Payout, Status
+from ..services.fx_service import FxConversionService
+from ..services.ledger_service import InsufficientFunds, LedgerService
+from .circuit_breaker import CircuitBreaker, CircuitOpen
+
+logger = logging.getLogger(__name__)
+
+
+class NettedTransferProcessingService:
+    """
+    Отправка сводного перевода в платежную систему
+
+    Успех завершает перевод и все его выплаты в одной транзакции. Отказ
+    провайдера разбирает перевод (NettedTransferManager.unwind), временная
+    ошибка возвращает перевод в 'pending' для повтора задачей. Если
+    предохранитель не пропустил перевод за все попытки, перевод
+    расформировывается (NettedTransferManager.dissolve). С книгой учета
+    под каждую выплату перевода до отправки ставится резерв (выплаты без
+    средств исключаются из перевода), при завершении резервы списываются,
+    при разборе и расформировании - снимаются
+    """
+
+    def __init__(self, transfer_id, gateway=None, breaker=None, ledger=None):
+        self.transfer_id = transfer_id
+        self.gateway = gateway or get_gateway_client()
+        self.breaker = breaker or CircuitBreaker('provider')
+        self.ledger = ledger or (LedgerService() if settings.PAYOUT_LEDGER_ENABLED else None)
+
+    def process(self) -> dict:
+        """Отправка перевода; CircuitOpen и временные ошибки пробрасываются для повтора"""
+        retry_after = self.breaker.retry_after()
+        if retry_after is not None:
+            raise CircuitOpen(self.breaker.name, retry_after)
+
+        transfer = NettedTransfer.objects.claim(self.transfer_id)
+        if transfer is None:
+            logger.info(f"Сводный перевод {self.transfer_id} уже обработан или обрабатывается")
+            return {'success': False, 'transfer_id': self.transfer_id, 'message': 'Перевод не подлежит обработке'}
+        if self.ledger:
+            transfer = self._reserve(transfer)
+            if transfer.status == Status.FAILED:
+                logger.error(f"Сводный перевод {self.transfer_id} не выполнен: {transfer.error}")
+                return {'success': False, 'transfer_id': self.transfer_id, 'payouts': 0, 'error': transfer.error}
+
+        probe = None
+        try:
+            probe = self.breaker.allow()
+            response = self.gateway.submit(transfer)
+        except GatewayDeclined as exc:
+            self.breaker.record_success(probe=probe)
+            return self.unwind(exc)
+        except CircuitOpen:
+            NettedTransfer.objects.release(self.transfer_id)
+            raise
+        except Exception:
+            self.breaker.record_failure(probe=probe)
+            NettedTransfer.objects.release(self.transfer_id)
+            raise
+        self.breaker.record_success(probe=probe)
+
+        with transaction.atomic():
+            completed = NettedTransfer.objects.complete(self.transfer_id, reference=response.get('reference') or '')
+            if completed and self.ledger:
+                self.ledger.capture(self._member_ids())
+        logger.info(f"Сводный перевод {self.transfer_id} выполнен, завершено выплат: {completed}")
+        return {
+            'success': True,
+            'transfer_id': self.transfer_id,
+            'payouts': completed,
+            'amount': str(transfer.amount),
+        }
+
+    def unwind(self, error) -> dict:
+        """Разбор перевода после отказа или исчерпания попыток"""
+        totals = NettedTransfer.objects.unwind(self.transfer_id, str(error))
+        if self.ledger:
+            self.ledger.release(self._member_ids())
+        logger.error(f"Сводный перевод {self.transfer_id} не выполнен, выплат переведено в failed: {totals['payouts']}")
+        return {
+            'success': False,
+            'transfer_id': self.transfer_id,
+            'payouts': totals['payouts'],
+            'error': str(error),
+        }
+
+    def dissolve(self, exc: CircuitOpen) -> dict:
+        """Расформирование перевода: выплаты возвращаются в 'pending' до остывания предохранителя"""
+        execute_at = timezone.now() + timedelta(seconds=exc.retry_after)
+        # После расформирования выплаты уже не связаны с переводом
+        member_ids = self._member_ids()
+        returned = NettedTransfer.objects.dissolve(self.transfer_id, str(exc), execute_at)
+        if self.ledger:
+            self.ledger.release(member_ids)
+        logger.warning(
+            f"Сводный перевод {self.transfer_id} расформирован, выплат возвращено в ожидание: {returned}"
+        )
+        return {
+            'success': False,
+            'transfer_id': self.transfer_id,
+            'payouts': returned,
+            'deferred': True,
+            'execute_at': execute_at.isoformat(),
+        }
+
+    def _reserve(self, transfer) -> NettedTransfer:
+        """Курсы и резервы под выплаты перевода; выплаты без курса или средств исключаются из перевода"""
+        # Резервы - в порядке создания выплат: при нехватке средств исключаются более поздние
+        members = list(
+            Payout.objects.filter(netted_transfer_id=self.transfer_id, status=Status.PROCESSING).order_by('created_at')
+        )
+        errors = FxConversionService().lock(members)
+        for payout in members:
+            if payout.id in errors:
+                continue
+            try:
+                self.ledger.reserve(payout)
+            except InsufficientFunds as exc:
+                errors[payout.id] = str(exc)
+        if not errors:
+            return transfer
+        logger.warning(f"Из сводного перевода {self.transfer_id} исключено выплат: {len(errors)}")
+        return NettedTransfer.objects.drop_members(self.transfer_id, errors)
+
+    def _member_ids(self) -> list:
+        return list(Payout.objects.filter(netted_transfer_id=self.transfer_id).values_list('id', flat=True))
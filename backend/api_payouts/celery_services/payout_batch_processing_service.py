@@ -0,0 +1,119 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor
+
+from datetime import timedelta
+
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..models import Payout
+from ..services.fx_service import FxConversionService
+from ..services.ledger_service import LedgerService
+from .circuit_breaker import CircuitOpen
+from .payout_lease import PayoutLeaseGroup
+from .payout_task_proccessing_service import PayoutProcessingService
+from .progress_reporter import ProgressReporter
+
+logger = logging.getLogger(__name__)
+
+# Выплата передана в пачку отправки и завершится SubmitBatcher
+BATCHED = object()
+
+
+class PayoutBatchProcessingService:
+    """
+    Пакетная обработка выплат
+
+    Пачка захватывается через SELECT ... FOR UPDATE SKIP LOCKED, этапы
+    выплат выполняются параллельно, а итоговые статусы пишутся двумя
+    UPDATE на пачку. Захваченные выплаты уже в 'processing' и держат
+    аренду в Redis до конца пачки, поэтому ни задача на отдельную выплату
+    (в том числе повторно доставленная), ни сборщик зависших их не возьмут
+    """
+
+    def __init__(self, batch_size=None, max_workers=None, max_batches=None):
+        self.batch_size = batch_size or settings.PAYOUT_BATCH_SIZE
+        self.max_workers = max_workers or settings.PAYOUT_BATCH_WORKERS
+        self.max_batches = max_batches or settings.PAYOUT_BATCH_MAX_BATCHES
+
+    def process(self) -> dict:
+        """Обработка пачек, пока они полные, но не больше max_batches за запуск"""
+        totals = {'completed': 0, 'failed': 0, 'deferred': 0}
+        for _ in range(self.max_batches):
+            result = self.process_batch()
+            for name in totals:
+                totals[name] += result[name]
+            if result['claimed'] < self.batch_size:
+                break
+        return totals
+
+    def process_batch(self) -> dict:
+        """Захват и обработка одной пачки"""
+        payouts = Payout.objects.claim_batch(limit=self.batch_size)
+        if not payouts:
+            return {'claimed': 0, 'completed': 0, 'failed': 0, 'deferred': 0}
+
+        logger.info(f"Пакетная обработка: захвачено выплат {len(payouts)}")
+        lease = PayoutLeaseGroup()
+        try:
+            return self._process_claimed(payouts, lease)
+        finally:
+            lease.release()
+
+    def _process_claimed(self, payouts, lease) -> dict:
+        held = lease.acquire([payout.id for payout in payouts])
+        busy = [payout.id for payout in payouts if str(payout.id) not in held]
+        if busy:
+            # Аренду держит другой воркер: выплаты возвращаются в очередь, а не обрабатываются дважды
+            logger.warning(f"Пакетная обработка: выплаты {len(busy)} уже в аренде, возвращены в ожидание")
+            Payout.objects.defer(busy, None)
+            payouts = [payout for payout in payouts if str(payout.id) in held]
+
+        # Курсы фиксируются для всей пачки сразу: один запрос курсов на валюту списания
+        fx_errors = FxConversionService().lock(payouts)
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='payout-batch') as pool:
+            outcomes = list(pool.map(self._run_stages, [payout for payout in payouts if payout.id not in fx_errors]))
+        outcomes += [(payout, fx_errors[payout.id]) for payout in payouts if payout.id in fx_errors]
+
+        completed = [payout.id for payout, error in outcomes if error is None]
+        deferred = {payout.id: error for payout, error in outcomes if isinstance(error, CircuitOpen)}
+        errors = {
+            payout.id: error for payout, error in outcomes
+            if error is not None and error is not BATCHED and payout.id not in deferred
+        }
+
+        with transaction.atomic():
+            Payout.objects.complete_batch(
+                completed,
+                references={payout.id: payout.provider_reference for payout, error in outcomes if error is None},
+            )
+            Payout.objects.fail_batch(errors)
+            if settings.PAYOUT_LEDGER_ENABLED:
+                LedgerService.capture(completed)
+                LedgerService.release(errors)
+        if deferred:
+            retry_after = max(exc.retry_after for exc in deferred.values())
+            Payout.objects.defer(deferred, timezone.now() + timedelta(seconds=retry_after))
+
+        return {
+            'claimed': len(payouts) + len(busy),
+            'completed': len(completed),
+            'failed': len(errors),
+            'deferred': len(deferred),
+        }
+
+    @staticmethod
+    def _run_stages(payout):
+        """Этапы одной выплаты; возвращает (выплата, текст ошибки, CircuitOpen, BATCHED или None)"""
+        service = PayoutProcessingService(str(payout.id), progress=ProgressReporter(None))
+        try:
+            if service.run_stages(payout):
+                return payout, BATCHED
+        except CircuitOpen as exc:
+            logger.warning(f"Выплата {payout.id} отложена: {exc}")
+            return payout, exc
+        except Exception as exc:
+            logger.error(f"Ошибка пакетной обработки выплаты {payout.id}: {exc}")
+            return payout, str(exc)
+        return payout, None
@@ -0,0 +1,229 @@
+import logging
+import threading
+import uuid
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from ..redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Продление и освобождение только владельцем (сравнение токена)
+RENEW_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('pexpire', KEYS[1], ARGV[2])
+end
+return 0
+"""
+
+RELEASE_SCRIPT = """
+if redis.call('get', KEYS[1]) == ARGV[1] then
+    return redis.call('del', KEYS[1])
+end
+return 0
+"""
+
+# Групповые варианты: ключи из KEYS, токен и TTL в ARGV
+RENEW_MANY_SCRIPT = """
+local renewed = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('get', key) == ARGV[1] then
+        renewed = renewed + redis.call('pexpire', key, ARGV[2])
+    end
+end
+return renewed
+"""
+
+RELEASE_MANY_SCRIPT = """
+local released = 0
+for _, key in ipairs(KEYS) do
+    if redis.call('get', key) == ARGV[1] then
+        released = released + redis.call('del', key)
+    end
+end
+return released
+"""
+
+
+class PayoutLease:
+    """
+    Распределенная аренда выплаты в Redis
+
+    Ключ ставится через SET NX PX с TTL и продлевается фоновым heartbeat.
+    Если воркер падает, heartbeat останавливается вместе с процессом и
+    ключ истекает сам, поэтому взаимной блокировки не возникает
+    """
+
+    KEY_PREFIX = 'payout:lease:'
+
+    def __init__(self, payout_id, ttl=None):
+        self.payout_id = str(payout_id)
+        self.key = f'{self.KEY_PREFIX}{self.payout_id}'
+        self.ttl = ttl or settings.PAYOUT_LEASE_TTL
+        self.token = uuid.uuid4().hex
+        self.held = False
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    @classmethod
+    def held_ids(cls, payout_ids) -> set:
+        """Идентификаторы выплат, аренда которых сейчас держится воркерами"""
+        payout_ids = list(payout_ids)
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for payout_id in payout_ids:
+                pipe.exists(f'{cls.KEY_PREFIX}{payout_id}')
+            exists = pipe.execute()
+        except RedisError as exc:
+            logger.warning(f"Redis недоступен, проверка аренд пропущена: {exc}")
+            return set()
+        return {payout_id for payout_id, held in zip(payout_ids, exists) if held}
+
+    def acquire(self) -> bool:
+        """
+        Взять аренду. Возвращает False, если ее держит другой воркер.
+        При недоступности Redis обработка продолжается: исключительность
+        все равно гарантирует условный UPDATE при захвате в БД
+        """
+        try:
+            acquired = get_redis().set(self.key, self.token, nx=True, px=self.ttl * 1000)
+        except RedisError as exc:
+            logger.warning(f"Redis недоступен, аренда выплаты {self.payout_id} не взята: {exc}")
+            return True
+
+        if not acquired:
+            return False
+
+        self.held = True
+        self._start_heartbeat()
+        return True
+
+    def renew(self) -> bool:
+        """Продлить аренду, если она все еще принадлежит нам"""
+        try:
+            renewed = get_redis().register_script(RENEW_SCRIPT)(
+                keys=[self.key], args=[self.token, self.ttl * 1000]
+            )
+        except RedisError as exc:
+            logger.warning(f"Не удалось продлить аренду выплаты {self.payout_id}: {exc}")
+            return False
+        if not renewed:
+            logger.warning(f"Аренда выплаты {self.payout_id} потеряна")
+        return bool(renewed)
+
+    def release(self) -> None:
+        """Остановить heartbeat и освободить аренду"""
+        self._stop.set()
+        if self._heartbeat is not None:
+            self._heartbeat.join(timeout=1)
+            self._heartbeat = None
+        if not self.held:
+            return
+        self.held = False
+        try:
+            get_redis().register_script(RELEASE_SCRIPT)(keys=[self.key], args=[self.token])
+        except RedisError as exc:
+            # Ключ истечет сам по TTL
+            logger.warning(f"Не удалось освободить аренду выплаты {self.payout_id}: {exc}")
+
+    def _start_heartbeat(self):
+        """Фоновое продление аренды каждые ttl/3 секунд"""
+        self._stop.clear()
+        self._heartbeat = threading.Thread(
+            target=self._heartbeat_loop,
+            name=f'payout-lease-{self.payout_id}',
+            daemon=True,
+        )
+        self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        interval = self.ttl / 3
+        while not self._stop.wait(interval):
+            if not self.renew():
+                return
+
+
+class PayoutLeaseGroup:
+    """
+    Аренды пачки выплат с общим токеном и одним heartbeat
+
+    Ключи те же, что у PayoutLease, поэтому задача на отдельную выплату
+    не возьмет выплату, захваченную пакетной обработкой, а сборщик
+    зависших выплат ее пропустит
+    """
+
+    def __init__(self, ttl=None):
+        self.ttl = ttl or settings.PAYOUT_LEASE_TTL
+        self.token = uuid.uuid4().hex
+        self.held = set()
+        self._stop = threading.Event()
+        self._heartbeat = None
+
+    def acquire(self, payout_ids) -> set:
+        """
+        Взять аренды; возвращает идентификаторы, которые удалось взять.
+        При недоступности Redis считаются взятыми все (как в PayoutLease.acquire)
+        """
+        payout_ids = [str(payout_id) for payout_id in payout_ids]
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for payout_id in payout_ids:
+                pipe.set(f'{PayoutLease.KEY_PREFIX}{payout_id}', self.token, nx=True, px=self.ttl * 1000)
+            acquired = pipe.execute()
+        except RedisError as exc:
+            logger.warning(f"Redis недоступен, аренды пачки выплат не взяты: {exc}")
+            return set(payout_ids)
+
+        held = {payout_id for payout_id, ok in zip(payout_ids, acquired) if ok}
+        self.held |= held
+        if self.held and self._heartbeat is None:
+            self._start_heartbeat()
+        return held
+
+    def renew(self) -> bool:
+        """Продлить все аренды, которые все еще принадлежат нам"""
+        held = list(self.held)
+        if not held:
+            return True
+        try:
+            get_redis().register_script(RENEW_MANY_SCRIPT)(
+                keys=[f'{PayoutLease.KEY_PREFIX}{payout_id}' for payout_id in held],
+                args=[self.token, self.ttl * 1000],
+            )
+        except RedisError as exc:
+            logger.warning(f"Не удалось продлить аренды пачки выплат: {exc}")
+            return False
+        return True
+
+    def release(self, payout_ids=None) -> None:
+        """Освободить аренды payout_ids (по умолчанию все); heartbeat останавливается, когда аренд не осталось"""
+        released = self.held if payout_ids is None else self.held & {str(payout_id) for payout_id in payout_ids}
+        self.held = self.held - released
+        if not self.held:
+            self._stop.set()
+            if self._heartbeat is not None:
+                self._heartbeat.join(timeout=1)
+                self._heartbeat = None
+        if not released:
+            return
+        try:
+            get_redis().register_script(RELEASE_MANY_SCRIPT)(
+                keys=[f'{PayoutLease.KEY_PREFIX}{payout_id}' for payout_id in released],
+                args=[self.token],
+            )
+        except RedisError as exc:
+            # Ключи истекут сами по TTL
+            logger.warning(f"Не удалось освободить аренды пачки выплат: {exc}")
+
+    def _start_heartbeat(self):
+        """Фоновое продление аренд каждые ttl/3 секунд"""
+        self._stop.clear()
+        self._heartbeat = threading.Thread(target=self._heartbeat_loop, name='payout-lease-group', daemon=True)
+        self._heartbeat.start()
+
+    def _heartbeat_loop(self):
+        interval = self.ttl / 3
+        while not self._stop.wait(interval):
+            if not self.renew():
+                return
@@ -0,0 +1,73 @@
+import logging
+from datetime import timedelta
+
+from celery import group
+from django.conf import settings
+from django.db import transaction
+from django.utils import timezone
+
+from ..metrics import PayoutMetrics
+from ..models import NettedTransfer
+
+logger = logging.getLogger(__name__)
+
+
+class PayoutNettingService:
+    """
+    Сведение повторных выплат одному получателю в сводные переводы
+
+    При включенном окне (PAYOUT_NETTING_WINDOW) новая выплата удерживается
+    через execute_at на время окна. Перед отправкой наступивших выплат
+    планировщиком группы из двух и более выплат с одинаковыми реквизитами и
+    валютой сводятся в NettedTransfer и отправляются одной задачей, а
+    одиночные выплаты уходят обычным путем. Группа, сумма которой выше
+    PAYOUT_TRANSFER_CAPS, делится на несколько переводов; валюты с лимитами
+    частоты не сводятся. Задачи переводов, потерянные
+    до выполнения или при падении воркера, публикуются снова (resume_stale)
+    """
+
+    def __init__(self, task, window=None, limit=None):
+        self.task = task
+        self.window = timedelta(seconds=settings.PAYOUT_NETTING_WINDOW if window is None else window)
+        self.limit = limit or settings.PAYOUT_NETTING_MAX_GROUPS
+        # Сводный перевод - один перевод провайдера: его сумма ограничена тем же лимитом
+        self.caps = settings.PAYOUT_TRANSFER_CAPS
+        self.excluded = self.velocity_limited()
+        self.metrics = PayoutMetrics('netting')
+
+    @staticmethod
+    def velocity_limited() -> list:
+        """
+        Валюты с лимитами частоты (PAYOUT_VELOCITY_LIMITS) не сводятся: сводный
+        перевод минует этап проверки, и лимиты по карте и мерчанту не учитывались бы
+        """
+        return [currency for currency, limits in settings.PAYOUT_VELOCITY_LIMITS.items() if limits]
+
+    def net_due(self) -> int:
+        """Сведение наступивших групп и публикация задач переводов. Возвращает число переводов"""
+        transfers = NettedTransfer.objects.net_due(
+            window=self.window, limit=self.limit, caps=self.caps, exclude_currencies=self.excluded
+        )
+        if not transfers:
+            return 0
+
+        signatures = [self.task.s(str(transfer.id)) for transfer in transfers]
+        transaction.on_commit(lambda: group(signatures).apply_async())
+        netted = sum(transfer.payout_count for transfer in transfers)
+        logger.info(f"Сведено выплат: {netted} в переводов: {len(transfers)}")
+        self.metrics.record(counters={'transfers': len(transfers), 'payouts': netted})
+        return len(transfers)
+
+    def resume_stale(self, timeout=None) -> int:
+        """Повторная публикация задач зависших переводов. Возвращает число переводов"""
+        timeout = timeout or settings.PAYOUT_STUCK_PROCESSING_TIMEOUT
+        cutoff = timezone.now() - timedelta(seconds=timeout)
+        transfer_ids = NettedTransfer.objects.resume_stale(cutoff=cutoff, limit=self.limit)
+        if not transfer_ids:
+            return 0
+
+        signatures = [self.task.s(str(transfer_id)) for transfer_id in transfer_ids]
+        transaction.on_commit(lambda: group(signatures).apply_async())
+        logger.warning(f"Повторно опубликованы задачи зависших сводных переводов: {len(transfer_ids)}")
+        self.metrics.record(counters={'resumed': len(transfer_ids)})
+        return len(transfer_ids)
@@ -0,0 +1,74 @@
+import logging
+import time
+from datetime import timedelta
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..metrics import PayoutMetrics
+from ..models import Payout
+from ..services.ledger_service import LedgerService
+from .payout_lease import PayoutLease
+
+logger = logging.getLogger(__name__)
+
+
+class PayoutReaperService:
+    """
+    Сервис возврата выплат, зависших в статусе 'processing' (например, воркер упал)
+
+    Выплаты ищутся по частичному индексу (updated_at) WHERE status='processing'.
+    Выплаты с живой арендой в Redis не трогаются: их воркер еще работает.
+    Разделенные выплаты, все части которых уже завершены, получают итоговый
+    статус (колбэк chord мог сработать раньше, чем завершилась последняя часть)
+    """
+
+    def __init__(self, timeout=None, chunk_size=None, max_chunks=None, max_reaps=None):
+        self.timeout = timeout or settings.PAYOUT_STUCK_PROCESSING_TIMEOUT
+        self.chunk_size = chunk_size or settings.PAYOUT_REAPER_CHUNK_SIZE
+        self.max_chunks = max_chunks or settings.PAYOUT_REAPER_MAX_CHUNKS
+        self.max_reaps = max_reaps or settings.PAYOUT_REAPER_MAX_REAPS
+        self.metrics = PayoutMetrics('reaper')
+
+    def reap(self) -> dict:
+        """Возврат зависших выплат пачками, результат и метрики запуска"""
+        started = time.monotonic()
+        cutoff = timezone.now() - timedelta(seconds=self.timeout)
+        totals = {'requeued': 0, 'failed': 0, 'skipped_leased': 0}
+        totals['finalized_splits'] = len(Payout.objects.finalize_stale_splits(cutoff=cutoff, limit=self.chunk_size))
+
+        after = None
+        for _ in range(self.max_chunks):
+            chunk = Payout.objects.reap_stuck(
+                cutoff=cutoff,
+                limit=self.chunk_size,
+                max_reaps=self.max_reaps,
+                exclude=PayoutLease.held_ids,
+                after=after,
+            )
+            totals['requeued'] += len(chunk['requeued'])
+            totals['failed'] += len(chunk['failed'])
+            if chunk['failed'] and settings.PAYOUT_LEDGER_ENABLED:
+                # Возвращенные в очередь сохраняют резерв, исчерпавшие возвраты - снимают
+                LedgerService.release(chunk['failed'])
+            totals['skipped_leased'] += len(chunk['skipped'])
+
+            if chunk['selected'] < self.chunk_size:
+                break
+            # Следующая пачка - после последней выбранной строки, в том числе арендованной
+            after = chunk['last']
+
+        duration_ms = int((time.monotonic() - started) * 1000)
+        self.metrics.record(
+            counters={'runs': 1, **totals},
+            gauges={'last_run_at': timezone.now().isoformat(), 'last_duration_ms': duration_ms},
+        )
+
+        if totals['requeued'] or totals['failed']:
+            logger.warning(
+                f"Возвращено зависших выплат: {totals['requeued']} в очередь, "
+                f"{totals['failed']} в статус 'failed'"
+            )
+        if totals['finalized_splits']:
+            logger.warning(f"Завершено разделенных выплат после колбэка chord: {totals['finalized_splits']}")
+        return {**totals, 'duration_ms': duration_ms}
@@ -0,0 +1,50 @@
+import logging
+
+from celery import group
+from django.conf import settings
+
+from ..models import Payout
+from ..routing import PayoutRouter
+from .fair_scheduler import FairScheduler
+
+logger = logging.getLogger(__name__)
+
+
+class PayoutSchedulerService:
+    """Сервис отправки запланированных выплат, срок которых наступил"""
+
+    def __init__(self, task, batch_size=None, max_batches=None):
+        self.task = task
+        self.batch_size = batch_size or settings.PAYOUT_SCHEDULER_BATCH_SIZE
+        self.max_batches = max_batches or settings.PAYOUT_SCHEDULER_MAX_BATCHES
+
+    def dispatch_due(self) -> int:
+        """
+        Отправка пачками по частичному индексу (execute_at) WHERE status='pending'.
+        Не больше max_batches пачек за запуск, чтобы не занимать beat надолго
+        """
+        dispatched = 0
+        for _ in range(self.max_batches):
+            rows = Payout.objects.claim_due(limit=self.batch_size, dispatch=self._dispatch)
+            dispatched += len(rows)
+            if len(rows) < self.batch_size:
+                break
+
+        if dispatched:
+            logger.info(f"Планировщик отправил в обработку выплат: {dispatched}")
+        return dispatched
+
+    def _dispatch(self, rows):
+        """
+        Публикация пачки задач одним обращением к брокеру. В пакетном режиме
+        достаточно сбросить execute_at: выплаты заберет payout_batch_task
+        """
+        if settings.PAYOUT_PROCESSING_MODE == 'batch':
+            return
+        if settings.PAYOUT_FAIR_SCHEDULING:
+            FairScheduler(task=self.task).enqueue_rows(rows)
+            return
+        group(
+            self.task.s(str(row['id'])).set(queue=PayoutRouter.queue_for(**row))
+            for row in rows
+        ).apply_async()
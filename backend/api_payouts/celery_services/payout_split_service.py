@@ -0,0 +1,67 @@
+import logging
+from decimal import Decimal
+
+from celery import chord
+from django.conf import settings
+from django.db import transaction
+
+from ..models import Payout
+from ..routing import PayoutRouter
+
+logger = logging.getLogger(__name__)
+
+
+class PayoutSplitService:
+    """
+    Разделение выплат, превышающих лимит перевода провайдера (PAYOUT_TRANSFER_CAPS)
+
+    Захваченная выплата делится на части не больше лимита, части обрабатываются
+    параллельно задачами chord, а колбэк вычисляет итоговый статус исходной
+    выплаты по статусам частей (PayoutManager.finalize_split)
+    """
+
+    def __init__(self, part_task, finalize_task, caps=None):
+        self.part_task = part_task
+        self.finalize_task = finalize_task
+        self.caps = settings.PAYOUT_TRANSFER_CAPS if caps is None else caps
+
+    def cap_for(self, currency) -> 'Decimal | None':
+        cap = self.caps.get(currency)
+        return Decimal(str(cap)) if cap else None
+
+    def needs_split(self, payout) -> bool:
+        """Выплата превышает лимит и сама не является частью"""
+        cap = self.cap_for(payout.currency)
+        return payout.parent_id is None and cap is not None and payout.amount > cap
+
+    @staticmethod
+    def part_amounts(amount, cap) -> list:
+        """Равные части не больше cap; копейки остатка достаются первым частям"""
+        cents = int(Decimal(amount) * 100)
+        count = -(-cents // int(cap * 100))
+        base, remainder = divmod(cents, count)
+        return [Decimal(base + (1 if number < remainder else 0)) / 100 for number in range(count)]
+
+    def split(self, payout) -> dict:
+        """Создание частей и запуск chord после коммита"""
+        amounts = self.part_amounts(payout.amount, self.cap_for(payout.currency))
+        parts = Payout.objects.create_parts(payout.id, amounts)
+        if parts:
+            header = [
+                self.part_task.s(str(part.id)).set(
+                    queue=PayoutRouter.queue_for(part.amount, part.currency, part.priority)
+                )
+                for part in parts
+            ]
+            callback = self.finalize_task.s(str(payout.id))
+            transaction.on_commit(lambda: chord(header)(callback))
+            logger.info(f"Выплата {payout.id} разделена на {len(parts)} частей")
+
+        return {
+            'success': True,
+            'payout_id': str(payout.id),
+            'status': 'processing',
+            'split': True,
+            'parts': len(parts),
+            'message': 'Выплата разделена на части'
+        }
@@ -1,7 +1,23 @@
 import logging
+from datetime import timedelta
+
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
 
-from ..models import Payout
+from ..gateway import get_gateway_client
+from ..gateway.base import GatewayDeclined
+from ..models import Payout, Status
+from ..services.fx_service import FxConversionService
+from ..services.ledger_service import InsufficientFunds, LedgerService
+from .circuit_breaker import CircuitBreaker, CircuitOpen
+from .payout_lease import PayoutLease
+from .progress_reporter import ProgressReporter
+from .latency_simulator import LatencySimulator
+from .stage_checkpoint import StageCheckpoint
+from .stage_executor import StageGraphExecutor
+from .submit_batcher import SubmitBatcher
+from .velocity_limiter import VelocityLimiter, VelocityLimitExceeded
 
 logger = logging.getLogger(__name__)
 
@@ -9,111 +25,252 @@ logger = logging.getLogger(__name__)
 class PayoutProcessingService:
     """Сервис для обработки выплат"""
 
-    def __init__(self, payout_id, task=None):
+    # Граф этапов: этап запускается после всех этапов из depends_on
+    STAGES = [
+        {"key": "check", "name": "Проверка данных", "duration": 0.5, "depends_on": []},
+        {"key": "balance", "name": "Верификация баланса", "duration": 0.5, "depends_on": []},
+        {"key": "reserve", "name": "Резервирование средств", "duration": 0.5, "depends_on": ["check", "balance"]},
+        {"key": "prepare", "name": "Подготовка транзакции", "duration": 0.5, "depends_on": ["reserve"]},
+        {"key": "submit", "name": "Отправка в платежную систему", "duration": 0.5, "depends_on": ["prepare"]}
+    ]
+
+    def __init__(self, payout_id, task=None, progress=None, lease=None, checkpoint=None, latency=None, breaker=None, gateway=None,
+                 batcher=None, splitter=None, ledger=None, velocity=None, fx=None):
         self.payout_id = payout_id
         self.payout = None
         self.result = {}
         self.task = task
+        self.progress = progress or ProgressReporter(task)
+        self.lease = lease or PayoutLease(payout_id)
+        self.checkpoint = checkpoint or StageCheckpoint(payout_id)
+        self.latency = latency or LatencySimulator()
+        self.breaker = breaker or CircuitBreaker('provider')
+        self.gateway = gateway or get_gateway_client(latency=self.latency, stage=self._stage('submit'))
+        self.batcher = batcher
+        # Разделение крупных выплат на части (см. PayoutSplitService)
+        self.splitter = splitter
+        # Книга учета: проверка остатка и резерв средств вместо имитации этапов
+        self.ledger = ledger or (LedgerService() if settings.PAYOUT_LEDGER_ENABLED else None)
+        # Лимиты частоты выплат по карте и мерчанту (этап проверки данных)
+        self.velocity = velocity or VelocityLimiter()
+        # Фиксация курса для выплат из счета в другой валюте
+        self.fx = fx or FxConversionService()
+        # Выплата передана в пачку отправки: завершит ее SubmitBatcher
+        self.batched = False
+        # Пачку с выплатой отправил этот же воркер: контрольная точка уже удалена
+        self.flushed = False
+        # Захват + этапы имитации + завершение
+        self.total_steps = len(self.STAGES) + 2
+
+    @classmethod
+    def _stage(cls, key):
+        return next(stage for stage in cls.STAGES if stage['key'] == key)
 
     def process(self):
         """
         Основной метод обработки выплаты
         Возвращает результат выполнения
+
+        На успешном пути выплата стоит ровно два запроса к БД:
+        атомарный захват (UPDATE ... RETURNING) и защищенное завершение (UPDATE)
         """
         try:
-            self._setup()
-            self._validate()
-            self._set_processing()
+            self._check_breaker()
+            self._acquire_lease()
+            self._claim()
+            if self.splitter and self.splitter.needs_split(self.payout):
+                return self.splitter.split(self.payout)
+            self._lock_fx_rate()
             self._simulate_processing()
+            if self.batched:
+                return self._batched_result()
             self._complete()
             return self._success_result()
 
         except Payout.DoesNotExist:
             return self._not_found_result()
+        except CircuitOpen as exc:
+            return self._defer(exc)
+        except (VelocityLimitExceeded, GatewayDeclined, InsufficientFunds) as exc:
+            return self._reject(exc)
         except Exception as exc:
             return self._handle_error(exc)
+        finally:
+            self.lease.release()
 
-    def _setup(self):
-        """Этап 1: Получение объекта выплаты"""
+    def _check_breaker(self):
+        """Платежная система недоступна: не захватываем выплату и не тратим попытки"""
+        retry_after = self.breaker.retry_after()
+        if retry_after is not None:
+            raise CircuitOpen(self.breaker.name, retry_after)
+
+    def _acquire_lease(self):
+        """Аренда выплаты в Redis: второй воркер отступает, не обращаясь к БД"""
+        if not self.lease.acquire():
+            logger.info(f"Выплата {self.payout_id} уже обрабатывается другим воркером")
+            raise ProcessingInProgress()
+
+    def _claim(self):
+        """Этап 1: Атомарный захват выплаты (pending/failed -> processing)"""
         logger.info(f"Начинаю обработку выплаты с ID: {self.payout_id}")
-        self.payout = Payout.objects.get_payout(payout_id=self.payout_id)
+        # С арендой можно перехватить выплату, чей воркер упал (повторная доставка acks_late)
+        stale_before = timezone.now() - timedelta(seconds=self.lease.ttl) if self.lease.held else None
+        self.payout = Payout.objects.claim_for_processing(payout_id=self.payout_id, stale_before=stale_before)
+        if self.payout is None:
+            self._resolve_unclaimed()
+        logger.info(f"Выплата {self.payout_id} переведена в статус 'processing'")
 
-        # Обновляем прогресс задачи если есть task
-        if self.task:
-            self.task.update_state(
-                state='PROGRESS',
-                meta={'current': 1, 'total': 4, 'stage': 'setup'}
-            )
+        self.progress.report(1, self.total_steps, 'processing', payout_id=str(self.payout_id))
+
+    def _resolve_unclaimed(self):
+        """Определение причины, по которой выплату не удалось захватить"""
+        status = Payout.objects.filter(id=self.payout_id).values_list('status', flat=True).first()
+
+        if status is None:
+            raise Payout.DoesNotExist()
 
-    def _validate(self):
-        """Этап 2: Валидация и проверка идемпотентности"""
-        if self.payout.is_completed():
+        if status == Status.COMPLETED:
             logger.info(f"Выплата {self.payout_id} уже выполнена ранее")
-            self.result = {'already_completed': True}
-            raise StopProcessing()
+            raise StopProcessing(result={
+                'success': True,
+                'payout_id': self.payout_id,
+                'already_completed': True,
+                'message': 'Обработка уже была выполнена'
+            })
 
-        elif self.payout.is_processing():
-            pass
+        if status == Status.PROCESSING:
+            raise ProcessingInProgress()
 
-        # Обновляем прогресс
-        if self.task:
-            self.task.update_state(
-                state='PROGRESS',
-                meta={'current': 2, 'total': 4, 'stage': 'validation'}
-            )
+        logger.info(f"Выплата {self.payout_id} в статусе '{status}' не подлежит обработке")
+        raise StopProcessing(result={
+            'success': False,
+            'payout_id': self.payout_id,
+            'status': status,
+            'message': 'Выплата не подлежит обработке'
+        })
 
-    def _set_processing(self):
-        """Этап 3: Установка статуса 'в обработке'"""
-        with transaction.atomic():
-            self.payout.mark_as_processing()
-        logger.info(f"Выплата {self.payout_id} переведена в статус 'processing'")
+    def run_stages(self, payout) -> bool:
+        """
+        Выполнение этапов для выплаты, уже захваченной пакетной обработкой.
+        Возвращает True, если выплата передана в пачку отправки
+        """
+        self.payout = payout
+        self._simulate_processing()
+        if not self.batched:
+            self.checkpoint.clear()
+        return self.batched
 
-        # Обновляем прогресс
-        if self.task:
-            self.task.update_state(
-                state='PROGRESS',
-                meta={'current': 3, 'total': 4, 'stage': 'processing'}
-            )
+    def _lock_fx_rate(self):
+        """Фиксация курса до резерва средств (повторная попытка использует сохраненный курс)"""
+        errors = self.fx.lock([self.payout])
+        if errors:
+            raise FxRateUnavailable(errors[self.payout.id])
 
     def _simulate_processing(self):
-        """Имитация обработки"""
+        """Имитация обработки: граф этапов с продолжением от последней контрольной точки"""
         logger.info(f"Имитация обработки выплаты {self.payout_id}...")
 
-        stages = [
-            {"name": "Проверка данных", "duration": 0.5},
-            {"name": "Верификация баланса", "duration": 0.5},
-            {"name": "Резервирование средств", "duration": 0.5},
-            {"name": "Подготовка транзакции", "duration": 0.5},
-            {"name": "Отправка в платежную систему", "duration": 0.5}
-        ]
-
-        for stage in stages:
-            logger.info(f"Этап '{stage['name']}' для выплаты {self.payout_id}")
-
-            if self.task:
-                 self.task.update_state(
-                    state='PROGRESS',
-                    meta={
-                        'payout_id': str(self.payout_id),
-                        'stage': stage['name'],
-                        'progress': f"Выполняется {stage['name']}"
-                    }
-                )
+        completed = self.checkpoint.load()
+        if completed:
+            logger.info(f"Выплата {self.payout_id}: пропуск уже завершенных этапов {sorted(completed)}")
+        if self.ledger and 'reserve' in completed:
+            # Резерв снимается при любой неудаче, а контрольная точка остается: ставим его
+            # заново до отправки (по действующему резерву reserve ничего не меняет)
+            self.ledger.reserve(self.payout)
+
+        StageGraphExecutor(self.STAGES, run_stage=self._run_stage, on_done=self._stage_done).run(completed)
         logger.info(f"Имитация обработки завершена для выплаты {self.payout_id}")
 
+    def _run_stage(self, stage):
+        """Выполнение одного этапа (в потоке исполнителя)"""
+        logger.info(f"Этап '{stage['name']}' для выплаты {self.payout_id}")
+        handler = self._stage_handler(stage)
+        if handler is None:
+            self.latency.wait(stage)
+        else:
+            handler()
+
+    def _stage_handler(self, stage):
+        """Обработчик этапа с реальной работой; None - этап только имитирует задержку"""
+        if stage['key'] == 'submit':
+            return lambda: self._submit(stage)
+        if stage['key'] == 'check' and self.velocity.enabled_for(self.payout.currency):
+            return lambda: self.velocity.check(self.payout)
+        if self.ledger and stage['key'] == 'balance':
+            return lambda: self.ledger.verify_balance(self.payout)
+        if self.ledger and stage['key'] == 'reserve':
+            return lambda: self.ledger.reserve(self.payout)
+        return None
+
+    def _submit(self, stage):
+        """Отправка в платежную систему через предохранитель или постановка в пачку"""
+        if settings.PAYOUT_SUBMIT_BATCHING:
+            self.batcher = self.batcher or SubmitBatcher(gateway=self.gateway, breaker=self.breaker)
+            if self.batcher.add(self.payout):
+                self.batched = True
+                # Пачку могла сразу отправить сама add: выплата уже завершена
+                self.flushed = str(self.payout_id) in self.batcher.finished
+                return
+
+        probe = self.breaker.allow()
+        try:
+            response = self.gateway.submit(self.payout)
+        except GatewayDeclined:
+            # Отказ по выплате - платежная система при этом доступна
+            self.breaker.record_success(probe=probe)
+            raise
+        except Exception:
+            self.breaker.record_failure(probe=probe)
+            raise
+        self.breaker.record_success(probe=probe)
+        self.payout.provider_reference = response.get('reference') or ''
+        logger.info(f"Выплата {self.payout_id} принята платежной системой: {self.payout.provider_reference}")
+
+    def _stage_done(self, stage, done):
+        """Контрольная точка и прогресс после завершения этапа"""
+        # Отправку пачкой контрольная точка не фиксирует: если пачка потеряется,
+        # возвращенная выплата будет отправлена снова
+        if not self.flushed:
+            self.checkpoint.save(done - {'submit'} if self.batched else done)
+        self.progress.report(
+            len(done) + 1,
+            self.total_steps,
+            stage['name'],
+            payout_id=str(self.payout_id),
+            progress=f"Завершен этап {stage['name']}"
+        )
+
     def _complete(self):
-        """Этап 4: Завершение обработки"""
+        """Этап 3: Завершение обработки"""
         logger.info(f"Завершение обработки выплаты {self.payout_id}")
-        with transaction.atomic():
-            self.payout.mark_as_completed()
+        if self.ledger is None:
+            completed_at = Payout.objects.complete_processing(
+                payout_id=self.payout_id, reference=self.payout.provider_reference
+            )
+        else:
+            # Завершение и списание резерва - одна транзакция
+            with transaction.atomic():
+                completed_at = Payout.objects.complete_processing(
+                    payout_id=self.payout_id, reference=self.payout.provider_reference
+                )
+                if completed_at is not None:
+                    self.ledger.capture([self.payout_id])
+        if completed_at is None:
+            # Статус изменили извне (например, отмена) во время обработки
+            logger.warning(f"Выплата {self.payout_id} вышла из статуса 'processing' до завершения")
+            if self.ledger:
+                self.ledger.release([self.payout_id])
+            raise StopProcessing(result={
+                'success': False,
+                'payout_id': self.payout_id,
+                'message': 'Статус выплаты изменен во время обработки'
+            })
+        self.payout.status = Status.COMPLETED
+        self.payout.updated_at = completed_at
+        self.checkpoint.clear()
         logger.info(f"Выплата {self.payout_id} успешно обработана")
 
-        # Обновляем прогресс
-        if self.task:
-            self.task.update_state(
-                state='PROGRESS',
-                meta={'current': 4, 'total': 4, 'stage': 'completion'}
-            )
+        self.progress.report(self.total_steps, self.total_steps, 'completion', payout_id=str(self.payout_id))
 
     def _success_result(self):
         """Формирование успешного результата"""
@@ -125,6 +282,48 @@ class PayoutProcessingService:
             'completed_at': self.payout.updated_at.isoformat()
         }
 
+    def _batched_result(self):
+        """Результат для выплаты, переданной в пачку отправки"""
+        logger.info(f"Выплата {self.payout_id} поставлена в пачку отправки")
+        return {
+            'success': True,
+            'payout_id': self.payout_id,
+            'status': 'processing',
+            'batched': True,
+            'message': 'Выплата передана в пачку отправки'
+        }
+
+    def _defer(self, exc):
+        """
+        Предохранитель разомкнут: выплата возвращается в 'pending' с execute_at
+        после остывания. Контрольная точка сохраняется - обработка продолжится с отправки
+        """
+        execute_at = timezone.now() + timedelta(seconds=exc.retry_after)
+        Payout.objects.defer([self.payout_id], execute_at, claimed=self.payout is not None)
+        logger.warning(f"Выплата {self.payout_id} отложена до {execute_at.isoformat()}: {exc}")
+        return {
+            'success': False,
+            'payout_id': self.payout_id,
+            'deferred': True,
+            'execute_at': execute_at.isoformat(),
+            'message': str(exc)
+        }
+
+    def _reject(self, exc):
+        """
+        Превышен лимит частоты, не хватает средств или платежная система
+        отклонила выплату: failed без повторных попыток
+        """
+        logger.warning(f"Выплата {self.payout_id} отклонена: {exc}")
+        self._mark_as_failed(exc)
+        return {
+            'success': False,
+            'payout_id': self.payout_id,
+            'status': 'failed',
+            'rejected': True,
+            'message': str(exc)
+        }
+
     def _not_found_result(self):
         """Обработка случая, когда выплата не найдена"""
         logger.error(f"Выплата с ID {self.payout_id} не найдена")
@@ -150,10 +349,13 @@ class PayoutProcessingService:
         raise exc
 
     def _mark_as_failed(self, error):
-        """Обновление статуса выплаты на 'failed'"""
+        """Обновление статуса захваченной выплаты на 'failed'"""
+        if self.payout is None:
+            return
         try:
-            with transaction.atomic():
-                self.payout.mark_as_failed(error_message=error)
+            Payout.objects.fail_processing(payout_id=self.payout_id, error_message=str(error))
+            if self.ledger:
+                self.ledger.release([self.payout_id])
         except Exception as update_exc:
             logger.error(f"Не удалось обновить статус для {self.payout_id}: {str(update_exc)}")
 
@@ -166,6 +368,10 @@ class StopProcessing(Exception):
         super().__init__()
 
 
+class FxRateUnavailable(Exception):
+    """Нет курса для конвертации в валюту выплаты"""
+
+
 class ProcessingInProgress(Exception):
     """Исключение для обработки, которая уже выполняется"""
     pass
\ No newline at end of file
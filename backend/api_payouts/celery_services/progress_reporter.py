@@ -0,0 +1,56 @@
+import time
+
+from django.conf import settings
+
+
+class ProgressReporter:
+    """
+    Отчет о прогрессе задачи с коалесцированием записей в result backend
+
+    Состояние PROGRESS записывается, только если с прошлой записи прошло
+    не меньше min_interval секунд или прогресс вырос не меньше чем на min_delta;
+    последний шаг (current == total) записывается всегда.
+    Для очередей из PAYOUT_PROGRESS_DISABLED_QUEUES отчеты не пишутся вовсе
+    """
+
+    def __init__(self, task=None, min_interval=None, min_delta=None, enabled=None):
+        self.task = task
+        self.min_interval = settings.PAYOUT_PROGRESS_MIN_INTERVAL if min_interval is None else min_interval
+        self.min_delta = settings.PAYOUT_PROGRESS_MIN_DELTA if min_delta is None else min_delta
+        self.enabled = self._is_enabled_for(task) if enabled is None else enabled and task is not None
+        self.writes = 0
+        self._last_time = time.monotonic()
+        self._last_fraction = 0.0
+
+    @staticmethod
+    def _is_enabled_for(task) -> bool:
+        """Отчеты включены, если есть задача и ее очередь не отключена"""
+        if task is None:
+            return False
+        delivery_info = getattr(task.request, 'delivery_info', None) or {}
+        queue = delivery_info.get('routing_key')
+        return queue not in settings.PAYOUT_PROGRESS_DISABLED_QUEUES
+
+    def report(self, current: int, total: int, stage: str, force: bool = False, **meta) -> bool:
+        """Записать прогресс, если изменение существенно. Возвращает True при записи"""
+        if not self.enabled:
+            return False
+
+        now = time.monotonic()
+        fraction = current / total if total else 1.0
+        significant = fraction - self._last_fraction >= self.min_delta
+        stale = now - self._last_time >= self.min_interval
+        # Завершение пишется всегда, иначе последний шаг может потеряться
+        finished = total and current >= total
+
+        if not (force or significant or stale or finished):
+            return False
+
+        self.task.update_state(
+            state='PROGRESS',
+            meta={'current': current, 'total': total, 'stage': stage, **meta}
+        )
+        self.writes += 1
+        self._last_time = now
+        self._last_fraction = fraction
+        return True
@@ -0,0 +1,73 @@
+import logging
+
+from celery import current_app
+from django.conf import settings
+from kombu.utils.encoding import bytes_to_str
+
+from ..metrics import PayoutMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class TaskResultPruner:
+    """
+    Очистка result backend от результатов задач без срока жизни
+
+    Ключи результатов перебираются SCAN порциями по batch_size, для порции
+    одним pipeline читаются TTL и MEMORY USAGE. Ключи без TTL (записанные до
+    включения result_expires) удаляются, остальные истекут сами. За запуск
+    просматривается не больше max_keys ключей; курсор SCAN хранится в том же
+    Redis, и следующий запуск продолжает с него, пока обход не завершится
+    """
+
+    CURSOR_KEY = 'payout:results:prune_cursor'
+
+    def __init__(self, client=None, batch_size=None, max_keys=None):
+        self.client = client
+        self.batch_size = batch_size or settings.PAYOUT_RESULT_PRUNE_BATCH
+        self.max_keys = max_keys or settings.PAYOUT_RESULT_PRUNE_MAX_KEYS
+        self.metrics = PayoutMetrics('results')
+
+    def prune(self) -> dict:
+        backend = current_app.backend
+        client = self.client or backend.client
+        totals = {'scanned': 0, 'deleted': 0, 'freed_bytes': 0}
+        match = f'{bytes_to_str(backend.task_keyprefix)}*'
+
+        cursor = int(client.get(self.CURSOR_KEY) or 0)
+        while True:
+            cursor, keys = client.scan(cursor, match=match, count=self.batch_size)
+            cursor = int(cursor)
+            if keys:
+                totals['scanned'] += len(keys)
+                self._prune_batch(client, keys, totals)
+            if cursor == 0 or totals['scanned'] >= self.max_keys:
+                break
+
+        if cursor:
+            client.set(self.CURSOR_KEY, cursor)
+        else:
+            # Обход завершен: следующий запуск начнет сначала
+            client.delete(self.CURSOR_KEY)
+
+        logger.info(f"Очистка результатов задач: просмотрено {totals['scanned']}, удалено {totals['deleted']}")
+        self.metrics.record(
+            counters={'deleted': totals['deleted'], 'freed_bytes': totals['freed_bytes']},
+            gauges={'last_scanned': totals['scanned'], 'cursor': cursor},
+        )
+        return totals
+
+    @staticmethod
+    def _prune_batch(client, keys, totals):
+        pipe = client.pipeline(transaction=False)
+        for key in keys:
+            pipe.ttl(key)
+            pipe.memory_usage(key)
+        replies = pipe.execute()
+
+        # TTL -1 - ключ без срока жизни, -2 - ключ уже истек
+        stale = [(key, replies[2 * i + 1] or 0) for i, key in enumerate(keys) if replies[2 * i] == -1]
+        if stale:
+            client.delete(*[key for key, _ in stale])
+            totals['deleted'] += len(stale)
+            totals['freed_bytes'] += sum(size for _, size in stale)
@@ -0,0 +1,52 @@
+import logging
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from ..redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class StageCheckpoint:
+    """
+    Контрольная точка обработки выплаты в Redis: ключи завершенных этапов
+
+    Повторно доставленная или повторенная задача продолжает со следующего
+    этапа. Недоступность Redis не мешает обработке: этапы просто начнутся
+    сначала
+    """
+
+    KEY_PREFIX = 'payout:checkpoint:'
+
+    def __init__(self, payout_id, ttl=None):
+        self.payout_id = str(payout_id)
+        self.key = f'{self.KEY_PREFIX}{self.payout_id}'
+        self.ttl = ttl or settings.PAYOUT_CHECKPOINT_TTL
+
+    def load(self) -> set:
+        """Ключи уже завершенных этапов"""
+        try:
+            value = get_redis().get(self.key)
+        except RedisError as exc:
+            logger.warning(f"Не удалось прочитать контрольную точку выплаты {self.payout_id}: {exc}")
+            return set()
+        if not value:
+            return set()
+        if isinstance(value, bytes):
+            value = value.decode()
+        return set(value.split(','))
+
+    def save(self, completed) -> None:
+        """Запомнить ключи завершенных этапов"""
+        try:
+            get_redis().set(self.key, ','.join(sorted(completed)), ex=self.ttl)
+        except RedisError as exc:
+            logger.warning(f"Не удалось сохранить контрольную точку выплаты {self.payout_id}: {exc}")
+
+    def clear(self) -> None:
+        """Удалить контрольную точку после завершения обработки"""
+        try:
+            get_redis().delete(self.key)
+        except RedisError as exc:
+            logger.warning(f"Не удалось удалить контрольную точку выплаты {self.payout_id}: {exc}")
@@ -0,0 +1,73 @@
+import logging
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from django.db import close_old_connections
+
+logger = logging.getLogger(__name__)
+
+
+class StageGraphExecutor:
+    """
+    Исполнитель графа этапов обработки
+
+    Этап запускается, как только завершены все его зависимости (depends_on),
+    независимые этапы выполняются параллельно в пуле потоков. Обработчик
+    завершения on_done вызывается в вызывающем потоке
+    """
+
+    def __init__(self, stages, run_stage, on_done=None, max_workers=None):
+        self.stages = {stage['key']: stage for stage in stages}
+        self.run_stage = run_stage
+        self.on_done = on_done
+        self.max_workers = max_workers or len(self.stages)
+        self._validate()
+
+    def _validate(self):
+        """Проверка, что зависимости объявлены и граф не содержит циклов"""
+        visited, active = set(), set()
+
+        def visit(key):
+            if key in active:
+                raise ValueError(f"Цикл в графе этапов: {key}")
+            if key in visited:
+                return
+            active.add(key)
+            for dependency in self.stages[key].get('depends_on', []):
+                if dependency not in self.stages:
+                    raise ValueError(f"Неизвестная зависимость этапа {key}: {dependency}")
+                visit(dependency)
+            active.discard(key)
+            visited.add(key)
+
+        for key in self.stages:
+            visit(key)
+
+    def run(self, completed=()) -> set:
+        """Выполнить невыполненные этапы, вернуть множество завершенных"""
+        done = set(completed)
+        pending = [key for key in self.stages if key not in done]
+        if not pending:
+            return done
+
+        with ThreadPoolExecutor(max_workers=self.max_workers, thread_name_prefix='payout-stage') as pool:
+            running = {}
+            while pending or running:
+                for key in [key for key in pending if set(self.stages[key].get('depends_on', [])) <= done]:
+                    pending.remove(key)
+                    running[pool.submit(self._run_in_thread, self.stages[key])] = key
+
+                finished, _ = wait(running, return_when=FIRST_COMPLETED)
+                for future in finished:
+                    key = running.pop(future)
+                    future.result()
+                    done.add(key)
+                    if self.on_done:
+                        self.on_done(self.stages[key], done)
+        return done
+
+    def _run_in_thread(self, stage):
+        try:
+            return self.run_stage(stage)
+        finally:
+            # Этапы с доступом к БД открывают соединение в своем потоке
+            close_old_connections()
@@ -0,0 +1,220 @@
+import json
+import logging
+import time
+
+from django.conf import settings
+from django.db import transaction
+from redis.exceptions import RedisError
+
+from ..gateway import get_gateway_client
+from ..gateway.base import GatewayClient, GatewayDeclined
+from ..metrics import PayoutMetrics
+from ..models import Payout, Currency, Status
+from ..redis_client import get_redis
+from ..services.ledger_service import LedgerService
+from .circuit_breaker import CircuitBreaker, CircuitOpen
+from .payout_lease import PayoutLease, RELEASE_MANY_SCRIPT
+from .stage_checkpoint import StageCheckpoint
+
+logger = logging.getLogger(__name__)
+
+# Атомарный забор пачки: полной или просроченной. Аренды забранных выплат
+# продлеваются на пачку; выплаты, аренду которых держит другой воркер
+# (аренда пачки истекла и выплату вернул сборщик зависших), выбрасываются
+POP_DUE_SCRIPT = """
+local oldest = redis.call('lindex', KEYS[1], 0)
+if not oldest then
+    return {}
+end
+if ARGV[1] == '0' and redis.call('llen', KEYS[1]) < tonumber(ARGV[2]) then
+    if tonumber(ARGV[3]) - tonumber(cjson.decode(oldest)['queued_at']) < tonumber(ARGV[4]) then
+        return {}
+    end
+end
+local items = redis.call('lpop', KEYS[1], ARGV[2]) or {}
+local owned = {}
+for _, item in ipairs(items) do
+    local lease = ARGV[5] .. cjson.decode(item)['payout_id']
+    local holder = redis.call('get', lease)
+    if not holder or holder == ARGV[6] then
+        redis.call('set', lease, ARGV[6], 'PX', ARGV[7])
+        table.insert(owned, item)
+    end
+end
+return owned
+"""
+
+
+class SubmitBatcher:
+    """
+    Пакетная отправка выплат в платежную систему
+
+    Готовые к отправке выплаты копятся в Redis-списках по провайдеру и валюте
+    (payout:submit:<provider>:<currency>). Пачка отправляется одним вызовом,
+    как только набрала batch_size выплат (сразу, воркером, добавившим последнюю)
+    или старейшая выплата ждет дольше max_age (периодической задачей).
+    Результаты раскладываются по выплатам двумя UPDATE: завершенные и отклоненные.
+    Если платежная система недоступна, пачка возвращается в начало списка;
+    выплаты, потерянные при падении воркера, вернет PayoutReaperService.
+    Пока выплата ждет в пачке, ее аренду (ключ PayoutLease) держит пачка,
+    поэтому ни сборщик зависших, ни повторно доставленная задача не отправят
+    ее второй раз. При отправке пачки выплаты, которые уже не в 'processing',
+    отбрасываются
+    """
+
+    KEY_PREFIX = 'payout:submit:'
+    MAX_BATCHES_PER_FLUSH = 20
+    # Общий токен аренд выплат в пачках (вместо токена задачи)
+    LEASE_TOKEN = 'submit-batch'
+
+    def __init__(self, gateway=None, breaker=None, batch_size=None, max_age=None, provider=None):
+        self.gateway = gateway or get_gateway_client()
+        self.breaker = breaker or CircuitBreaker('provider')
+        self.batch_size = batch_size or settings.PAYOUT_SUBMIT_BATCH_SIZE
+        self.max_age = settings.PAYOUT_SUBMIT_BATCH_MAX_AGE if max_age is None else max_age
+        self.provider = provider or settings.PAYOUT_GATEWAY
+        self.lease_ttl = settings.PAYOUT_SUBMIT_BATCH_LEASE_TTL
+        self.metrics = PayoutMetrics('submit_batches')
+        # Выплаты, результаты которых разложены этим экземпляром (в том числе при отправке из add)
+        self.finished = set()
+
+    def key(self, currency: str) -> str:
+        return f'{self.KEY_PREFIX}{self.provider}:{currency}'
+
+    def add(self, payout) -> bool:
+        """Поставить выплату в пачку; False - Redis недоступен, выплату нужно отправить напрямую"""
+        item = json.dumps({**GatewayClient.payload(payout), 'queued_at': time.time()})
+        try:
+            redis = get_redis()
+            # Аренда переходит от задачи к пачке до постановки в список
+            redis.set(f'{PayoutLease.KEY_PREFIX}{payout.id}', self.LEASE_TOKEN, px=self.lease_ttl * 1000)
+            length = redis.rpush(self.key(payout.currency), item)
+        except RedisError as exc:
+            logger.warning(f"Не удалось поставить выплату {payout.id} в пачку отправки: {exc}")
+            return False
+        if length >= self.batch_size:
+            self.flush(payout.currency)
+        return True
+
+    def flush_due(self) -> dict:
+        """Отправка полных и просроченных пачек по всем валютам"""
+        totals = {'batches': 0, 'submitted': 0}
+        for currency in Currency.values:
+            for _ in range(self.MAX_BATCHES_PER_FLUSH):
+                submitted = self.flush(currency)
+                if not submitted:
+                    break
+                totals['batches'] += 1
+                totals['submitted'] += submitted
+                if submitted < self.batch_size:
+                    break
+        return totals
+
+    def flush(self, currency: str, force: bool = False) -> int:
+        """Отправить пачку валюты, если она полна или просрочена. Возвращает размер отправленной пачки"""
+        key = self.key(currency)
+        try:
+            items = self._pop_due(key, force)
+        except RedisError as exc:
+            logger.warning(f"Не удалось забрать пачку отправки {key}: {exc}")
+            return 0
+        if not items:
+            return 0
+        return self._submit(key, items)
+
+    def _pop_due(self, key, force):
+        return get_redis().register_script(POP_DUE_SCRIPT)(
+            keys=[key],
+            args=[
+                int(force), self.batch_size, time.time(), self.max_age,
+                PayoutLease.KEY_PREFIX, self.LEASE_TOKEN, self.lease_ttl * 1000,
+            ],
+        ) or []
+
+    def _submit(self, key, items) -> int:
+        payloads = [json.loads(item) for item in items]
+        for payload in payloads:
+            payload.pop('queued_at', None)
+        # Выплата могла завершиться иначе (например, после истечения аренды пачки)
+        live = {
+            str(payout_id) for payout_id in Payout.objects.filter(
+                id__in=[payload['payout_id'] for payload in payloads], status=Status.PROCESSING,
+            ).values_list('id', flat=True)
+        }
+        if len(live) < len(payloads):
+            logger.warning(f"Пачка {key}: пропущено выплат не в 'processing': {len(payloads) - len(live)}")
+            items = [item for item, payload in zip(items, payloads) if payload['payout_id'] in live]
+            payloads = [payload for payload in payloads if payload['payout_id'] in live]
+            if not payloads:
+                return 0
+
+        try:
+            probe = self.breaker.allow()
+        except CircuitOpen as exc:
+            logger.warning(f"Пачка {key} ({len(items)}) не отправлена: {exc}")
+            self._requeue(key, items)
+            return 0
+
+        try:
+            results = self.gateway.submit_batch(payloads)
+        except GatewayDeclined as exc:
+            # Отклонена вся пачка: платежная система доступна, выплаты переводятся в failed
+            self.breaker.record_success(probe=probe)
+            results = [{'payout_id': p['payout_id'], 'status': 'declined', 'error': str(exc)} for p in payloads]
+        except Exception as exc:
+            logger.error(f"Ошибка отправки пачки {key} ({len(items)}): {exc}")
+            self.breaker.record_failure(probe=probe)
+            self._requeue(key, items)
+            self.metrics.record(counters={'errors': 1})
+            return 0
+        else:
+            self.breaker.record_success(probe=probe)
+
+        self._apply(payloads, results)
+        return len(payloads)
+
+    def _apply(self, payloads, results):
+        """Раскладка результатов пачки по выплатам массовыми UPDATE"""
+        by_id = {result.get('payout_id'): result for result in results}
+        accepted, declined, references = [], {}, {}
+        for payload in payloads:
+            result = by_id.get(payload['payout_id'])
+            if result is None:
+                declined[payload['payout_id']] = 'Платежная система не вернула результат по выплате'
+            elif result.get('status') == 'accepted':
+                accepted.append(payload['payout_id'])
+                references[payload['payout_id']] = result.get('reference') or ''
+            else:
+                declined[payload['payout_id']] = result.get('error') or 'Выплата отклонена платежной системой'
+
+        with transaction.atomic():
+            Payout.objects.complete_batch(accepted, references=references)
+            Payout.objects.fail_batch(declined)
+            if settings.PAYOUT_LEDGER_ENABLED:
+                LedgerService.capture(accepted)
+                LedgerService.release(declined)
+        payout_ids = [payload['payout_id'] for payload in payloads]
+        self.finished.update(payout_ids)
+        try:
+            redis = get_redis()
+            redis.delete(*[f'{StageCheckpoint.KEY_PREFIX}{payout_id}' for payout_id in payout_ids])
+            redis.register_script(RELEASE_MANY_SCRIPT)(
+                keys=[f'{PayoutLease.KEY_PREFIX}{payout_id}' for payout_id in payout_ids], args=[self.LEASE_TOKEN],
+            )
+        except RedisError as exc:
+            # Контрольные точки истекут по PAYOUT_CHECKPOINT_TTL, аренды - по PAYOUT_SUBMIT_BATCH_LEASE_TTL
+            logger.warning(f"Не удалось удалить контрольные точки и аренды пачки: {exc}")
+
+        logger.info(f"Пачка отправлена: принято {len(accepted)}, отклонено {len(declined)}")
+        self.metrics.record(
+            counters={'batches': 1, 'items': len(payloads), 'accepted': len(accepted), 'declined': len(declined)},
+            gauges={'last_batch_size': len(payloads)},
+        )
+
+    @staticmethod
+    def _requeue(key, items):
+        """Вернуть пачку в начало списка в исходном порядке"""
+        try:
+            get_redis().lpush(key, *reversed(items))
+        except RedisError as exc:
+            logger.error(f"Не удалось вернуть пачку в {key}, выплаты вернет PayoutReaperService: {exc}")
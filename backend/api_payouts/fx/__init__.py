@@ -0,0 +1,21 @@
+from functools import lru_cache
+
+from django.conf import settings
+
+from .base import RateSource
+from .cache import FxRateCache
+from .http_source import HttpRateSource
+from .static import StaticRateSource
+
+
+def get_rate_source() -> RateSource:
+    """Источник курсов по настройке PAYOUT_FX_SOURCE: 'static' или 'http'"""
+    if settings.PAYOUT_FX_SOURCE == 'http':
+        return HttpRateSource(settings.PAYOUT_FX_SOURCE_URL)
+    return StaticRateSource()
+
+
+@lru_cache(maxsize=None)
+def get_rate_cache() -> FxRateCache:
+    """Кеш курсов один на процесс: курсы в памяти общие для всех потоков воркера"""
+    return FxRateCache(get_rate_source())
@@ -0,0 +1,13 @@
+from abc import ABC, abstractmethod
+
+
+class RateSourceError(Exception):
+    """Источник курсов недоступен или не знает валюту"""
+
+
+class RateSource(ABC):
+    """Источник курсов: все курсы к базовой валюте одним запросом"""
+
+    @abstractmethod
+    def fetch(self, base: str) -> dict:
+        """Курсы {валюта: Decimal} - сколько единиц валюты дают за единицу base"""
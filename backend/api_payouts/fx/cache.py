@@ -0,0 +1,134 @@
+import logging
+import threading
+import time
+from decimal import Decimal
+
+from django.conf import settings
+from redis.exceptions import RedisError
+
+from ..redis_client import get_redis
+from .base import RateSourceError
+
+logger = logging.getLogger(__name__)
+
+
+class FxRateCache:
+    """
+    Двухуровневый кеш курсов: память процесса и Redis-хэш payout:fx:<base>
+
+    Курсы к базовой валюте хранятся целиком (один запрос к источнику на базу)
+    и живут ttl секунд. После доли refresh_ahead от ttl первый читатель
+    запускает фоновое обновление, а сам получает текущие курсы: к истечению
+    ttl свежие курсы уже в кеше, и обработка не ждет источник. Обновляет
+    источник один процесс (блокировка в Redis), остальные забирают курсы из
+    Redis. Ошибки Redis не прерывают работу - курсы берутся из источника
+    """
+
+    KEY_PREFIX = 'payout:fx:'
+    FETCHED_AT = '_fetched_at'
+
+    def __init__(self, source, ttl=None, refresh_ahead=None):
+        self.source = source
+        self.ttl = ttl or settings.PAYOUT_FX_CACHE_TTL
+        self.refresh_ahead = settings.PAYOUT_FX_REFRESH_AHEAD if refresh_ahead is None else refresh_ahead
+        self.fetches = 0
+        self._local = {}
+        self._refreshing = set()
+        self._lock = threading.Lock()
+
+    def rate(self, base: str, quote: str) -> Decimal:
+        """Курс base -> quote: единиц quote за единицу base"""
+        if base == quote:
+            return Decimal(1)
+        rates = self.rates(base)
+        if quote not in rates:
+            raise RateSourceError(f"Нет курса {base} -> {quote}")
+        return rates[quote]
+
+    def rates(self, base: str) -> dict:
+        """Все курсы к base"""
+        entry = self._local.get(base)
+        if entry is None or self._age(entry) >= self.ttl:
+            with self._lock:
+                entry = self._local.get(base)
+                if entry is None or self._age(entry) >= self.ttl:
+                    entry = self._load(base)
+        if self._age(entry) >= self.ttl * self.refresh_ahead:
+            self._refresh_async(base)
+        return entry[0]
+
+    def _load(self, base: str) -> tuple:
+        """Курсы из Redis, если свежие, иначе из источника"""
+        entry = self._read_shared(base)
+        if entry is None or self._age(entry) >= self.ttl:
+            entry = self._fetch(base)
+        self._local[base] = entry
+        return entry
+
+    def _fetch(self, base: str) -> tuple:
+        rates = self.source.fetch(base)
+        fetched_at = time.time()
+        self.fetches += 1
+        logger.info(f"Курсы к {base} обновлены из источника: {len(rates)} валют")
+        try:
+            pipe = get_redis().pipeline(transaction=True)
+            pipe.delete(f'{self.KEY_PREFIX}{base}')
+            pipe.hset(f'{self.KEY_PREFIX}{base}', mapping={
+                **{quote: str(rate) for quote, rate in rates.items()}, self.FETCHED_AT: fetched_at,
+            })
+            pipe.expire(f'{self.KEY_PREFIX}{base}', int(self.ttl))
+            pipe.execute()
+        except RedisError as exc:
+            logger.warning(f"Курсы к {base} не сохранены в Redis: {exc}")
+        return rates, fetched_at
+
+    def _read_shared(self, base: str):
+        try:
+            raw = get_redis().hgetall(f'{self.KEY_PREFIX}{base}')
+        except RedisError as exc:
+            logger.warning(f"Курсы к {base} не прочитаны из Redis: {exc}")
+            return None
+        values = {
+            (key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value)
+            for key, value in raw.items()
+        }
+        fetched_at = values.pop(self.FETCHED_AT, None)
+        if fetched_at is None:
+            return None
+        return {quote: Decimal(rate) for quote, rate in values.items()}, float(fetched_at)
+
+    def _refresh_async(self, base: str):
+        """Фоновое обновление курсов к base (одно на процесс)"""
+        with self._lock:
+            if base in self._refreshing:
+                return None
+            self._refreshing.add(base)
+        thread = threading.Thread(target=self._refresh, args=(base,), name=f'fx-refresh-{base}', daemon=True)
+        thread.start()
+        return thread
+
+    def _refresh(self, base: str) -> None:
+        try:
+            if self._claim_refresh(base):
+                entry = self._fetch(base)
+            else:
+                # Обновляет другой процесс: берем его результат, если он уже в Redis
+                entry = self._read_shared(base)
+            if entry is not None and entry[1] > self._local.get(base, (None, 0))[1]:
+                self._local[base] = entry
+        except RateSourceError as exc:
+            logger.warning(f"Фоновое обновление курсов к {base} не удалось: {exc}")
+        finally:
+            with self._lock:
+                self._refreshing.discard(base)
+
+    def _claim_refresh(self, base: str) -> bool:
+        lock_ttl = max(int(self.ttl * (1 - self.refresh_ahead)), 1)
+        try:
+            return bool(get_redis().set(f'{self.KEY_PREFIX}{base}:refresh', 1, nx=True, ex=lock_ttl))
+        except RedisError:
+            return True
+
+    @staticmethod
+    def _age(entry) -> float:
+        return time.time() - entry[1]
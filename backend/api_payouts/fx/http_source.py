@@ -0,0 +1,28 @@
+import json
+from decimal import Decimal
+from urllib.error import HTTPError, URLError
+from urllib.parse import urlencode
+from urllib.request import urlopen
+
+from django.conf import settings
+
+from .base import RateSource, RateSourceError
+
+
+class HttpRateSource(RateSource):
+    """Курсы провайдера: GET <url>/rates?base=USD -> {'base': 'USD', 'rates': {'RUB': '92.5', ...}}"""
+
+    def __init__(self, base_url=None, timeout=None):
+        self.base_url = (base_url or settings.PAYOUT_FX_SOURCE_URL).rstrip('/')
+        self.timeout = timeout or settings.PAYOUT_GATEWAY_READ_TIMEOUT
+
+    def fetch(self, base: str) -> dict:
+        url = f"{self.base_url}/rates?{urlencode({'base': base})}"
+        try:
+            with urlopen(url, timeout=self.timeout) as response:
+                payload = json.loads(response.read())
+        except HTTPError as exc:
+            raise RateSourceError(f"Источник курсов вернул {exc.code} для {base}") from exc
+        except (URLError, OSError, ValueError) as exc:
+            raise RateSourceError(f"Источник курсов недоступен: {exc}") from exc
+        return {quote: Decimal(str(rate)) for quote, rate in payload.get('rates', {}).items()}
@@ -0,0 +1,25 @@
+from decimal import Decimal
+
+from django.conf import settings
+
+from .base import RateSource, RateSourceError
+
+
+class StaticRateSource(RateSource):
+    """
+    Курсы из таблицы PAYOUT_FX_RATES: стоимость единицы каждой валюты в общей
+    расчетной единице. Кросс-курс base -> quote = rates[base] / rates[quote]
+    """
+
+    def __init__(self, rates=None):
+        table = settings.PAYOUT_FX_RATES if rates is None else rates
+        self.rates = {currency: Decimal(str(value)) for currency, value in table.items()}
+
+    def fetch(self, base: str) -> dict:
+        if base not in self.rates:
+            raise RateSourceError(f"Нет курса для валюты {base}")
+        return {
+            quote: (self.rates[base] / value).quantize(Decimal('0.00000001'))
+            for quote, value in self.rates.items()
+            if quote != base
+        }
@@ -0,0 +1,23 @@
+from functools import lru_cache
+
+from django.conf import settings
+
+from .base import GatewayClient
+from .http_client import HttpGatewayClient
+from .simulated import SimulatedGatewayClient
+
+
+def get_gateway_client(latency=None, stage=None) -> GatewayClient:
+    """
+    Клиент платежной системы по настройке PAYOUT_GATEWAY: 'simulated' или 'http'.
+    HTTP-клиент один на процесс (общий пул соединений), latency и stage
+    используются только имитацией
+    """
+    if settings.PAYOUT_GATEWAY == 'http':
+        return _http_client(settings.PAYOUT_GATEWAY_URL)
+    return SimulatedGatewayClient(latency=latency, stage=stage)
+
+
+@lru_cache(maxsize=None)
+def _http_client(base_url) -> HttpGatewayClient:
+    return HttpGatewayClient(base_url)
@@ -0,0 +1,38 @@
+from abc import ABC, abstractmethod
+
+
+class GatewayError(Exception):
+    """Платежная система недоступна или ответила ошибкой (таймаут, 5xx): повод для повтора"""
+
+
+class GatewayDeclined(GatewayError):
+    """Платежная система отклонила выплату (4xx): повторять бессмысленно"""
+
+
+class GatewayClient(ABC):
+    """Клиент платежной системы: отправка выплаты, ответ - словарь с reference и status"""
+
+    @abstractmethod
+    def submit(self, payout) -> dict:
+        """Отправка одной выплаты"""
+
+    @abstractmethod
+    def submit_batch(self, payloads: list) -> list:
+        """
+        Отправка пачки выплат одним вызовом (payloads - результаты payload()).
+        Ответ - результаты по каждой выплате: payout_id, status ('accepted' или
+        'declined'), reference или error
+        """
+
+    @staticmethod
+    def payload(payout) -> dict:
+        """Тело запроса на выплату"""
+        return {
+            'payout_id': str(payout.id),
+            'amount': str(payout.amount),
+            'currency': payout.currency,
+            'recipient_details': payout.recipient_details,
+        }
+
+    def close(self) -> None:
+        """Освобождение соединений"""
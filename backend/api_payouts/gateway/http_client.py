@@ -0,0 +1,129 @@
+import hashlib
+import json
+import logging
+import queue
+import socket
+from http.client import HTTPConnection, HTTPSConnection, HTTPException
+from urllib.parse import urlsplit
+
+from django.conf import settings
+
+from .base import GatewayClient, GatewayError, GatewayDeclined
+
+logger = logging.getLogger(__name__)
+
+
+class HttpGatewayClient(GatewayClient):
+    """
+    HTTP-клиент платежной системы с пулом keep-alive соединений
+
+    Соединения переиспользуются между запросами (и потоками этапов), пул
+    ограничен pool_size: лишние соединения закрываются после ответа.
+    Таймауты раздельные: на установку соединения и на чтение ответа.
+    Запрос несет Idempotency-Key, поэтому запрос, упавший на протухшем
+    keep-alive соединении, безопасно повторяется один раз на новом
+    """
+
+    def __init__(self, base_url=None, pool_size=None, connect_timeout=None, read_timeout=None):
+        url = urlsplit(base_url or settings.PAYOUT_GATEWAY_URL)
+        self.connection_class = HTTPSConnection if url.scheme == 'https' else HTTPConnection
+        self.host = url.hostname
+        self.port = url.port
+        self.base_path = url.path.rstrip('/')
+        self.pool_size = settings.PAYOUT_GATEWAY_POOL_SIZE if pool_size is None else pool_size
+        self.connect_timeout = connect_timeout or settings.PAYOUT_GATEWAY_CONNECT_TIMEOUT
+        self.read_timeout = read_timeout or settings.PAYOUT_GATEWAY_READ_TIMEOUT
+        self._pool = queue.LifoQueue(maxsize=max(self.pool_size, 1))
+        self.connections_opened = 0
+
+    def submit(self, payout) -> dict:
+        return self.request('POST', '/payouts', self.payload(payout), idempotency_key=str(payout.id))
+
+    def submit_batch(self, payloads: list) -> list:
+        # Ключ идемпотентности из состава пачки: повтор той же пачки не задвоит выплаты
+        batch_id = hashlib.sha256(','.join(sorted(p['payout_id'] for p in payloads)).encode()).hexdigest()
+        result = self.request(
+            'POST', '/payouts/batch', {'batch_id': batch_id, 'items': payloads}, idempotency_key=batch_id
+        )
+        return result.get('results', [])
+
+    def request(self, method: str, path: str, body=None, idempotency_key: str = None) -> dict:
+        """JSON-запрос к платежной системе через соединение из пула"""
+        data = json.dumps(body).encode() if body is not None else None
+        headers = {'Content-Type': 'application/json', 'Connection': 'keep-alive'}
+        if idempotency_key:
+            headers['Idempotency-Key'] = idempotency_key
+
+        connection, reused = self._acquire()
+        try:
+            status, payload, keep_alive = self._send(connection, method, path, data, headers)
+        except (ConnectionError, HTTPException) as exc:
+            connection.close()
+            if not reused:
+                raise GatewayError(f"Ошибка соединения с платежной системой: {exc}") from exc
+            # Сервер закрыл простаивающее соединение: повтор на новом
+            connection, _ = self._acquire(fresh=True)
+            try:
+                status, payload, keep_alive = self._send(connection, method, path, data, headers)
+            except (OSError, HTTPException) as retry_exc:
+                connection.close()
+                raise GatewayError(f"Ошибка соединения с платежной системой: {retry_exc}") from retry_exc
+        except (socket.timeout, OSError) as exc:
+            connection.close()
+            raise GatewayError(f"Платежная система не ответила: {exc}") from exc
+
+        self._release(connection, keep_alive)
+        return self._result(status, payload)
+
+    def _send(self, connection, method, path, data, headers):
+        connection.request(method, f'{self.base_path}{path}', body=data, headers=headers)
+        response = connection.getresponse()
+        payload = response.read()
+        return response.status, payload, not response.will_close
+
+    @staticmethod
+    def _result(status, payload) -> dict:
+        try:
+            result = json.loads(payload) if payload else {}
+        except ValueError:
+            result = {'error': payload.decode(errors='replace')}
+        if status >= 500:
+            raise GatewayError(f"Платежная система вернула {status}: {result.get('error', '')}")
+        if status >= 400:
+            raise GatewayDeclined(f"Выплата отклонена платежной системой ({status}): {result.get('error', '')}")
+        return result
+
+    def _acquire(self, fresh=False):
+        """Соединение из пула (reused=True) или новое"""
+        if not fresh:
+            try:
+                return self._pool.get_nowait(), True
+            except queue.Empty:
+                pass
+        connection = self.connection_class(self.host, self.port, timeout=self.connect_timeout)
+        try:
+            connection.connect()
+        except OSError as exc:
+            connection.close()
+            raise GatewayError(f"Не удалось подключиться к платежной системе: {exc}") from exc
+        connection.sock.settimeout(self.read_timeout)
+        # Без Nagle: иначе на keep-alive соединении короткие запросы ждут отложенного ACK
+        connection.sock.setsockopt(socket.IPPROTO_TCP, socket.TCP_NODELAY, 1)
+        self.connections_opened += 1
+        return connection, False
+
+    def _release(self, connection, keep_alive):
+        if not (keep_alive and self.pool_size):
+            connection.close()
+            return
+        try:
+            self._pool.put_nowait(connection)
+        except queue.Full:
+            connection.close()
+
+    def close(self) -> None:
+        while True:
+            try:
+                self._pool.get_nowait().close()
+            except queue.Empty:
+                return
@@ -0,0 +1,23 @@
+import uuid
+
+from ..celery_services.latency_simulator import LatencySimulator
+from .base import GatewayClient
+
+
+class SimulatedGatewayClient(GatewayClient):
+    """Имитация платежной системы: задержка этапа отправки без сетевых запросов"""
+
+    def __init__(self, latency=None, stage=None):
+        self.latency = latency or LatencySimulator()
+        self.stage = stage or {'key': 'submit', 'duration': 0}
+
+    def submit(self, payout) -> dict:
+        self.latency.wait(self.stage)
+        return {'reference': uuid.uuid4().hex, 'status': 'accepted'}
+
+    def submit_batch(self, payloads: list) -> list:
+        self.latency.wait(self.stage)
+        return [
+            {'payout_id': payload['payout_id'], 'reference': uuid.uuid4().hex, 'status': 'accepted'}
+            for payload in payloads
+        ]
@@ -0,0 +1,138 @@
+import json
+import random
+import threading
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from urllib.parse import parse_qs, urlsplit
+
+from ..celery_services.latency_simulator import LatencySimulator
+from ..fx.base import RateSourceError
+from ..fx.static import StaticRateSource
+
+
+class StubProviderHandler(BaseHTTPRequestHandler):
+    """Обработчик запросов заглушки: HTTP/1.1 с keep-alive"""
+
+    protocol_version = 'HTTP/1.1'
+    disable_nagle_algorithm = True
+
+    def setup(self):
+        super().setup()
+        self.server.count('connections')
+
+    def do_GET(self):
+        url = urlsplit(self.path)
+        if url.path.rstrip('/') != '/rates':
+            return self._respond(404, {'error': 'not found'})
+
+        self.server.count('rate_requests')
+        base = parse_qs(url.query).get('base', [''])[0]
+        try:
+            rates = self.server.rates.fetch(base)
+        except RateSourceError as exc:
+            return self._respond(404, {'error': str(exc)})
+        self._respond(200, {'base': base, 'rates': {quote: str(rate) for quote, rate in rates.items()}})
+
+    def do_POST(self):
+        body = self.rfile.read(int(self.headers.get('Content-Length') or 0))
+        if self.path.rstrip('/') == '/payouts/batch':
+            return self._batch(json.loads(body or b'{}'))
+        if self.path.rstrip('/') != '/payouts':
+            return self._respond(404, {'error': 'not found'})
+
+        self.server.count('requests')
+        self.server.latency.wait({'key': 'provider', 'duration': 0})
+        outcome = self.server.outcome()
+        if outcome == 'error':
+            return self._respond(503, {'error': 'provider unavailable'})
+        if outcome == 'declined':
+            return self._respond(422, {'error': 'recipient declined'})
+
+        payout = json.loads(body or b'{}')
+        self._respond(200, {
+            'payout_id': payout.get('payout_id'),
+            'reference': uuid.uuid4().hex,
+            'status': 'accepted',
+        })
+
+    def _batch(self, batch):
+        """Пачка: одна задержка на вызов, отказы - по отдельным выплатам"""
+        self.server.count('requests')
+        self.server.latency.wait({'key': 'provider', 'duration': 0})
+        if self.server.rng.random() < self.server.error_rate:
+            return self._respond(503, {'error': 'provider unavailable'})
+
+        results = []
+        for item in batch.get('items', []):
+            if self.server.rng.random() < self.server.decline_rate:
+                results.append({'payout_id': item.get('payout_id'), 'status': 'declined', 'error': 'recipient declined'})
+            else:
+                results.append({'payout_id': item.get('payout_id'), 'status': 'accepted', 'reference': uuid.uuid4().hex})
+        self._respond(200, {'batch_id': batch.get('batch_id'), 'results': results})
+
+    def _respond(self, status, payload):
+        data = json.dumps(payload).encode()
+        self.send_response(status)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+
+class StubProviderServer(ThreadingHTTPServer):
+    """
+    Локальная заглушка платежной системы для тестов и бенчмарков
+
+    latency - параметры распределения задержки ответа в формате
+    LatencySimulator ({'distribution': 'lognormal', 'mu': -3, 'sigma': 0.5}),
+    error_rate и decline_rate - доли ответов 503 и 422, rates - таблица курсов
+    в формате PAYOUT_FX_RATES для GET /rates?base=<валюта>
+    """
+
+    daemon_threads = True
+    request_queue_size = 128
+
+    def __init__(self, address=('127.0.0.1', 8090), latency=None, error_rate=0.0, decline_rate=0.0, seed=None,
+                 rates=None):
+        super().__init__(address, StubProviderHandler)
+        self.latency = LatencySimulator(
+            config={'default': latency or {'distribution': 'fixed', 'value': 0}}, enabled=True, seed=seed
+        )
+        self.error_rate = error_rate
+        self.decline_rate = decline_rate
+        self.rng = random.Random(seed)
+        self.rates = StaticRateSource(rates)
+        self.stats = {'connections': 0, 'requests': 0}
+        self._lock = threading.Lock()
+
+    @property
+    def url(self) -> str:
+        host, port = self.server_address[:2]
+        return f'http://{host}:{port}'
+
+    def count(self, name):
+        with self._lock:
+            self.stats[name] = self.stats.get(name, 0) + 1
+
+    def outcome(self) -> str:
+        roll = self.rng.random()
+        if roll < self.error_rate:
+            return 'error'
+        if roll < self.error_rate + self.decline_rate:
+            return 'declined'
+        return 'accepted'
+
+    def start(self) -> threading.Thread:
+        """Запуск в фоновом потоке (для тестов и бенчмарков)"""
+        thread = threading.Thread(
+            target=self.serve_forever, kwargs={'poll_interval': 0.05}, name='stub-provider', daemon=True
+        )
+        thread.start()
+        return thread
+
+    def stop(self) -> None:
+        self.shutdown()
+        self.server_close()
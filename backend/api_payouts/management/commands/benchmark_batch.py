@@ -0,0 +1,53 @@
+import time
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, transaction
+from django.test.utils import CaptureQueriesContext
+
+from api_payouts.models import Payout, Currency
+from api_payouts.celery_services.payout_batch_processing_service import PayoutBatchProcessingService
+from api_payouts.celery_services.payout_task_proccessing_service import PayoutProcessingService
+
+
+class Command(BaseCommand):
+    help = 'Сравнение пропускной способности: задача на выплату и пакетная обработка (без накладных расходов брокера)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payouts', type=int, default=1000, help='Количество выплат')
+        parser.add_argument('--batch-size', type=int, default=100, help='Размер пачки')
+
+    def handle(self, *args, **options):
+        count = options['payouts']
+        batch_size = options['batch_size']
+
+        def per_payout(payouts):
+            for payout in payouts:
+                PayoutProcessingService(str(payout.id)).process()
+
+        def batch(payouts):
+            PayoutBatchProcessingService(batch_size=batch_size, max_batches=count).process()
+
+        for name, run in (('per-payout', per_payout), (f'batch ({batch_size})', batch)):
+            elapsed, queries = self._measure(count, run)
+            self.stdout.write(
+                f"{name}: {count / elapsed:.0f} выплат/с, запросов к БД на выплату {queries / count:.2f}"
+            )
+
+    def _measure(self, count, run):
+        """Прогон в откатываемой транзакции: (время, число запросов к БД)"""
+        with transaction.atomic():
+            payouts = Payout.objects.bulk_create([
+                Payout(
+                    amount=Decimal('100.00'),
+                    currency=Currency.RUB,
+                    recipient_details={'card_number': '5555555555554444'},
+                )
+                for _ in range(count)
+            ])
+            with CaptureQueriesContext(connection) as queries:
+                started = time.perf_counter()
+                run(payouts)
+                elapsed = time.perf_counter() - started
+            transaction.set_rollback(True)
+        return elapsed, len(queries)
@@ -0,0 +1,102 @@
+import os
+import subprocess
+import sys
+import time
+from decimal import Decimal
+
+from celery import current_app
+from django.conf import settings
+from django.core.management.base import BaseCommand, CommandError
+
+from api_payouts.models import Payout, Currency, Status
+from api_payouts.tasks import payout_task
+
+
+class Command(BaseCommand):
+    help = (
+        'Пропускная способность асинхронного воркера и пулов Celery на одной очереди. '
+        'Нужны Redis и общая для процессов БД (Postgres из docker-compose); '
+        'этапы ждут объявленную длительность (имитация задержек включается в воркерах)'
+    )
+
+    QUEUE = 'payouts.benchmark'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payouts', type=int, default=400, help='Количество выплат на прогон')
+        parser.add_argument('--concurrency', type=int, default=50, help='Конкурентность воркера')
+        parser.add_argument('--engines', default='async,solo,threads,prefork',
+                            help='Движки через запятую: async, solo, threads, prefork')
+        parser.add_argument('--timeout', type=float, default=600, help='Предельное время прогона, с')
+
+    def handle(self, *args, **options):
+        count = options['payouts']
+        for engine in options['engines'].split(','):
+            self._purge()
+            ids = self._create(count)
+            try:
+                self._publish(ids)
+                elapsed = self._run(engine, options['concurrency'], ids, options['timeout'])
+            finally:
+                Payout.objects.filter(id__in=ids).delete()
+            self.stdout.write(
+                f"{engine} (concurrency={options['concurrency']}): {count / elapsed:.1f} выплат/с, {elapsed:.1f} с"
+            )
+
+    def _run(self, engine, concurrency, ids, timeout) -> float:
+        """Запуск воркера; время от первой обработанной выплаты до последней"""
+        env = {**os.environ, 'PAYOUT_LATENCY_SIMULATION': 'True'}
+        process = subprocess.Popen(
+            self._command(engine, concurrency), cwd=settings.BASE_DIR, env=env,
+            stdout=subprocess.DEVNULL, stderr=subprocess.DEVNULL,
+        )
+        try:
+            return self._wait(ids, timeout)
+        finally:
+            process.terminate()
+            try:
+                process.wait(timeout=30)
+            except subprocess.TimeoutExpired:
+                process.kill()
+
+    def _command(self, engine, concurrency) -> list:
+        if engine == 'async':
+            return [sys.executable, 'manage.py', 'run_async_worker', '-Q', self.QUEUE, '-c', str(concurrency)]
+        return [
+            'celery', '-A', 'backend', 'worker', f'--pool={engine}', f'--concurrency={concurrency}',
+            '-Q', self.QUEUE, '-n', f'benchmark-{engine}@%h', '--loglevel=warning',
+            '--without-gossip', '--without-mingle', '--without-heartbeat',
+        ]
+
+    def _wait(self, ids, timeout) -> float:
+        """Ожидание, пока все выплаты выйдут из pending/processing"""
+        deadline = time.monotonic() + timeout
+        started = None
+        while time.monotonic() < deadline:
+            remaining = Payout.objects.filter(id__in=ids, status__in=[Status.PENDING, Status.PROCESSING]).count()
+            if started is None and remaining < len(ids):
+                started = time.monotonic()
+            if remaining == 0:
+                return time.monotonic() - started
+            time.sleep(0.1)
+        raise CommandError(f"Прогон не завершился за {timeout} с")
+
+    @staticmethod
+    def _create(count) -> list:
+        payouts = Payout.objects.bulk_create([
+            Payout(amount=Decimal('100.00'), currency=Currency.RUB, recipient_details={'card_number': '5555555555554444'})
+            for _ in range(count)
+        ])
+        return [payout.id for payout in payouts]
+
+    def _publish(self, ids):
+        with current_app.producer_or_acquire() as producer:
+            for payout_id in ids:
+                payout_task.apply_async(args=[str(payout_id)], queue=self.QUEUE, producer=producer)
+
+    def _purge(self):
+        with current_app.connection_for_write() as connection:
+            try:
+                connection.default_channel.queue_purge(self.QUEUE)
+            except Exception:
+                # Очереди еще нет
+                pass
@@ -0,0 +1,106 @@
+import heapq
+import random
+import statistics
+from collections import deque
+
+from django.core.management.base import BaseCommand
+
+
+class Command(BaseCommand):
+    help = (
+        'Симуляция: задержка выплат малых мерчантов во время выгруза крупного мерчанта, '
+        'общая FIFO-очередь против справедливой диспетчеризации (round-robin с квантом и лимитом)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=16)
+        parser.add_argument('--service-ms', type=float, default=50, help='Среднее время обработки выплаты')
+        parser.add_argument('--big', type=int, default=20000, help='Выплат у крупного мерчанта (все в момент 0)')
+        parser.add_argument('--small-tenants', type=int, default=50)
+        parser.add_argument('--small-payouts', type=int, default=20, help='Выплат у каждого малого мерчанта')
+        parser.add_argument('--window', type=float, default=30, help='Окно поступления малых выплат, секунды')
+        parser.add_argument('--quantum', type=int, default=10)
+        parser.add_argument('--tenant-concurrency', type=int, default=8)
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        rng = random.Random(options['seed'])
+        service = options['service_ms'] / 1000
+        jobs = [('big', 0.0, rng.expovariate(1 / service)) for _ in range(options['big'])]
+        for tenant in range(options['small_tenants']):
+            for _ in range(options['small_payouts']):
+                jobs.append((f'small-{tenant}', rng.uniform(0, options['window']), rng.expovariate(1 / service)))
+        jobs.sort(key=lambda job: job[1])
+
+        for name, simulate in (('fifo', self._fifo), ('fair', self._fair)):
+            latencies = simulate(jobs, options)
+            small = sorted(latency for tenant, latency in latencies if tenant != 'big')
+            big = [latency for tenant, latency in latencies if tenant == 'big']
+            self.stdout.write(
+                f"{name}: малые мерчанты p50 {statistics.median(small):.2f} с, "
+                f"p99 {small[int(len(small) * 0.99) - 1]:.2f} с; "
+                f"крупный мерчант, последняя выплата {max(big):.1f} с"
+            )
+
+    @staticmethod
+    def _fifo(jobs, options):
+        """Одна общая очередь: задача уходит первому освободившемуся воркеру"""
+        workers = [0.0] * options['workers']
+        latencies = []
+        for tenant, arrival, duration in jobs:
+            free = heapq.heappop(workers)
+            finish = max(free, arrival) + duration
+            heapq.heappush(workers, finish)
+            latencies.append((tenant, finish - arrival))
+        return latencies
+
+    @staticmethod
+    def _fair(jobs, options):
+        """Очереди мерчантов, обход по кругу квантами, лимит одновременной обработки на мерчанта"""
+        quantum, cap = options['quantum'], options['tenant_concurrency']
+        pending = deque(jobs)
+        queues, ring, credit, inflight = {}, deque(), {}, {}
+        running = []  # (finish, tenant)
+        free_workers = options['workers']
+        now = 0.0
+        latencies = []
+
+        def admit(until):
+            while pending and pending[0][1] <= until:
+                tenant, arrival, duration = pending.popleft()
+                if tenant not in queues:
+                    queues[tenant] = deque()
+                if not queues[tenant]:
+                    ring.append(tenant)
+                    credit[tenant] = quantum
+                queues[tenant].append((arrival, duration))
+
+        while pending or ring or running:
+            admit(now)
+            # Раздача свободных воркеров по кругу мерчантов
+            skipped = 0
+            while free_workers and ring and skipped < len(ring):
+                tenant = ring[0]
+                if inflight.get(tenant, 0) >= cap or credit[tenant] <= 0:
+                    credit[tenant] = quantum
+                    ring.rotate(-1)
+                    skipped += 1
+                    continue
+                skipped = 0
+                arrival, duration = queues[tenant].popleft()
+                credit[tenant] -= 1
+                inflight[tenant] = inflight.get(tenant, 0) + 1
+                free_workers -= 1
+                heapq.heappush(running, (now + duration, tenant))
+                latencies.append((tenant, now + duration - arrival))
+                if not queues[tenant]:
+                    ring.popleft()
+
+            next_arrival = pending[0][1] if pending else float('inf')
+            next_finish = running[0][0] if running else float('inf')
+            now = min(next_arrival, next_finish)
+            while running and running[0][0] <= now:
+                _, tenant = heapq.heappop(running)
+                inflight[tenant] -= 1
+                free_workers += 1
+        return latencies
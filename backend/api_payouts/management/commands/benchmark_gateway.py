@@ -0,0 +1,78 @@
+import statistics
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+
+from api_payouts.gateway.http_client import HttpGatewayClient
+from api_payouts.gateway.stub_provider import StubProviderServer
+
+
+class Command(BaseCommand):
+    help = (
+        'Отправка выплат в локальную заглушку платежной системы: соединение на запрос, '
+        'пул keep-alive соединений и пакетная отправка'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--requests', type=int, default=2000, help='Количество запросов')
+        parser.add_argument('--threads', type=int, default=16, help='Параллельных отправителей')
+        parser.add_argument('--latency-ms', type=float, default=5.0, help='Задержка ответа заглушки, мс')
+        parser.add_argument('--batch-size', type=int, default=200, help='Размер пачки пакетной отправки')
+
+    def handle(self, *args, **options):
+        server = StubProviderServer(
+            ('127.0.0.1', 0),
+            latency={'distribution': 'fixed', 'value': options['latency_ms'] / 1000},
+        )
+        server.start()
+        try:
+            for name, pool_size in (('connection per request', 0), ('keep-alive pool', options['threads'])):
+                client = HttpGatewayClient(server.url, pool_size=pool_size)
+                self._run(name, client, options['requests'], options['threads'])
+                client.close()
+
+            client = HttpGatewayClient(server.url)
+            requests_before = server.stats['requests']
+            self._run_batches(client, options['requests'], options['batch_size'])
+            self.stdout.write(f"  запросов к провайдеру: {server.stats['requests'] - requests_before}")
+            client.close()
+        finally:
+            server.stop()
+
+    @staticmethod
+    def _payouts(count):
+        return [
+            SimpleNamespace(id=uuid.uuid4(), amount=Decimal('100.00'), currency='RUB', recipient_details={})
+            for _ in range(count)
+        ]
+
+    def _run_batches(self, client, count, batch_size):
+        payloads = [client.payload(payout) for payout in self._payouts(count)]
+        started = time.perf_counter()
+        for offset in range(0, count, batch_size):
+            client.submit_batch(payloads[offset:offset + batch_size])
+        elapsed = time.perf_counter() - started
+        self.stdout.write(f"batch ({batch_size}): {count / elapsed:.0f} выплат/с в одном потоке")
+
+    def _run(self, name, client, count, threads):
+        payouts = self._payouts(count)
+
+        def submit(payout):
+            started = time.perf_counter()
+            client.submit(payout)
+            return time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=threads) as pool:
+            latencies = sorted(pool.map(submit, payouts))
+        elapsed = time.perf_counter() - started
+
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        self.stdout.write(
+            f"{name}: {count / elapsed:.0f} запросов/с, p50 {statistics.median(latencies) * 1000:.1f} ms, "
+            f"p99 {p99 * 1000:.1f} ms, открыто соединений {client.connections_opened}"
+        )
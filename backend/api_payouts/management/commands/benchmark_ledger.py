@@ -0,0 +1,72 @@
+import time
+import uuid
+from concurrent.futures import ThreadPoolExecutor
+from decimal import Decimal
+
+from django.core.management.base import BaseCommand
+from django.db import connection, OperationalError
+
+from api_payouts.models import Payout, Currency, LedgerAccount, LedgerEntry, LedgerHold
+from api_payouts.services.ledger_service import LedgerService, InsufficientFunds
+
+
+class Command(BaseCommand):
+    help = (
+        'Конкурентный резерв средств многими воркерами: один счет финансирования против шардов. '
+        'Показателен на PostgreSQL: SQLite блокирует базу целиком'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--workers', type=int, default=32, help='Параллельных воркеров')
+        parser.add_argument('--reservations', type=int, default=2000, help='Количество резервов')
+        parser.add_argument('--shards', default='1,8,32', help='Варианты количества шардов через запятую')
+
+    def handle(self, *args, **options):
+        for shards in [int(value) for value in options['shards'].split(',')]:
+            owner = f'bench-{uuid.uuid4().hex[:8]}'
+            try:
+                self._run(owner, shards, options['workers'], options['reservations'])
+            finally:
+                self._cleanup(owner)
+
+    def _run(self, owner, shards, workers, count):
+        ledger = LedgerService(shards=shards)
+        ledger.open_account(owner, Currency.RUB)
+        ledger.fund(owner, Currency.RUB, Decimal(count) * 2)
+        payouts = Payout.objects.bulk_create([
+            Payout(amount=Decimal('1.00'), currency=Currency.RUB, merchant_id=owner,
+                   recipient_details={'card_number': '5555555555554444'})
+            for _ in range(count)
+        ])
+
+        def reserve(payout):
+            started = time.perf_counter()
+            try:
+                ledger.reserve(payout)
+                outcome = 'ok'
+            except (InsufficientFunds, OperationalError):
+                outcome = 'error'
+            finally:
+                connection.close()
+            return outcome, time.perf_counter() - started
+
+        started = time.perf_counter()
+        with ThreadPoolExecutor(max_workers=workers) as pool:
+            results = list(pool.map(reserve, payouts))
+        elapsed = time.perf_counter() - started
+
+        latencies = sorted(latency for _, latency in results)
+        errors = sum(1 for outcome, _ in results if outcome == 'error')
+        p99 = latencies[int(len(latencies) * 0.99) - 1]
+        self.stdout.write(
+            f"shards={shards}: {count / elapsed:.0f} резервов/с, p99 {p99 * 1000:.1f} ms, ошибок {errors}"
+        )
+
+    @staticmethod
+    def _cleanup(owner):
+        LedgerHold.objects.filter(payout__merchant_id=owner).delete()
+        accounts = LedgerAccount.objects.funding_shards(owner, Currency.RUB)
+        transactions = LedgerEntry.objects.filter(account__in=accounts).values_list('transaction_id', flat=True)
+        LedgerEntry.objects.filter(transaction_id__in=list(transactions)).delete()
+        accounts.delete()
+        Payout.objects.filter(merchant_id=owner).delete()
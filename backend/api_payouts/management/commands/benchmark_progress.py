@@ -0,0 +1,62 @@
+from decimal import Decimal
+from types import SimpleNamespace
+
+from django.core.management.base import BaseCommand
+from django.db import transaction
+
+from api_payouts.models import Payout, Currency
+from api_payouts.celery_services.payout_task_proccessing_service import PayoutProcessingService
+from api_payouts.celery_services.progress_reporter import ProgressReporter
+
+# Redis backend на каждую запись состояния выполняет SET/SETEX + PUBLISH
+REDIS_OPS_PER_WRITE = 2
+
+
+class CountingTask:
+    """Заглушка задачи Celery, считающая записи состояния"""
+
+    def __init__(self):
+        self.request = SimpleNamespace(id='benchmark', delivery_info={'routing_key': 'celery'})
+        self.writes = 0
+
+    def update_state(self, task_id=None, state=None, meta=None, **kwargs):
+        self.writes += 1
+
+
+class Command(BaseCommand):
+    help = 'Сравнение числа записей прогресса в result backend на выплату: без коалесцирования и с ним'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payouts', type=int, default=1000, help='Количество выплат')
+
+    def handle(self, *args, **options):
+        count = options['payouts']
+        scenarios = {
+            'before (каждый этап)': dict(min_interval=0, min_delta=0),
+            'after (коалесцирование)': dict(),
+        }
+
+        for name, reporter_options in scenarios.items():
+            writes = self._run(count, reporter_options)
+            self.stdout.write(
+                f"{name}: записей на выплату {writes / count:.2f}, "
+                f"операций Redis на выплату {writes * REDIS_OPS_PER_WRITE / count:.2f}"
+            )
+
+    def _run(self, count, reporter_options):
+        """Обработать count выплат в откатываемой транзакции, вернуть число записей"""
+        task = CountingTask()
+        with transaction.atomic():
+            payouts = Payout.objects.bulk_create([
+                Payout(
+                    amount=Decimal('100.00'),
+                    currency=Currency.RUB,
+                    recipient_details={'card_number': '5555555555554444'},
+                )
+                for _ in range(count)
+            ])
+            for payout in payouts:
+                progress = ProgressReporter(task, **reporter_options)
+                PayoutProcessingService(str(payout.id), task=task, progress=progress).process()
+            transaction.set_rollback(True)
+        return task.writes
@@ -0,0 +1,83 @@
+import uuid
+
+from celery import current_app
+from django.core.management.base import BaseCommand
+from django.utils import timezone
+
+from api_payouts.tasks import compact_result
+
+# Накладные расходы Redis на строковый ключ (dictEntry, redisObject, заголовки SDS) - если MEMORY USAGE недоступна
+REDIS_KEY_OVERHEAD = 56
+
+
+class Command(BaseCommand):
+    help = (
+        'Память result backend на миллион выплат: подробный результат payout_task без срока жизни '
+        'и сжатое хранение (итог в строке выплаты, результаты частей с result_expires)'
+    )
+
+    def add_arguments(self, parser):
+        parser.add_argument('--payouts', type=int, default=1_000_000, help='Количество выплат для пересчета')
+        parser.add_argument('--samples', type=int, default=100, help='Сколько ключей записать для MEMORY USAGE')
+
+    def handle(self, *args, **options):
+        count = options['payouts']
+        backend = current_app.backend
+        client = self._client(backend)
+
+        verbose = self._key_size(backend, client, self._verbose_result(), options['samples'])
+        compact = self._key_size(backend, client, compact_result({'payout_id': str(uuid.uuid4()), 'success': True}),
+                                 options['samples'])
+        source = 'MEMORY USAGE' if client is not None else 'оценка по размеру ключа и значения'
+
+        self.stdout.write(f"Размер ключа результата ({source}): подробный {verbose} байт, сжатый {compact} байт")
+        self.stdout.write(
+            f"before (результат payout_task без срока жизни): {verbose * count / 2 ** 20:.1f} МиБ "
+            f"на {count} выплат, растет с историей"
+        )
+        self.stdout.write(
+            f"after (ignore_result, result_expires={current_app.conf.result_expires} с): 0 МиБ после истечения; "
+            f"в окне хранятся только части разбитых выплат - {compact} байт на часть"
+        )
+
+    @staticmethod
+    def _verbose_result() -> dict:
+        """Результат payout_task до перехода на хранение итога в строке выплаты"""
+        return {
+            'success': True,
+            'payout_id': str(uuid.uuid4()),
+            'status': 'completed',
+            'message': 'Выплата успешно обработана',
+            'completed_at': timezone.now().isoformat(),
+        }
+
+    @staticmethod
+    def _client(backend):
+        try:
+            backend.client.ping()
+            return backend.client
+        except Exception:
+            return None
+
+    @staticmethod
+    def _key_size(backend, client, result, samples) -> int:
+        """Средний размер ключа с метаданными результата в том виде, в каком его пишет backend"""
+        task_id = str(uuid.uuid4())
+        meta = backend._get_result_meta(result=result, state='SUCCESS', traceback=None, request=None)
+        meta['task_id'] = task_id
+        value = backend.encode(meta)
+        key = backend.get_key_for_task(task_id)
+        if client is None:
+            return len(key) + len(value) + REDIS_KEY_OVERHEAD
+
+        keys = [backend.get_key_for_task(str(uuid.uuid4())) for _ in range(samples)]
+        try:
+            pipe = client.pipeline(transaction=False)
+            for sample in keys:
+                pipe.set(sample, value)
+            for sample in keys:
+                pipe.memory_usage(sample)
+            sizes = pipe.execute()[samples:]
+        finally:
+            client.delete(*keys)
+        return sum(sizes) // samples
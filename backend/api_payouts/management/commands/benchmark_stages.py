@@ -0,0 +1,40 @@
+import statistics
+import time
+
+from django.core.management.base import BaseCommand
+
+from api_payouts.celery_services.latency_simulator import LatencySimulator
+from api_payouts.celery_services.payout_task_proccessing_service import PayoutProcessingService
+from api_payouts.celery_services.stage_executor import StageGraphExecutor
+
+
+class Command(BaseCommand):
+    help = 'Сквозная задержка графа этапов: последовательно и параллельно, с имитацией задержек'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--runs', type=int, default=50, help='Количество прогонов')
+        parser.add_argument('--low', type=float, default=0.02, help='Минимальная задержка этапа, секунды')
+        parser.add_argument('--high', type=float, default=0.08, help='Максимальная задержка этапа, секунды')
+        parser.add_argument('--seed', type=int, default=42)
+
+    def handle(self, *args, **options):
+        config = {'default': {'distribution': 'uniform', 'low': options['low'], 'high': options['high']}}
+
+        for name, max_workers in (('sequential', 1), ('dag', None)):
+            simulator = LatencySimulator(config=config, enabled=True, seed=options['seed'])
+            latencies = []
+            for _ in range(options['runs']):
+                started = time.perf_counter()
+                StageGraphExecutor(
+                    PayoutProcessingService.STAGES,
+                    run_stage=simulator.wait,
+                    max_workers=max_workers,
+                ).run()
+                latencies.append(time.perf_counter() - started)
+
+            latencies.sort()
+            p95 = latencies[int(len(latencies) * 0.95) - 1]
+            self.stdout.write(
+                f"{name}: mean {statistics.mean(latencies) * 1000:.1f} ms, "
+                f"p50 {statistics.median(latencies) * 1000:.1f} ms, p95 {p95 * 1000:.1f} ms"
+            )
@@ -0,0 +1,18 @@
+from datetime import date
+
+from django.core.management.base import BaseCommand
+
+from api_payouts.services.reconciliation_service import ReconciliationService
+
+
+class Command(BaseCommand):
+    help = 'Сверка выплат с файлом расчетов платежной системы (CSV, отсортирован по payout_id)'
+
+    def add_arguments(self, parser):
+        parser.add_argument('path', help='Путь к файлу расчетов')
+        parser.add_argument('--date', type=date.fromisoformat, required=True, help='Дата расчетов, YYYY-MM-DD')
+        parser.add_argument('--restart', action='store_true', help='Начать заново, а не с контрольной точки')
+
+    def handle(self, *args, **options):
+        summary = ReconciliationService(options['path'], options['date']).run(restart=options['restart'])
+        self.stdout.write(', '.join(f"{key}: {value}" for key, value in summary.items()))
@@ -0,0 +1,26 @@
+from django.core.management.base import BaseCommand
+
+from api_payouts.services.dead_letter_service import DeadLetterService
+
+
+class Command(BaseCommand):
+    help = 'Повторная отправка задач выплат из dead letter пачками с ограничением скорости'
+
+    def add_arguments(self, parser):
+        parser.add_argument('ids', nargs='*', type=int, help='Идентификаторы записей (по умолчанию все ожидающие)')
+        parser.add_argument('--error-contains', help='Только записи с указанным текстом ошибки')
+        parser.add_argument('--batch-size', type=int, default=100, help='Размер пачки')
+        parser.add_argument('--interval', type=float, default=1.0, help='Пауза между пачками, секунды')
+        parser.add_argument('--limit', type=int, help='Максимальное число задач')
+
+    def handle(self, *args, **options):
+        result = DeadLetterService.replay(
+            ids=options['ids'],
+            error_contains=options['error_contains'],
+            batch_size=options['batch_size'],
+            interval=options['interval'],
+            limit=options['limit'],
+        )
+        self.stdout.write(
+            f"Отправлено повторно: {result['replayed']}, не требуют повтора: {result['resolved']}"
+        )
@@ -0,0 +1,21 @@
+import asyncio
+
+from django.core.management.base import BaseCommand
+
+from api_payouts.async_worker import AsyncPayoutWorker
+
+
+class Command(BaseCommand):
+    help = 'Асинхронный воркер выплат: много конвейеров обработки в одном цикле asyncio вместо воркера Celery'
+
+    def add_arguments(self, parser):
+        parser.add_argument('-Q', '--queues', default=None, help='Очереди через запятую (PAYOUT_ASYNC_WORKER_QUEUES)')
+        parser.add_argument('-c', '--concurrency', type=int, default=None,
+                            help='Выплат одновременно (PAYOUT_ASYNC_WORKER_CONCURRENCY)')
+        parser.add_argument('--max-messages', type=int, default=None, help='Остановиться после N сообщений')
+
+    def handle(self, *args, **options):
+        queues = options['queues'].split(',') if options['queues'] else None
+        worker = AsyncPayoutWorker(queues=queues, concurrency=options['concurrency'])
+        processed = asyncio.run(worker.run(max_messages=options['max_messages']))
+        self.stdout.write(f"Асинхронный воркер остановлен, обработано сообщений: {processed}")
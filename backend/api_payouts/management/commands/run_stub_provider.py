@@ -0,0 +1,33 @@
+from django.core.management.base import BaseCommand
+
+from api_payouts.gateway.stub_provider import StubProviderServer
+
+
+class Command(BaseCommand):
+    help = 'Локальная заглушка платежной системы с настраиваемыми задержкой и долей ошибок'
+
+    def add_arguments(self, parser):
+        parser.add_argument('--host', default='127.0.0.1')
+        parser.add_argument('--port', type=int, default=8090)
+        parser.add_argument('--latency-mu', type=float, default=-3.0, help='mu логнормальной задержки (ln секунд)')
+        parser.add_argument('--latency-sigma', type=float, default=0.5)
+        parser.add_argument('--error-rate', type=float, default=0.0, help='Доля ответов 503')
+        parser.add_argument('--decline-rate', type=float, default=0.0, help='Доля ответов 422')
+        parser.add_argument('--seed', type=int, default=None)
+
+    def handle(self, *args, **options):
+        server = StubProviderServer(
+            (options['host'], options['port']),
+            latency={'distribution': 'lognormal', 'mu': options['latency_mu'], 'sigma': options['latency_sigma']},
+            error_rate=options['error_rate'],
+            decline_rate=options['decline_rate'],
+            seed=options['seed'],
+        )
+        self.stdout.write(f"Заглушка платежной системы слушает {server.url}")
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            self.stdout.write(f"Статистика: {server.stats}")
@@ -0,0 +1,46 @@
+import logging
+
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from .redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+
+class PayoutMetrics:
+    """
+    Счетчики фоновых процессов выплат в Redis-хэшах payout:metrics:<group>
+
+    Ошибки Redis не прерывают обработку: метрики пишутся по возможности
+    """
+
+    KEY_PREFIX = 'payout:metrics:'
+
+    def __init__(self, group: str):
+        self.group = group
+        self.key = f'{self.KEY_PREFIX}{group}'
+
+    def record(self, counters: dict = None, gauges: dict = None) -> None:
+        """Увеличить счетчики и установить текущие значения одним pipeline"""
+        try:
+            pipe = get_redis().pipeline(transaction=False)
+            for name, amount in (counters or {}).items():
+                pipe.hincrby(self.key, name, int(amount))
+            gauges = {**(gauges or {}), 'updated_at': timezone.now().isoformat()}
+            pipe.hset(self.key, mapping={name: str(value) for name, value in gauges.items()})
+            pipe.execute()
+        except RedisError as exc:
+            logger.warning(f"Не удалось записать метрики '{self.group}': {exc}")
+
+    def snapshot(self) -> dict:
+        """Текущие значения метрик группы"""
+        try:
+            raw = get_redis().hgetall(self.key)
+        except RedisError as exc:
+            logger.warning(f"Не удалось прочитать метрики '{self.group}': {exc}")
+            return {}
+        return {
+            (key.decode() if isinstance(key, bytes) else key): (value.decode() if isinstance(value, bytes) else value)
+            for key, value in raw.items()
+        }
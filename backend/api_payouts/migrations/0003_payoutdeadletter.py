@@ -0,0 +1,33 @@
+# Generated by Django 5.2.10 on 2026-10-19 02:51
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0002_rename_api_app_pay_status_6c6838_idx_api_payouts_status_f5fe30_idx_and_more'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='PayoutDeadLetter',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('task_id', models.CharField(blank=True, max_length=255, verbose_name='Идентификатор задачи')),
+                ('error', models.TextField(verbose_name='Последняя ошибка')),
+                ('attempts', models.JSONField(default=list, verbose_name='История попыток')),
+                ('status', models.CharField(choices=[('pending', 'Ожидает повтора'), ('replayed', 'Отправлено повторно'), ('resolved', 'Не требует повтора')], default='pending', max_length=20, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('replayed_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата повтора')),
+                ('payout', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='dead_letters', to='api_payouts.payout', verbose_name='Выплата')),
+            ],
+            options={
+                'verbose_name': 'Неудачная задача выплаты',
+                'verbose_name_plural': 'Неудачные задачи выплат',
+                'ordering': ['created_at'],
+                'indexes': [models.Index(fields=['status', 'created_at'], name='api_payouts_status_27e031_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,22 @@
+# Generated by Django 5.2.10 on 2026-10-19 02:52
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0003_payoutdeadletter'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='execute_at',
+            field=models.DateTimeField(blank=True, null=True, verbose_name='Запланированное время исполнения'),
+        ),
+        migrations.AddIndex(
+            model_name='payout',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['execute_at'], name='api_payouts_pending_due_idx'),
+        ),
+    ]
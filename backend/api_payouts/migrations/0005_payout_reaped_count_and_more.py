@@ -0,0 +1,22 @@
+# Generated by Django 5.2.10 on 2026-10-19 02:54
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0004_payout_execute_at_payout_api_payouts_pending_due_idx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='reaped_count',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Количество возвратов из зависшей обработки'),
+        ),
+        migrations.AddIndex(
+            model_name='payout',
+            index=models.Index(condition=models.Q(('status', 'processing')), fields=['updated_at'], name='api_payouts_processing_upd_idx'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-19 02:59
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0005_payout_reaped_count_and_more'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='priority',
+            field=models.CharField(blank=True, choices=[('low', 'Низкий'), ('normal', 'Обычный'), ('high', 'Высокий')], max_length=10, null=True, verbose_name='Приоритет (по умолчанию - по сумме и валюте)'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-19 03:00
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0006_payout_priority'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='merchant_id',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Мерчант'),
+        ),
+    ]
@@ -0,0 +1,51 @@
+# Generated by Django 5.2.10 on 2026-10-19 03:09
+
+import django.db.models.deletion
+import uuid
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0007_payout_merchant_id'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='recipient_key',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Отпечаток реквизитов получателя'),
+        ),
+        migrations.CreateModel(
+            name='NettedTransfer',
+            fields=[
+                ('id', models.UUIDField(default=uuid.uuid4, editable=False, primary_key=True, serialize=False, verbose_name='Идентификатор')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=14, verbose_name='Сумма перевода')),
+                ('currency', models.CharField(choices=[('RUB', 'Российский рубль'), ('USD', 'Доллар США'), ('EUR', 'Евро')], max_length=3, verbose_name='Валюта')),
+                ('recipient_key', models.CharField(max_length=64, verbose_name='Отпечаток реквизитов получателя')),
+                ('recipient_details', models.JSONField(verbose_name='Реквизиты получателя')),
+                ('payout_count', models.PositiveIntegerField(verbose_name='Количество выплат')),
+                ('status', models.CharField(choices=[('pending', 'Ожидание'), ('processing', 'В обработке'), ('completed', 'Выплачено'), ('failed', 'Ошибка'), ('cancelled', 'Отменено')], default='pending', max_length=20, verbose_name='Статус перевода')),
+                ('reference', models.CharField(blank=True, default='', max_length=255, verbose_name='Идентификатор у провайдера')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Сводный перевод',
+                'verbose_name_plural': 'Сводные переводы',
+                'ordering': ['-created_at'],
+                'indexes': [models.Index(fields=['status', 'updated_at'], name='api_payouts_status_05517e_idx')],
+            },
+        ),
+        migrations.AddField(
+            model_name='payout',
+            name='netted_transfer',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='payouts', to='api_payouts.nettedtransfer', verbose_name='Сводный перевод'),
+        ),
+        migrations.AddIndex(
+            model_name='payout',
+            index=models.Index(condition=models.Q(('status', 'pending')), fields=['currency', 'recipient_key', 'execute_at'], name='api_payouts_netting_idx'),
+        ),
+    ]
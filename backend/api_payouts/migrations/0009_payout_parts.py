@@ -0,0 +1,24 @@
+# Generated by Django 5.2.10 on 2026-10-19 03:11
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0008_netted_transfer'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='parent',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='api_payouts.payout', verbose_name='Исходная выплата (для части разделенной выплаты)'),
+        ),
+        migrations.AddField(
+            model_name='payout',
+            name='parts_count',
+            field=models.PositiveSmallIntegerField(default=0, verbose_name='Количество частей'),
+        ),
+    ]
@@ -0,0 +1,65 @@
+# Generated by Django 5.2.10 on 2026-10-19 03:13
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0009_payout_parts'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='LedgerAccount',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('kind', models.CharField(choices=[('funding', 'Счет финансирования выплат'), ('settlement', 'Расчеты с платежной системой'), ('deposit', 'Пополнения')], default='funding', max_length=20, verbose_name='Тип счета')),
+                ('owner', models.CharField(blank=True, default='', max_length=64, verbose_name='Владелец (мерчант)')),
+                ('currency', models.CharField(choices=[('RUB', 'Российский рубль'), ('USD', 'Доллар США'), ('EUR', 'Евро')], max_length=3, verbose_name='Валюта')),
+                ('shard', models.PositiveSmallIntegerField(default=0, verbose_name='Номер шарда')),
+                ('balance', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Остаток')),
+                ('reserved', models.DecimalField(decimal_places=2, default=0, max_digits=16, verbose_name='Зарезервировано')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+            ],
+            options={
+                'verbose_name': 'Счет книги учета',
+                'verbose_name_plural': 'Счета книги учета',
+                'constraints': [models.UniqueConstraint(fields=('kind', 'owner', 'currency', 'shard'), name='api_payouts_ledger_account_uniq'), models.CheckConstraint(condition=models.Q(('balance__gte', models.F('reserved')), ('reserved__gte', 0)), name='api_payouts_ledger_account_no_overdraft')],
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerHold',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=16, verbose_name='Сумма')),
+                ('status', models.CharField(choices=[('held', 'Зарезервировано'), ('captured', 'Списано'), ('released', 'Снято')], default='held', max_length=20, verbose_name='Статус')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='holds', to='api_payouts.ledgeraccount', verbose_name='Шард счета')),
+                ('payout', models.OneToOneField(on_delete=django.db.models.deletion.CASCADE, related_name='ledger_hold', to='api_payouts.payout', verbose_name='Выплата')),
+            ],
+            options={
+                'verbose_name': 'Резерв средств',
+                'verbose_name_plural': 'Резервы средств',
+            },
+        ),
+        migrations.CreateModel(
+            name='LedgerEntry',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('transaction_id', models.UUIDField(db_index=True, verbose_name='Транзакция')),
+                ('amount', models.DecimalField(decimal_places=2, max_digits=16, verbose_name='Сумма (со знаком)')),
+                ('kind', models.CharField(max_length=20, verbose_name='Тип проводки')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('account', models.ForeignKey(on_delete=django.db.models.deletion.PROTECT, related_name='entries', to='api_payouts.ledgeraccount', verbose_name='Счет')),
+                ('payout', models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='api_payouts.payout', verbose_name='Выплата')),
+            ],
+            options={
+                'verbose_name': 'Проводка',
+                'verbose_name_plural': 'Проводки',
+                'indexes': [models.Index(fields=['account', 'created_at'], name='api_payouts_account_012a81_idx')],
+            },
+        ),
+    ]
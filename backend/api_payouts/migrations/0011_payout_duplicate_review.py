@@ -0,0 +1,33 @@
+# Generated by Django 5.2.10 on 2026-10-19 03:17
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0010_ledger'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='suspected_duplicates', to='api_payouts.payout', verbose_name='Возможный оригинал (для выплаты на проверке)'),
+        ),
+        migrations.AlterField(
+            model_name='nettedtransfer',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидание'), ('processing', 'В обработке'), ('completed', 'Выплачено'), ('failed', 'Ошибка'), ('cancelled', 'Отменено'), ('review', 'На проверке')], default='pending', max_length=20, verbose_name='Статус перевода'),
+        ),
+        migrations.AlterField(
+            model_name='payout',
+            name='status',
+            field=models.CharField(choices=[('pending', 'Ожидание'), ('processing', 'В обработке'), ('completed', 'Выплачено'), ('failed', 'Ошибка'), ('cancelled', 'Отменено'), ('review', 'На проверке')], default='pending', max_length=20, verbose_name='Статус заявки'),
+        ),
+        migrations.AddIndex(
+            model_name='payout',
+            index=models.Index(fields=['recipient_key', 'currency', 'amount', 'created_at'], name='api_payouts_duplicate_idx'),
+        ),
+    ]
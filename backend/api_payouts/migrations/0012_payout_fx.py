@@ -0,0 +1,28 @@
+# Generated by Django 5.2.10 on 2026-10-19 03:21
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0011_payout_duplicate_review'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='funding_amount',
+            field=models.DecimalField(blank=True, decimal_places=2, max_digits=14, null=True, verbose_name='Сумма списания в валюте списания'),
+        ),
+        migrations.AddField(
+            model_name='payout',
+            name='funding_currency',
+            field=models.CharField(blank=True, choices=[('RUB', 'Российский рубль'), ('USD', 'Доллар США'), ('EUR', 'Евро')], default='', max_length=3, verbose_name='Валюта списания (пусто - валюта выплаты)'),
+        ),
+        migrations.AddField(
+            model_name='payout',
+            name='fx_rate',
+            field=models.DecimalField(blank=True, decimal_places=8, max_digits=18, null=True, verbose_name='Зафиксированный курс (единиц валюты выплаты за единицу валюты списания)'),
+        ),
+    ]
@@ -0,0 +1,18 @@
+# Generated by Django 5.2.10 on 2026-10-19 03:27
+
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0012_payout_fx'),
+    ]
+
+    operations = [
+        migrations.AddField(
+            model_name='payout',
+            name='provider_reference',
+            field=models.CharField(blank=True, default='', max_length=64, verbose_name='Идентификатор выплаты у платежной системы'),
+        ),
+    ]
@@ -0,0 +1,54 @@
+# Generated by Django 5.2.10 on 2026-10-19 03:33
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0013_payout_provider_reference'),
+    ]
+
+    operations = [
+        migrations.CreateModel(
+            name='ReconciliationRun',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('settlement_date', models.DateField(verbose_name='Дата расчетов')),
+                ('source', models.CharField(max_length=255, verbose_name='Файл расчетов')),
+                ('status', models.CharField(choices=[('running', 'Выполняется'), ('completed', 'Завершена'), ('failed', 'Прервана')], default='running', max_length=20, verbose_name='Статус')),
+                ('last_payout_id', models.CharField(blank=True, default='', max_length=36, verbose_name='Последняя сверенная выплата')),
+                ('file_offset', models.BigIntegerField(default=0, verbose_name='Позиция в файле')),
+                ('summary', models.JSONField(default=dict, verbose_name='Итоги')),
+                ('error', models.TextField(blank=True, default='', verbose_name='Ошибка')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('updated_at', models.DateTimeField(auto_now=True, verbose_name='Дата обновления')),
+                ('finished_at', models.DateTimeField(blank=True, null=True, verbose_name='Дата завершения')),
+            ],
+            options={
+                'verbose_name': 'Сверка с файлом расчетов',
+                'verbose_name_plural': 'Сверки с файлами расчетов',
+                'ordering': ['-settlement_date'],
+                'constraints': [models.UniqueConstraint(fields=('settlement_date', 'source'), name='api_payouts_reconciliation_uniq')],
+            },
+        ),
+        migrations.CreateModel(
+            name='ReconciliationMismatch',
+            fields=[
+                ('id', models.BigAutoField(auto_created=True, primary_key=True, serialize=False, verbose_name='ID')),
+                ('payout_id', models.CharField(max_length=36, verbose_name='Выплата')),
+                ('kind', models.CharField(choices=[('missing_in_file', 'Нет в файле расчетов'), ('missing_in_db', 'Нет в базе'), ('amount', 'Расходится сумма'), ('status', 'Расходится статус')], max_length=20, verbose_name='Вид расхождения')),
+                ('expected', models.JSONField(default=dict, verbose_name='Данные файла расчетов')),
+                ('actual', models.JSONField(default=dict, verbose_name='Данные выплаты')),
+                ('created_at', models.DateTimeField(auto_now_add=True, verbose_name='Дата создания')),
+                ('run', models.ForeignKey(on_delete=django.db.models.deletion.CASCADE, related_name='mismatches', to='api_payouts.reconciliationrun', verbose_name='Сверка')),
+            ],
+            options={
+                'verbose_name': 'Расхождение сверки',
+                'verbose_name_plural': 'Расхождения сверки',
+                'ordering': ['payout_id'],
+                'indexes': [models.Index(fields=['run', 'kind'], name='api_payouts_run_id_118929_idx')],
+            },
+        ),
+    ]
@@ -0,0 +1,46 @@
+# Generated by Django 5.2.10 on 2026-10-19 03:36
+
+import django.db.models.deletion
+from django.db import migrations, models
+
+
+def partition_payouts(apps, schema_editor):
+    # Только PostgreSQL; обратного перехода нет - секции придется слить вручную
+    from api_payouts.services.partition_service import PayoutPartitionService
+    PayoutPartitionService.partition_table(schema_editor)
+
+
+class Migration(migrations.Migration):
+
+    dependencies = [
+        ('api_payouts', '0014_reconciliation'),
+    ]
+
+    operations = [
+        migrations.AlterField(
+            model_name='ledgerentry',
+            name='payout',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='ledger_entries', to='api_payouts.payout', verbose_name='Выплата'),
+        ),
+        migrations.AlterField(
+            model_name='ledgerhold',
+            name='payout',
+            field=models.OneToOneField(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='ledger_hold', to='api_payouts.payout', verbose_name='Выплата'),
+        ),
+        migrations.AlterField(
+            model_name='payout',
+            name='duplicate_of',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.SET_NULL, related_name='suspected_duplicates', to='api_payouts.payout', verbose_name='Возможный оригинал (для выплаты на проверке)'),
+        ),
+        migrations.AlterField(
+            model_name='payout',
+            name='parent',
+            field=models.ForeignKey(blank=True, db_constraint=False, null=True, on_delete=django.db.models.deletion.CASCADE, related_name='parts', to='api_payouts.payout', verbose_name='Исходная выплата (для части разделенной выплаты)'),
+        ),
+        migrations.AlterField(
+            model_name='payoutdeadletter',
+            name='payout',
+            field=models.ForeignKey(db_constraint=False, on_delete=django.db.models.deletion.CASCADE, related_name='dead_letters', to='api_payouts.payout', verbose_name='Выплата'),
+        ),
+        migrations.RunPython(partition_payouts),
+    ]
@@ -1,6 +1,12 @@
+import hashlib
+import json
 import logging
+from decimal import Decimal
 
-from django.db import models
+from django.db import models, connection, transaction
+from django.db.models import Case, Count, Exists, F, Min, OuterRef, Q, Sum, Value, When
+from django.db.models.functions import Coalesce, Concat
+from django.utils import timezone
 from uuid import uuid4
 
 from django.shortcuts import get_object_or_404
@@ -13,12 +19,44 @@ class Status(models.TextChoices):
     COMPLETED = 'completed', 'Выплачено'
     FAILED = 'failed', 'Ошибка'
     CANCELLED = 'cancelled', 'Отменено'
+    REVIEW = 'review', 'На проверке'
 
 class Currency(models.TextChoices):
     RUB = 'RUB', 'Российский рубль'
     USD = 'USD', 'Доллар США'
     EUR = 'EUR', 'Евро'
 
+class Priority(models.TextChoices):
+    LOW = 'low', 'Низкий'
+    NORMAL = 'normal', 'Обычный'
+    HIGH = 'high', 'Высокий'
+
+class DeadLetterStatus(models.TextChoices):
+    PENDING = 'pending', 'Ожидает повтора'
+    REPLAYED = 'replayed', 'Отправлено повторно'
+    RESOLVED = 'resolved', 'Не требует повтора'
+
+class LedgerAccountKind(models.TextChoices):
+    FUNDING = 'funding', 'Счет финансирования выплат'
+    SETTLEMENT = 'settlement', 'Расчеты с платежной системой'
+    DEPOSIT = 'deposit', 'Пополнения'
+
+class LedgerHoldStatus(models.TextChoices):
+    HELD = 'held', 'Зарезервировано'
+    CAPTURED = 'captured', 'Списано'
+    RELEASED = 'released', 'Снято'
+
+class ReconciliationStatus(models.TextChoices):
+    RUNNING = 'running', 'Выполняется'
+    COMPLETED = 'completed', 'Завершена'
+    FAILED = 'failed', 'Прервана'
+
+class MismatchKind(models.TextChoices):
+    MISSING_IN_FILE = 'missing_in_file', 'Нет в файле расчетов'
+    MISSING_IN_DB = 'missing_in_db', 'Нет в базе'
+    AMOUNT = 'amount', 'Расходится сумма'
+    STATUS = 'status', 'Расходится статус'
+
 class PayoutQuerySet(models.QuerySet):
 
     def get_by_id(self, payout_id: str) -> 'Payout':
@@ -36,6 +74,16 @@ class PayoutManager(models.Manager):
 
     def create_payout(self, **kwargs) -> 'Payout':
         kwargs.setdefault('status', Status.PENDING)
+        if kwargs.get('merchant_id') is None:
+            kwargs.pop('merchant_id', None)
+        # Счет финансирования в валюте выплаты - конвертация не нужна
+        if kwargs.get('funding_currency') in (None, kwargs.get('currency')):
+            kwargs.pop('funding_currency', None)
+        kwargs['recipient_key'] = Payout.recipient_key_for(kwargs.get('recipient_details'))
+        # Время исполнения в прошлом означает немедленную обработку
+        execute_at = kwargs.get('execute_at')
+        if execute_at is not None and execute_at <= timezone.now():
+            kwargs['execute_at'] = None
         return self.create(**kwargs)
 
     def update_payout(self, payout_id: str, **kwargs) -> 'Payout':
@@ -43,6 +91,8 @@ class PayoutManager(models.Manager):
         for key, value in kwargs.items():
             if hasattr(payout, key):
                 setattr(payout, key, value)
+        if 'recipient_details' in kwargs:
+            payout.recipient_key = Payout.recipient_key_for(payout.recipient_details)
         payout.save()
         return payout
 
@@ -50,6 +100,306 @@ class PayoutManager(models.Manager):
         payout = self.get_queryset().get_by_id(payout_id)
         payout.delete()
 
+    def claim_for_processing(self, payout_id: str, stale_before=None) -> 'Payout | None':
+        """
+        Атомарный захват выплаты одним UPDATE ... RETURNING:
+        pending/failed -> processing. Возвращает None, если захват не удался.
+        stale_before - разрешить перехват выплаты, зависшей в 'processing'
+        дольше этого момента (только при взятой аренде в Redis)
+        """
+        table = connection.ops.quote_name(self.model._meta.db_table)
+        columns = ', '.join(
+            connection.ops.quote_name(field.column) for field in self.model._meta.concrete_fields
+        )
+        updated_at = self.model._meta.get_field('updated_at')
+        condition = 'status IN (%s, %s)'
+        params = [
+            Status.PROCESSING.value,
+            updated_at.get_db_prep_value(timezone.now(), connection),
+            self.model._meta.pk.get_db_prep_value(payout_id, connection),
+            Status.PENDING.value,
+            Status.FAILED.value,
+        ]
+        if stale_before is not None:
+            # Участников сводного перевода завершает сам перевод
+            # Разделенную выплату завершает chord частей
+            condition = (
+                f'({condition} OR (status = %s AND updated_at < %s '
+                f'AND netted_transfer_id IS NULL AND parts_count = 0))'
+            )
+            params += [
+                Status.PROCESSING.value,
+                updated_at.get_db_prep_value(stale_before, connection),
+            ]
+        sql = (
+            f'UPDATE {table} SET status = %s, updated_at = %s '
+            f'WHERE id = %s AND {condition} '
+            f'RETURNING {columns}'
+        )
+        claimed = list(self.raw(sql, params))
+        return claimed[0] if claimed else None
+
+    def complete_processing(self, payout_id: str, reference: str = ''):
+        """
+        Завершение обработки: processing -> completed, только для захваченной выплаты.
+        reference - идентификатор выплаты у платежной системы.
+        Возвращает время завершения или None, если статус уже изменен
+        """
+        completed_at = timezone.now()
+        updated = self.filter(id=payout_id, status=Status.PROCESSING).update(
+            status=Status.COMPLETED,
+            provider_reference=reference,
+            updated_at=completed_at,
+        )
+        return completed_at if updated else None
+
+    def claim_due(self, limit: int, dispatch) -> list:
+        """
+        Выбор пачки запланированных выплат, срок которых наступил.
+        Строки блокируются с SKIP LOCKED, execute_at сбрасывается, а dispatch
+        вызывается внутри транзакции: при ошибке брокера расписание сохранится.
+        dispatch получает словари с полями, нужными для маршрутизации
+        """
+        with transaction.atomic():
+            rows = list(
+                self.select_for_update(skip_locked=True)
+                .filter(status=Status.PENDING, execute_at__lte=timezone.now())
+                .order_by('execute_at')
+                .values('id', 'merchant_id', 'amount', 'currency', 'priority')[:limit]
+            )
+            if rows:
+                self.filter(id__in=[row['id'] for row in rows]).update(execute_at=None)
+                dispatch(rows)
+        return rows
+
+    def reap_stuck(self, cutoff, limit: int, max_reaps: int, exclude=None, after=None) -> dict:
+        """
+        Возврат зависших в 'processing' выплат одним UPDATE на пачку:
+        в 'pending' с execute_at=now (их отправит планировщик) или в 'failed',
+        если выплату уже возвращали max_reaps раз.
+        exclude - функция, возвращающая идентификаторы, которые трогать нельзя;
+        after - ключ (updated_at, id) последней строки прошлой пачки: пропущенные
+        строки не выбираются повторно
+        """
+        with transaction.atomic():
+            queryset = self.select_for_update(skip_locked=True).filter(
+                status=Status.PROCESSING, updated_at__lt=cutoff, netted_transfer__isnull=True, parts_count=0,
+            )
+            if after is not None:
+                queryset = queryset.filter(
+                    Q(updated_at__gt=after[0]) | Q(updated_at=after[0], id__gt=after[1])
+                )
+            selected = list(queryset.order_by('updated_at', 'id').values_list('id', 'reaped_count', 'updated_at')[:limit])
+            last = (selected[-1][2], selected[-1][0]) if selected else None
+            rows = [(payout_id, reaped) for payout_id, reaped, _ in selected]
+            skipped = exclude([payout_id for payout_id, _ in rows]) if exclude and rows else set()
+            rows = [(payout_id, reaped) for payout_id, reaped in rows if payout_id not in skipped]
+
+            failed = [payout_id for payout_id, reaped in rows if reaped + 1 >= max_reaps]
+            requeued = [payout_id for payout_id, reaped in rows if reaped + 1 < max_reaps]
+
+            if rows:
+                now = timezone.now()
+                exhausted = When(reaped_count__gte=max_reaps - 1, then=Value(Status.FAILED.value))
+                self.filter(id__in=[payout_id for payout_id, _ in rows], status=Status.PROCESSING).update(
+                    status=Case(exhausted, default=Value(Status.PENDING.value)),
+                    execute_at=Case(
+                        When(reaped_count__gte=max_reaps - 1, then=Value(None)),
+                        default=Value(now),
+                        output_field=models.DateTimeField(),
+                    ),
+                    reaped_count=F('reaped_count') + 1,
+                    updated_at=now,
+                )
+
+        return {'selected': len(selected), 'requeued': requeued, 'failed': failed, 'skipped': skipped, 'last': last}
+
+    def claim_batch(self, limit: int) -> list:
+        """
+        Захват пачки ожидающих (не запланированных) выплат для пакетной обработки:
+        SELECT ... FOR UPDATE SKIP LOCKED и один UPDATE в 'processing'
+        """
+        with transaction.atomic():
+            payouts = list(
+                self.select_for_update(skip_locked=True)
+                .filter(status=Status.PENDING, execute_at__isnull=True)
+                .order_by('created_at')[:limit]
+            )
+            if payouts:
+                now = timezone.now()
+                self.filter(id__in=[payout.id for payout in payouts]).update(
+                    status=Status.PROCESSING,
+                    updated_at=now,
+                )
+                for payout in payouts:
+                    payout.status = Status.PROCESSING
+                    payout.updated_at = now
+        return payouts
+
+    def complete_batch(self, payout_ids, references: dict = None) -> int:
+        """Завершение пачки захваченных выплат одним UPDATE; references - {id: идентификатор у платежной системы}"""
+        fields = {'status': Status.COMPLETED, 'updated_at': timezone.now()}
+        if references:
+            fields['provider_reference'] = Case(
+                *[When(id=payout_id, then=Value(reference)) for payout_id, reference in references.items()],
+                default=F('provider_reference'),
+                output_field=models.CharField(),
+            )
+        return self.filter(id__in=list(payout_ids), status=Status.PROCESSING).update(**fields)
+
+    def fail_batch(self, errors: dict) -> int:
+        """Перевод пачки захваченных выплат в 'failed' одним UPDATE; errors - {id: текст ошибки}"""
+        if not errors:
+            return 0
+        description = Case(
+            *[
+                When(id=payout_id, then=Concat(
+                    Coalesce('description', Value('')),
+                    Value(f'\n {message}'),
+                    output_field=models.TextField(),
+                ))
+                for payout_id, message in errors.items()
+            ],
+            default=F('description'),
+            output_field=models.TextField(),
+        )
+        return self.filter(id__in=list(errors), status=Status.PROCESSING).update(
+            status=Status.FAILED,
+            description=description,
+            updated_at=timezone.now(),
+        )
+
+    def defer(self, payout_ids, execute_at, claimed: bool = True) -> int:
+        """
+        Отложить выплаты до execute_at (их отправит планировщик).
+        claimed=True - захваченные выплаты (processing -> pending),
+        иначе - еще не захваченные (pending/failed -> pending)
+        """
+        statuses = [Status.PROCESSING] if claimed else [Status.PENDING, Status.FAILED]
+        return self.filter(id__in=list(payout_ids), status__in=statuses).update(
+            status=Status.PENDING,
+            execute_at=execute_at,
+            updated_at=timezone.now(),
+        )
+
+    def find_duplicate(self, recipient_key: str, amount, currency: str, since) -> 'str | None':
+        """
+        Живая выплата с теми же реквизитами, суммой и валютой, созданная после since
+        (индекс api_payouts_duplicate_idx). Неудачные и отмененные не учитываются
+        """
+        return self.filter(
+            recipient_key=recipient_key,
+            currency=currency,
+            amount=amount,
+            created_at__gte=since,
+        ).exclude(
+            status__in=[Status.FAILED, Status.CANCELLED]
+        ).order_by('created_at').values_list('id', flat=True).first()
+
+    def lock_fx_rates(self, payouts) -> int:
+        """Сохранение зафиксированных курсов и сумм списания пачки выплат одним запросом"""
+        now = timezone.now()
+        for payout in payouts:
+            payout.updated_at = now
+        return self.bulk_update(payouts, ['fx_rate', 'funding_amount', 'updated_at'])
+
+    def release_review(self, payout_id) -> bool:
+        """Подтвердить выплату, задержанную как возможный дубликат: review -> pending"""
+        return self.filter(id=payout_id, status=Status.REVIEW).update(
+            status=Status.PENDING, updated_at=timezone.now()
+        ) == 1
+
+    def create_parts(self, parent_id, amounts) -> list:
+        """
+        Разделение захваченной выплаты на части с суммами amounts.
+        Части наследуют реквизиты, валюту, мерчанта и приоритет; повторный
+        вызов для уже разделенной выплаты возвращает пустой список
+        """
+        with transaction.atomic():
+            parent = self.select_for_update().filter(
+                id=parent_id, status=Status.PROCESSING, parts_count=0
+            ).first()
+            if parent is None:
+                return []
+            parts = self.bulk_create([
+                self.model(
+                    parent=parent,
+                    amount=amount,
+                    currency=parent.currency,
+                    funding_currency=parent.funding_currency,
+                    recipient_details=parent.recipient_details,
+                    recipient_key=parent.recipient_key,
+                    merchant_id=parent.merchant_id,
+                    priority=parent.priority,
+                    description=f'Часть {number} из {len(amounts)} выплаты {parent.id}',
+                )
+                for number, amount in enumerate(amounts, start=1)
+            ])
+            self.filter(id=parent.id).update(parts_count=len(parts), updated_at=timezone.now())
+        return parts
+
+    def finalize_split(self, parent_id) -> 'str | None':
+        """
+        Итоговый статус разделенной выплаты по статусам частей, под блокировкой
+        исходной выплаты: completed - если выполнены все части, иначе failed с
+        итогами в описании. Возвращает статус или None, если части еще в работе
+        """
+        with transaction.atomic():
+            parent = self.select_for_update().filter(id=parent_id, status=Status.PROCESSING).first()
+            if parent is None or not parent.parts_count:
+                return None
+            outcome = self.filter(parent_id=parent_id).aggregate(
+                total=Count('id'),
+                completed=Count('id', filter=Q(status=Status.COMPLETED)),
+                open=Count('id', filter=Q(status__in=[Status.PENDING, Status.PROCESSING])),
+                completed_amount=Sum('amount', filter=Q(status=Status.COMPLETED)),
+            )
+            if outcome['open']:
+                return None
+
+            fields = {'updated_at': timezone.now()}
+            if outcome['completed'] == outcome['total']:
+                fields['status'] = Status.COMPLETED
+            else:
+                fields['status'] = Status.FAILED
+                fields['description'] = Concat(
+                    Coalesce('description', Value('')),
+                    Value(
+                        f"\n Выполнено частей {outcome['completed']} из {outcome['total']} "
+                        f"на сумму {outcome['completed_amount'] or 0:.2f}"
+                    ),
+                    output_field=models.TextField(),
+                )
+            self.filter(id=parent_id).update(**fields)
+        return fields['status']
+
+    def finalize_stale_splits(self, cutoff, limit: int) -> list:
+        """
+        Итоговый статус разделенных выплат, чьи части завершились уже после
+        колбэка chord (часть была отложена, возвращена сборщиком или завершена
+        пачкой): разделенные выплаты в 'processing' дольше cutoff без открытых
+        частей. Возвращает идентификаторы завершенных
+        """
+        open_parts = self.filter(parent_id=OuterRef('pk'), status__in=[Status.PENDING, Status.PROCESSING])
+        parent_ids = list(
+            self.filter(status=Status.PROCESSING, parts_count__gt=0, updated_at__lt=cutoff)
+            .filter(~Exists(open_parts))
+            .order_by('updated_at')
+            .values_list('id', flat=True)[:limit]
+        )
+        return [parent_id for parent_id in parent_ids if self.finalize_split(parent_id)]
+
+    def fail_processing(self, payout_id: str, error_message: str = None) -> bool:
+        """Ошибка обработки: processing -> failed, с дописыванием ошибки в описание"""
+        fields = {'status': Status.FAILED, 'updated_at': timezone.now()}
+        if error_message:
+            fields['description'] = Concat(
+                Coalesce('description', Value('')),
+                Value(f'\n {error_message}'),
+                output_field=models.TextField(),
+            )
+        return self.filter(id=payout_id, status=Status.PROCESSING).update(**fields) == 1
+
 class Payout(models.Model):
 
     id = models.UUIDField(
@@ -72,6 +422,30 @@ class Payout(models.Model):
         verbose_name='Валюта'
     )
 
+    funding_currency = models.CharField(
+        max_length=3,
+        choices=Currency.choices,
+        blank=True,
+        default='',
+        verbose_name='Валюта списания (пусто - валюта выплаты)'
+    )
+
+    fx_rate = models.DecimalField(
+        max_digits=18,
+        decimal_places=8,
+        blank=True,
+        null=True,
+        verbose_name='Зафиксированный курс (единиц валюты выплаты за единицу валюты списания)'
+    )
+
+    funding_amount = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        blank=True,
+        null=True,
+        verbose_name='Сумма списания в валюте списания'
+    )
+
     recipient_details = models.JSONField(
         verbose_name='Реквизиты получателя'
     )
@@ -83,6 +457,82 @@ class Payout(models.Model):
         verbose_name='Статус заявки'
     )
 
+    execute_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='Запланированное время исполнения'
+    )
+
+    merchant_id = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name='Мерчант'
+    )
+
+    priority = models.CharField(
+        max_length=10,
+        choices=Priority.choices,
+        blank=True,
+        null=True,
+        verbose_name='Приоритет (по умолчанию - по сумме и валюте)'
+    )
+
+    recipient_key = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name='Отпечаток реквизитов получателя'
+    )
+
+    provider_reference = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name='Идентификатор выплаты у платежной системы'
+    )
+
+    netted_transfer = models.ForeignKey(
+        'NettedTransfer',
+        on_delete=models.SET_NULL,
+        blank=True,
+        null=True,
+        related_name='payouts',
+        verbose_name='Сводный перевод'
+    )
+
+    # Ссылки на выплаты - без ограничений внешнего ключа в БД: таблица выплат
+    # секционирована по created_at и не имеет уникального ключа только по id
+    parent = models.ForeignKey(
+        'self',
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        blank=True,
+        null=True,
+        related_name='parts',
+        verbose_name='Исходная выплата (для части разделенной выплаты)'
+    )
+
+    duplicate_of = models.ForeignKey(
+        'self',
+        on_delete=models.SET_NULL,
+        db_constraint=False,
+        blank=True,
+        null=True,
+        related_name='suspected_duplicates',
+        verbose_name='Возможный оригинал (для выплаты на проверке)'
+    )
+
+    parts_count = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Количество частей'
+    )
+
+    reaped_count = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Количество возвратов из зависшей обработки'
+    )
+
     description = models.TextField(
         blank=True,
         null=True,
@@ -108,6 +558,25 @@ class Payout(models.Model):
         indexes = [
             models.Index(fields=['status']),
             models.Index(fields=['created_at']),
+            models.Index(
+                fields=['execute_at'],
+                condition=models.Q(status=Status.PENDING),
+                name='api_payouts_pending_due_idx',
+            ),
+            models.Index(
+                fields=['updated_at'],
+                condition=models.Q(status=Status.PROCESSING),
+                name='api_payouts_processing_upd_idx',
+            ),
+            models.Index(
+                fields=['currency', 'recipient_key', 'execute_at'],
+                condition=models.Q(status=Status.PENDING),
+                name='api_payouts_netting_idx',
+            ),
+            models.Index(
+                fields=['recipient_key', 'currency', 'amount', 'created_at'],
+                name='api_payouts_duplicate_idx',
+            ),
         ]
 
     def mark_as_pending(self) -> None:
@@ -161,5 +630,854 @@ class Payout(models.Model):
         """Отменена"""
         return self.status == Status.CANCELLED
 
+    @property
+    def needs_fx_rate(self) -> bool:
+        """Выплата из счета в другой валюте, курс еще не зафиксирован"""
+        return bool(self.funding_currency) and self.funding_currency != self.currency and self.fx_rate is None
+
+    @property
+    def debit_currency(self) -> str:
+        """Валюта, в которой средства списываются со счета финансирования"""
+        return self.funding_currency or self.currency
+
+    @property
+    def debit_amount(self):
+        """Сумма списания: после фиксации курса - в валюте списания"""
+        return self.amount if self.funding_amount is None else self.funding_amount
+
+    @staticmethod
+    def recipient_key_for(recipient_details) -> str:
+        """Отпечаток реквизитов: одинаковые реквизиты дают одинаковый ключ"""
+        if not recipient_details:
+            return ''
+        canonical = json.dumps(recipient_details, sort_keys=True, separators=(',', ':'))
+        return hashlib.sha256(canonical.encode()).hexdigest()
+
     def __str__(self):
         return f"Выплата {self.id} - {self.amount} {self.currency}"
+
+
+class PayoutDeadLetterManager(models.Manager):
+
+    def record(self, payout_id: str, task_id: str, error: str, attempts: list) -> 'PayoutDeadLetter':
+        """Запись задачи, исчерпавшей попытки"""
+        return self.create(
+            payout_id=payout_id,
+            task_id=task_id or '',
+            error=error,
+            attempts=attempts,
+        )
+
+    def pending(self):
+        return self.filter(status=DeadLetterStatus.PENDING)
+
+
+class PayoutDeadLetter(models.Model):
+    """Задача обработки выплаты, исчерпавшая все попытки"""
+
+    payout = models.ForeignKey(
+        Payout,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='dead_letters',
+        verbose_name='Выплата'
+    )
+
+    task_id = models.CharField(
+        max_length=255,
+        blank=True,
+        verbose_name='Идентификатор задачи'
+    )
+
+    error = models.TextField(
+        verbose_name='Последняя ошибка'
+    )
+
+    attempts = models.JSONField(
+        default=list,
+        verbose_name='История попыток'
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=DeadLetterStatus.choices,
+        default=DeadLetterStatus.PENDING,
+        verbose_name='Статус'
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания'
+    )
+
+    replayed_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='Дата повтора'
+    )
+
+    objects = PayoutDeadLetterManager()
+
+    class Meta:
+        verbose_name = 'Неудачная задача выплаты'
+        verbose_name_plural = 'Неудачные задачи выплат'
+        ordering = ['created_at']
+        indexes = [
+            models.Index(fields=['status', 'created_at']),
+        ]
+
+    def __str__(self):
+        return f"Dead letter {self.payout_id}: {self.error[:50]}"
+
+
+class NettedTransferManager(models.Manager):
+
+    def net_due(self, window, limit: int, caps=None, exclude_currencies=()) -> list:
+        """
+        Сведение ожидающих выплат одному получателю в одной валюте в сводные переводы.
+        Группа сводится, когда срок старейшей выплаты наступил; в нее попадают
+        выплаты со сроком в пределах окна. Группы выбираются одним GROUP BY по
+        частичному индексу (currency, recipient_key, execute_at) WHERE status='pending',
+        каждая группа сводится в своей транзакции с SKIP LOCKED. Части разделенных
+        выплат не сводятся: их итог собирает исходная выплата. Сумма перевода не
+        превышает лимит провайдера для валюты из caps: группа делится на несколько
+        переводов, выплаты сверх лимита и оставшиеся поодиночке уходят обычным путем.
+        Выплаты в валютах exclude_currencies не сводятся
+        """
+        caps = caps or {}
+        now = timezone.now()
+        horizon = now + window
+        groups = list(
+            Payout.objects
+            .filter(status=Status.PENDING, execute_at__lte=horizon, parent__isnull=True)
+            .exclude(recipient_key='')
+            .exclude(currency__in=exclude_currencies)
+            .values('currency', 'recipient_key')
+            .annotate(payouts=Count('id'), first_due=Min('execute_at'))
+            .filter(payouts__gt=1, first_due__lte=now)
+            .order_by('first_due')[:limit]
+        )
+
+        transfers = []
+        for group in groups:
+            with transaction.atomic():
+                members = list(
+                    Payout.objects.select_for_update(skip_locked=True)
+                    .filter(
+                        status=Status.PENDING,
+                        currency=group['currency'],
+                        recipient_key=group['recipient_key'],
+                        execute_at__lte=horizon,
+                        parent__isnull=True,
+                    )
+                    .order_by('execute_at', 'created_at')
+                    .values('id', 'amount', 'recipient_details')
+                )
+                for chunk in self._capped(members, caps.get(group['currency'])):
+                    if len(chunk) < 2:
+                        continue
+                    transfer = self.create(
+                        currency=group['currency'],
+                        recipient_key=group['recipient_key'],
+                        recipient_details=chunk[0]['recipient_details'],
+                        amount=sum(member['amount'] for member in chunk),
+                        payout_count=len(chunk),
+                    )
+                    Payout.objects.filter(id__in=[member['id'] for member in chunk]).update(
+                        status=Status.PROCESSING,
+                        netted_transfer=transfer,
+                        execute_at=None,
+                        updated_at=now,
+                    )
+                    transfers.append(transfer)
+        return transfers
+
+    @staticmethod
+    def _capped(members, cap) -> list:
+        """Выплаты группы по порядку срока, набранные в переводы не больше cap"""
+        if not cap:
+            return [members]
+        chunks, current, total = [], [], 0
+        for member in members:
+            if member['amount'] > cap:
+                # Выплату сверх лимита разделит обычная обработка
+                continue
+            if total + member['amount'] > cap:
+                chunks.append(current)
+                current, total = [], 0
+            current.append(member)
+            total += member['amount']
+        return chunks + [current]
+
+    def claim(self, transfer_id) -> 'NettedTransfer | None':
+        """Захват перевода: pending -> processing"""
+        if not self.filter(id=transfer_id, status=Status.PENDING).update(
+            status=Status.PROCESSING, updated_at=timezone.now()
+        ):
+            return None
+        return self.get(id=transfer_id)
+
+    def release(self, transfer_id) -> bool:
+        """Возврат захваченного перевода в 'pending' для повторной попытки"""
+        return self.filter(id=transfer_id, status=Status.PROCESSING).update(
+            status=Status.PENDING, updated_at=timezone.now()
+        ) == 1
+
+    def resume_stale(self, cutoff, limit: int) -> list:
+        """
+        Переводы, зависшие в 'pending' или 'processing' дольше cutoff (задача
+        потеряна или воркер упал): 'processing' возвращается в 'pending',
+        updated_at обновляется, чтобы следующий проход не взял их снова.
+        Возвращает идентификаторы переводов для повторной публикации задач
+        """
+        with transaction.atomic():
+            transfer_ids = list(
+                self.select_for_update(skip_locked=True)
+                .filter(status__in=[Status.PENDING, Status.PROCESSING], updated_at__lt=cutoff)
+                .order_by('updated_at')
+                .values_list('id', flat=True)[:limit]
+            )
+            if transfer_ids:
+                self.filter(id__in=transfer_ids).update(status=Status.PENDING, updated_at=timezone.now())
+        return transfer_ids
+
+    def dissolve(self, transfer_id, error_message: str, execute_at) -> int:
+        """
+        Расформирование перевода, который так и не удалось отправить (платежная
+        система недоступна): перевод - в 'cancelled', его выплаты отвязываются и
+        возвращаются в 'pending' с execute_at - их снова сведет или отправит
+        планировщик. Возвращает число возвращенных выплат
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            if not self.filter(id=transfer_id, status__in=[Status.PENDING, Status.PROCESSING]).update(
+                status=Status.CANCELLED, error=error_message, updated_at=now
+            ):
+                return 0
+            return Payout.objects.filter(netted_transfer_id=transfer_id, status=Status.PROCESSING).update(
+                status=Status.PENDING, netted_transfer=None, execute_at=execute_at, updated_at=now
+            )
+
+    def drop_members(self, transfer_id, errors: dict) -> 'NettedTransfer':
+        """
+        Исключение выплат из захваченного перевода до отправки (например, не
+        хватило средств на резерв): выплаты - в 'failed' с текстом ошибки,
+        сумма и число выплат перевода уменьшаются. Перевод без выплат - в 'failed'.
+        errors - {id выплаты: текст ошибки}
+        """
+        with transaction.atomic():
+            transfer = self.select_for_update().get(id=transfer_id)
+            members = Payout.objects.filter(
+                id__in=list(errors), netted_transfer_id=transfer_id, status=Status.PROCESSING
+            )
+            dropped = members.aggregate(payouts=Count('id'), amount=Sum('amount'))
+            Payout.objects.fail_batch({
+                payout_id: f'Исключена из сводного перевода {transfer_id}: {errors[payout_id]}'
+                for payout_id in members.values_list('id', flat=True)
+            })
+            transfer.payout_count -= dropped['payouts']
+            transfer.amount -= dropped['amount'] or 0
+            if not transfer.payout_count:
+                transfer.status = Status.FAILED
+                transfer.error = 'Все выплаты исключены из перевода'
+            transfer.save(update_fields=['payout_count', 'amount', 'status', 'error', 'updated_at'])
+        return transfer
+
+    def complete(self, transfer_id, reference: str = '') -> int:
+        """Завершение перевода и всех его выплат в одной транзакции. Возвращает число выплат"""
+        now = timezone.now()
+        with transaction.atomic():
+            if not self.filter(id=transfer_id, status=Status.PROCESSING).update(
+                status=Status.COMPLETED, reference=reference, updated_at=now
+            ):
+                return 0
+            return Payout.objects.filter(netted_transfer_id=transfer_id, status=Status.PROCESSING).update(
+                status=Status.COMPLETED, provider_reference=reference, updated_at=now
+            )
+
+    def unwind(self, transfer_id, error_message: str) -> dict:
+        """
+        Разбор неудавшегося перевода: перевод и его выплаты - в 'failed' с текстом
+        ошибки, связь с переводом сохраняется. Сверяет сумму и число разобранных
+        выплат с итогами перевода
+        """
+        now = timezone.now()
+        with transaction.atomic():
+            transfer = self.select_for_update().get(id=transfer_id)
+            if transfer.status in (Status.COMPLETED, Status.FAILED):
+                return {'payouts': 0, 'amount': 0}
+            members = Payout.objects.select_for_update().filter(
+                netted_transfer_id=transfer_id, status=Status.PROCESSING
+            )
+            totals = members.aggregate(payouts=Count('id'), amount=Sum('amount'))
+            totals['amount'] = totals['amount'] or 0
+            members.update(
+                status=Status.FAILED,
+                description=Concat(
+                    Coalesce('description', Value('')),
+                    Value(f'\n Сводный перевод {transfer_id} не выполнен: {error_message}'),
+                    output_field=models.TextField(),
+                ),
+                updated_at=now,
+            )
+            transfer.status = Status.FAILED
+            transfer.error = error_message
+            transfer.save(update_fields=['status', 'error', 'updated_at'])
+
+        if totals['payouts'] != transfer.payout_count or totals['amount'] != transfer.amount:
+            logger.error(
+                f"Расхождение при разборе перевода {transfer_id}: выплат {totals['payouts']} "
+                f"из {transfer.payout_count}, сумма {totals['amount']} из {transfer.amount}"
+            )
+        return totals
+
+
+class NettedTransfer(models.Model):
+    """Сводный перевод: несколько выплат одному получателю одной транзакцией провайдера"""
+
+    id = models.UUIDField(
+        primary_key=True,
+        default=uuid4,
+        editable=False,
+        verbose_name='Идентификатор'
+    )
+
+    amount = models.DecimalField(
+        max_digits=14,
+        decimal_places=2,
+        verbose_name='Сумма перевода'
+    )
+
+    currency = models.CharField(
+        max_length=3,
+        choices=Currency.choices,
+        verbose_name='Валюта'
+    )
+
+    recipient_key = models.CharField(
+        max_length=64,
+        verbose_name='Отпечаток реквизитов получателя'
+    )
+
+    recipient_details = models.JSONField(
+        verbose_name='Реквизиты получателя'
+    )
+
+    payout_count = models.PositiveIntegerField(
+        verbose_name='Количество выплат'
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=Status.choices,
+        default=Status.PENDING,
+        verbose_name='Статус перевода'
+    )
+
+    reference = models.CharField(
+        max_length=255,
+        blank=True,
+        default='',
+        verbose_name='Идентификатор у провайдера'
+    )
+
+    error = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='Ошибка'
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания'
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата обновления'
+    )
+
+    objects = NettedTransferManager()
+
+    class Meta:
+        verbose_name = 'Сводный перевод'
+        verbose_name_plural = 'Сводные переводы'
+        ordering = ['-created_at']
+        indexes = [
+            models.Index(fields=['status', 'updated_at']),
+        ]
+
+    def __str__(self):
+        return f"Сводный перевод {self.id} - {self.amount} {self.currency} ({self.payout_count})"
+
+
+class LedgerAccountManager(models.Manager):
+
+    def funding_shards(self, owner: str, currency: str):
+        """Шарды счета финансирования мерчанта в валюте"""
+        return self.filter(kind=LedgerAccountKind.FUNDING, owner=owner, currency=currency).order_by('shard')
+
+    def system_account(self, kind: str, currency: str) -> 'LedgerAccount':
+        """Системный счет (расчеты, пополнения): остаток по нему не ведется, только проводки"""
+        account, _ = self.get_or_create(kind=kind, owner='', currency=currency, shard=0)
+        return account
+
+    def available(self, owner: str, currency: str):
+        """Доступный остаток по всем шардам одним запросом без блокировок"""
+        return self.funding_shards(owner, currency).aggregate(
+            available=Coalesce(Sum(F('balance') - F('reserved')), Value(0), output_field=models.DecimalField())
+        )['available']
+
+    def try_reserve(self, account_id, amount) -> bool:
+        """
+        Резерв на шарде одним условным UPDATE: блокировка строки держится
+        только на время оператора, недостаток средств - просто 0 строк
+        """
+        return self.filter(id=account_id, balance__gte=F('reserved') + amount).update(
+            reserved=F('reserved') + amount,
+            updated_at=timezone.now(),
+        ) == 1
+
+    def rebalance(self, owner: str, currency: str, primary_shard=None, need=0) -> int:
+        """
+        Консолидация шардов: доступный остаток распределяется поровну, а если
+        задан primary_shard - этому шарду сначала достается need. Шарды
+        блокируются по порядку номеров, переносы записываются проводками.
+        Возвращает число измененных шардов
+        """
+        with transaction.atomic():
+            shards = list(self.funding_shards(owner, currency).select_for_update())
+            if len(shards) < 2:
+                return 0
+            available = [shard.balance - shard.reserved for shard in shards]
+            targets = self.distribute(sum(available), shards, primary_shard, need)
+
+            entries, changed = [], []
+            transaction_id = uuid4()
+            for shard, current, target in zip(shards, available, targets):
+                delta = target - current
+                if not delta:
+                    continue
+                shard.balance += delta
+                changed.append(shard)
+                entries.append(LedgerEntry(
+                    transaction_id=transaction_id, account=shard, amount=delta, kind=LedgerEntry.CONSOLIDATION
+                ))
+            if changed:
+                now = timezone.now()
+                for shard in changed:
+                    shard.updated_at = now
+                self.bulk_update(changed, ['balance', 'updated_at'])
+                LedgerEntry.objects.bulk_create(entries)
+        return len(changed)
+
+    @staticmethod
+    def distribute(total, shards, primary_shard=None, need=0) -> list:
+        """Раскладка суммы по шардам поровну (с точностью до копейки), primary_shard сначала получает need"""
+        cents = int(total * 100)
+        reserved_for_primary = min(int(need * 100), cents) if primary_shard is not None else 0
+        others = [shard for shard in shards if primary_shard is None or shard.shard != primary_shard]
+        base, remainder = divmod(cents - reserved_for_primary, len(others))
+        targets, position = [], 0
+        for shard in shards:
+            if primary_shard is not None and shard.shard == primary_shard:
+                targets.append(Decimal(reserved_for_primary) / 100)
+                continue
+            targets.append(Decimal(base + (1 if position < remainder else 0)) / 100)
+            position += 1
+        return targets
+
+
+class LedgerAccount(models.Model):
+    """
+    Счет книги учета. Счет финансирования мерчанта в валюте разбит на шарды
+    (shard 0..N-1), чтобы резервы параллельных воркеров не упирались в
+    блокировку одной строки
+    """
+
+    kind = models.CharField(
+        max_length=20,
+        choices=LedgerAccountKind.choices,
+        default=LedgerAccountKind.FUNDING,
+        verbose_name='Тип счета'
+    )
+
+    owner = models.CharField(
+        max_length=64,
+        blank=True,
+        default='',
+        verbose_name='Владелец (мерчант)'
+    )
+
+    currency = models.CharField(
+        max_length=3,
+        choices=Currency.choices,
+        verbose_name='Валюта'
+    )
+
+    shard = models.PositiveSmallIntegerField(
+        default=0,
+        verbose_name='Номер шарда'
+    )
+
+    balance = models.DecimalField(
+        max_digits=16,
+        decimal_places=2,
+        default=0,
+        verbose_name='Остаток'
+    )
+
+    reserved = models.DecimalField(
+        max_digits=16,
+        decimal_places=2,
+        default=0,
+        verbose_name='Зарезервировано'
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата обновления'
+    )
+
+    objects = LedgerAccountManager()
+
+    class Meta:
+        verbose_name = 'Счет книги учета'
+        verbose_name_plural = 'Счета книги учета'
+        constraints = [
+            models.UniqueConstraint(
+                fields=['kind', 'owner', 'currency', 'shard'],
+                name='api_payouts_ledger_account_uniq',
+            ),
+            models.CheckConstraint(
+                condition=models.Q(reserved__gte=0, balance__gte=F('reserved')),
+                name='api_payouts_ledger_account_no_overdraft',
+            ),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}:{self.owner}:{self.currency}#{self.shard}"
+
+
+class LedgerEntry(models.Model):
+    """Проводка: у каждой транзакции сумма проводок равна нулю"""
+
+    DEPOSIT = 'deposit'
+    CAPTURE = 'capture'
+    CONSOLIDATION = 'consolidation'
+
+    transaction_id = models.UUIDField(
+        db_index=True,
+        verbose_name='Транзакция'
+    )
+
+    account = models.ForeignKey(
+        LedgerAccount,
+        on_delete=models.PROTECT,
+        related_name='entries',
+        verbose_name='Счет'
+    )
+
+    payout = models.ForeignKey(
+        Payout,
+        on_delete=models.SET_NULL,
+        db_constraint=False,
+        blank=True,
+        null=True,
+        related_name='ledger_entries',
+        verbose_name='Выплата'
+    )
+
+    amount = models.DecimalField(
+        max_digits=16,
+        decimal_places=2,
+        verbose_name='Сумма (со знаком)'
+    )
+
+    kind = models.CharField(
+        max_length=20,
+        verbose_name='Тип проводки'
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания'
+    )
+
+    class Meta:
+        verbose_name = 'Проводка'
+        verbose_name_plural = 'Проводки'
+        indexes = [
+            models.Index(fields=['account', 'created_at']),
+        ]
+
+
+class LedgerHoldManager(models.Manager):
+
+    def capture(self, payout_ids) -> int:
+        """
+        Списание резервов выплат: остаток и резерв шардов уменьшаются одним
+        UPDATE на шард, проводки (шард -> расчеты) пишутся одним INSERT
+        """
+        with transaction.atomic():
+            holds = list(
+                self.select_for_update()
+                .filter(payout_id__in=list(payout_ids), status=LedgerHoldStatus.HELD)
+                .select_related('account')
+            )
+            if not holds:
+                return 0
+            transaction_id = uuid4()
+            entries = []
+            for account_id, amount in self._totals(holds).items():
+                LedgerAccount.objects.filter(id=account_id).update(
+                    balance=F('balance') - amount,
+                    reserved=F('reserved') - amount,
+                    updated_at=timezone.now(),
+                )
+            settlements = {
+                currency: LedgerAccount.objects.system_account(LedgerAccountKind.SETTLEMENT, currency)
+                for currency in {hold.account.currency for hold in holds}
+            }
+            for hold in holds:
+                settlement = settlements[hold.account.currency]
+                entries += [
+                    LedgerEntry(transaction_id=transaction_id, account=hold.account, payout_id=hold.payout_id,
+                                amount=-hold.amount, kind=LedgerEntry.CAPTURE),
+                    LedgerEntry(transaction_id=transaction_id, account=settlement, payout_id=hold.payout_id,
+                                amount=hold.amount, kind=LedgerEntry.CAPTURE),
+                ]
+            LedgerEntry.objects.bulk_create(entries)
+            return self.filter(id__in=[hold.id for hold in holds]).update(
+                status=LedgerHoldStatus.CAPTURED, updated_at=timezone.now()
+            )
+
+    def release(self, payout_ids) -> int:
+        """Снятие резервов выплат без списания (ошибка или отмена)"""
+        with transaction.atomic():
+            holds = list(
+                self.select_for_update().filter(payout_id__in=list(payout_ids), status=LedgerHoldStatus.HELD)
+            )
+            if not holds:
+                return 0
+            for account_id, amount in self._totals(holds).items():
+                LedgerAccount.objects.filter(id=account_id).update(
+                    reserved=F('reserved') - amount,
+                    updated_at=timezone.now(),
+                )
+            return self.filter(id__in=[hold.id for hold in holds]).update(
+                status=LedgerHoldStatus.RELEASED, updated_at=timezone.now()
+            )
+
+    @staticmethod
+    def _totals(holds) -> dict:
+        totals = {}
+        for hold in holds:
+            totals[hold.account_id] = totals.get(hold.account_id, 0) + hold.amount
+        # Порядок по id - единый порядок блокировок шардов между воркерами
+        return dict(sorted(totals.items()))
+
+
+class LedgerHold(models.Model):
+    """Резерв средств под выплату на одном из шардов счета финансирования"""
+
+    payout = models.OneToOneField(
+        Payout,
+        on_delete=models.CASCADE,
+        db_constraint=False,
+        related_name='ledger_hold',
+        verbose_name='Выплата'
+    )
+
+    account = models.ForeignKey(
+        LedgerAccount,
+        on_delete=models.PROTECT,
+        related_name='holds',
+        verbose_name='Шард счета'
+    )
+
+    amount = models.DecimalField(
+        max_digits=16,
+        decimal_places=2,
+        verbose_name='Сумма'
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=LedgerHoldStatus.choices,
+        default=LedgerHoldStatus.HELD,
+        verbose_name='Статус'
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания'
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата обновления'
+    )
+
+    objects = LedgerHoldManager()
+
+    class Meta:
+        verbose_name = 'Резерв средств'
+        verbose_name_plural = 'Резервы средств'
+
+
+class ReconciliationRunManager(models.Manager):
+
+    def start(self, settlement_date, source: str, restart: bool = False) -> 'ReconciliationRun':
+        """
+        Сверка файла расчетов: новая или продолжение прерванной с контрольной точки.
+        restart - начать заново, удалив найденные расхождения
+        """
+        with transaction.atomic():
+            run, created = self.select_for_update().get_or_create(settlement_date=settlement_date, source=source)
+            if restart and not created:
+                run.mismatches.all().delete()
+                run.last_payout_id = ''
+                run.file_offset = 0
+                run.summary = {}
+                run.status = ReconciliationStatus.RUNNING
+            elif run.status == ReconciliationStatus.FAILED:
+                run.status = ReconciliationStatus.RUNNING
+            run.error = ''
+            run.save()
+            return run
+
+    def checkpoint(self, run_id: int, last_payout_id: str, file_offset: int, summary: dict,
+                   mismatches: list, status: str = ReconciliationStatus.RUNNING) -> None:
+        """Расхождения порции и позиция в обоих потоках пишутся в одной транзакции"""
+        with transaction.atomic():
+            ReconciliationMismatch.objects.bulk_create(mismatches)
+            self.filter(id=run_id).update(
+                last_payout_id=last_payout_id,
+                file_offset=file_offset,
+                summary=summary,
+                status=status,
+                updated_at=timezone.now(),
+                finished_at=timezone.now() if status == ReconciliationStatus.COMPLETED else None,
+            )
+
+
+class ReconciliationRun(models.Model):
+    """Сверка выплат с файлом расчетов платежной системы за день"""
+
+    settlement_date = models.DateField(
+        verbose_name='Дата расчетов'
+    )
+
+    source = models.CharField(
+        max_length=255,
+        verbose_name='Файл расчетов'
+    )
+
+    status = models.CharField(
+        max_length=20,
+        choices=ReconciliationStatus.choices,
+        default=ReconciliationStatus.RUNNING,
+        verbose_name='Статус'
+    )
+
+    last_payout_id = models.CharField(
+        max_length=36,
+        blank=True,
+        default='',
+        verbose_name='Последняя сверенная выплата'
+    )
+
+    file_offset = models.BigIntegerField(
+        default=0,
+        verbose_name='Позиция в файле'
+    )
+
+    summary = models.JSONField(
+        default=dict,
+        verbose_name='Итоги'
+    )
+
+    error = models.TextField(
+        blank=True,
+        default='',
+        verbose_name='Ошибка'
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания'
+    )
+
+    updated_at = models.DateTimeField(
+        auto_now=True,
+        verbose_name='Дата обновления'
+    )
+
+    finished_at = models.DateTimeField(
+        blank=True,
+        null=True,
+        verbose_name='Дата завершения'
+    )
+
+    objects = ReconciliationRunManager()
+
+    class Meta:
+        verbose_name = 'Сверка с файлом расчетов'
+        verbose_name_plural = 'Сверки с файлами расчетов'
+        ordering = ['-settlement_date']
+        constraints = [
+            models.UniqueConstraint(fields=['settlement_date', 'source'], name='api_payouts_reconciliation_uniq'),
+        ]
+
+    def __str__(self):
+        return f"Сверка {self.source} за {self.settlement_date}: {self.status}"
+
+
+class ReconciliationMismatch(models.Model):
+    """Расхождение выплаты с файлом расчетов"""
+
+    run = models.ForeignKey(
+        ReconciliationRun,
+        on_delete=models.CASCADE,
+        related_name='mismatches',
+        verbose_name='Сверка'
+    )
+
+    # Не внешний ключ: выплаты из файла может не быть в базе
+    payout_id = models.CharField(
+        max_length=36,
+        verbose_name='Выплата'
+    )
+
+    kind = models.CharField(
+        max_length=20,
+        choices=MismatchKind.choices,
+        verbose_name='Вид расхождения'
+    )
+
+    expected = models.JSONField(
+        default=dict,
+        verbose_name='Данные файла расчетов'
+    )
+
+    actual = models.JSONField(
+        default=dict,
+        verbose_name='Данные выплаты'
+    )
+
+    created_at = models.DateTimeField(
+        auto_now_add=True,
+        verbose_name='Дата создания'
+    )
+
+    class Meta:
+        verbose_name = 'Расхождение сверки'
+        verbose_name_plural = 'Расхождения сверки'
+        ordering = ['payout_id']
+        indexes = [
+            models.Index(fields=['run', 'kind']),
+        ]
+
+    def __str__(self):
+        return f"{self.kind}: {self.payout_id}"
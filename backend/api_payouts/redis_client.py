@@ -0,0 +1,6 @@
+from django_redis import get_redis_connection
+
+
+def get_redis():
+    """Соединение с Redis из настроек кеша (используется для координации воркеров)"""
+    return get_redis_connection('default')
@@ -0,0 +1,84 @@
+from decimal import Decimal
+
+from django.conf import settings
+
+from .models import Payout, Priority
+
+QUEUE_URGENT = 'payouts.urgent'
+QUEUE_DEFAULT = 'payouts.default'
+QUEUE_BULK = 'payouts.bulk'
+
+PAYOUT_QUEUES = (QUEUE_URGENT, QUEUE_DEFAULT, QUEUE_BULK)
+
+PAYOUT_TASK_NAME = 'api_payouts.tasks.payout_task'
+
+
+class PayoutRouter:
+    """
+    Маршрутизация задач обработки выплат по очередям
+
+    Явный приоритет выплаты важнее суммы: high -> urgent, low -> bulk.
+    Без приоритета крупные суммы (порог по валюте) идут в urgent,
+    мелкие - в bulk, остальные - в default
+    """
+
+    @staticmethod
+    def queue_for(amount, currency, priority=None, **kwargs) -> str:
+        if priority == Priority.HIGH:
+            return QUEUE_URGENT
+        if priority == Priority.LOW:
+            return QUEUE_BULK
+        if priority == Priority.NORMAL:
+            return QUEUE_DEFAULT
+
+        amount = Decimal(amount)
+        urgent = settings.PAYOUT_ROUTING_URGENT_AMOUNT.get(currency)
+        if urgent is not None and amount >= urgent:
+            return QUEUE_URGENT
+        bulk = settings.PAYOUT_ROUTING_BULK_AMOUNT.get(currency)
+        if bulk is not None and amount < bulk:
+            return QUEUE_BULK
+        return QUEUE_DEFAULT
+
+
+def route_payout_task(name, args, kwargs, options, task=None, **kw):
+    """
+    Роутер Celery (task_routes) для payout_task, опубликованной без явной очереди.
+    Издатели, у которых уже есть сумма и валюта, передают queue сами
+    """
+    if name != PAYOUT_TASK_NAME or options.get('queue') or not args:
+        return None
+    row = Payout.objects.filter(id=args[0]).values('amount', 'currency', 'priority').first()
+    if row is None:
+        return {'queue': QUEUE_DEFAULT}
+    return {'queue': PayoutRouter.queue_for(**row)}
+
+
+def queue_depth(channel, queue):
+    """Число сообщений в очереди брокера; None, если очередь еще не объявлена"""
+    try:
+        return channel.queue_declare(queue=queue, passive=True).message_count
+    except Exception:
+        return None
+
+
+def queue_stats() -> dict:
+    """Глубина очередей выплат в брокере и задержка от публикации до начала обработки"""
+    from celery import current_app
+    from .metrics import PayoutMetrics
+
+    stats = {}
+    with current_app.connection_for_read() as connection:
+        channel = connection.default_channel
+        for queue in PAYOUT_QUEUES:
+            depth = queue_depth(channel, queue)
+            metrics = PayoutMetrics(f'queue:{queue}').snapshot()
+            consumed = int(metrics.get('consumed', 0))
+            latency_total = int(metrics.get('latency_ms_total', 0))
+            stats[queue] = {
+                'depth': depth,
+                'consumed': consumed,
+                'avg_latency_ms': latency_total / consumed if consumed else None,
+                'last_latency_ms': metrics.get('last_latency_ms'),
+            }
+    return stats
@@ -1,9 +1,9 @@
 from decimal import Decimal
-from ninja import Schema, Field
-from typing import Optional, Dict, Any
+from ninja import Schema, Field, FilterSchema, FilterLookup
+from typing import Annotated, Optional, Dict, Any
 from datetime import datetime
 from pydantic import UUID4, BaseModel
-from .models import Currency, Status
+from .models import Currency, Status, Priority
 
 class CardSchema(Schema):
     card_number: str  = Field(
@@ -43,12 +43,40 @@ class PayoutStatusMixin(Schema):
 class PayoutDescriptionMixin(Schema):
     description: Optional[str] = Field(None, max_length=500, description="Описание")
 
+class PayoutScheduleMixin(Schema):
+    execute_at: Optional[datetime] = Field(None, description="Время исполнения (по умолчанию - сразу)")
+
+class PayoutMerchantMixin(Schema):
+    merchant_id: Optional[str] = Field(None, max_length=64, description="Идентификатор мерчанта")
+
+class PayoutPriorityMixin(Schema):
+    priority: Optional[Priority] = Field(None, description="Приоритет (по умолчанию - по сумме и валюте)")
+
+class PayoutFundingMixin(Schema):
+    funding_currency: Optional[Currency] = Field(None, description="Валюта списания (по умолчанию - валюта выплаты)")
+
+class PayoutFxMixin(Schema):
+    funding_currency: Optional[Currency] = Field(None, description="Валюта списания (пусто - валюта выплаты)")
+    fx_rate: Optional[Decimal] = Field(None, description="Зафиксированный курс конвертации")
+    funding_amount: Optional[Decimal] = Field(None, description="Сумма списания в валюте списания")
+
+    @staticmethod
+    def resolve_funding_currency(obj):
+        return obj.funding_currency or None
+
+class PayoutOutcomeMixin(Schema):
+    provider_reference: Optional[str] = Field(None, description="Идентификатор выплаты у платежной системы")
+
 class PayoutDetailsMixin(Schema):
     amount: Decimal = Field(..., gt=0, decimal_places=2, max_digits=12 ,description="Сумма выплаты (должна быть больше 0)")
     currency: Currency = Field(..., description="Валюта выплаты")
     recipient_details: CardSchema = Field(..., description="Данные получателя")
 
 class PayoutCreateSchema(
+    PayoutFundingMixin,
+    PayoutMerchantMixin,
+    PayoutPriorityMixin,
+    PayoutScheduleMixin,
     PayoutDescriptionMixin,
     PayoutDetailsMixin
 ):
@@ -62,13 +90,29 @@ class PayoutUpdateSchema(
 
 class PayoutResponseSchema(
     PayoutTimestampMixin,
+    PayoutOutcomeMixin,
+    PayoutFxMixin,
     PayoutStatusMixin,
+    PayoutMerchantMixin,
+    PayoutPriorityMixin,
+    PayoutScheduleMixin,
     PayoutDescriptionMixin,
     PayoutIdentifierMixin,
     PayoutDetailsMixin
 ):
     pass
 
+class PayoutFilterSchema(FilterSchema):
+    status: Optional[Status] = Field(None, description="Статус заявки")
+    currency: Optional[Currency] = Field(None, description="Валюта выплаты")
+    merchant_id: Optional[str] = Field(None, description="Идентификатор мерчанта")
+    created_from: Annotated[Optional[datetime], FilterLookup('created_at__gte')] = Field(
+        None, description="Созданы не раньше (по умолчанию - за последние PAYOUT_LIST_WINDOW_DAYS дней, если окно задано)"
+    )
+    created_to: Annotated[Optional[datetime], FilterLookup('created_at__lt')] = Field(
+        None, description="Созданы раньше"
+    )
+
 class ErrorSchema(Schema):
     detail: str
     code: Optional[str] = None
@@ -0,0 +1,74 @@
+import logging
+import time
+from typing import Iterable, Optional
+
+from celery import group
+from django.utils import timezone
+
+from ..models import PayoutDeadLetter, DeadLetterStatus, Status
+from ..routing import PayoutRouter
+from ..tasks import payout_task
+
+logger = logging.getLogger(__name__)
+
+
+class DeadLetterService:
+    """Сервис для повторной отправки задач из dead letter"""
+
+    @staticmethod
+    def replay(
+        ids: Optional[Iterable[int]] = None,
+        error_contains: Optional[str] = None,
+        batch_size: int = 100,
+        interval: float = 1.0,
+        limit: Optional[int] = None,
+    ) -> dict:
+        """
+        Повторная отправка задач пачками с паузой между пачками
+
+        Выплаты, которые уже вышли из статуса 'failed', не отправляются,
+        а их записи помечаются как не требующие повтора
+        """
+        queryset = PayoutDeadLetter.objects.pending()
+        if ids:
+            queryset = queryset.filter(id__in=list(ids))
+        if error_contains:
+            queryset = queryset.filter(error__icontains=error_contains)
+
+        resolved = queryset.exclude(payout__status=Status.FAILED).update(
+            status=DeadLetterStatus.RESOLVED,
+        )
+
+        letters = queryset.filter(payout__status=Status.FAILED).values_list(
+            'id', 'payout_id', 'payout__amount', 'payout__currency', 'payout__priority'
+        )
+        if limit:
+            letters = letters[:limit]
+
+        replayed = 0
+        batch = []
+        for letter in letters.iterator(chunk_size=batch_size):
+            batch.append(letter)
+            if len(batch) >= batch_size:
+                replayed += DeadLetterService._replay_batch(batch)
+                batch = []
+                time.sleep(interval)
+        if batch:
+            replayed += DeadLetterService._replay_batch(batch)
+
+        return {'replayed': replayed, 'resolved': resolved}
+
+    @staticmethod
+    def _replay_batch(batch) -> int:
+        """Отправка пачки задач одним обращением к брокеру и отметка записей"""
+        letter_ids = [letter_id for letter_id, *_ in batch]
+        group(
+            payout_task.s(str(payout_id)).set(queue=PayoutRouter.queue_for(amount, currency, priority))
+            for _, payout_id, amount, currency, priority in batch
+        ).apply_async()
+        PayoutDeadLetter.objects.filter(id__in=letter_ids).update(
+            status=DeadLetterStatus.REPLAYED,
+            replayed_at=timezone.now(),
+        )
+        logger.info(f"Повторно отправлено задач из dead letter: {len(batch)}")
+        return len(batch)
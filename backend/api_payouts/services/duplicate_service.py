@@ -0,0 +1,94 @@
+import hashlib
+import logging
+import time
+from datetime import timedelta
+from decimal import Decimal
+
+from django.conf import settings
+from django.utils import timezone
+from redis.exceptions import RedisError
+
+from ..metrics import PayoutMetrics
+from ..models import Payout
+from ..redis_client import get_redis
+
+logger = logging.getLogger(__name__)
+
+# Проверка и добавление отпечатка в фильтр Блума текущего поколения.
+# KEYS[1] - текущее поколение, KEYS[2] - предыдущее; ARGV[1] - TTL, ARGV[2..] - номера битов.
+# Возвращает 1, если отпечаток, возможно, уже встречался в одном из поколений
+CHECK_AND_ADD_SCRIPT = """
+local in_current, in_previous = 1, 1
+for i = 2, #ARGV do
+    local bit = tonumber(ARGV[i])
+    if redis.call('setbit', KEYS[1], bit, 1) == 0 then
+        in_current = 0
+    end
+    if in_previous == 1 and redis.call('getbit', KEYS[2], bit) == 0 then
+        in_previous = 0
+    end
+end
+redis.call('expire', KEYS[1], ARGV[1])
+return math.max(in_current, in_previous)
+"""
+
+
+class DuplicateDetectionService:
+    """
+    Выявление повторно присланных выплат (те же реквизиты, сумма и валюта в окне)
+
+    Быстрый путь - фильтр Блума в Redis: поколение живет одно окно, проверяются
+    текущее и предыдущее. Отрицательный ответ фильтра точен, и запрос к БД не
+    нужен; только при возможном совпадении выполняется индексный запрос
+    find_duplicate. Если Redis недоступен, проверка идет сразу в БД
+    """
+
+    KEY_PREFIX = 'payout:dedup:'
+
+    def __init__(self, window=None, bits=None, hashes=None):
+        self.window = settings.PAYOUT_DUPLICATE_WINDOW if window is None else window
+        self.bits = bits or settings.PAYOUT_DUPLICATE_BLOOM_BITS
+        self.hashes = hashes or settings.PAYOUT_DUPLICATE_BLOOM_HASHES
+        self.metrics = PayoutMetrics('duplicates')
+
+    @property
+    def enabled(self) -> bool:
+        return self.window > 0
+
+    def find_duplicate(self, recipient_key: str, amount, currency: str) -> 'str | None':
+        """Идентификатор возможного оригинала или None"""
+        if not self.enabled or not recipient_key:
+            return None
+
+        fingerprint = f'{recipient_key}:{currency}:{Decimal(amount):.2f}'
+        if not self._maybe_seen(fingerprint):
+            self.metrics.record(counters={'checked': 1})
+            return None
+
+        since = timezone.now() - timedelta(seconds=self.window)
+        duplicate_of = Payout.objects.find_duplicate(recipient_key, amount, currency, since)
+        self.metrics.record(counters={
+            'checked': 1,
+            'possible': 1,
+            'held' if duplicate_of else 'false_positive': 1,
+        })
+        if duplicate_of:
+            logger.warning(f"Возможный дубликат выплаты {duplicate_of}: {amount} {currency}")
+        return duplicate_of
+
+    def _maybe_seen(self, fingerprint: str) -> bool:
+        generation = int(time.time() // self.window)
+        keys = [f'{self.KEY_PREFIX}{generation}', f'{self.KEY_PREFIX}{generation - 1}']
+        try:
+            script = get_redis().register_script(CHECK_AND_ADD_SCRIPT)
+            return bool(script(keys=keys, args=[2 * self.window, *self._bit_positions(fingerprint)]))
+        except RedisError as exc:
+            logger.warning(f"Фильтр дубликатов недоступен, проверка по БД: {exc}")
+            return True
+
+    def _bit_positions(self, fingerprint: str) -> list:
+        """Номера битов двойным хешированием: h1 + i * h2"""
+        digest = hashlib.sha256(fingerprint.encode()).digest()
+        h1 = int.from_bytes(digest[:8], 'big')
+        h2 = int.from_bytes(digest[8:16], 'big') | 1
+        return [(h1 + i * h2) % self.bits for i in range(self.hashes)]
@@ -0,0 +1,58 @@
+import logging
+from decimal import Decimal, ROUND_UP
+
+from ..fx import get_rate_cache
+from ..fx.base import RateSourceError
+from ..models import Payout
+
+logger = logging.getLogger(__name__)
+
+
+class FxConversionService:
+    """
+    Фиксация курса для выплат из счета в другой валюте
+
+    Курсы берутся из FxRateCache один раз на валюту списания для всей пачки,
+    сумма списания округляется вверх до копейки. Курс и сумма сохраняются
+    одним bulk_update; выплаты с уже зафиксированным курсом не трогаются
+    """
+
+    CENT = Decimal('0.01')
+
+    def __init__(self, cache=None):
+        self._cache = cache
+
+    @property
+    def cache(self):
+        if self._cache is None:
+            self._cache = get_rate_cache()
+        return self._cache
+
+    def lock(self, payouts) -> dict:
+        """Зафиксировать курсы; возвращает ошибки {payout_id: текст} по выплатам без курса"""
+        pending = [payout for payout in payouts if payout.needs_fx_rate]
+        if not pending:
+            return {}
+
+        rates, errors = {}, {}
+        for base in {payout.funding_currency for payout in pending}:
+            try:
+                rates[base] = self.cache.rates(base)
+            except RateSourceError as exc:
+                logger.error(f"Курсы к {base} недоступны: {exc}")
+                rates[base] = {}
+
+        locked = []
+        for payout in pending:
+            rate = rates[payout.funding_currency].get(payout.currency)
+            if not rate:
+                errors[payout.id] = f"Нет курса {payout.funding_currency} -> {payout.currency}"
+                continue
+            payout.fx_rate = rate
+            payout.funding_amount = (payout.amount / rate).quantize(self.CENT, rounding=ROUND_UP)
+            locked.append(payout)
+
+        if locked:
+            Payout.objects.lock_fx_rates(locked)
+            logger.info(f"Зафиксированы курсы для выплат: {len(locked)}")
+        return errors
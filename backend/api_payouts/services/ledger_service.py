@@ -0,0 +1,135 @@
+import logging
+import uuid
+from decimal import Decimal
+
+from django.conf import settings
+from django.db import IntegrityError, transaction
+from django.utils import timezone
+
+from ..models import LedgerAccount, LedgerAccountKind, LedgerEntry, LedgerHold, LedgerHoldStatus
+
+logger = logging.getLogger(__name__)
+
+
+class InsufficientFunds(Exception):
+    """Недостаточно средств на счете финансирования"""
+
+
+class LedgerService:
+    """
+    Книга учета: остатки счетов финансирования и резервы под выплаты
+
+    Резерв ставится условным UPDATE на одном шарде счета: шард выбирается по
+    идентификатору выплаты, при нехватке средств пробуются остальные, а если
+    средства есть только в сумме по шардам - шарды консолидируются в пользу
+    выплаты. Списание при завершении и снятие при ошибке - массовые операции
+    LedgerHoldManager
+    """
+
+    def __init__(self, shards=None):
+        self.shards = shards or settings.PAYOUT_LEDGER_SHARDS
+
+    def open_account(self, owner: str, currency: str, shards=None) -> list:
+        """Создание недостающих шардов счета финансирования"""
+        for shard in range(shards or self.shards):
+            LedgerAccount.objects.get_or_create(
+                kind=LedgerAccountKind.FUNDING, owner=owner, currency=currency, shard=shard
+            )
+        return list(LedgerAccount.objects.funding_shards(owner, currency))
+
+    def fund(self, owner: str, currency: str, amount) -> None:
+        """Пополнение счета поровну по шардам с проводкой со счета пополнений"""
+        amount = Decimal(amount)
+        with transaction.atomic():
+            shards = list(LedgerAccount.objects.funding_shards(owner, currency).select_for_update())
+            if not shards:
+                raise LedgerAccount.DoesNotExist(f"Нет счета финансирования {owner or '-'} в {currency}")
+            parts = LedgerAccount.objects.distribute(amount, shards)
+            deposit = LedgerAccount.objects.system_account(LedgerAccountKind.DEPOSIT, currency)
+            transaction_id = uuid.uuid4()
+            entries = [LedgerEntry(transaction_id=transaction_id, account=deposit, amount=-amount,
+                                   kind=LedgerEntry.DEPOSIT)]
+            now = timezone.now()
+            for shard, part in zip(shards, parts):
+                shard.balance += part
+                shard.updated_at = now
+                entries.append(LedgerEntry(transaction_id=transaction_id, account=shard, amount=part,
+                                           kind=LedgerEntry.DEPOSIT))
+            LedgerAccount.objects.bulk_update(shards, ['balance', 'updated_at'])
+            LedgerEntry.objects.bulk_create(entries)
+
+    def verify_balance(self, payout) -> None:
+        """Проверка доступного остатка без блокировок (этап 'Верификация баланса')"""
+        available = LedgerAccount.objects.available(payout.merchant_id, payout.debit_currency)
+        if available < payout.debit_amount:
+            raise InsufficientFunds(
+                f"Недостаточно средств для выплаты {payout.id}: доступно {available}, нужно {payout.debit_amount}"
+            )
+
+    def reserve(self, payout) -> LedgerHold:
+        """Резерв средств под выплату (этап 'Резервирование средств'); повторный вызов возвращает резерв"""
+        existing = LedgerHold.objects.filter(payout_id=payout.id, status=LedgerHoldStatus.HELD).first()
+        if existing is not None:
+            return existing
+
+        shards = list(
+            LedgerAccount.objects.funding_shards(payout.merchant_id, payout.debit_currency).values_list('id', 'shard')
+        )
+        if not shards:
+            raise InsufficientFunds(f"Нет счета финансирования {payout.merchant_id or '-'} в {payout.debit_currency}")
+
+        start = payout.id.int % len(shards) if isinstance(payout.id, uuid.UUID) else 0
+        ordered = shards[start:] + shards[:start]
+        hold = self._reserve_on(payout, ordered)
+        available = LedgerAccount.objects.available(payout.merchant_id, payout.debit_currency)
+        if hold is None and available >= payout.debit_amount:
+            # Средств хватает только в сумме по шардам: собираем их на шард выплаты
+            logger.info(f"Консолидация счета {payout.merchant_id or '-'} {payout.debit_currency} под выплату {payout.id}")
+            LedgerAccount.objects.rebalance(
+                payout.merchant_id, payout.debit_currency, primary_shard=ordered[0][1], need=payout.debit_amount
+            )
+            hold = self._reserve_on(payout, ordered[:1])
+        if hold is None:
+            raise InsufficientFunds(f"Недостаточно средств для резерва по выплате {payout.id}")
+        return hold
+
+    @staticmethod
+    def _reserve_on(payout, shards):
+        for account_id, _ in shards:
+            try:
+                with transaction.atomic():
+                    if not LedgerAccount.objects.try_reserve(account_id, payout.debit_amount):
+                        continue
+                    # Резерв, снятый после неудачной попытки, ставится заново: резерв у выплаты один
+                    if LedgerHold.objects.filter(payout_id=payout.id, status=LedgerHoldStatus.RELEASED).update(
+                        status=LedgerHoldStatus.HELD, account_id=account_id, amount=payout.debit_amount,
+                        updated_at=timezone.now(),
+                    ):
+                        return LedgerHold.objects.get(payout_id=payout.id)
+                    return LedgerHold.objects.create(
+                        payout_id=payout.id, account_id=account_id, amount=payout.debit_amount
+                    )
+            except IntegrityError:
+                # Резерв уже поставлен параллельной попыткой: наш откатился вместе с транзакцией
+                return LedgerHold.objects.get(payout_id=payout.id)
+        return None
+
+    @staticmethod
+    def capture(payout_ids) -> int:
+        return LedgerHold.objects.capture(payout_ids)
+
+    @staticmethod
+    def release(payout_ids) -> int:
+        return LedgerHold.objects.release(payout_ids)
+
+    def consolidate_all(self) -> int:
+        """Периодическая консолидация: выравнивание доступных остатков шардов"""
+        accounts = (
+            LedgerAccount.objects.filter(kind=LedgerAccountKind.FUNDING, shard__gt=0)
+            .values_list('owner', 'currency')
+            .distinct()
+        )
+        changed = 0
+        for owner, currency in accounts:
+            changed += LedgerAccount.objects.rebalance(owner, currency)
+        return changed
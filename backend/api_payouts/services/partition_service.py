@@ -0,0 +1,184 @@
+import logging
+import re
+from datetime import date, datetime, timezone as dt_timezone
+
+from django.conf import settings
+from django.db import DatabaseError, connection as default_connection, transaction
+from django.utils import timezone
+
+from ..metrics import PayoutMetrics
+
+logger = logging.getLogger(__name__)
+
+
+class PayoutPartitionService:
+    """
+    Секционирование таблицы выплат по месяцам created_at (PostgreSQL)
+
+    Таблица api_payouts_payout - секционированная по диапазону created_at,
+    секция на каждый месяц (api_payouts_payout_pYYYY_MM, границы в UTC) и
+    секция по умолчанию на случай, если секция месяца не создана заранее.
+    Первичный ключ - (id, created_at): ключ секционирования обязан входить
+    в уникальные ключи. Строки, существовавшие до секционирования, остаются
+    в секции api_payouts_payout_legacy. На других СУБД методы ничего не делают
+    """
+
+    TABLE = 'api_payouts_payout'
+    LEGACY = 'api_payouts_payout_legacy'
+    DEFAULT = 'api_payouts_payout_default'
+
+    @staticmethod
+    def month_start(day) -> date:
+        return date(day.year, day.month, 1)
+
+    @staticmethod
+    def next_month(month: date) -> date:
+        return date(month.year + month.month // 12, month.month % 12 + 1, 1)
+
+    @classmethod
+    def partition_name(cls, month: date) -> str:
+        return f'{cls.TABLE}_p{month:%Y_%m}'
+
+    @staticmethod
+    def bound(month: date) -> str:
+        return datetime(month.year, month.month, 1, tzinfo=dt_timezone.utc).isoformat(sep=' ')
+
+    @classmethod
+    def is_partitioned(cls, connection=None) -> bool:
+        connection = connection or default_connection
+        if connection.vendor != 'postgresql':
+            return False
+        with connection.cursor() as cursor:
+            cursor.execute(
+                "SELECT 1 FROM pg_partitioned_table WHERE partrelid = to_regclass(%s)", [cls.TABLE]
+            )
+            return cursor.fetchone() is not None
+
+    @classmethod
+    def ensure_partitions(cls, months_ahead=None, connection=None) -> list:
+        """Секции с текущего месяца на months_ahead вперед; возвращает имена созданных"""
+        connection = connection or default_connection
+        if not cls.is_partitioned(connection):
+            return []
+        months_ahead = settings.PAYOUT_PARTITION_MONTHS_AHEAD if months_ahead is None else months_ahead
+
+        created = []
+        current = cls.month_start(timezone.now().astimezone(dt_timezone.utc))
+        with connection.cursor() as cursor:
+            # Месяцы до верхней границы legacy уже покрыты ею
+            month = max(current, cls._legacy_bound(cursor) or current)
+            last = current
+            for _ in range(months_ahead):
+                last = cls.next_month(last)
+            while month <= last:
+                name = cls.partition_name(month)
+                cursor.execute("SELECT to_regclass(%s) IS NOT NULL", [name])
+                if not cursor.fetchone()[0]:
+                    try:
+                        with transaction.atomic(using=connection.alias):
+                            cursor.execute(cls._create_partition_sql(month))
+                        created.append(name)
+                        logger.info(f"Создана секция выплат {name}")
+                    except DatabaseError as exc:
+                        # Например, строки этого месяца уже попали в секцию по умолчанию
+                        logger.error(f"Не удалось создать секцию выплат {name}: {exc}")
+                month = cls.next_month(month)
+            cursor.execute(f"SELECT count(*) FROM {cls.DEFAULT}")
+            default_rows = cursor.fetchone()[0]
+
+        if default_rows:
+            logger.warning(f"В секции по умолчанию {cls.DEFAULT} строк: {default_rows}")
+        PayoutMetrics('partitions').record(
+            counters={'created': len(created)},
+            gauges={'default_rows': default_rows},
+        )
+        return created
+
+    @classmethod
+    def partition_table(cls, schema_editor) -> None:
+        """
+        Перевод существующей таблицы в секционированную без копирования строк
+
+        Таблица переименовывается в api_payouts_payout_legacy и подключается
+        секцией до начала следующего месяца. Строки не копируются: таблица
+        читается, только чтобы проверить CHECK на created_at (после него ATTACH
+        не сканирует ее повторно) и построить уникальный индекс (id, created_at).
+        Индексы legacy с теми же определениями становятся секциями индексов
+        новой таблицы, а не строятся заново
+        """
+        connection = schema_editor.connection
+        if connection.vendor != 'postgresql' or cls.is_partitioned(connection):
+            return
+        bound = cls.bound(cls.next_month(cls.month_start(timezone.now().astimezone(dt_timezone.utc))))
+
+        with connection.cursor() as cursor:
+            cursor.execute(
+                """
+                SELECT i.relname, pg_get_indexdef(i.oid)
+                FROM pg_index x JOIN pg_class i ON i.oid = x.indexrelid
+                WHERE x.indrelid = to_regclass(%s) AND NOT x.indisprimary AND NOT x.indisunique
+                """,
+                [cls.TABLE],
+            )
+            indexes = cursor.fetchall()
+            cursor.execute(
+                """
+                SELECT conname, pg_get_constraintdef(oid)
+                FROM pg_constraint WHERE conrelid = to_regclass(%s) AND contype = 'f'
+                """,
+                [cls.TABLE],
+            )
+            foreign_keys = cursor.fetchall()
+
+            cursor.execute(f"ALTER TABLE {cls.TABLE} RENAME TO {cls.LEGACY}")
+            cursor.execute(f"ALTER TABLE {cls.LEGACY} RENAME CONSTRAINT {cls.TABLE}_pkey TO {cls.LEGACY}_pkey")
+            for name, _ in indexes:
+                cursor.execute(f"ALTER INDEX {name} RENAME TO {cls._legacy_index(name)}")
+
+            cursor.execute(
+                f"CREATE TABLE {cls.TABLE} (LIKE {cls.LEGACY} INCLUDING DEFAULTS INCLUDING CONSTRAINTS "
+                f"INCLUDING STORAGE) PARTITION BY RANGE (created_at)"
+            )
+            cursor.execute(f"ALTER TABLE {cls.TABLE} ADD CONSTRAINT {cls.TABLE}_pkey PRIMARY KEY (id, created_at)")
+            for name, definition in foreign_keys:
+                cursor.execute(f"ALTER TABLE {cls.TABLE} ADD CONSTRAINT {name} {definition}")
+
+            cursor.execute(
+                f"ALTER TABLE {cls.LEGACY} ADD CONSTRAINT {cls.LEGACY}_bound "
+                f"CHECK (created_at < '{bound}') NOT VALID"
+            )
+            cursor.execute(f"ALTER TABLE {cls.LEGACY} VALIDATE CONSTRAINT {cls.LEGACY}_bound")
+            cursor.execute(f"CREATE UNIQUE INDEX {cls.LEGACY}_id_created ON {cls.LEGACY} (id, created_at)")
+            cursor.execute(
+                f"ALTER TABLE {cls.TABLE} ATTACH PARTITION {cls.LEGACY} FOR VALUES FROM (MINVALUE) TO ('{bound}')"
+            )
+            # Определения прочитаны до переименования: имя индекса и таблицы - исходные
+            for _, definition in indexes:
+                cursor.execute(definition)
+            cursor.execute(f"CREATE TABLE {cls.DEFAULT} PARTITION OF {cls.TABLE} DEFAULT")
+
+        cls.ensure_partitions(connection=connection)
+
+    @classmethod
+    def _create_partition_sql(cls, month: date) -> str:
+        return (
+            f"CREATE TABLE {cls.partition_name(month)} PARTITION OF {cls.TABLE} "
+            f"FOR VALUES FROM ('{cls.bound(month)}') TO ('{cls.bound(cls.next_month(month))}')"
+        )
+
+    @staticmethod
+    def _legacy_index(name: str) -> str:
+        # Имена в PostgreSQL - не длиннее 63 символов
+        return f'{name[:56]}_legacy'
+
+    @classmethod
+    def _legacy_bound(cls, cursor):
+        """Первый месяц после верхней границы секции legacy; None, если ее нет"""
+        cursor.execute(
+            "SELECT pg_get_expr(relpartbound, oid) FROM pg_class WHERE oid = to_regclass(%s)", [cls.LEGACY]
+        )
+        row = cursor.fetchone()
+        match = re.search(r"TO \('(\d{4})-(\d{2})", row[0] or '') if row else None
+        if match is None:
+            return None
+        return date(int(match.group(1)), int(match.group(2)), 1)
@@ -1,15 +1,29 @@
-from typing import List, Dict, Any
-from ..models import Payout
-from ..schemas import PayoutCreateSchema, PayoutUpdateSchema
+from datetime import timedelta
+from typing import List, Dict, Any, Optional
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..models import Payout, Status
+from ..schemas import PayoutCreateSchema, PayoutUpdateSchema, PayoutFilterSchema
+from .duplicate_service import DuplicateDetectionService
 
 
 class PayoutCRUDService:
     """Сервис для работы с выплатами CRUD"""
 
     @staticmethod
-    def get_list_payouts() -> List[Payout]:
-        """Получить все выплаты"""
-        return Payout.objects.all().order_by('-created_at')
+    def get_list_payouts(filters: Optional[PayoutFilterSchema] = None) -> List[Payout]:
+        """
+        Получить выплаты, новые первыми. Если задан PAYOUT_LIST_WINDOW_DAYS, без нижней
+        границы created_at берутся выплаты за это число дней: граница отсекает старые секции таблицы
+        """
+        queryset = Payout.objects.all()
+        if filters is not None:
+            queryset = filters.filter(queryset)
+        if (filters is None or filters.created_from is None) and settings.PAYOUT_LIST_WINDOW_DAYS:
+            queryset = queryset.filter(created_at__gte=timezone.now() - timedelta(days=settings.PAYOUT_LIST_WINDOW_DAYS))
+        return queryset.order_by('-created_at')
 
     @staticmethod
     def get_payout(payout_id: str) -> Payout:
@@ -18,8 +32,14 @@ class PayoutCRUDService:
 
     @staticmethod
     def create_payout(payload: PayoutCreateSchema) -> Payout:
-        """Создать новую выплату"""
-        payout = Payout.objects.create_payout(**payload.dict(exclude_unset=True), status='pending')
+        """Создать новую выплату (возможный дубликат создается на проверке, status='review')"""
+        data = {**payload.dict(exclude_unset=True), 'status': 'pending'}
+        duplicate_of = DuplicateDetectionService().find_duplicate(
+            Payout.recipient_key_for(data['recipient_details']), data['amount'], data['currency']
+        )
+        if duplicate_of:
+            data.update(status=Status.REVIEW, duplicate_of_id=duplicate_of)
+        payout = Payout.objects.create_payout(**data)
 
         return payout
 
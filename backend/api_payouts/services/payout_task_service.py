@@ -1,5 +1,11 @@
+from datetime import timedelta
 from typing import Dict, Any
+from django.conf import settings
 from django.db import transaction
+from django.utils import timezone
+from ..models import Payout, Status
+from ..celery_services.fair_scheduler import FairScheduler
+from ..celery_services.payout_netting_service import PayoutNettingService
 from ..tasks import payout_task
 
 
@@ -7,6 +13,54 @@ class PayoutTaskService:
     """Сервис для работы с фоновыми задачами"""
 
     @staticmethod
-    def execute_payout(payout_id: str, countdown=1) -> Dict[str, Any]:
-        """Фоновая обработка выплаты - запуск"""
-        return transaction.on_commit(lambda: payout_task.apply_async(args=[payout_id], countdown=countdown))
+    def execute_payout(payout_id: str, countdown=None) -> Dict[str, Any]:
+        """
+        Фоновая обработка выплаты - запуск
+
+        Отложенный запуск не использует ETA/countdown Celery (такие задачи
+        держатся в памяти воркеров), а планирует выплату через execute_at.
+        В пакетном режиме выплату заберет payout_batch_task, при справедливой
+        диспетчеризации выплата встает в очередь своего мерчанта. При включенном
+        сведении (PAYOUT_NETTING_WINDOW) выплата, которую можно свести,
+        удерживается на время окна
+        """
+        if countdown:
+            return PayoutTaskService.schedule_payout(
+                payout_id, execute_at=timezone.now() + timedelta(seconds=countdown)
+            )
+        if settings.PAYOUT_NETTING_WINDOW and PayoutTaskService.hold_for_netting(payout_id):
+            return None
+        if settings.PAYOUT_PROCESSING_MODE == 'batch':
+            return None
+        if settings.PAYOUT_FAIR_SCHEDULING:
+            return transaction.on_commit(lambda: FairScheduler(task=payout_task).enqueue([payout_id]))
+        return transaction.on_commit(lambda: payout_task.apply_async(args=[payout_id]))
+
+    @staticmethod
+    def approve_payout(payout_id: str) -> Payout:
+        """Подтвердить выплату, задержанную как возможный дубликат, и запустить ее"""
+        if Payout.objects.release_review(payout_id):
+            payout = Payout.objects.get_payout(payout_id)
+            if payout.execute_at is None:
+                PayoutTaskService.execute_payout(payout_id)
+            return payout
+        return Payout.objects.get_payout(payout_id)
+
+    @staticmethod
+    def hold_for_netting(payout_id: str) -> bool:
+        """
+        Удержание выплаты на окно сведения одним условным UPDATE: только выплаты
+        с известными реквизитами получателя, не являющиеся частями разделенной,
+        в валютах без лимитов частоты
+        """
+        execute_at = timezone.now() + timedelta(seconds=settings.PAYOUT_NETTING_WINDOW)
+        return Payout.objects.filter(
+            id=payout_id, status=Status.PENDING, parent__isnull=True,
+        ).exclude(recipient_key='').exclude(
+            currency__in=PayoutNettingService.velocity_limited()
+        ).update(execute_at=execute_at) == 1
+
+    @staticmethod
+    def schedule_payout(payout_id: str, execute_at) -> int:
+        """Запланировать выплату: ее отправит планировщик dispatch_due_payouts"""
+        return Payout.objects.filter(id=payout_id, status=Status.PENDING).update(execute_at=execute_at)
@@ -0,0 +1,230 @@
+import csv
+import logging
+import os
+import uuid
+from datetime import datetime, time, timedelta
+from decimal import Decimal, InvalidOperation
+
+from django.conf import settings
+from django.utils import timezone
+
+from ..metrics import PayoutMetrics
+from ..models import (
+    Payout, ReconciliationRun, ReconciliationMismatch, ReconciliationStatus, MismatchKind,
+)
+
+logger = logging.getLogger(__name__)
+
+
+class SettlementFileError(Exception):
+    """Файл расчетов нельзя сверить: нет колонок, некорректный id или строки не отсортированы"""
+
+
+class SettlementFile:
+    """
+    Построчное чтение CSV-файла расчетов, отсортированного по payout_id
+
+    Файл читается в двоичном режиме, чтобы позиция каждой строки была
+    точным смещением в байтах: с него сверка продолжается после перерыва
+    """
+
+    COLUMNS = ('payout_id', 'amount', 'currency', 'status')
+
+    def __init__(self, path):
+        self.path = path
+
+    def rows(self, offset=0):
+        """Пары (смещение начала строки, строка) начиная с offset; offset 0 - сразу после заголовка"""
+        with open(self.path, 'rb') as file:
+            header = next(csv.reader([file.readline().decode('utf-8-sig')]), [])
+            missing = [column for column in self.COLUMNS if column not in header]
+            if missing:
+                raise SettlementFileError(f"В файле расчетов нет колонок: {', '.join(missing)}")
+            if offset:
+                file.seek(offset)
+
+            previous = None
+            while True:
+                position = file.tell()
+                line = file.readline()
+                if not line:
+                    return
+                if not line.strip():
+                    continue
+                row = dict(zip(header, next(csv.reader([line.decode('utf-8')]))))
+                try:
+                    # str(UUID) сортируется так же, как id в базе
+                    row['payout_id'] = str(uuid.UUID(row['payout_id'].strip()))
+                except ValueError:
+                    raise SettlementFileError(f"Некорректный payout_id в позиции {position}: {row['payout_id']}")
+                if previous is not None and row['payout_id'] <= previous:
+                    raise SettlementFileError(
+                        f"Файл расчетов не отсортирован по payout_id: {row['payout_id']} после {previous}"
+                    )
+                previous = row['payout_id']
+                yield position, row
+
+
+class ReconciliationService:
+    """
+    Сверка выплат с файлом расчетов платежной системы за день
+
+    Файл и выплаты, отправленные провайдеру за день расчетов (есть
+    provider_reference, обновлены в этот день), читаются потоками,
+    упорядоченными по id, и сливаются (merge join): память не зависит от
+    размера файла. Каждые checkpoint_every шагов расхождения порции и
+    позиция в обоих потоках (последний id и смещение в файле) пишутся в одной
+    транзакции - прерванная сверка продолжается с контрольной точки.
+    Строки файла без пары в потоке дня (выплату обновили позже, например
+    при возврате) перед записью порции ищутся в базе по id одним запросом и
+    сверяются как обычно: missing_in_db - только если выплаты нет или она
+    не отправлялась провайдеру
+    """
+
+    def __init__(self, path, settlement_date, checkpoint_every=None, chunk_size=None):
+        self.file = SettlementFile(path)
+        self.source = os.path.basename(path)
+        self.settlement_date = settlement_date
+        self.checkpoint_every = checkpoint_every or settings.PAYOUT_RECONCILIATION_CHECKPOINT_EVERY
+        self.chunk_size = chunk_size or settings.PAYOUT_RECONCILIATION_CHUNK_SIZE
+        self.statuses = settings.PAYOUT_SETTLEMENT_STATUSES
+
+    def run(self, restart: bool = False) -> dict:
+        """Сверка (или ее продолжение); возвращает итоги"""
+        run = ReconciliationRun.objects.start(self.settlement_date, self.source, restart=restart)
+        if run.status == ReconciliationStatus.COMPLETED:
+            logger.info(f"Сверка {self.source} за {self.settlement_date} уже завершена")
+            return run.summary
+        if run.last_payout_id:
+            logger.info(f"Сверка {self.source}: продолжение после выплаты {run.last_payout_id}")
+
+        try:
+            summary = self._merge(run)
+        except Exception as exc:
+            logger.error(f"Сверка {self.source} за {self.settlement_date} прервана: {exc}")
+            ReconciliationRun.objects.filter(id=run.id).update(status=ReconciliationStatus.FAILED, error=str(exc))
+            raise
+
+        logger.info(f"Сверка {self.source} за {self.settlement_date} завершена: {summary}")
+        PayoutMetrics('reconciliation').record(
+            counters={'runs': 1},
+            gauges={f'last_{key}': value for key, value in summary.items()},
+        )
+        return summary
+
+    def _merge(self, run) -> dict:
+        summary = {
+            'matched': 0, 'file_rows': 0,
+            **{kind: 0 for kind in MismatchKind.values},
+            **run.summary,
+        }
+        mismatches, unmatched = [], []
+        last_key, offset = run.last_payout_id, run.file_offset
+        steps = 0
+
+        rows = self.file.rows(offset)
+        payouts = self._payouts(last_key)
+        row_item = next(rows, None)
+        payout = next(payouts, None)
+
+        while row_item is not None or payout is not None:
+            if payout is None or (row_item is not None and row_item[1]['payout_id'] < payout[0]):
+                last_key = row_item[1]['payout_id']
+                unmatched.append(row_item[1])
+                summary['file_rows'] += 1
+                row_item = next(rows, None)
+            elif row_item is None or payout[0] < row_item[1]['payout_id']:
+                last_key = payout[0]
+                mismatches.append(self._mismatch(run, last_key, MismatchKind.MISSING_IN_FILE, actual=payout))
+                payout = next(payouts, None)
+            else:
+                last_key = payout[0]
+                found = self._compare(run, row_item[1], payout)
+                mismatches += found
+                summary['matched'] += not found
+                summary['file_rows'] += 1
+                row_item = next(rows, None)
+                payout = next(payouts, None)
+
+            steps += 1
+            if steps % self.checkpoint_every == 0:
+                # Позиция - начало первой несверенной строки файла
+                offset = row_item[0] if row_item is not None else os.path.getsize(self.file.path)
+                mismatches += self._resolve(run, unmatched, summary)
+                unmatched = []
+                self._checkpoint(run, last_key, offset, summary, mismatches)
+                mismatches = []
+
+        mismatches += self._resolve(run, unmatched, summary)
+        self._checkpoint(run, last_key, os.path.getsize(self.file.path), summary, mismatches,
+                         status=ReconciliationStatus.COMPLETED)
+        return summary
+
+    def _payouts(self, after: str):
+        """Отправленные провайдеру выплаты дня по возрастанию id (серверный курсор в Postgres)"""
+        start = timezone.make_aware(datetime.combine(self.settlement_date, time.min))
+        queryset = (
+            Payout.objects
+            .filter(updated_at__gte=start, updated_at__lt=start + timedelta(days=1))
+            .exclude(provider_reference='')
+            .order_by('id')
+            .values_list('id', 'amount', 'currency', 'status')
+        )
+        if after:
+            queryset = queryset.filter(id__gt=after)
+        for payout_id, amount, currency, status in queryset.iterator(chunk_size=self.chunk_size):
+            yield str(payout_id), amount, currency, status
+
+    def _resolve(self, run, rows, summary) -> list:
+        """Сверка строк файла, не найденных среди выплат дня, с выплатами из базы по id"""
+        if not rows:
+            return []
+        payouts = {
+            str(payout_id): (str(payout_id), amount, currency, status)
+            for payout_id, amount, currency, status in (
+                Payout.objects
+                .filter(id__in=[row['payout_id'] for row in rows])
+                .exclude(provider_reference='')
+                .values_list('id', 'amount', 'currency', 'status')
+            )
+        }
+        mismatches = []
+        for row in rows:
+            payout = payouts.get(row['payout_id'])
+            if payout is None:
+                mismatches.append(self._mismatch(run, row['payout_id'], MismatchKind.MISSING_IN_DB, expected=row))
+                continue
+            found = self._compare(run, row, payout)
+            mismatches += found
+            summary['matched'] += not found
+        return mismatches
+
+    def _compare(self, run, row, payout) -> list:
+        payout_id, amount, currency, status = payout
+        mismatches = []
+        try:
+            row_amount = Decimal(row['amount'])
+        except InvalidOperation:
+            row_amount = None
+        if row_amount != amount or row['currency'].strip().upper() != currency:
+            mismatches.append(self._mismatch(run, payout_id, MismatchKind.AMOUNT, expected=row, actual=payout))
+        if self.statuses.get(row['status'].strip().lower(), row['status']) != status:
+            mismatches.append(self._mismatch(run, payout_id, MismatchKind.STATUS, expected=row, actual=payout))
+        return mismatches
+
+    @staticmethod
+    def _mismatch(run, payout_id, kind, expected=None, actual=None) -> ReconciliationMismatch:
+        if actual is not None:
+            actual = {'amount': str(actual[1]), 'currency': actual[2], 'status': actual[3]}
+        return ReconciliationMismatch(
+            run=run, payout_id=payout_id, kind=kind, expected=expected or {}, actual=actual or {},
+        )
+
+    @staticmethod
+    def _checkpoint(run, last_key, offset, summary, mismatches, status=ReconciliationStatus.RUNNING):
+        for mismatch in mismatches:
+            summary[mismatch.kind] += 1
+        ReconciliationRun.objects.checkpoint(
+            run.id, last_payout_id=last_key, file_offset=offset, summary=dict(summary),
+            mismatches=mismatches, status=status,
+        )
@@ -1,30 +1,63 @@
-from celery import shared_task
+from celery import shared_task, states
+from celery.signals import before_task_publish, task_prerun, task_postrun
 import logging
+import os
+import time
+from datetime import date, timedelta
+from django.conf import settings
+from django.utils import timezone
+from .celery_services.circuit_breaker import CircuitOpen
+from .celery_services.fair_scheduler import FairScheduler
+from .celery_services.netted_transfer_processing_service import NettedTransferProcessingService
+from .celery_services.payout_batch_processing_service import PayoutBatchProcessingService
+from .celery_services.payout_netting_service import PayoutNettingService
+from .celery_services.payout_reaper_service import PayoutReaperService
+from .celery_services.payout_scheduler_service import PayoutSchedulerService
+from .celery_services.payout_split_service import PayoutSplitService
 from .celery_services.payout_task_proccessing_service import PayoutProcessingService, ProcessingInProgress, StopProcessing
+from .celery_services.result_pruner import TaskResultPruner
+from .celery_services.submit_batcher import SubmitBatcher
+from .metrics import PayoutMetrics
+from .models import Payout, PayoutDeadLetter
+from .services.ledger_service import LedgerService
+from .services.partition_service import PayoutPartitionService
+from .services.reconciliation_service import ReconciliationService
 
 logger = logging.getLogger(__name__)
 
 
+def compact_result(result) -> dict:
+    """Сжатый итог выплаты для result backend: подробности - в строке выплаты"""
+    result = result or {}
+    return {'payout_id': str(result.get('payout_id', '')), 'success': bool(result.get('success'))}
+
+
 @shared_task(
     bind=True,
     max_retries=3,
     default_retry_delay=30,
     autoretry_for=(ConnectionError, TimeoutError),
     retry_backoff=True,
-    ignore_result=False,
+    ignore_result=True,
     acks_late=True,
 )
-def payout_task(self, payout_id):
+def payout_task(self, payout_id, attempts=None, tenant=None):
     """
     Асинхронная задача обработки выплаты
 
     1. Принимает идентификатор созданной заявки (payout_id)
     2. Имитирует обработку (задержка, логирование, проверки)
     3. Изменяет статус заявки после обработки
+    4. После исчерпания попыток записывает задачу в dead letter с историей попыток
+
+    tenant передает справедливый диспетчер: после выполнения слот мерчанта освобождается.
+    Результат в result backend не сохраняется: итог выплаты - в ее строке
+    (статус, provider_reference, ошибки в описании)
     """
 
     try:
-        service = PayoutProcessingService(payout_id, task=self)
+        splitter = PayoutSplitService(part_task=payout_part_task, finalize_task=finalize_split_payout)
+        service = PayoutProcessingService(payout_id, task=self, splitter=splitter)
         return service.process()
 
     except ProcessingInProgress as exc:
@@ -42,4 +75,206 @@ def payout_task(self, payout_id):
 
     except Exception as exc:
         logger.error(f"Ошибка в задаче обработки выплаты {payout_id}: {str(exc)}")
-        raise self.retry(exc=exc)
\ No newline at end of file
+        attempts = [*(attempts or []), {
+            'attempt': self.request.retries + 1,
+            'error': str(exc),
+            'at': timezone.now().isoformat(),
+        }]
+
+        if self.request.retries >= self.max_retries:
+            logger.error(f"Попытки обработки выплаты {payout_id} исчерпаны, задача перенесена в dead letter")
+            PayoutDeadLetter.objects.record(
+                payout_id=payout_id,
+                task_id=self.request.id,
+                error=str(exc),
+                attempts=attempts,
+            )
+            raise
+
+        # tenant сохраняется: слот мерчанта занят до окончательного завершения задачи
+        raise self.retry(exc=exc, args=[payout_id], kwargs={'attempts': attempts, 'tenant': tenant})
+
+
+@shared_task(
+    bind=True,
+    max_retries=3,
+    default_retry_delay=30,
+    retry_backoff=True,
+    ignore_result=False,
+    acks_late=True,
+)
+def payout_part_task(self, part_id):
+    """
+    Задача обработки части разделенной выплаты (заголовок chord).
+    Исход всегда возвращается, а не пробрасывается: иначе колбэк chord не сработает.
+    Chord нужен результат каждой части, поэтому он хранится, но в сжатом виде
+    """
+    try:
+        return compact_result(PayoutProcessingService(part_id, task=self).process())
+
+    except StopProcessing as exc:
+        return compact_result(exc.result)
+
+    except Exception as exc:
+        logger.error(f"Ошибка обработки части выплаты {part_id}: {str(exc)}")
+        if self.request.retries >= self.max_retries:
+            return compact_result({'success': False, 'payout_id': part_id})
+        countdown = 10 if isinstance(exc, ProcessingInProgress) else None
+        raise self.retry(exc=exc, countdown=countdown)
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def finalize_split_payout(results, parent_id):
+    """Колбэк chord: итоговый статус разделенной выплаты по статусам частей"""
+    status = Payout.objects.finalize_split(parent_id)
+    logger.info(f"Разделенная выплата {parent_id}: итоговый статус {status}")
+    return {'payout_id': parent_id, 'status': status, 'parts': len(results)}
+
+
+@shared_task(
+    bind=True,
+    max_retries=3,
+    default_retry_delay=30,
+    retry_backoff=True,
+    ignore_result=True,
+    acks_late=True,
+)
+def netted_transfer_task(self, transfer_id):
+    """
+    Задача отправки сводного перевода. После исчерпания попыток перевод
+    разбирается: его выплаты переводятся в 'failed', а если все попытки
+    отклонил предохранитель - возвращаются в 'pending'
+    """
+    service = NettedTransferProcessingService(transfer_id)
+    try:
+        return service.process()
+
+    except CircuitOpen as exc:
+        if self.request.retries >= self.max_retries:
+            return service.dissolve(exc)
+        raise self.retry(countdown=exc.retry_after, exc=exc)
+
+    except Exception as exc:
+        logger.error(f"Ошибка отправки сводного перевода {transfer_id}: {str(exc)}")
+        if self.request.retries >= self.max_retries:
+            return service.unwind(exc)
+        raise self.retry(exc=exc)
+
+
+@shared_task(ignore_result=True)
+def dispatch_due_payouts():
+    """
+    Периодическая задача: отправка запланированных выплат, срок которых наступил.
+    При включенном сведении повторные выплаты одному получателю сначала
+    сводятся в сводные переводы
+    """
+    if settings.PAYOUT_NETTING_WINDOW:
+        PayoutNettingService(task=netted_transfer_task).net_due()
+    return PayoutSchedulerService(task=payout_task).dispatch_due()
+
+
+@shared_task(ignore_result=True)
+def reap_stuck_payouts():
+    """Периодическая задача: возврат выплат, зависших в статусе 'processing', и зависших сводных переводов"""
+    PayoutNettingService(task=netted_transfer_task).resume_stale()
+    return PayoutReaperService().reap()
+
+
+@shared_task(ignore_result=True, acks_late=True)
+def payout_batch_task(batch_size=None):
+    """Периодическая задача пакетного режима: обработка пачек ожидающих выплат"""
+    if settings.PAYOUT_PROCESSING_MODE != 'batch':
+        return None
+    return PayoutBatchProcessingService(batch_size=batch_size).process()
+
+
+@shared_task(ignore_result=True)
+def dispatch_fair_payouts():
+    """Периодическая задача: справедливая выдача выплат из очередей мерчантов"""
+    if not settings.PAYOUT_FAIR_SCHEDULING:
+        return None
+    return FairScheduler(task=payout_task).dispatch()
+
+
+@shared_task(ignore_result=True)
+def flush_submit_batches():
+    """Периодическая задача: отправка пачек выплат, ожидающих дольше PAYOUT_SUBMIT_BATCH_MAX_AGE"""
+    if not settings.PAYOUT_SUBMIT_BATCHING:
+        return None
+    return SubmitBatcher().flush_due()
+
+
+@shared_task(ignore_result=True)
+def consolidate_ledger():
+    """Периодическая задача: выравнивание остатков шардов счетов финансирования"""
+    if not settings.PAYOUT_LEDGER_ENABLED:
+        return None
+    return LedgerService().consolidate_all()
+
+
+@shared_task(ignore_result=True)
+def prune_task_results():
+    """Периодическая задача: удаление результатов задач, записанных без срока жизни"""
+    return TaskResultPruner().prune()
+
+
+@shared_task(ignore_result=True)
+def reconcile_settlement(settlement_date=None):
+    """
+    Периодическая задача: сверка с файлом расчетов за день (по умолчанию вчера)
+    из PAYOUT_SETTLEMENT_DIR. Прерванная сверка продолжается с контрольной точки
+    """
+    if not settings.PAYOUT_SETTLEMENT_DIR:
+        return None
+    settlement_date = settlement_date or (timezone.localdate() - timedelta(days=1)).isoformat()
+    path = os.path.join(
+        settings.PAYOUT_SETTLEMENT_DIR, settings.PAYOUT_SETTLEMENT_FILE_PATTERN.format(date=settlement_date)
+    )
+    if not os.path.exists(path):
+        logger.warning(f"Файл расчетов за {settlement_date} не найден: {path}")
+        return None
+    return ReconciliationService(path, date.fromisoformat(settlement_date)).run()
+
+
+@shared_task(ignore_result=True)
+def ensure_payout_partitions():
+    """Периодическая задача: секции таблицы выплат на PAYOUT_PARTITION_MONTHS_AHEAD месяцев вперед"""
+    return PayoutPartitionService.ensure_partitions()
+
+
+@before_task_publish.connect
+def stamp_enqueued_at(headers=None, **kwargs):
+    """Время публикации в заголовках - для задержки очереди"""
+    if headers is not None:
+        headers['enqueued_at'] = time.time()
+
+
+@task_prerun.connect
+def record_queue_latency(task=None, **kwargs):
+    """Задержка от публикации до начала обработки по очередям выплат"""
+    if task is None or task.name != payout_task.name:
+        return
+    enqueued_at = getattr(task.request, 'enqueued_at', None)
+    if enqueued_at is None:
+        return
+    queue = (task.request.delivery_info or {}).get('routing_key') or 'unknown'
+    latency_ms = max(0, int((time.time() - enqueued_at) * 1000))
+    PayoutMetrics(f'queue:{queue}').record(
+        counters={'consumed': 1, 'latency_ms_total': latency_ms},
+        gauges={'last_latency_ms': latency_ms},
+    )
+
+
+@task_postrun.connect
+def release_tenant_slot(task=None, args=None, kwargs=None, state=None, **extra):
+    """Освобождение слота мерчанта справедливого диспетчера; при повторе слот остается за выплатой"""
+    if task is None or task.name != payout_task.name or state == states.RETRY:
+        return
+    tenant = (kwargs or {}).get('tenant')
+    if tenant is None or not args:
+        return
+    try:
+        FairScheduler.release(tenant, args[0])
+    except Exception as exc:
+        # Слот освободится сам по PAYOUT_FAIR_INFLIGHT_TTL
+        logger.warning(f"Не удалось освободить слот мерчанта {tenant}: {exc}")
@@ -1,4 +1,5 @@
 import uuid
+from datetime import timedelta
 from decimal import Decimal
 from unittest.mock import patch, MagicMock
 from django.test import TestCase
@@ -52,6 +53,14 @@ class PayoutAPITestCase(TestCase):
         self.assertIn("items", response.json())
         self.assertIn("count", response.json())
 
+    def test_list_payouts_filters(self):
+        """Тест фильтров списка выплат"""
+        response = self.client.get("/?status=completed")
+        self.assertEqual(response.json()["count"], 0)
+
+        response = self.client.get(f"/?currency={self.payout.currency.value}")
+        self.assertEqual(response.json()["items"][0]["id"], str(self.payout.id))
+
     def test_get_payout_success(self):
         """Тест получения конкретной выплаты"""
         response = self.client.get(f"/{self.payout.id}/")
@@ -97,6 +106,17 @@ class PayoutAPITestCase(TestCase):
         mock_create.assert_called_once()
         mock_execute.assert_called_once_with(str(mock_payout.id))
 
+    @patch('api_payouts.services.payout_service.PayoutService.execute_payout')
+    def test_create_scheduled_payout(self, mock_execute):
+        """Тест, что запланированная выплата не отправляется в обработку сразу"""
+        execute_at = timezone.now() + timedelta(hours=1)
+
+        response = self.client.post("/", json={**self.payout_data, "execute_at": execute_at.isoformat()})
+
+        self.assertEqual(response.status_code, 200)
+        self.assertIsNotNone(response.json()["execute_at"])
+        mock_execute.assert_not_called()
+
     def test_create_payout_validation_error(self):
         """Тест создания выплаты с невалидными данными"""
         invalid_data = {
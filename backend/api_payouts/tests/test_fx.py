@@ -0,0 +1,117 @@
+import time
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase
+
+from api_payouts.models import Payout, Currency, Status
+from api_payouts.fx.base import RateSourceError
+from api_payouts.fx.cache import FxRateCache
+from api_payouts.fx.http_source import HttpRateSource
+from api_payouts.fx.static import StaticRateSource
+from api_payouts.gateway.stub_provider import StubProviderServer
+from api_payouts.services.fx_service import FxConversionService
+from api_payouts.celery_services.payout_task_proccessing_service import PayoutProcessingService
+
+
+class FxRateCacheTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.addCleanup(redis_patcher.stop)
+        self.redis.hgetall.return_value = {}
+        self.source = MagicMock(wraps=StaticRateSource({'RUB': '1', 'USD': '92.50'}))
+
+    def test_source_fetched_once_and_shared(self):
+        """Тест, что курсы загружаются из источника один раз и сохраняются в Redis"""
+        cache = FxRateCache(self.source, ttl=60, refresh_ahead=0.9)
+
+        self.assertEqual(cache.rate('USD', 'RUB'), Decimal('92.5'))
+        self.assertEqual(cache.rate('USD', 'RUB'), Decimal('92.5'))
+        self.assertEqual(cache.rate('USD', 'USD'), Decimal(1))
+
+        self.source.fetch.assert_called_once_with('USD')
+        mapping = self.redis.pipeline.return_value.hset.call_args.kwargs['mapping']
+        self.assertEqual(mapping['RUB'], '92.50000000')
+        self.assertIn('_fetched_at', mapping)
+
+    def test_redis_hit_skips_source(self):
+        """Тест, что свежие курсы из Redis не требуют запроса к источнику"""
+        self.redis.hgetall.return_value = {b'RUB': b'92.1', b'_fetched_at': str(time.time()).encode()}
+        cache = FxRateCache(self.source, ttl=60, refresh_ahead=0.9)
+
+        self.assertEqual(cache.rate('USD', 'RUB'), Decimal('92.1'))
+        self.source.fetch.assert_not_called()
+        with self.assertRaises(RateSourceError):
+            cache.rate('USD', 'EUR')
+
+    def test_refresh_ahead(self):
+        """Тест фонового обновления: читатель получает текущие курсы, обновление идет отдельно"""
+        cache = FxRateCache(self.source, ttl=10, refresh_ahead=0.5)
+        cache._local['USD'] = ({'RUB': Decimal('90')}, time.time() - 6)
+
+        with patch.object(cache, '_refresh_async') as refresh:
+            self.assertEqual(cache.rate('USD', 'RUB'), Decimal('90'))
+        refresh.assert_called_once_with('USD')
+
+        cache._refresh_async('USD').join()
+        self.assertEqual(cache.rate('USD', 'RUB'), Decimal('92.5'))
+        self.redis.set.assert_called_once_with('payout:fx:USD:refresh', 1, nx=True, ex=5)
+
+
+class HttpRateSourceTestCase(TestCase):
+    def test_fetch_from_stub_provider(self):
+        """Тест получения курсов у заглушки провайдера"""
+        server = StubProviderServer(('127.0.0.1', 0), rates={'RUB': '1', 'USD': '92.50', 'EUR': '100.50'})
+        server.start()
+        self.addCleanup(server.stop)
+        source = HttpRateSource(server.url, timeout=2)
+
+        self.assertEqual(source.fetch('EUR'), {'RUB': Decimal('100.5'), 'USD': Decimal('1.08648649')})
+        with self.assertRaises(RateSourceError):
+            source.fetch('GBP')
+        self.assertEqual(server.stats['rate_requests'], 2)
+
+
+class FxConversionServiceTestCase(TestCase):
+    def setUp(self):
+        self.cache = MagicMock()
+        self.cache.rates.side_effect = lambda base: {'USD': Decimal('0.0108'), 'EUR': Decimal('0.00995')}
+
+    def payout(self, amount, currency, funding_currency='RUB'):
+        return Payout.objects.create_payout(
+            amount=Decimal(amount), currency=currency, funding_currency=funding_currency,
+            recipient_details={"card_number": "4444"},
+        )
+
+    def test_lock_batch_with_one_lookup_per_base(self):
+        """Тест фиксации курсов пачки: один запрос курсов на валюту списания"""
+        payouts = [self.payout("100.00", Currency.USD), self.payout("10.00", Currency.EUR),
+                   self.payout("5.00", Currency.RUB)]
+
+        errors = FxConversionService(self.cache).lock(payouts)
+
+        self.assertEqual(errors, {})
+        self.cache.rates.assert_called_once_with('RUB')
+        first, second, same_currency = [Payout.objects.get(id=payout.id) for payout in payouts]
+        self.assertEqual((first.fx_rate, first.funding_amount), (Decimal('0.0108'), Decimal('9259.26')))
+        self.assertEqual(second.funding_amount, Decimal('1005.03'))
+        self.assertEqual(same_currency.funding_currency, '')
+        self.assertIsNone(same_currency.fx_rate)
+
+        self.assertEqual(FxConversionService(self.cache).lock([first]), {})
+        self.cache.rates.assert_called_once()
+
+    def test_missing_rate_fails_payout(self):
+        """Тест, что выплата без курса падает, не доходя до отправки"""
+        self.cache.rates.side_effect = RateSourceError('нет курсов')
+        payout = self.payout("100.00", Currency.USD)
+
+        with patch('api_payouts.redis_client.get_redis_connection') as redis:
+            redis.return_value.get.return_value = None
+            with self.assertRaises(Exception):
+                PayoutProcessingService(str(payout.id), fx=FxConversionService(self.cache)).process()
+
+        payout.refresh_from_db()
+        self.assertEqual(payout.status, Status.FAILED)
+        self.assertIn('Нет курса RUB -> USD', payout.description)
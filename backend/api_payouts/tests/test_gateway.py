@@ -0,0 +1,263 @@
+import json
+import time
+from decimal import Decimal
+from unittest.mock import MagicMock, patch
+
+from django.test import TestCase, override_settings
+
+from api_payouts.models import Payout, PayoutDeadLetter, Currency, Status
+from api_payouts.gateway.base import GatewayError, GatewayDeclined
+from api_payouts.gateway.http_client import HttpGatewayClient
+from api_payouts.gateway.simulated import SimulatedGatewayClient
+from api_payouts.gateway.stub_provider import StubProviderServer
+from api_payouts.celery_services.latency_simulator import LatencySimulator
+from api_payouts.celery_services.submit_batcher import SubmitBatcher
+from api_payouts.celery_services.payout_task_proccessing_service import PayoutProcessingService
+from api_payouts.tasks import payout_task
+
+
+class HttpGatewayClientTestCase(TestCase):
+    def setUp(self):
+        self.payout = Payout.objects.create(
+            amount=Decimal("100.50"),
+            currency=Currency.USD,
+            recipient_details={"card_number": "5555555555554444"},
+        )
+
+    def start_provider(self, **kwargs):
+        server = StubProviderServer(('127.0.0.1', 0), **kwargs)
+        server.start()
+        self.addCleanup(server.stop)
+        return server
+
+    def test_keep_alive_reuses_connection(self):
+        """Тест, что последовательные запросы идут через одно соединение из пула"""
+        server = self.start_provider()
+        client = HttpGatewayClient(server.url, pool_size=2)
+        self.addCleanup(client.close)
+
+        results = [client.submit(self.payout) for _ in range(5)]
+
+        self.assertTrue(all(result['status'] == 'accepted' for result in results))
+        self.assertEqual(results[0]['payout_id'], str(self.payout.id))
+        self.assertEqual(server.stats, {'connections': 1, 'requests': 5})
+        self.assertEqual(client.connections_opened, 1)
+
+    def test_provider_errors(self):
+        """Тест разделения ошибок: 5xx - повторяемая, 4xx - отказ"""
+        client = HttpGatewayClient(self.start_provider(error_rate=1).url)
+        with self.assertRaises(GatewayError) as ctx:
+            client.submit(self.payout)
+        self.assertNotIsInstance(ctx.exception, GatewayDeclined)
+
+        client = HttpGatewayClient(self.start_provider(decline_rate=1).url)
+        with self.assertRaises(GatewayDeclined):
+            client.submit(self.payout)
+
+    def test_read_timeout(self):
+        """Тест таймаута чтения ответа"""
+        server = self.start_provider(latency={'distribution': 'fixed', 'value': 0.5})
+        client = HttpGatewayClient(server.url, read_timeout=0.05)
+
+        with self.assertRaises(GatewayError):
+            client.submit(self.payout)
+
+    def test_submit_batch_single_call(self):
+        """Тест отправки пачки одним запросом с результатами по каждой выплате"""
+        server = self.start_provider()
+        client = HttpGatewayClient(server.url)
+        payloads = [{**client.payload(self.payout), 'payout_id': str(i)} for i in range(50)]
+
+        results = client.submit_batch(payloads)
+
+        self.assertEqual([r['payout_id'] for r in results], [str(i) for i in range(50)])
+        self.assertTrue(all(r['status'] == 'accepted' for r in results))
+        self.assertEqual(server.stats['requests'], 1)
+
+    def test_processing_submits_through_gateway(self):
+        """Тест сквозной обработки выплаты через HTTP-клиент и заглушку"""
+        server = self.start_provider()
+        client = HttpGatewayClient(server.url)
+        self.addCleanup(client.close)
+
+        with patch('api_payouts.redis_client.get_redis_connection') as redis:
+            redis.return_value.get.return_value = None
+            result = PayoutProcessingService(str(self.payout.id), gateway=client).process()
+
+        self.assertTrue(result['success'])
+        self.assertEqual(server.stats['requests'], 1)
+
+    def test_declined_does_not_trip_breaker(self):
+        """Тест, что отказ по выплате не считается сбоем платежной системы"""
+        gateway = MagicMock()
+        gateway.submit.side_effect = GatewayDeclined("declined")
+        breaker = MagicMock()
+        breaker.retry_after.return_value = None
+
+        with patch('api_payouts.redis_client.get_redis_connection') as redis:
+            redis.return_value.get.return_value = None
+            result = PayoutProcessingService(str(self.payout.id), gateway=gateway, breaker=breaker).process()
+
+        self.assertTrue(result['rejected'])
+        breaker.record_failure.assert_not_called()
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.FAILED)
+
+    def test_declined_is_terminal(self):
+        """Тест, что отказ платежной системы не повторяется и не попадает в dead letter"""
+        gateway = MagicMock()
+        gateway.submit.side_effect = GatewayDeclined("closed account")
+
+        with patch('api_payouts.redis_client.get_redis_connection') as redis, patch(
+            'api_payouts.celery_services.payout_task_proccessing_service.get_gateway_client', return_value=gateway
+        ), patch.object(payout_task, 'update_state'), patch.object(payout_task, 'retry') as mock_retry:
+            redis.return_value.get.return_value = None
+            redis.return_value.hmget.return_value = [None, None]
+            payout_task.push_request(id='task-1', retries=0)
+            try:
+                result = payout_task.run(str(self.payout.id))
+            finally:
+                payout_task.pop_request()
+
+        self.assertEqual(result['status'], 'failed')
+        gateway.submit.assert_called_once()
+        mock_retry.assert_not_called()
+        self.assertFalse(PayoutDeadLetter.objects.exists())
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.FAILED)
+        self.assertIn("closed account", self.payout.description)
+
+
+class SubmitBatcherTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.addCleanup(redis_patcher.stop)
+
+        self.payouts = [
+            Payout.objects.create(
+                amount=Decimal("10.00"), currency=Currency.RUB, recipient_details={"card_number": "4444"},
+                status=Status.PROCESSING
+            )
+            for _ in range(3)
+        ]
+        self.items = [
+            json.dumps({**SimulatedGatewayClient.payload(payout), 'queued_at': time.time()}).encode()
+            for payout in self.payouts
+        ]
+        # Скрипт забора пачки (и освобождения аренд): возвращает забранные элементы
+        self.script = self.redis.register_script.return_value
+        self.script.return_value = self.items
+        self.breaker = MagicMock()
+        self.breaker.retry_after.return_value = None
+
+    def batcher(self, gateway, **kwargs):
+        return SubmitBatcher(gateway=gateway, breaker=self.breaker, batch_size=3, provider='stub', **kwargs)
+
+    def test_add_flushes_full_batch(self):
+        """Тест отправки пачки воркером, добавившим последнюю выплату"""
+        gateway = SimulatedGatewayClient(latency=LatencySimulator(enabled=False))
+        self.redis.rpush.return_value = 3
+
+        batcher = self.batcher(gateway)
+        self.assertTrue(batcher.add(self.payouts[-1]))
+
+        self.redis.set.assert_called_once_with(
+            f'payout:lease:{self.payouts[-1].id}', SubmitBatcher.LEASE_TOKEN, px=600000
+        )
+        pop = self.script.call_args_list[0].kwargs
+        self.assertEqual(pop['keys'], ['payout:submit:stub:RUB'])
+        self.assertEqual(pop['args'][:2], [0, 3])
+        self.assertEqual(Payout.objects.filter(status=Status.COMPLETED).count(), 3)
+        self.assertEqual(batcher.finished, {str(payout.id) for payout in self.payouts})
+        # Аренды пачки освобождаются после раскладки результатов
+        release = self.script.call_args_list[-1].kwargs
+        self.assertEqual(release['keys'], [f'payout:lease:{payout.id}' for payout in self.payouts])
+        self.assertEqual(release['args'], [SubmitBatcher.LEASE_TOKEN])
+        self.breaker.record_success.assert_called_once_with(probe=self.breaker.allow.return_value)
+
+    def test_results_fanned_out(self):
+        """Тест раскладки результатов: принятые завершаются, отклоненные - в failed"""
+        gateway = MagicMock()
+        gateway.submit_batch.return_value = [
+            {'payout_id': str(self.payouts[0].id), 'status': 'accepted', 'reference': 'r1'},
+            {'payout_id': str(self.payouts[1].id), 'status': 'declined', 'error': 'closed account'},
+        ]
+
+        self.assertEqual(self.batcher(gateway).flush('RUB'), 3)
+
+        statuses = {p.id: p for p in Payout.objects.all()}
+        self.assertEqual(statuses[self.payouts[0].id].status, Status.COMPLETED)
+        self.assertEqual(statuses[self.payouts[1].id].status, Status.FAILED)
+        self.assertIn('closed account', statuses[self.payouts[1].id].description)
+        # Выплата без результата не остается в processing
+        self.assertEqual(statuses[self.payouts[2].id].status, Status.FAILED)
+        sent = gateway.submit_batch.call_args.args[0]
+        self.assertNotIn('queued_at', sent[0])
+
+    def test_provider_error_requeues_batch(self):
+        """Тест возврата пачки в начало очереди при сбое платежной системы"""
+        gateway = MagicMock()
+        gateway.submit_batch.side_effect = GatewayError("timeout")
+
+        self.assertEqual(self.batcher(gateway).flush('RUB'), 0)
+
+        self.redis.lpush.assert_called_once_with('payout:submit:stub:RUB', *reversed(self.items))
+        self.breaker.record_failure.assert_called_once_with(probe=self.breaker.allow.return_value)
+        self.assertEqual(Payout.objects.filter(status=Status.PROCESSING).count(), 3)
+
+    def test_young_partial_batch_waits(self):
+        """Тест, что неполная пачка ждет до max_age"""
+        self.script.return_value = []
+        gateway = MagicMock()
+
+        self.assertEqual(self.batcher(gateway, max_age=60).flush('RUB'), 0)
+        self.assertEqual(self.script.call_args.kwargs['args'][3], 60)
+        gateway.submit_batch.assert_not_called()
+
+    def test_finished_payouts_dropped_from_batch(self):
+        """Тест, что выплата, завершенная помимо пачки, повторно не отправляется"""
+        Payout.objects.filter(id=self.payouts[0].id).update(status=Status.COMPLETED)
+        gateway = MagicMock()
+        gateway.submit_batch.side_effect = lambda payloads: [
+            {'payout_id': payload['payout_id'], 'status': 'accepted', 'reference': 'r'} for payload in payloads
+        ]
+
+        self.assertEqual(self.batcher(gateway).flush('RUB'), 2)
+
+        sent = [payload['payout_id'] for payload in gateway.submit_batch.call_args.args[0]]
+        self.assertEqual(sent, [str(payout.id) for payout in self.payouts[1:]])
+
+    @override_settings(PAYOUT_SUBMIT_BATCHING=True)
+    def test_processing_hands_payout_to_batch(self):
+        """Тест, что при пакетной отправке задача оставляет выплату пачке"""
+        payout = Payout.objects.create(
+            amount=Decimal("10.00"), currency=Currency.RUB, recipient_details={"card_number": "4444"}
+        )
+        self.redis.get.return_value = None
+        batcher = MagicMock()
+        batcher.add.return_value = True
+
+        result = PayoutProcessingService(str(payout.id), batcher=batcher, breaker=self.breaker).process()
+
+        self.assertTrue(result['batched'])
+        payout.refresh_from_db()
+        self.assertEqual(payout.status, Status.PROCESSING)
+        saved = [c.args[1] for c in self.redis.set.call_args_list if c.args[0].startswith('payout:checkpoint:')]
+        self.assertNotIn('submit', saved[-1])
+
+    @override_settings(PAYOUT_SUBMIT_BATCHING=True)
+    def test_inline_flush_leaves_no_checkpoint(self):
+        """Тест, что после отправки пачки из add контрольная точка завершенной выплаты не пишется снова"""
+        payout = Payout.objects.create(
+            amount=Decimal("10.00"), currency=Currency.RUB, recipient_details={"card_number": "4444"}
+        )
+        self.redis.get.return_value = None
+        batcher = MagicMock(finished=set())
+        batcher.add.side_effect = lambda added: batcher.finished.add(str(added.id)) or True
+
+        PayoutProcessingService(str(payout.id), batcher=batcher, breaker=self.breaker).process()
+
+        saved = [c.args[1] for c in self.redis.set.call_args_list if c.args[0].startswith('payout:checkpoint:')]
+        # Только этапы до отправки: после _apply контрольная точка не восстанавливается
+        self.assertEqual(len(saved), len(PayoutProcessingService.STAGES) - 1)
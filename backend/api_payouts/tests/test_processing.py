@@ -0,0 +1,808 @@
+import asyncio
+import signal
+import time
+import uuid
+from datetime import timedelta
+from decimal import Decimal
+from types import SimpleNamespace
+from unittest.mock import MagicMock, patch
+
+from asgiref.sync import async_to_sync
+from celery import states
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from redis.exceptions import ConnectionError as RedisConnectionError
+
+from api_payouts.models import Payout, PayoutDeadLetter, Currency, Status
+from api_payouts.tasks import payout_task, compact_result, release_tenant_slot
+from api_payouts.async_worker import AsyncPayoutWorker
+from api_payouts.worker_supervisor import ScalingPolicy, WorkerSupervisor
+from api_payouts.celery_services.async_processing_service import AsyncPayoutProcessingService
+from api_payouts.celery_services.payout_task_proccessing_service import (
+    PayoutProcessingService,
+    ProcessingInProgress,
+)
+from api_payouts.celery_services.payout_lease import PayoutLease
+from api_payouts.celery_services.circuit_breaker import CircuitBreaker, CircuitOpen
+from api_payouts.celery_services.progress_reporter import ProgressReporter
+from api_payouts.celery_services.result_pruner import TaskResultPruner
+from api_payouts.celery_services.latency_simulator import LatencySimulator
+from api_payouts.celery_services.stage_executor import StageGraphExecutor
+from api_payouts.celery_services.velocity_limiter import VelocityLimiter, VelocityLimitExceeded
+
+
+class PayoutProcessingServiceTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.redis.get.return_value = None
+        self.addCleanup(redis_patcher.stop)
+
+        self.card_data = {
+            "card_number": "5555555555554444",
+            "card_holder": "Ivanov Ivan",
+            "expiry_date": "12/25"
+        }
+
+        self.payout = Payout.objects.create(
+            amount=Decimal("100.50"),
+            currency=Currency.USD,
+            description="Test payout",
+            recipient_details=self.card_data,
+            status=Status.PENDING
+        )
+
+    def test_process_success_two_statements(self):
+        """Тест успешной обработки: захват и завершение - два запроса"""
+        service = PayoutProcessingService(str(self.payout.id))
+
+        with self.assertNumQueries(2):
+            result = service.process()
+
+        self.payout.refresh_from_db()
+        self.assertTrue(result['success'])
+        self.assertEqual(self.payout.status, Status.COMPLETED)
+        self.assertEqual(result['completed_at'], self.payout.updated_at.isoformat())
+
+    def test_claim_failed_payout(self):
+        """Тест повторной обработки выплаты в статусе failed"""
+        Payout.objects.filter(id=self.payout.id).update(status=Status.FAILED)
+
+        claimed = Payout.objects.claim_for_processing(str(self.payout.id))
+
+        self.assertEqual(claimed.id, self.payout.id)
+        self.assertEqual(claimed.status, Status.PROCESSING)
+        self.assertEqual(claimed.amount, Decimal("100.50"))
+
+    def test_claim_is_exclusive(self):
+        """Тест, что выплату может захватить только один обработчик"""
+        first = Payout.objects.claim_for_processing(str(self.payout.id))
+        second = Payout.objects.claim_for_processing(str(self.payout.id))
+
+        self.assertIsNotNone(first)
+        self.assertIsNone(second)
+
+    def test_process_already_processing(self):
+        """Тест, что выплата в обработке не обрабатывается повторно"""
+        Payout.objects.filter(id=self.payout.id).update(status=Status.PROCESSING)
+
+        with self.assertRaises(ProcessingInProgress):
+            PayoutProcessingService(str(self.payout.id)).process()
+
+    def test_process_lease_held_by_other_worker(self):
+        """Тест, что при занятой аренде воркер отступает без запросов к БД"""
+        self.redis.set.return_value = None
+
+        with self.assertNumQueries(0):
+            with self.assertRaises(ProcessingInProgress):
+                PayoutProcessingService(str(self.payout.id)).process()
+
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.PENDING)
+
+    def test_process_resumes_from_checkpoint(self):
+        """Тест продолжения обработки со следующего после контрольной точки этапа"""
+        self.redis.get.return_value = b'balance,check,reserve'
+        service = PayoutProcessingService(str(self.payout.id))
+
+        result = service.process()
+
+        self.assertTrue(result['success'])
+        saved = [c.args[1] for c in self.redis.set.call_args_list if c.args[0].startswith('payout:checkpoint:')]
+        self.assertEqual(saved, ['balance,check,prepare,reserve', 'balance,check,prepare,reserve,submit'])
+        self.redis.delete.assert_called_once_with(f'payout:checkpoint:{self.payout.id}')
+
+    def test_redelivered_task_reclaims_stale_processing(self):
+        """Тест перехвата выплаты, чей воркер упал в статусе processing"""
+        stale = timezone.now() - timedelta(hours=1)
+        Payout.objects.filter(id=self.payout.id).update(status=Status.PROCESSING, updated_at=stale)
+
+        result = PayoutProcessingService(str(self.payout.id)).process()
+
+        self.assertTrue(result['success'])
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.COMPLETED)
+
+    def test_process_already_completed(self):
+        """Тест идемпотентности для завершенной выплаты"""
+        Payout.objects.filter(id=self.payout.id).update(status=Status.COMPLETED)
+
+        result = PayoutProcessingService(str(self.payout.id)).process()
+
+        self.assertTrue(result['success'])
+        self.assertTrue(result['already_completed'])
+
+    def test_process_not_found(self):
+        """Тест обработки несуществующей выплаты"""
+        result = PayoutProcessingService(str(uuid.uuid4())).process()
+
+        self.assertFalse(result['success'])
+
+    def test_complete_guarded(self):
+        """Тест, что завершение не перезаписывает отмененную выплату"""
+        Payout.objects.claim_for_processing(str(self.payout.id))
+        Payout.objects.filter(id=self.payout.id).update(status=Status.CANCELLED)
+
+        self.assertIsNone(Payout.objects.complete_processing(str(self.payout.id)))
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.CANCELLED)
+
+    def test_fail_processing_appends_error(self):
+        """Тест перевода захваченной выплаты в failed с текстом ошибки"""
+        Payout.objects.claim_for_processing(str(self.payout.id))
+
+        self.assertTrue(Payout.objects.fail_processing(str(self.payout.id), error_message="boom"))
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.FAILED)
+        self.assertIn("boom", self.payout.description)
+
+    def test_open_breaker_defers_without_claim(self):
+        """Тест, что при разомкнутом предохранителе выплата откладывается без захвата"""
+        breaker = MagicMock(name='breaker')
+        breaker.name = 'provider'
+        breaker.retry_after.return_value = 30
+
+        result = PayoutProcessingService(str(self.payout.id), breaker=breaker).process()
+
+        self.assertTrue(result['deferred'])
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.PENDING)
+        self.assertGreater(self.payout.execute_at, timezone.now() + timedelta(seconds=20))
+        self.redis.set.assert_not_called()
+
+    def test_breaker_opened_before_submit_keeps_checkpoint(self):
+        """Тест отложенной отправки: выплата возвращается в pending, контрольная точка сохраняется"""
+        breaker = MagicMock()
+        breaker.retry_after.return_value = None
+        breaker.allow.side_effect = CircuitOpen('provider', 10)
+
+        result = PayoutProcessingService(str(self.payout.id), breaker=breaker).process()
+
+        self.assertTrue(result['deferred'])
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.PENDING)
+        self.assertIsNotNone(self.payout.execute_at)
+        self.redis.delete.assert_not_called()
+        breaker.record_success.assert_not_called()
+
+    def test_submit_failure_recorded_by_breaker(self):
+        """Тест, что ошибка отправки учитывается предохранителем и роняет выплату"""
+        breaker = MagicMock()
+        breaker.retry_after.return_value = None
+        latency = MagicMock()
+        latency.wait.side_effect = lambda stage: stage['key'] == 'submit' and 1 / 0
+
+        with self.assertRaises(ZeroDivisionError):
+            PayoutProcessingService(str(self.payout.id), breaker=breaker, latency=latency).process()
+
+        breaker.record_failure.assert_called_once_with(probe=breaker.allow.return_value)
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.FAILED)
+
+    def test_velocity_limit_rejects_without_retry(self):
+        """Тест, что превышение лимита частоты переводит выплату в failed без повторных попыток"""
+        velocity = MagicMock()
+        velocity.enabled_for.return_value = True
+        velocity.check.side_effect = VelocityLimitExceeded('Превышен лимит количества выплат по карте за час: 10')
+
+        result = PayoutProcessingService(str(self.payout.id), velocity=velocity).process()
+
+        self.assertTrue(result['rejected'])
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.FAILED)
+        self.assertIn('по карте за час', self.payout.description)
+
+
+class AsyncPayoutWorkerTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.redis.get.return_value = None
+        self.addCleanup(redis_patcher.stop)
+        self.payouts = [
+            Payout.objects.create(amount=Decimal("100.50"), currency=Currency.USD,
+                                  recipient_details={"card_number": "5555555555554444"})
+            for _ in range(10)
+        ]
+
+    def test_pipelines_share_event_loop(self):
+        """Тест, что ожидания этапов разных выплат идут одновременно в одном цикле"""
+        latency = LatencySimulator(config={'default': {'distribution': 'fixed', 'value': 0.1}}, enabled=True)
+
+        async def run_all():
+            return await asyncio.gather(*(
+                AsyncPayoutProcessingService(str(payout.id), latency=latency).aprocess() for payout in self.payouts
+            ))
+
+        started = time.monotonic()
+        results = async_to_sync(run_all)()
+
+        self.assertLess(time.monotonic() - started, 2)
+        self.assertTrue(all(result['success'] for result in results))
+        self.assertEqual(Payout.objects.filter(status=Status.COMPLETED).count(), 10)
+
+    def test_execute_retries_then_dead_letters(self):
+        """Тест повторов с историей попыток и записи в dead letter, как у payout_task"""
+        service = MagicMock()
+        service.aprocess.side_effect = RuntimeError('gateway down')
+        worker = AsyncPayoutWorker(queues=['payouts.default'], service_factory=lambda payout_id: service)
+        payout_id = str(self.payouts[0].id)
+
+        with patch.object(payout_task, 'apply_async') as apply_async:
+            self.assertIsNone(async_to_sync(worker.execute)(
+                payout_id, kwargs={'tenant': 'shop-1'}, retries=0, queue='payouts.default'
+            ))
+        self.assertEqual(apply_async.call_args.kwargs['retries'], 1)
+        self.assertEqual(apply_async.call_args.kwargs['queue'], 'payouts.default')
+        self.assertEqual(apply_async.call_args.kwargs['kwargs']['attempts'][0]['error'], 'gateway down')
+        self.assertEqual(apply_async.call_args.kwargs['kwargs']['tenant'], 'shop-1')
+
+        async_to_sync(worker.execute)(payout_id, task_id='task-1', retries=payout_task.max_retries)
+        self.assertEqual(PayoutDeadLetter.objects.get(payout_id=payout_id).task_id, 'task-1')
+
+    def test_retry_countdown_backs_off(self):
+        """Тест паузы перед повтором: экспонента retry_backoff с ограничением retry_backoff_max"""
+        with patch('random.randrange', side_effect=lambda stop: stop - 1):
+            self.assertEqual([AsyncPayoutWorker._backoff(retries) for retries in (0, 1, 2, 20)], [1, 2, 4, 600])
+
+    def test_message_held_until_eta(self):
+        """Тест, что повтор с eta не обрабатывается раньше срока и не занимает окно prefetch"""
+        consumer = MagicMock()
+        eta = (timezone.now() + timedelta(seconds=0.3)).isoformat()
+        message = SimpleNamespace(headers={'task': payout_task.name, 'id': 'task-1', 'eta': eta})
+        due = SimpleNamespace(headers={'task': payout_task.name, 'id': 'task-2', 'eta': timezone.now().isoformat()})
+
+        async def hold():
+            inbox = asyncio.Queue()
+            self.assertFalse(AsyncPayoutWorker._hold_until_due(due, inbox, consumer))
+            started = time.monotonic()
+            self.assertTrue(AsyncPayoutWorker._hold_until_due(message, inbox, consumer))
+            await asyncio.sleep(0.1)
+            self.assertTrue(inbox.empty())
+            self.assertIs(await asyncio.wait_for(inbox.get(), timeout=2), message)
+            return time.monotonic() - started
+
+        self.assertGreaterEqual(async_to_sync(hold)(), 0.25)
+        self.assertEqual([call.args for call in consumer.hold.call_args_list], [(1,), (-1,)])
+
+    def test_consume_acks_without_storing_result(self):
+        """Тест разбора сообщения Celery: итог в строке выплаты, а не в backend; подтверждение через поток брокера"""
+        app = MagicMock()
+        app.conf.task_default_queue = 'celery'
+        worker = AsyncPayoutWorker(queues=['payouts.default'], app=app)
+        payout_id = str(self.payouts[0].id)
+        message = SimpleNamespace(
+            headers={'task': payout_task.name, 'id': 'task-1', 'retries': 0},
+            delivery_info={'routing_key': 'payouts.default'},
+            decode=lambda: [[payout_id], {}, {}],
+        )
+        consumer = MagicMock()
+
+        async_to_sync(worker._consume)(message, consumer)
+
+        consumer.ack.assert_called_once_with(message)
+        app.backend.store_result.assert_not_called()
+        self.assertEqual(Payout.objects.get(id=payout_id).status, Status.COMPLETED)
+        with self.assertRaises(ValueError):
+            AsyncPayoutWorker(queues=['celery', 'payouts.default'], app=app)
+
+    def test_forward_republishes_original_message(self):
+        """Тест пересылки чужой задачи: тело и заголовки (колбэки, chord) не меняются"""
+        app = MagicMock()
+        app.conf.task_default_queue = 'celery'
+        worker = AsyncPayoutWorker(queues=['payouts.default'], app=app)
+        headers = {'task': 'api_payouts.tasks.payout_part_task', 'id': 'task-2', 'retries': 1}
+        message = SimpleNamespace(
+            headers=headers, body=b'[["part-1"], {}, {"callbacks": null, "chord": {"task": "finalize"}}]',
+            content_type='application/json', content_encoding='utf-8',
+            properties={'correlation_id': 'task-2', 'delivery_tag': 'x'},
+        )
+        consumer = MagicMock()
+
+        async_to_sync(worker._consume)(message, consumer)
+
+        producer = app.producer_or_acquire.return_value.__enter__.return_value
+        publish = producer.publish.call_args
+        self.assertEqual(publish.args[0], message.body)
+        self.assertEqual(publish.kwargs['headers'], headers)
+        self.assertEqual(publish.kwargs['correlation_id'], 'task-2')
+        self.assertNotIn('delivery_tag', publish.kwargs)
+        app.send_task.assert_not_called()
+        consumer.ack.assert_called_once_with(message)
+
+
+class TaskResultsTestCase(TestCase):
+    def test_payout_outcome_stored_on_row(self):
+        """Тест, что итог выплаты хранится в строке, а в result backend - только сжатый результат частей"""
+        payout = Payout.objects.create(amount=Decimal('100.00'), currency=Currency.RUB,
+                                       recipient_details={'card_number': '5555555555554444'})
+
+        result = PayoutProcessingService(str(payout.id)).process()
+
+        payout.refresh_from_db()
+        self.assertTrue(payout_task.ignore_result)
+        self.assertEqual(payout.status, Status.COMPLETED)
+        self.assertTrue(payout.provider_reference)
+        self.assertEqual(compact_result(result), {'payout_id': str(payout.id), 'success': True})
+
+    @patch('api_payouts.celery_services.result_pruner.current_app')
+    def test_pruner_deletes_keys_without_ttl(self, app):
+        """Тест, что удаляются только ключи без срока жизни, и считается освобожденная память"""
+        app.backend.task_keyprefix = b'celery-task-meta-'
+        client = MagicMock()
+        client.get.return_value = None
+        client.scan.side_effect = [(7, [b'celery-task-meta-1', b'celery-task-meta-2']), (0, [b'celery-task-meta-3'])]
+        # TTL и MEMORY USAGE попарно: без срока, с остатком часа, без срока
+        client.pipeline.return_value.execute.side_effect = [[-1, 500, 3600, 300], [-1, 200]]
+
+        totals = TaskResultPruner(client=client, batch_size=2).prune()
+
+        self.assertEqual(totals, {'scanned': 3, 'deleted': 2, 'freed_bytes': 700})
+        client.delete.assert_any_call(b'celery-task-meta-1')
+        client.delete.assert_any_call(b'celery-task-meta-3')
+        self.assertEqual(client.scan.call_args.kwargs['match'], 'celery-task-meta-*')
+        # Обход завершен: курсор сброшен
+        client.delete.assert_any_call(TaskResultPruner.CURSOR_KEY)
+
+    @patch('api_payouts.celery_services.result_pruner.current_app')
+    def test_pruner_resumes_scan_from_saved_cursor(self, app):
+        """Тест, что запуск, остановленный на max_keys, сохраняет курсор SCAN, а следующий продолжает с него"""
+        app.backend.task_keyprefix = b'celery-task-meta-'
+        client = MagicMock()
+        client.get.return_value = None
+        client.scan.side_effect = [(7, [b'celery-task-meta-1', b'celery-task-meta-2']), (0, [b'celery-task-meta-3'])]
+        client.pipeline.return_value.execute.return_value = [3600, 100] * 2
+
+        self.assertEqual(TaskResultPruner(client=client, batch_size=2, max_keys=2).prune()['scanned'], 2)
+        client.set.assert_called_once_with(TaskResultPruner.CURSOR_KEY, 7)
+
+        client.get.return_value = b'7'
+        self.assertEqual(TaskResultPruner(client=client, batch_size=2, max_keys=2).prune()['scanned'], 1)
+        self.assertEqual(client.scan.call_args.args, (7,))
+        client.delete.assert_called_once_with(TaskResultPruner.CURSOR_KEY)
+
+
+class FakeWorkerProcess:
+    """Процесс воркера для тестов супервизора"""
+
+    def __init__(self, command):
+        self.command = command
+        self.pid = id(self)
+        self.returncode = None
+        self.signals = []
+
+    def poll(self):
+        return self.returncode
+
+    def send_signal(self, sig):
+        self.signals.append(sig)
+
+    def kill(self):
+        self.returncode = -9
+
+    def wait(self, timeout=None):
+        return self.returncode
+
+
+@override_settings(PAYOUT_SUPERVISOR_POOLS={
+    'default': {'queues': ['payouts.default'], 'pool': 'threads', 'concurrency': 8,
+                'min_workers': 1, 'max_workers': 3, 'target_depth': 10, 'scale_down_after': 30},
+})
+class WorkerSupervisorTestCase(TestCase):
+    def setUp(self):
+        self.spawned = []
+        self.supervisor = WorkerSupervisor(drain_timeout=60, app=MagicMock(), spawn=self._spawn)
+        self.pool = self.supervisor.pools[0]
+        self.depth = 0
+        patcher = patch.object(WorkerSupervisor, '_depths', lambda supervisor: {'payouts.default': self.depth})
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        patcher = patch.object(type(self.pool), 'latency_ms', lambda pool: None)
+        patcher.start()
+        self.addCleanup(patcher.stop)
+
+    def _spawn(self, command):
+        process = FakeWorkerProcess(command)
+        self.spawned.append(process)
+        return process
+
+    def test_policy_scales_by_depth_and_latency(self):
+        """Тест политики: рост по глубине и задержке шагами, уменьшение после паузы"""
+        policy = ScalingPolicy(min_workers=1, max_workers=5, target_depth=10, max_latency_ms=1000, step=2,
+                               scale_down_after=30)
+
+        self.assertEqual(policy.desired(1, 100, None, now=0), 3)
+        self.assertEqual(policy.desired(1, 0, 2500, now=0), 3)
+        self.assertEqual(policy.desired(3, None, None, now=0), 3)
+        self.assertEqual(policy.desired(4, 0, None, now=0), 4)
+        self.assertEqual(policy.desired(4, 0, None, now=29), 4)
+        self.assertEqual(policy.desired(4, 0, None, now=30), 2)
+        with self.assertRaises(ValueError):
+            ScalingPolicy(min_workers=3, max_workers=2)
+
+    def test_scales_up_and_drains_newest(self):
+        """Тест масштабирования пула: запуск воркеров по глубине, теплая остановка самого нового"""
+        self.supervisor.tick(now=0)
+        self.assertEqual(len(self.spawned), 1)
+        self.assertIn('--pool=threads', self.spawned[0].command)
+        self.assertIn('default-0@%h', self.spawned[0].command)
+
+        self.depth = 25
+        self.supervisor.tick(now=1)
+        status = self.supervisor.tick(now=2)
+        self.assertEqual(status['default']['workers'], 3)
+
+        self.depth = 0
+        self.supervisor.tick(now=3)
+        status = self.supervisor.tick(now=40)
+        self.assertEqual((status['default']['workers'], status['default']['draining']), (2, 1))
+        self.assertEqual(self.spawned[2].signals, [signal.SIGTERM])
+
+        self.spawned[2].returncode = 0
+        status = self.supervisor.tick(now=41)
+        self.assertEqual(status['default']['draining'], 0)
+
+    def test_restarts_crashed_worker_with_backoff(self):
+        """Тест перезапуска упавшего воркера: сразу после старта - с нарастающей паузой"""
+        self.supervisor.tick(now=0)
+        self.spawned[0].returncode = 1
+
+        self.supervisor.tick(now=1)
+        self.assertEqual(len(self.spawned), 1)
+        self.supervisor.tick(now=2)
+        self.assertEqual(len(self.spawned), 2)
+        self.assertIn('default-0@%h', self.spawned[1].command)
+
+        self.spawned[1].returncode = 1
+        self.supervisor.tick(now=3)
+        self.supervisor.tick(now=4)
+        self.assertEqual(len(self.spawned), 2)
+        self.supervisor.tick(now=5)
+        self.assertEqual(len(self.spawned), 3)
+
+    def test_drain_timeout_kills_worker(self):
+        """Тест, что воркер, не остановившийся за drain_timeout, завершается принудительно"""
+        self.supervisor.tick(now=0)
+        worker = self.pool.workers[0]
+        self.supervisor._drain(self.pool, worker, now=0)
+
+        self.supervisor._reap(self.pool, now=61)
+
+        self.assertEqual(worker.exit_code(), -9)
+        self.assertEqual(self.pool.workers, [])
+
+
+class ProgressReporterTestCase(TestCase):
+    def setUp(self):
+        self.task = MagicMock()
+        self.task.request = SimpleNamespace(delivery_info={'routing_key': 'celery'})
+
+    def test_coalesces_small_changes(self):
+        """Тест, что мелкие изменения прогресса не пишутся в backend"""
+        reporter = ProgressReporter(self.task, min_interval=60, min_delta=0.5)
+
+        sent = [reporter.report(step, 6, 'stage') for step in range(1, 6)]
+
+        self.assertEqual(sent.count(True), 1)
+        self.assertEqual(self.task.update_state.call_count, 1)
+
+    def test_always_writes_completion(self):
+        """Тест, что последний шаг пишется, даже если изменение несущественно"""
+        reporter = ProgressReporter(self.task, min_interval=60, min_delta=0.5)
+
+        sent = [reporter.report(step, 7, 'stage') for step in range(1, 8)]
+
+        self.assertEqual(sent, [False, False, False, True, False, False, True])
+        self.assertEqual(self.task.update_state.call_args.kwargs['meta']['current'], 7)
+
+    def test_force_and_interval(self):
+        """Тест принудительной записи и записи по интервалу"""
+        reporter = ProgressReporter(self.task, min_interval=0, min_delta=1)
+
+        self.assertTrue(reporter.report(1, 7, 'stage'))
+        self.assertTrue(reporter.report(1, 7, 'stage', force=True))
+        self.assertEqual(reporter.writes, 2)
+
+    @override_settings(PAYOUT_PROGRESS_DISABLED_QUEUES=['celery'])
+    def test_disabled_for_queue(self):
+        """Тест отключения отчетов для очереди"""
+        reporter = ProgressReporter(self.task, min_interval=0, min_delta=0)
+
+        self.assertFalse(reporter.report(7, 7, 'completion', force=True))
+        self.task.update_state.assert_not_called()
+
+
+class PayoutLeaseTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.addCleanup(redis_patcher.stop)
+
+    def test_acquire_sets_key_with_ttl(self):
+        """Тест взятия аренды через SET NX PX"""
+        lease = PayoutLease('payout-1', ttl=30)
+
+        self.assertTrue(lease.acquire())
+        lease.release()
+
+        self.redis.set.assert_called_once_with(
+            'payout:lease:payout-1', lease.token, nx=True, px=30000
+        )
+        release_script = self.redis.register_script.return_value
+        release_script.assert_called_with(keys=['payout:lease:payout-1'], args=[lease.token])
+
+    def test_acquire_busy(self):
+        """Тест, что занятая аренда не берется и не освобождается чужим воркером"""
+        self.redis.set.return_value = None
+        lease = PayoutLease('payout-1')
+
+        self.assertFalse(lease.acquire())
+        lease.release()
+
+        self.redis.register_script.assert_not_called()
+
+
+class CircuitBreakerTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.addCleanup(redis_patcher.stop)
+        self.script = self.redis.register_script.return_value
+
+    def test_allow_closed(self):
+        """Тест пропуска вызова при замкнутом предохранителе"""
+        self.script.return_value = [b'closed', b'0']
+
+        self.assertIsNone(CircuitBreaker('provider').allow())
+
+    def test_probe_outcome_carries_token(self):
+        """Тест, что исход пробного вызова передается с токеном пробы, а обычного - без него"""
+        breaker = CircuitBreaker('provider')
+        self.script.return_value = [b'probe', b'0']
+
+        probe = breaker.allow()
+
+        self.assertEqual(self.script.call_args.kwargs['args'][3], probe)
+        self.script.return_value = b'closed'
+        breaker.record_success(probe=probe)
+        self.assertEqual(self.script.call_args.kwargs['args'], [probe])
+        breaker.record_failure()
+        self.assertEqual(self.script.call_args.kwargs['args'][3], '')
+
+    def test_allow_open_short_circuits(self):
+        """Тест отказа без вызова при разомкнутом предохранителе"""
+        self.script.return_value = [b'open', b'12.5']
+
+        with self.assertRaises(CircuitOpen) as ctx:
+            CircuitBreaker('provider').allow()
+
+        self.assertEqual(ctx.exception.retry_after, 12.5)
+        self.redis.pipeline.return_value.hincrby.assert_any_call(
+            'payout:metrics:breaker:provider', 'short_circuited', 1
+        )
+
+    def test_retry_after_reads_state(self):
+        """Тест предварительной проверки: время до пробного вызова"""
+        breaker = CircuitBreaker('provider')
+        self.redis.hmget.return_value = [b'open', str(timezone.now().timestamp() - 5).encode()]
+        self.assertAlmostEqual(breaker.retry_after(), breaker.cooldown - 5, delta=1)
+
+        self.redis.hmget.return_value = [b'half_open', None]
+        self.assertIsNone(breaker.retry_after())
+
+    def test_failure_opens_and_counts(self):
+        """Тест учета ошибки, разомкнувшей предохранитель"""
+        self.script.return_value = b'open'
+
+        CircuitBreaker('provider').record_failure()
+
+        keys = self.script.call_args.kwargs['keys']
+        self.assertEqual(keys, ['payout:breaker:provider', 'payout:breaker:provider:probe',
+                                'payout:breaker:provider:failures'])
+        self.redis.pipeline.return_value.hincrby.assert_any_call('payout:metrics:breaker:provider', 'opened', 1)
+
+    def test_redis_unavailable_fails_open(self):
+        """Тест, что недоступность Redis не блокирует отправку"""
+        self.redis.register_script.side_effect = RedisConnectionError()
+        self.redis.hmget.side_effect = RedisConnectionError()
+        breaker = CircuitBreaker('provider')
+
+        self.assertIsNone(breaker.retry_after())
+        self.assertIsNone(breaker.allow())
+        breaker.record_failure()
+
+
+class VelocityLimiterTestCase(TestCase):
+    LIMITS = {'RUB': {
+        'card': {'hour': {'count': 10, 'amount': 300_000}, 'day': {'count': 30}},
+        'merchant': {'day': {'amount': 5_000_000}},
+    }}
+
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.addCleanup(redis_patcher.stop)
+        self.script = self.redis.register_script.return_value
+        self.payout = Payout(
+            id=uuid.uuid4(), amount=Decimal('1500.25'), currency=Currency.RUB, merchant_id='shop-1',
+            recipient_details={'card_number': '5555555555554444', 'card_holder': 'Ivanov Ivan'},
+        )
+
+    def test_check_passes_all_windows_in_one_call(self):
+        """Тест, что все лимиты выплаты проверяются одним вызовом скрипта"""
+        self.script.return_value = [0, b'']
+
+        VelocityLimiter(self.LIMITS).check(self.payout)
+
+        self.script.assert_called_once()
+        keys = self.script.call_args.kwargs['keys']
+        args = self.script.call_args.kwargs['args']
+        self.assertEqual(len(keys), 6)
+        self.assertTrue(keys[0].startswith('payout:velocity:card:'))
+        self.assertNotIn('5555555555554444', keys[0])
+        self.assertTrue(keys[4].startswith('payout:velocity:merchant:shop-1:day:'))
+        self.assertEqual(args[1:], [150025, 3600, 10, 30000000, 86400, 30, -1, 86400, -1, 500000000])
+
+    def test_violation_raises(self):
+        """Тест отказа при превышении лимита и учета отказа в метриках"""
+        self.script.return_value = [3, b'amount']
+
+        with self.assertRaises(VelocityLimitExceeded) as ctx:
+            VelocityLimiter(self.LIMITS).check(self.payout)
+
+        self.assertIn('суммы выплат по мерчанту за сутки', str(ctx.exception))
+        self.redis.pipeline.return_value.hincrby.assert_any_call(
+            'payout:metrics:velocity', 'rejected:merchant:day:amount', 1
+        )
+
+    def test_disabled_and_redis_unavailable(self):
+        """Тест, что без лимитов валюты и при недоступном Redis выплата пропускается"""
+        limiter = VelocityLimiter(self.LIMITS)
+        self.assertFalse(limiter.enabled_for(Currency.USD))
+
+        self.redis.register_script.side_effect = RedisConnectionError()
+        limiter.check(self.payout)
+
+
+class PayoutTaskDeadLetterTestCase(TestCase):
+    def setUp(self):
+        self.payout = Payout.objects.create(
+            amount=Decimal("100.50"),
+            currency=Currency.USD,
+            recipient_details={"card_number": "5555555555554444"},
+            status=Status.FAILED
+        )
+
+    def _run_task(self, retries, attempts=None, tenant=None):
+        payout_task.push_request(id='task-1', retries=retries)
+        try:
+            return payout_task.run(str(self.payout.id), attempts=attempts, tenant=tenant)
+        finally:
+            payout_task.pop_request()
+
+    @patch('api_payouts.tasks.PayoutProcessingService')
+    def test_retry_carries_attempt_history(self, mock_service):
+        """Тест передачи истории попыток при повторе"""
+        mock_service.return_value.process.side_effect = ValueError("provider down")
+
+        with patch.object(payout_task, 'retry', side_effect=RuntimeError) as mock_retry:
+            with self.assertRaises(RuntimeError):
+                self._run_task(retries=0, tenant='shop-1')
+
+        retry_kwargs = mock_retry.call_args.kwargs['kwargs']
+        self.assertEqual(len(retry_kwargs['attempts']), 1)
+        self.assertEqual(retry_kwargs['attempts'][0]['error'], "provider down")
+        self.assertEqual(retry_kwargs['tenant'], 'shop-1')
+        self.assertFalse(PayoutDeadLetter.objects.exists())
+
+    @patch('api_payouts.tasks.FairScheduler.release')
+    def test_tenant_slot_kept_on_retry(self, mock_release):
+        """Тест, что слот мерчанта освобождается только после окончательного завершения задачи"""
+        args, kwargs = [str(self.payout.id)], {'tenant': 'shop-1'}
+
+        release_tenant_slot(task=payout_task, args=args, kwargs=kwargs, state=states.RETRY)
+        mock_release.assert_not_called()
+
+        release_tenant_slot(task=payout_task, args=args, kwargs=kwargs, state=states.FAILURE)
+        mock_release.assert_called_once_with('shop-1', str(self.payout.id))
+
+    @patch('api_payouts.tasks.PayoutProcessingService')
+    def test_exhausted_task_goes_to_dead_letter(self, mock_service):
+        """Тест записи в dead letter после исчерпания попыток"""
+        mock_service.return_value.process.side_effect = ValueError("provider down")
+        history = [{'attempt': n, 'error': "provider down"} for n in range(1, 4)]
+
+        with self.assertRaises(ValueError):
+            self._run_task(retries=payout_task.max_retries, attempts=history)
+
+        letter = PayoutDeadLetter.objects.get()
+        self.assertEqual(letter.payout_id, self.payout.id)
+        self.assertEqual(letter.task_id, 'task-1')
+        self.assertEqual(len(letter.attempts), 4)
+
+
+class StageGraphExecutorTestCase(TestCase):
+    STAGES = PayoutProcessingService.STAGES
+
+    def test_respects_dependencies(self):
+        """Тест, что этап запускается только после своих зависимостей"""
+        order = []
+        executor = StageGraphExecutor(self.STAGES, run_stage=lambda stage: order.append(stage['key']))
+
+        done = executor.run()
+
+        self.assertEqual(done, {stage['key'] for stage in self.STAGES})
+        self.assertEqual(order[2:], ['reserve', 'prepare', 'submit'])
+        self.assertEqual(set(order[:2]), {'check', 'balance'})
+
+    def test_skips_completed(self):
+        """Тест пропуска завершенных этапов"""
+        run = []
+        executor = StageGraphExecutor(self.STAGES, run_stage=lambda stage: run.append(stage['key']))
+
+        executor.run(completed={'check', 'balance', 'reserve'})
+
+        self.assertEqual(run, ['prepare', 'submit'])
+
+    def test_rejects_cycle(self):
+        """Тест обнаружения цикла в графе"""
+        stages = [
+            {"key": "a", "name": "A", "depends_on": ["b"]},
+            {"key": "b", "name": "B", "depends_on": ["a"]},
+        ]
+        with self.assertRaises(ValueError):
+            StageGraphExecutor(stages, run_stage=lambda stage: None)
+
+    def test_stage_error_propagates(self):
+        """Тест, что ошибка этапа прерывает выполнение графа"""
+        def run_stage(stage):
+            if stage['key'] == 'balance':
+                raise ConnectionError("provider down")
+
+        with self.assertRaises(ConnectionError):
+            StageGraphExecutor(self.STAGES, run_stage=run_stage).run()
+
+
+class LatencySimulatorTestCase(TestCase):
+    def test_distribution_per_stage(self):
+        """Тест выбора распределения по ключу этапа и по умолчанию"""
+        simulator = LatencySimulator(
+            config={
+                'default': {'distribution': 'fixed', 'value': 0.1},
+                'submit': {'distribution': 'uniform', 'low': 1, 'high': 2},
+            },
+            enabled=True,
+            seed=1,
+            sleep=MagicMock(),
+        )
+
+        self.assertEqual(simulator.wait({'key': 'check'}), 0.1)
+        self.assertTrue(1 <= simulator.wait({'key': 'submit'}) <= 2)
+
+    def test_disabled(self):
+        """Тест, что выключенная имитация не ждет"""
+        sleep = MagicMock()
+        simulator = LatencySimulator(config={}, enabled=False, sleep=sleep)
+
+        self.assertEqual(simulator.wait({'key': 'check', 'duration': 0.5}), 0.0)
+        sleep.assert_not_called()
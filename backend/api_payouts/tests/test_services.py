@@ -1,15 +1,43 @@
+import os
+import tempfile
 import uuid
+from datetime import date, timedelta
 from decimal import Decimal
+from unittest import skipUnless
 from unittest.mock import patch, MagicMock
 
+from django.db import connection
 from django.http import Http404
-from django.test import TestCase
+from django.test import TestCase, override_settings
+from django.utils import timezone
+from redis.exceptions import ConnectionError as RedisConnectionError
 
-from api_payouts.models import Payout, Currency, Status
-from api_payouts.schemas import PayoutCreateSchema, PayoutUpdateSchema
+from api_payouts.models import (
+    Payout, PayoutDeadLetter, NettedTransfer, Currency, Status, DeadLetterStatus, Priority,
+    LedgerAccount, LedgerEntry, LedgerHold, LedgerHoldStatus,
+    ReconciliationRun, ReconciliationStatus, MismatchKind,
+)
+from api_payouts.schemas import PayoutCreateSchema, PayoutUpdateSchema, PayoutFilterSchema
 from api_payouts.services.payout_service import PayoutService
 from api_payouts.services.payout_crud_service import PayoutCRUDService
 from api_payouts.services.payout_task_service import PayoutTaskService
+from api_payouts.services.dead_letter_service import DeadLetterService
+from api_payouts.services.ledger_service import LedgerService, InsufficientFunds
+from api_payouts.services.duplicate_service import DuplicateDetectionService
+from api_payouts.services.reconciliation_service import ReconciliationService, SettlementFileError
+from api_payouts.services.partition_service import PayoutPartitionService
+from api_payouts.celery_services.payout_scheduler_service import PayoutSchedulerService
+from api_payouts.celery_services.payout_reaper_service import PayoutReaperService
+from api_payouts.celery_services.circuit_breaker import CircuitOpen
+from api_payouts.celery_services.payout_netting_service import PayoutNettingService
+from api_payouts.celery_services.payout_split_service import PayoutSplitService
+from api_payouts.celery_services.payout_task_proccessing_service import PayoutProcessingService
+from api_payouts.celery_services.netted_transfer_processing_service import NettedTransferProcessingService
+from api_payouts.gateway.base import GatewayError, GatewayDeclined
+from api_payouts.celery_services.payout_batch_processing_service import PayoutBatchProcessingService
+from api_payouts.celery_services.fair_scheduler import FairScheduler
+from api_payouts.tasks import netted_transfer_task
+from api_payouts.routing import PayoutRouter, route_payout_task, QUEUE_URGENT, QUEUE_DEFAULT, QUEUE_BULK
 
 
 class PayoutCRUDServiceTestCase(TestCase):
@@ -50,6 +78,20 @@ class PayoutCRUDServiceTestCase(TestCase):
         payouts = PayoutCRUDService.get_list_payouts()
         self.assertEqual(payouts.count(), 2)
 
+    @override_settings(PAYOUT_LIST_WINDOW_DAYS=30)
+    def test_get_list_payouts_window_and_filters(self):
+        """Тест списка: окно по created_at по умолчанию (отсечение секций) и фильтры"""
+        old = Payout.objects.create(amount=Decimal("200.00"), currency=Currency.EUR, recipient_details=self.card_data)
+        Payout.objects.filter(id=old.id).update(created_at=timezone.now() - timedelta(days=45))
+
+        self.assertEqual(list(PayoutCRUDService.get_list_payouts()), [self.payout])
+        with override_settings(PAYOUT_LIST_WINDOW_DAYS=0):
+            self.assertEqual(PayoutCRUDService.get_list_payouts().count(), 2)
+
+        filters = PayoutFilterSchema(created_from=timezone.now() - timedelta(days=60), currency=Currency.EUR)
+        self.assertEqual(list(PayoutCRUDService.get_list_payouts(filters)), [old])
+        self.assertEqual(PayoutCRUDService.get_list_payouts(PayoutFilterSchema(status=Status.COMPLETED)).count(), 0)
+
     def test_get_payout_success(self):
         """Тест получения выплаты по ID"""
         payout = PayoutCRUDService.get_payout(str(self.payout.id))
@@ -129,35 +171,28 @@ class PayoutCRUDServiceTestCase(TestCase):
 
 
 class PayoutTaskServiceTestCase(TestCase):
+    def setUp(self):
+        self.payout = Payout.objects.create(
+            amount=Decimal("100.50"),
+            currency=Currency.USD,
+            recipient_details={"card_number": "5555555555554444"},
+            status=Status.PENDING
+        )
+
     @patch('api_payouts.services.payout_task_service.payout_task.apply_async')
     @patch('django.db.transaction.on_commit')
-    def test_execute_payout(self, mock_on_commit, mock_apply_async):
-        """Тест запуска фоновой задачи"""
-        payout_id = str(uuid.uuid4())
-
-        mock_task_result = MagicMock()
-        mock_task_result.id = "task_123"
-        mock_apply_async.return_value = mock_task_result
-
-        mock_callback = MagicMock()
-        mock_on_commit.return_value = mock_callback
-
-        result = PayoutTaskService.execute_payout(payout_id, countdown=5)
+    def test_execute_payout_with_countdown_schedules(self, mock_on_commit, mock_apply_async):
+        """Тест, что отложенный запуск планируется через execute_at, а не ETA задачи"""
+        PayoutTaskService.execute_payout(str(self.payout.id), countdown=5)
 
-        self.assertEqual(result, mock_callback)
-        mock_on_commit.assert_called_once()
-
-        callback = mock_on_commit.call_args[0][0]
-
-        callback()
-        mock_apply_async.assert_called_once_with(
-            args=[payout_id],
-            countdown=5
-        )
+        mock_on_commit.assert_not_called()
+        mock_apply_async.assert_not_called()
+        self.payout.refresh_from_db()
+        self.assertIsNotNone(self.payout.execute_at)
 
     @patch('api_payouts.services.payout_task_service.payout_task.apply_async')
-    def test_execute_payout_default_countdown(self, mock_apply_async):
-        """Тест запуска задачи с дефолтным countdown"""
+    def test_execute_payout_default(self, mock_apply_async):
+        """Тест немедленного запуска задачи без countdown"""
         payout_id = str(uuid.uuid4())
 
         with patch('django.db.transaction.on_commit') as mock_on_commit:
@@ -168,10 +203,46 @@ class PayoutTaskServiceTestCase(TestCase):
             callback = mock_on_commit.call_args[0][0]
             callback()
 
-            mock_apply_async.assert_called_once_with(
-                args=[payout_id],
-                countdown=1  # Дефолтное значение
+            mock_apply_async.assert_called_once_with(args=[payout_id])
+
+
+class PayoutSchedulerServiceTestCase(TestCase):
+    def setUp(self):
+        card_data = {"card_number": "5555555555554444"}
+        now = timezone.now()
+        self.due = [
+            Payout.objects.create(
+                amount=Decimal("10.00"), currency=Currency.RUB, recipient_details=card_data,
+                execute_at=now - timedelta(minutes=n)
             )
+            for n in range(1, 4)
+        ]
+        self.future = Payout.objects.create(
+            amount=Decimal("10.00"), currency=Currency.RUB, recipient_details=card_data,
+            execute_at=now + timedelta(hours=1)
+        )
+
+    @patch('api_payouts.celery_services.payout_scheduler_service.group')
+    def test_dispatch_due_in_batches(self, mock_group):
+        """Тест отправки наступивших выплат пачками"""
+        task = MagicMock()
+
+        dispatched = PayoutSchedulerService(task=task, batch_size=2).dispatch_due()
+
+        self.assertEqual(dispatched, 3)
+        self.assertEqual(mock_group.return_value.apply_async.call_count, 2)
+        self.assertEqual(Payout.objects.filter(execute_at__isnull=False).get(), self.future)
+
+    def test_dispatch_error_keeps_schedule(self):
+        """Тест, что ошибка брокера не теряет расписание"""
+        task = MagicMock()
+
+        with patch('api_payouts.celery_services.payout_scheduler_service.group') as mock_group:
+            mock_group.return_value.apply_async.side_effect = ConnectionError
+            with self.assertRaises(ConnectionError):
+                PayoutSchedulerService(task=task).dispatch_due()
+
+        self.assertEqual(Payout.objects.filter(execute_at__isnull=False).count(), 4)
 
 
 class PayoutServiceIntegrationTestCase(TestCase):
@@ -220,4 +291,999 @@ class PayoutServiceIntegrationTestCase(TestCase):
 
         # Тестируем execute_payout через основной сервис
         self.service.execute_payout(payout_id, countdown=2)
-        mock_execute.assert_called_once_with(payout_id, countdown=2)
\ No newline at end of file
+        mock_execute.assert_called_once_with(payout_id, countdown=2)
+
+
+class DeadLetterServiceTestCase(TestCase):
+    def setUp(self):
+        card_data = {"card_number": "5555555555554444"}
+        self.letters = []
+        for status in (Status.FAILED, Status.FAILED, Status.FAILED, Status.COMPLETED):
+            payout = Payout.objects.create(
+                amount=Decimal("10.00"),
+                currency=Currency.RUB,
+                recipient_details=card_data,
+                status=status
+            )
+            self.letters.append(PayoutDeadLetter.objects.record(
+                payout_id=payout.id, task_id='task', error='provider down', attempts=[]
+            ))
+
+    @patch('api_payouts.services.dead_letter_service.time.sleep')
+    @patch('api_payouts.services.dead_letter_service.group')
+    def test_replay_in_batches(self, mock_group, mock_sleep):
+        """Тест повторной отправки пачками"""
+        result = DeadLetterService.replay(batch_size=2, interval=0.5)
+
+        self.assertEqual(result, {'replayed': 3, 'resolved': 1})
+        self.assertEqual(mock_group.return_value.apply_async.call_count, 2)
+        mock_sleep.assert_called_once_with(0.5)
+        self.assertEqual(
+            PayoutDeadLetter.objects.filter(status=DeadLetterStatus.REPLAYED).count(), 3
+        )
+        self.assertFalse(PayoutDeadLetter.objects.pending().exists())
+
+    @patch('api_payouts.services.dead_letter_service.group')
+    def test_replay_selected(self, mock_group):
+        """Тест повторной отправки выбранных записей"""
+        result = DeadLetterService.replay(ids=[self.letters[0].id])
+
+        self.assertEqual(result['replayed'], 1)
+        self.assertEqual(PayoutDeadLetter.objects.pending().count(), 3)
+
+
+
+class PayoutReaperServiceTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.redis.pipeline.return_value.execute.return_value = []
+        self.addCleanup(redis_patcher.stop)
+
+        card_data = {"card_number": "5555555555554444"}
+        stale = timezone.now() - timedelta(hours=1)
+        self.stuck = Payout.objects.create(
+            amount=Decimal("10.00"), currency=Currency.RUB, recipient_details=card_data,
+            status=Status.PROCESSING
+        )
+        self.exhausted = Payout.objects.create(
+            amount=Decimal("10.00"), currency=Currency.RUB, recipient_details=card_data,
+            status=Status.PROCESSING, reaped_count=2
+        )
+        self.fresh = Payout.objects.create(
+            amount=Decimal("10.00"), currency=Currency.RUB, recipient_details=card_data,
+            status=Status.PROCESSING
+        )
+        Payout.objects.filter(id__in=[self.stuck.id, self.exhausted.id]).update(updated_at=stale)
+
+    def test_reap_stuck_payouts(self):
+        """Тест возврата зависших выплат в очередь и в failed"""
+        self.redis.pipeline.return_value.execute.return_value = [0, 0]
+
+        result = PayoutReaperService(timeout=60, max_reaps=3).reap()
+
+        self.assertEqual(result['requeued'], 1)
+        self.assertEqual(result['failed'], 1)
+        for payout in (self.stuck, self.exhausted, self.fresh):
+            payout.refresh_from_db()
+        self.assertEqual(self.stuck.status, Status.PENDING)
+        self.assertIsNotNone(self.stuck.execute_at)
+        self.assertEqual(self.stuck.reaped_count, 1)
+        self.assertEqual(self.exhausted.status, Status.FAILED)
+        self.assertIsNone(self.exhausted.execute_at)
+        self.assertEqual(self.fresh.status, Status.PROCESSING)
+
+    def test_reap_skips_leased(self):
+        """Тест, что выплаты с живой арендой не возвращаются"""
+        self.redis.pipeline.return_value.execute.return_value = [1, 1]
+
+        result = PayoutReaperService(timeout=60).reap()
+
+        self.assertEqual(result['skipped_leased'], 2)
+        self.assertEqual(Payout.objects.filter(status=Status.PROCESSING).count(), 3)
+
+    def test_reap_continues_past_leased_chunk(self):
+        """Тест, что полностью арендованная пачка не останавливает возврат следующих"""
+        Payout.objects.filter(id=self.exhausted.id).update(updated_at=timezone.now() - timedelta(hours=2))
+        # Аренда по пачкам: первая (exhausted) занята, вторая (stuck) свободна; затем метрики
+        self.redis.pipeline.return_value.execute.side_effect = [[1], [0], []]
+
+        result = PayoutReaperService(timeout=60, chunk_size=1).reap()
+
+        self.assertEqual((result['skipped_leased'], result['requeued']), (1, 1))
+        self.stuck.refresh_from_db()
+        self.assertEqual(self.stuck.status, Status.PENDING)
+
+
+
+class PayoutBatchProcessingServiceTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.redis.get.return_value = None
+        # SET NX аренд пачки: все взяты
+        self.redis.pipeline.return_value.execute.return_value = [True] * 3
+        self.addCleanup(redis_patcher.stop)
+
+        card_data = {"card_number": "5555555555554444"}
+        self.payouts = [
+            Payout.objects.create(
+                amount=Decimal("10.00"), currency=Currency.RUB, recipient_details=card_data,
+                description="batch"
+            )
+            for _ in range(3)
+        ]
+        self.scheduled = Payout.objects.create(
+            amount=Decimal("10.00"), currency=Currency.RUB, recipient_details=card_data,
+            execute_at=timezone.now() + timedelta(hours=1)
+        )
+
+    def test_claim_batch_skips_scheduled(self):
+        """Тест захвата пачки: только ожидающие незапланированные выплаты"""
+        claimed = Payout.objects.claim_batch(limit=10)
+
+        self.assertEqual({payout.id for payout in claimed}, {payout.id for payout in self.payouts})
+        self.assertEqual(Payout.objects.filter(status=Status.PROCESSING).count(), 3)
+        self.assertEqual(Payout.objects.claim_batch(limit=10), [])
+
+    def test_process_batches_with_bulk_updates(self):
+        """Тест пакетной обработки с итоговыми статусами массовыми UPDATE"""
+        failing_id = self.payouts[0].id
+
+        def run_stages(service, payout):
+            if payout.id == failing_id:
+                raise ConnectionError("provider down")
+
+        with patch(
+            'api_payouts.celery_services.payout_batch_processing_service.PayoutProcessingService.run_stages',
+            autospec=True, side_effect=run_stages
+        ):
+            result = PayoutBatchProcessingService(batch_size=2, max_workers=2).process()
+
+        self.assertEqual(result, {'completed': 2, 'failed': 1, 'deferred': 0})
+        failed = Payout.objects.get(id=failing_id)
+        self.assertEqual(failed.status, Status.FAILED)
+        self.assertIn("provider down", failed.description)
+        self.assertEqual(Payout.objects.filter(status=Status.COMPLETED).count(), 2)
+        self.assertEqual(Payout.objects.get(id=self.scheduled.id).status, Status.PENDING)
+
+    def test_process_batch_defers_on_open_breaker(self):
+        """Тест, что при разомкнутом предохранителе выплаты откладываются, а не падают"""
+        with patch(
+            'api_payouts.celery_services.payout_batch_processing_service.PayoutProcessingService.run_stages',
+            autospec=True, side_effect=CircuitOpen('provider', 30)
+        ):
+            result = PayoutBatchProcessingService(batch_size=3).process_batch()
+
+        self.assertEqual(result['deferred'], 3)
+        self.assertEqual(result['failed'], 0)
+        deferred = Payout.objects.filter(id__in=[payout.id for payout in self.payouts])
+        self.assertTrue(all(p.status == Status.PENDING and p.execute_at > timezone.now() for p in deferred))
+
+    def test_process_batch_leases_claimed(self):
+        """Тест аренды захваченных выплат: занятые возвращаются в ожидание, остальные освобождаются в конце"""
+        self.redis.pipeline.return_value.execute.return_value = [True, None, True]
+
+        with patch(
+            'api_payouts.celery_services.payout_batch_processing_service.PayoutProcessingService.run_stages',
+            autospec=True, return_value=False
+        ) as run_stages:
+            result = PayoutBatchProcessingService(batch_size=3).process_batch()
+
+        self.assertEqual(result['claimed'], 3)
+        self.assertEqual(result['completed'], 2)
+        self.assertEqual(run_stages.call_count, 2)
+        pipe = self.redis.pipeline.return_value
+        keys = [call.args[0] for call in pipe.set.call_args_list]
+        self.assertEqual(keys, [f'payout:lease:{payout.id}' for payout in self.payouts])
+        busy_id = keys[1].rsplit(':', 1)[1]
+        self.assertEqual(Payout.objects.get(id=busy_id).status, Status.PENDING)
+        release = self.redis.register_script.return_value
+        self.assertEqual(len(release.call_args.kwargs['keys']), 2)
+        self.assertNotIn(keys[1], release.call_args.kwargs['keys'])
+
+
+
+class PayoutRouterTestCase(TestCase):
+    def test_queue_by_amount_and_currency(self):
+        """Тест выбора очереди по порогам суммы для валюты"""
+        self.assertEqual(PayoutRouter.queue_for(Decimal("50000.00"), Currency.USD), QUEUE_URGENT)
+        self.assertEqual(PayoutRouter.queue_for(Decimal("500.00"), Currency.RUB), QUEUE_BULK)
+        self.assertEqual(PayoutRouter.queue_for(Decimal("50000.00"), Currency.RUB), QUEUE_DEFAULT)
+
+    def test_explicit_priority_wins(self):
+        """Тест, что явный приоритет важнее суммы"""
+        self.assertEqual(PayoutRouter.queue_for(Decimal("1.00"), Currency.RUB, Priority.HIGH), QUEUE_URGENT)
+        self.assertEqual(PayoutRouter.queue_for(Decimal("50000.00"), Currency.USD, Priority.LOW), QUEUE_BULK)
+
+    def test_celery_router(self):
+        """Тест роутера Celery: поиск выплаты только без явной очереди"""
+        payout = Payout.objects.create(
+            amount=Decimal("20000.00"), currency=Currency.EUR,
+            recipient_details={"card_number": "5555555555554444"}
+        )
+        name = 'api_payouts.tasks.payout_task'
+
+        self.assertEqual(route_payout_task(name, [str(payout.id)], {}, {}), {'queue': QUEUE_URGENT})
+        with self.assertNumQueries(0):
+            self.assertIsNone(route_payout_task(name, [str(payout.id)], {}, {'queue': QUEUE_BULK}))
+            self.assertIsNone(route_payout_task('other', [], {}, {}))
+
+
+
+class FairSchedulerTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.addCleanup(redis_patcher.stop)
+
+    def test_enqueue_into_tenant_queues(self):
+        """Тест постановки выплат в очереди своих мерчантов"""
+        payout = Payout.objects.create(
+            amount=Decimal("50000.00"), currency=Currency.USD, merchant_id="shop-1",
+            recipient_details={"card_number": "5555555555554444"}
+        )
+
+        FairScheduler().enqueue([payout.id])
+
+        pipe = self.redis.pipeline.return_value
+        key, item = pipe.rpush.call_args.args
+        self.assertEqual(key, 'payout:fair:queue:shop-1')
+        self.assertIn(QUEUE_URGENT, item)
+        pipe.sadd.assert_called_once_with('payout:fair:active', 'shop-1')
+
+    @override_settings(PAYOUT_FAIR_QUANTUM=2, PAYOUT_FAIR_TENANT_LIMITS={'big': {'concurrency': 1, 'weight': 3}})
+    @patch('api_payouts.celery_services.fair_scheduler.group')
+    def test_dispatch_round_robin_with_limits(self, mock_group):
+        """Тест обхода мерчантов по кругу с квантом и лимитом мерчанта"""
+        self.redis.smembers.return_value = {b'big', b'small'}
+        self.redis.incr.return_value = 0
+        pop = self.redis.register_script.return_value
+        pop.side_effect = [
+            ['{"id": "p1", "queue": "payouts.bulk"}'],
+            ['{"id": "p2", "queue": "payouts.default"}'],
+            [],
+            [],
+        ]
+        task = MagicMock()
+
+        dispatched = FairScheduler(task=task).dispatch()
+
+        self.assertEqual(dispatched, 2)
+        big_call, small_call = pop.call_args_list[:2]
+        self.assertEqual(big_call.kwargs['args'][:2], [6, 1])
+        self.assertEqual(small_call.kwargs['args'][:2], [2, 50])
+        task.s.assert_any_call('p1', tenant='big')
+        mock_group.return_value.apply_async.assert_called_once()
+
+    def test_release_slot(self):
+        """Тест освобождения слота мерчанта"""
+        FairScheduler.release('shop-1', 'p1')
+
+        self.redis.zrem.assert_called_once_with('payout:fair:inflight:shop-1', 'p1')
+
+
+class PayoutNettingTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.addCleanup(redis_patcher.stop)
+
+        self.card = {"card_number": "5555555555554444", "card_holder": "Ivanov Ivan"}
+        now = timezone.now()
+        self.members = [
+            self.create(Decimal("10.00"), self.card, now - timedelta(seconds=5)),
+            self.create(Decimal("15.50"), {"card_holder": "Ivanov Ivan", "card_number": "5555555555554444"},
+                        now + timedelta(seconds=30)),
+        ]
+        self.single = self.create(Decimal("20.00"), {"card_number": "4111111111111111"}, now - timedelta(seconds=5))
+        self.other_currency = self.create(Decimal("5.00"), self.card, now - timedelta(seconds=5), Currency.USD)
+        self.breaker = MagicMock()
+        self.breaker.retry_after.return_value = None
+
+    @staticmethod
+    def create(amount, card, execute_at, currency=Currency.RUB):
+        payout = Payout.objects.create_payout(amount=amount, currency=currency, recipient_details=card)
+        Payout.objects.filter(id=payout.id).update(execute_at=execute_at)
+        return payout
+
+    def net(self):
+        task = MagicMock()
+        with patch('api_payouts.celery_services.payout_netting_service.group') as group:
+            with self.captureOnCommitCallbacks(execute=True):
+                netted = PayoutNettingService(task=task, window=60).net_due()
+        return netted, group
+
+    def test_net_due_groups_same_recipient_and_currency(self):
+        """Тест сведения выплат одному получателю в одной валюте в пределах окна"""
+        netted, group = self.net()
+
+        self.assertEqual(netted, 1)
+        transfer = NettedTransfer.objects.get()
+        self.assertEqual(transfer.amount, Decimal("25.50"))
+        self.assertEqual(transfer.payout_count, 2)
+        self.assertEqual(
+            set(transfer.payouts.values_list('id', flat=True)), {payout.id for payout in self.members}
+        )
+        self.assertEqual(set(transfer.payouts.values_list('status', flat=True)), {Status.PROCESSING})
+        self.assertEqual(Payout.objects.get(id=self.single.id).status, Status.PENDING)
+        self.assertEqual(Payout.objects.get(id=self.other_currency.id).status, Status.PENDING)
+        group.return_value.apply_async.assert_called_once_with()
+
+    @override_settings(PAYOUT_TRANSFER_CAPS={'RUB': 30})
+    def test_transfers_respect_caps(self):
+        """Тест, что сводный перевод не превышает лимит провайдера: группа делится, крупная выплата не сводится"""
+        now = timezone.now()
+        extra = [self.create(Decimal(amount), self.card, now - timedelta(seconds=4)) for amount in ("12.00", "40.00")]
+        self.create(Decimal("9.00"), self.card, now - timedelta(seconds=3))
+
+        netted, _ = self.net()
+
+        self.assertEqual(netted, 2)
+        self.assertEqual(
+            sorted(NettedTransfer.objects.values_list('amount', 'payout_count')),
+            [(Decimal("22.00"), 2), (Decimal("24.50"), 2)],
+        )
+        self.assertEqual(Payout.objects.get(id=extra[1].id).status, Status.PENDING)
+
+    @override_settings(PAYOUT_VELOCITY_LIMITS={'RUB': {'card': {'hour': {'count': 1}}}})
+    def test_velocity_limited_currency_not_netted(self):
+        """Тест, что выплаты в валюте с лимитами частоты не сводятся и не удерживаются: лимиты проверит обычная обработка"""
+        netted, _ = self.net()
+
+        self.assertEqual(netted, 0)
+        self.assertEqual(Payout.objects.get(id=self.members[0].id).status, Status.PENDING)
+        with override_settings(PAYOUT_NETTING_WINDOW=60):
+            self.assertFalse(PayoutTaskService.hold_for_netting(str(self.single.id)))
+
+    def test_group_waits_for_oldest_due(self):
+        """Тест, что группа не сводится, пока срок старейшей выплаты не наступил"""
+        Payout.objects.filter(id=self.members[0].id).update(execute_at=timezone.now() + timedelta(seconds=10))
+
+        netted, _ = self.net()
+
+        self.assertEqual(netted, 0)
+        self.assertFalse(NettedTransfer.objects.exists())
+
+    def test_transfer_completes_all_members(self):
+        """Тест завершения перевода и его выплат одной транзакцией"""
+        self.net()
+        transfer = NettedTransfer.objects.get()
+        gateway = MagicMock()
+        gateway.submit.return_value = {'reference': 'ref-1', 'status': 'accepted'}
+
+        result = NettedTransferProcessingService(str(transfer.id), gateway=gateway, breaker=self.breaker).process()
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['payouts'], 2)
+        gateway.submit.assert_called_once()
+        transfer.refresh_from_db()
+        self.assertEqual((transfer.status, transfer.reference), (Status.COMPLETED, 'ref-1'))
+        self.assertEqual(set(transfer.payouts.values_list('status', flat=True)), {Status.COMPLETED})
+
+    def test_declined_transfer_unwinds(self):
+        """Тест разбора отклоненного перевода: выплаты в failed со ссылкой на перевод"""
+        self.net()
+        transfer = NettedTransfer.objects.get()
+        gateway = MagicMock()
+        gateway.submit.side_effect = GatewayDeclined("limit exceeded")
+
+        result = NettedTransferProcessingService(str(transfer.id), gateway=gateway, breaker=self.breaker).process()
+
+        self.assertFalse(result['success'])
+        self.assertEqual(result['payouts'], 2)
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.status, Status.FAILED)
+        for payout in transfer.payouts.all():
+            self.assertEqual(payout.status, Status.FAILED)
+            self.assertIn("limit exceeded", payout.description)
+
+    def test_transient_error_releases_transfer(self):
+        """Тест возврата перевода в pending при временной ошибке провайдера"""
+        self.net()
+        transfer = NettedTransfer.objects.get()
+        gateway = MagicMock()
+        gateway.submit.side_effect = GatewayError("timeout")
+
+        with self.assertRaises(GatewayError):
+            NettedTransferProcessingService(str(transfer.id), gateway=gateway, breaker=self.breaker).process()
+
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.status, Status.PENDING)
+        self.breaker.record_failure.assert_called_once_with(probe=self.breaker.allow.return_value)
+        self.assertEqual(set(transfer.payouts.values_list('status', flat=True)), {Status.PROCESSING})
+
+    def test_netted_members_not_reaped(self):
+        """Тест, что зависшие участники перевода не возвращаются поштучно"""
+        self.net()
+        Payout.objects.filter(netted_transfer__isnull=False).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        result = Payout.objects.reap_stuck(cutoff=timezone.now(), limit=10, max_reaps=3)
+
+        self.assertEqual(result['selected'], 0)
+
+    def test_open_breaker_exhausted_dissolves_transfer(self):
+        """Тест расформирования перевода, если все попытки отклонил предохранитель"""
+        self.net()
+        transfer = NettedTransfer.objects.get()
+        self.breaker.retry_after.return_value = 30.0
+        netted_transfer_task.push_request(id='task-1', retries=netted_transfer_task.max_retries)
+        try:
+            with patch('api_payouts.tasks.NettedTransferProcessingService') as service_class:
+                service_class.side_effect = lambda transfer_id: NettedTransferProcessingService(
+                    transfer_id, gateway=MagicMock(), breaker=self.breaker
+                )
+                result = netted_transfer_task.run(str(transfer.id))
+        finally:
+            netted_transfer_task.pop_request()
+
+        self.assertTrue(result['deferred'])
+        self.assertEqual(result['payouts'], 2)
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.status, Status.CANCELLED)
+        for payout in Payout.objects.filter(id__in=[member.id for member in self.members]):
+            self.assertEqual(payout.status, Status.PENDING)
+            self.assertIsNone(payout.netted_transfer_id)
+            self.assertGreater(payout.execute_at, timezone.now())
+
+    def test_resume_stale_transfers(self):
+        """Тест повторной публикации задач переводов, зависших после падения воркера"""
+        self.net()
+        transfer = NettedTransfer.objects.get()
+        NettedTransfer.objects.filter(id=transfer.id).update(
+            status=Status.PROCESSING, updated_at=timezone.now() - timedelta(hours=1)
+        )
+        task = MagicMock()
+
+        with patch('api_payouts.celery_services.payout_netting_service.group') as group:
+            with self.captureOnCommitCallbacks(execute=True):
+                resumed = PayoutNettingService(task=task).resume_stale(timeout=60)
+
+        self.assertEqual(resumed, 1)
+        task.s.assert_called_once_with(str(transfer.id))
+        group.return_value.apply_async.assert_called_once_with()
+        transfer.refresh_from_db()
+        self.assertEqual(transfer.status, Status.PENDING)
+        self.assertEqual(PayoutNettingService(task=task).resume_stale(timeout=60), 0)
+
+    @override_settings(PAYOUT_NETTING_WINDOW=30)
+    def test_execute_payout_holds_for_netting_window(self):
+        """Тест удержания новой выплаты на время окна сведения"""
+        payout = Payout.objects.create_payout(amount=Decimal("1.00"), recipient_details=self.card)
+
+        PayoutTaskService.execute_payout(str(payout.id))
+
+        payout.refresh_from_db()
+        self.assertGreater(payout.execute_at, timezone.now() + timedelta(seconds=20))
+        self.assertEqual(payout.recipient_key, self.members[0].recipient_key)
+
+    @override_settings(PAYOUT_NETTING_WINDOW=30)
+    @patch('api_payouts.services.payout_task_service.payout_task')
+    def test_execute_payout_without_recipient_key_not_held(self, mock_task):
+        """Тест, что выплата, которую нельзя свести, отправляется сразу"""
+        payout = Payout.objects.create_payout(amount=Decimal("1.00"), recipient_details={})
+
+        with self.captureOnCommitCallbacks(execute=True):
+            PayoutTaskService.execute_payout(str(payout.id))
+
+        payout.refresh_from_db()
+        self.assertIsNone(payout.execute_at)
+        mock_task.apply_async.assert_called_once_with(args=[str(payout.id)])
+
+
+class PayoutSplitServiceTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.redis.get.return_value = None
+        self.addCleanup(redis_patcher.stop)
+
+        self.payout = Payout.objects.create_payout(
+            amount=Decimal("1500000.01"), currency=Currency.RUB, recipient_details={"card_number": "4444"}
+        )
+        self.splitter = PayoutSplitService(part_task=MagicMock(), finalize_task=MagicMock())
+
+    def split(self):
+        with patch('api_payouts.celery_services.payout_split_service.chord') as chord:
+            with self.captureOnCommitCallbacks(execute=True):
+                result = PayoutProcessingService(str(self.payout.id), splitter=self.splitter).process()
+        return result, chord
+
+    def test_part_amounts_respect_cap(self):
+        """Тест деления суммы: части не больше лимита, сумма сохраняется до копейки"""
+        parts = PayoutSplitService.part_amounts(Decimal("1500000.01"), Decimal("600000"))
+
+        self.assertEqual(parts, [Decimal("500000.01"), Decimal("500000.00"), Decimal("500000.00")])
+        self.assertEqual(PayoutSplitService.part_amounts(Decimal("1200000.00"), Decimal("600000")),
+                         [Decimal("600000.00"), Decimal("600000.00")])
+
+    def test_oversized_payout_split_into_chord(self):
+        """Тест разделения крупной выплаты и запуска частей через chord"""
+        result, chord = self.split()
+
+        self.assertTrue(result['split'])
+        self.assertEqual(result['parts'], 3)
+        self.payout.refresh_from_db()
+        self.assertEqual((self.payout.status, self.payout.parts_count), (Status.PROCESSING, 3))
+        parts = self.payout.parts.all()
+        self.assertEqual(sum(part.amount for part in parts), Decimal("1500000.01"))
+        self.assertEqual({part.status for part in parts}, {Status.PENDING})
+        self.assertEqual(len(chord.call_args.args[0]), 3)
+        chord.return_value.assert_called_once_with(self.splitter.finalize_task.s.return_value)
+        self.splitter.finalize_task.s.assert_called_once_with(str(self.payout.id))
+
+    def test_small_payout_not_split(self):
+        """Тест, что выплата в пределах лимита обрабатывается целиком"""
+        Payout.objects.filter(id=self.payout.id).update(amount=Decimal("100.00"))
+
+        result, chord = self.split()
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['status'], 'completed')
+        chord.assert_not_called()
+
+    def test_finalize_from_children(self):
+        """Тест итогового статуса: ждет все части, completed только при всех выполненных"""
+        self.split()
+        parts = list(self.payout.parts.order_by('amount'))
+
+        Payout.objects.filter(id=parts[0].id).update(status=Status.COMPLETED)
+        self.assertIsNone(Payout.objects.finalize_split(self.payout.id))
+
+        Payout.objects.filter(id=parts[1].id).update(status=Status.COMPLETED)
+        Payout.objects.filter(id=parts[2].id).update(status=Status.FAILED)
+        self.assertEqual(Payout.objects.finalize_split(self.payout.id), Status.FAILED)
+
+        self.payout.refresh_from_db()
+        self.assertEqual(self.payout.status, Status.FAILED)
+        self.assertIn("Выполнено частей 2 из 3 на сумму 1000000.00", self.payout.description)
+
+    def test_finalize_all_completed(self):
+        """Тест завершения исходной выплаты, когда выполнены все части"""
+        self.split()
+        self.payout.parts.update(status=Status.COMPLETED)
+
+        self.assertEqual(Payout.objects.finalize_split(self.payout.id), Status.COMPLETED)
+        self.assertEqual(Payout.objects.get(id=self.payout.id).status, Status.COMPLETED)
+
+    def test_split_parent_not_reaped(self):
+        """Тест, что исходная выплата с частями не возвращается сборщиком зависших"""
+        self.split()
+        Payout.objects.filter(id=self.payout.id).update(updated_at=timezone.now() - timedelta(hours=1))
+
+        result = Payout.objects.reap_stuck(cutoff=timezone.now(), limit=10, max_reaps=3)
+
+        self.assertEqual(result['selected'], 0)
+
+    def test_reaper_finalizes_parts_finished_after_chord(self):
+        """Тест, что сборщик завершает разделенную выплату, если последняя часть завершилась после колбэка chord"""
+        self.split()
+        Payout.objects.filter(id=self.payout.id).update(updated_at=timezone.now() - timedelta(hours=1))
+        parts = list(self.payout.parts.order_by('amount'))
+        Payout.objects.filter(id=parts[0].id).update(status=Status.COMPLETED)
+        # Колбэк chord сработал, пока часть была отложена
+        self.assertIsNone(Payout.objects.finalize_split(self.payout.id))
+
+        result = PayoutReaperService(timeout=60).reap()
+        self.assertEqual(result['finalized_splits'], 0)
+
+        self.payout.parts.update(status=Status.COMPLETED)
+        result = PayoutReaperService(timeout=60).reap()
+
+        self.assertEqual(result['finalized_splits'], 1)
+        self.assertEqual(Payout.objects.get(id=self.payout.id).status, Status.COMPLETED)
+
+    def test_parts_not_netted(self):
+        """Тест, что части разделенной выплаты не сводятся в сводный перевод"""
+        self.split()
+        self.payout.parts.update(execute_at=timezone.now() - timedelta(seconds=5))
+
+        self.assertEqual(NettedTransfer.objects.net_due(window=timedelta(seconds=60), limit=10), [])
+        self.assertEqual(self.payout.parts.filter(status=Status.PENDING).count(), 3)
+
+
+class LedgerServiceTestCase(TestCase):
+    def setUp(self):
+        self.ledger = LedgerService(shards=4)
+        self.ledger.open_account('m-1', Currency.RUB)
+        self.ledger.fund('m-1', Currency.RUB, Decimal("100.02"))
+
+    def payout(self, amount):
+        return Payout.objects.create_payout(
+            amount=Decimal(amount), currency=Currency.RUB, merchant_id='m-1', recipient_details={"card_number": "4444"}
+        )
+
+    def shards(self):
+        return list(LedgerAccount.objects.funding_shards('m-1', Currency.RUB))
+
+    def test_fund_spreads_over_shards(self):
+        """Тест пополнения: сумма распределена по шардам, проводки сходятся в ноль"""
+        self.assertEqual([shard.balance for shard in self.shards()],
+                         [Decimal("25.01"), Decimal("25.01"), Decimal("25.00"), Decimal("25.00")])
+        self.assertEqual(sum(entry.amount for entry in LedgerEntry.objects.all()), 0)
+
+    def test_reserve_and_capture(self):
+        """Тест резерва на шарде и списания с проводками шард -> расчеты"""
+        payout = self.payout("20.00")
+
+        hold = self.ledger.reserve(payout)
+        self.assertEqual(self.ledger.reserve(payout), hold)
+        self.assertEqual(LedgerAccount.objects.get(id=hold.account_id).reserved, Decimal("20.00"))
+        self.assertEqual(LedgerAccount.objects.available('m-1', Currency.RUB), Decimal("80.02"))
+
+        self.assertEqual(self.ledger.capture([payout.id]), 1)
+
+        account = LedgerAccount.objects.get(id=hold.account_id)
+        self.assertEqual(account.reserved, 0)
+        self.assertEqual(sum(shard.balance for shard in self.shards()), Decimal("80.02"))
+        capture = LedgerEntry.objects.filter(kind=LedgerEntry.CAPTURE)
+        self.assertEqual(capture.count(), 2)
+        self.assertEqual(sum(entry.amount for entry in capture), 0)
+        self.assertEqual(LedgerHold.objects.get().status, LedgerHoldStatus.CAPTURED)
+
+    def test_release_returns_reserve(self):
+        """Тест снятия резерва при ошибке выплаты"""
+        payout = self.payout("20.00")
+        self.ledger.reserve(payout)
+
+        self.assertEqual(self.ledger.release([payout.id]), 1)
+
+        self.assertEqual(LedgerAccount.objects.available('m-1', Currency.RUB), Decimal("100.02"))
+        self.assertEqual(self.ledger.capture([payout.id]), 0)
+
+        # Повторная попытка выплаты ставит снятый резерв заново
+        self.assertEqual(self.ledger.reserve(payout).status, LedgerHoldStatus.HELD)
+        self.assertEqual(LedgerAccount.objects.available('m-1', Currency.RUB), Decimal("80.02"))
+
+    def test_reserve_consolidates_fragmented_funds(self):
+        """Тест резерва суммы больше любого шарда: средства собираются на шард выплаты"""
+        payout = self.payout("60.00")
+
+        hold = self.ledger.reserve(payout)
+
+        self.assertEqual(hold.amount, Decimal("60.00"))
+        self.assertEqual(sum(shard.balance for shard in self.shards()), Decimal("100.02"))
+        self.assertEqual(LedgerAccount.objects.available('m-1', Currency.RUB), Decimal("40.02"))
+        consolidation = LedgerEntry.objects.filter(kind=LedgerEntry.CONSOLIDATION)
+        self.assertEqual(sum(entry.amount for entry in consolidation), 0)
+
+    def test_insufficient_funds(self):
+        """Тест отказа в резерве сверх доступного остатка"""
+        payout = self.payout("100.03")
+
+        with self.assertRaises(InsufficientFunds):
+            self.ledger.verify_balance(payout)
+        with self.assertRaises(InsufficientFunds):
+            self.ledger.reserve(payout)
+        self.assertFalse(LedgerHold.objects.exists())
+
+    def test_consolidate_all_evens_shards(self):
+        """Тест периодической консолидации шардов"""
+        hold = self.ledger.reserve(self.payout("20.00"))
+        shard = next(shard for shard in self.shards() if shard.id != hold.account_id)
+        LedgerAccount.objects.filter(id=shard.id).update(balance=shard.balance + Decimal("20.00"))
+
+        self.assertGreater(self.ledger.consolidate_all(), 0)
+
+        available = [shard.balance - shard.reserved for shard in self.shards()]
+        self.assertLessEqual(max(available) - min(available), Decimal("0.01"))
+
+    def test_processing_uses_ledger(self):
+        """Тест этапов проверки и резерва через книгу учета и списания при завершении"""
+        payout = self.payout("20.00")
+        ledger = MagicMock()
+
+        with patch('api_payouts.redis_client.get_redis_connection') as redis:
+            redis.return_value.get.return_value = None
+            result = PayoutProcessingService(str(payout.id), ledger=ledger).process()
+
+        self.assertTrue(result['success'])
+        ledger.verify_balance.assert_called_once()
+        ledger.reserve.assert_called_once()
+        ledger.capture.assert_called_once_with([str(payout.id)])
+
+    def test_retry_after_released_hold_reserves_again(self):
+        """Тест повтора после ошибки отправки: снятый резерв ставится заново и списывается"""
+        payout = self.payout("20.00")
+        self.ledger.reserve(payout)
+        # Первая попытка: резерв поставлен, отправка упала - выплата в failed, резерв снят
+        Payout.objects.fail_processing(payout_id=payout.id, error_message='Connection refused')
+        self.ledger.release([payout.id])
+        gateway = MagicMock()
+        gateway.submit.return_value = {'reference': 'ref-1'}
+
+        with patch('api_payouts.redis_client.get_redis_connection') as redis:
+            redis.return_value.get.return_value = b'balance,check,prepare,reserve'
+            result = PayoutProcessingService(str(payout.id), ledger=self.ledger, gateway=gateway).process()
+
+        self.assertTrue(result['success'])
+        self.assertEqual(LedgerHold.objects.get(payout_id=payout.id).status, LedgerHoldStatus.CAPTURED)
+        self.assertEqual(sum(shard.balance for shard in self.shards()), Decimal("80.02"))
+
+    def test_insufficient_funds_is_terminal(self):
+        """Тест, что нехватка средств переводит выплату в failed без повторных попыток"""
+        payout = self.payout("100.03")
+        ledger = MagicMock()
+        ledger.verify_balance.side_effect = InsufficientFunds("Недостаточно средств для выплаты")
+
+        with patch('api_payouts.redis_client.get_redis_connection') as redis:
+            redis.return_value.get.return_value = None
+            result = PayoutProcessingService(str(payout.id), ledger=ledger).process()
+
+        self.assertTrue(result['rejected'])
+        payout.refresh_from_db()
+        self.assertEqual(payout.status, Status.FAILED)
+        self.assertIn("Недостаточно средств", payout.description)
+        ledger.release.assert_called_once_with([str(payout.id)])
+
+    def test_status_changed_before_completion_releases_hold(self):
+        """Тест снятия резерва, если выплату вывели из 'processing' до завершения"""
+        payout = self.payout("20.00")
+        ledger = MagicMock()
+
+        with patch('api_payouts.redis_client.get_redis_connection') as redis, patch.object(
+            Payout.objects, 'complete_processing', return_value=None
+        ):
+            redis.return_value.get.return_value = None
+            result = PayoutProcessingService(str(payout.id), ledger=ledger).process()
+
+        self.assertFalse(result['success'])
+        ledger.capture.assert_not_called()
+        ledger.release.assert_called_once_with([str(payout.id)])
+
+    @override_settings(PAYOUT_LEDGER_ENABLED=True)
+    def test_reaper_releases_exhausted_holds(self):
+        """Тест снятия резерва выплаты, которую сборщик перевел в failed"""
+        payout = self.payout("20.00")
+        self.ledger.reserve(payout)
+        Payout.objects.filter(id=payout.id).update(
+            status=Status.PROCESSING, reaped_count=2, updated_at=timezone.now() - timedelta(hours=1)
+        )
+
+        with patch('api_payouts.redis_client.get_redis_connection') as redis:
+            redis.return_value.pipeline.return_value.execute.return_value = [0]
+            result = PayoutReaperService(timeout=60, max_reaps=3).reap()
+
+        self.assertEqual(result['failed'], 1)
+        self.assertEqual(LedgerHold.objects.get().status, LedgerHoldStatus.RELEASED)
+        self.assertEqual(LedgerAccount.objects.available('m-1', Currency.RUB), Decimal("100.02"))
+
+    def test_netted_transfer_reserves_and_captures(self):
+        """Тест резервов сводного перевода: выплата без средств исключается, остальные списываются"""
+        payouts = [self.payout("30.00"), self.payout("40.00"), self.payout("90.00")]
+        Payout.objects.filter(id__in=[payout.id for payout in payouts]).update(
+            execute_at=timezone.now() - timedelta(seconds=5)
+        )
+        transfer = NettedTransfer.objects.net_due(window=timedelta(seconds=60), limit=10)[0]
+        gateway = MagicMock()
+        gateway.submit.return_value = {'reference': 'ref-1'}
+        breaker = MagicMock()
+        breaker.retry_after.return_value = None
+
+        result = NettedTransferProcessingService(
+            str(transfer.id), gateway=gateway, breaker=breaker, ledger=self.ledger
+        ).process()
+
+        self.assertTrue(result['success'])
+        self.assertEqual(result['payouts'], 2)
+        self.assertEqual(gateway.submit.call_args.args[0].amount, Decimal("70.00"))
+        statuses = dict(Payout.objects.values_list('id', 'status'))
+        self.assertEqual(
+            [statuses[payout.id] for payout in payouts], [Status.COMPLETED, Status.COMPLETED, Status.FAILED]
+        )
+        self.assertEqual(LedgerHold.objects.filter(status=LedgerHoldStatus.CAPTURED).count(), 2)
+        self.assertEqual(sum(shard.balance for shard in self.shards()), Decimal("30.02"))
+
+
+@override_settings(PAYOUT_DUPLICATE_WINDOW=600)
+class DuplicateDetectionServiceTestCase(TestCase):
+    def setUp(self):
+        redis_patcher = patch('api_payouts.redis_client.get_redis_connection')
+        self.redis = redis_patcher.start().return_value
+        self.addCleanup(redis_patcher.stop)
+        self.script = self.redis.register_script.return_value
+
+        self.payload = PayoutCreateSchema(
+            amount=Decimal("100.50"),
+            currency=Currency.USD,
+            recipient_details={
+                "card_number": "5555555555554444",
+                "card_holder": "Ivanov Ivan",
+                "expiry_date": "12/25"
+            },
+        )
+
+    def test_filter_miss_skips_database(self):
+        """Тест, что отрицательный ответ фильтра не требует запроса к БД"""
+        self.script.return_value = 0
+        service = DuplicateDetectionService()
+
+        with self.assertNumQueries(0):
+            self.assertIsNone(service.find_duplicate('key', Decimal("100.50"), Currency.USD))
+
+        args = self.script.call_args.kwargs['args']
+        self.assertEqual(args[0], 1200)
+        self.assertEqual(len(args), 1 + service.hashes)
+        self.assertTrue(all(0 <= bit < service.bits for bit in args[1:]))
+
+    def test_duplicate_held_for_review(self):
+        """Тест, что повторная выплата создается на проверке и не отправляется в обработку"""
+        self.script.return_value = 0
+        original = PayoutCRUDService.create_payout(self.payload)
+        self.script.return_value = 1
+
+        with patch('api_payouts.services.payout_task_service.payout_task') as task:
+            duplicate = PayoutCRUDService.create_payout(self.payload)
+            self.assertEqual(duplicate.status, Status.REVIEW)
+            self.assertEqual(duplicate.duplicate_of_id, original.id)
+
+            with self.captureOnCommitCallbacks(execute=True):
+                approved = PayoutService.approve_payout(str(duplicate.id))
+
+        self.assertEqual(approved.status, Status.PENDING)
+        task.apply_async.assert_called_once_with(args=[str(duplicate.id)])
+
+    def test_false_positive_and_redis_unavailable(self):
+        """Тест ложного срабатывания фильтра и проверки по БД при недоступном Redis"""
+        self.script.return_value = 1
+        other = self.payload.model_copy(update={'amount': Decimal("100.51")})
+        self.assertEqual(PayoutCRUDService.create_payout(other).status, Status.PENDING)
+
+        self.redis.register_script.side_effect = RedisConnectionError()
+        self.assertEqual(PayoutCRUDService.create_payout(self.payload).status, Status.PENDING)
+        self.assertEqual(PayoutCRUDService.create_payout(self.payload).status, Status.REVIEW)
+
+
+class ReconciliationServiceTestCase(TestCase):
+    def setUp(self):
+        self.payouts = sorted(
+            [
+                Payout.objects.create(
+                    amount=Decimal('100.00'), currency=Currency.RUB, status=Status.COMPLETED,
+                    provider_reference=f'ref-{index}', recipient_details={'card_number': '5555555555554444'},
+                )
+                for index in range(5)
+            ],
+            key=lambda payout: str(payout.id),
+        )
+        # Не отправлялась провайдеру - в сверку не попадает
+        Payout.objects.create(amount=Decimal('100.00'), currency=Currency.RUB,
+                              recipient_details={'card_number': '5555555555554444'})
+        self.date = timezone.localdate()
+        self.unknown = str(uuid.UUID(int=2 ** 128 - 1))
+
+        # 0 - совпадает, 1 - сумма, 2 - статус, 3 - нет в файле, 4 - совпадает, unknown - нет в базе
+        lines = ['payout_id,amount,currency,status,reference']
+        lines.append(f'{self.payouts[0].id},100.00,RUB,settled,ref-0')
+        lines.append(f'{self.payouts[1].id},99.00,RUB,settled,ref-1')
+        lines.append(f'{self.payouts[2].id},100.00,RUB,failed,ref-2')
+        lines.append(f'{self.payouts[4].id},100.00,RUB,completed,ref-4')
+        lines.append(f'{self.unknown},10.00,RUB,settled,ref-x')
+        self.path = self._write(lines)
+
+    def _write(self, lines):
+        file = tempfile.NamedTemporaryFile('w', suffix='.csv', delete=False)
+        file.write('\n'.join(lines) + '\n')
+        file.close()
+        self.addCleanup(os.unlink, file.name)
+        return file.name
+
+    def _mismatches(self, run):
+        return sorted((mismatch.payout_id, mismatch.kind) for mismatch in run.mismatches.all())
+
+    def test_merge_join_finds_mismatches(self):
+        """Тест сверки: пропуски с обеих сторон, расхождения суммы и статуса, итоги"""
+        summary = ReconciliationService(self.path, self.date).run()
+
+        run = ReconciliationRun.objects.get()
+        self.assertEqual(run.status, ReconciliationStatus.COMPLETED)
+        self.assertEqual(self._mismatches(run), sorted([
+            (str(self.payouts[1].id), MismatchKind.AMOUNT),
+            (str(self.payouts[2].id), MismatchKind.STATUS),
+            (str(self.payouts[3].id), MismatchKind.MISSING_IN_FILE),
+            (self.unknown, MismatchKind.MISSING_IN_DB),
+        ]))
+        self.assertEqual(summary, {
+            'matched': 2, 'file_rows': 5, 'missing_in_file': 1, 'missing_in_db': 1, 'amount': 1, 'status': 1,
+        })
+        self.assertEqual(run.summary, summary)
+
+    def test_resumes_from_checkpoint(self):
+        """Тест продолжения прерванной сверки: итоги и расхождения как у непрерывной, без повторов"""
+        original = ReconciliationRun.objects.checkpoint
+        calls = []
+
+        def interrupted(*args, **kwargs):
+            calls.append(kwargs['last_payout_id'])
+            if len(calls) == 3:
+                raise RuntimeError('Соединение с БД потеряно')
+            return original(*args, **kwargs)
+
+        with patch.object(ReconciliationRun.objects, 'checkpoint', side_effect=interrupted):
+            with self.assertRaises(RuntimeError):
+                ReconciliationService(self.path, self.date, checkpoint_every=1).run()
+
+        run = ReconciliationRun.objects.get()
+        self.assertEqual(run.status, ReconciliationStatus.FAILED)
+        self.assertEqual(run.last_payout_id, str(self.payouts[1].id))
+
+        summary = ReconciliationService(self.path, self.date, checkpoint_every=1).run()
+
+        run.refresh_from_db()
+        self.assertEqual(run.status, ReconciliationStatus.COMPLETED)
+        self.assertEqual(len(self._mismatches(run)), 4)
+        self.assertEqual((summary['matched'], summary['file_rows']), (2, 5))
+        # Завершенная сверка не повторяется
+        self.assertEqual(ReconciliationService(self.path, self.date).run(), summary)
+
+    def test_payout_updated_later_is_not_missing(self):
+        """Тест, что выплата из файла, обновленная после дня расчетов, сверяется, а не считается отсутствующей"""
+        Payout.objects.filter(id=self.payouts[4].id).update(updated_at=timezone.now() + timedelta(days=1))
+
+        summary = ReconciliationService(self.path, self.date, checkpoint_every=2).run()
+
+        run = ReconciliationRun.objects.get()
+        self.assertNotIn((str(self.payouts[4].id), MismatchKind.MISSING_IN_DB), self._mismatches(run))
+        self.assertEqual((summary['matched'], summary['missing_in_db']), (2, 1))
+
+    def test_unsorted_file_fails(self):
+        """Тест, что неотсортированный файл прерывает сверку с ошибкой"""
+        path = self._write([
+            'payout_id,amount,currency,status',
+            f'{self.payouts[1].id},100.00,RUB,settled',
+            f'{self.payouts[0].id},100.00,RUB,settled',
+        ])
+
+        with self.assertRaises(SettlementFileError):
+            ReconciliationService(path, self.date).run()
+
+        self.assertEqual(ReconciliationRun.objects.get().status, ReconciliationStatus.FAILED)
+
+
+class PayoutPartitionServiceTestCase(TestCase):
+    def test_month_partitions(self):
+        """Тест границ и имен месячных секций"""
+        december = PayoutPartitionService.month_start(timezone.datetime(2026, 12, 17))
+
+        self.assertEqual(PayoutPartitionService.next_month(december), timezone.datetime(2027, 1, 1).date())
+        self.assertEqual(PayoutPartitionService.partition_name(december), 'api_payouts_payout_p2026_12')
+        self.assertEqual(PayoutPartitionService._create_partition_sql(december), (
+            "CREATE TABLE api_payouts_payout_p2026_12 PARTITION OF api_payouts_payout "
+            "FOR VALUES FROM ('2026-12-01 00:00:00+00:00') TO ('2027-01-01 00:00:00+00:00')"
+        ))
+
+    @skipUnless(connection.vendor != 'postgresql', 'Проверка поведения без PostgreSQL')
+    def test_noop_without_postgres(self):
+        """Тест, что на других СУБД секции не создаются"""
+        self.assertFalse(PayoutPartitionService.is_partitioned())
+        self.assertEqual(PayoutPartitionService.ensure_partitions(), [])
+
+    @skipUnless(connection.vendor == 'postgresql', 'Секционирование - только в PostgreSQL')
+    def test_rows_routed_to_monthly_partitions(self):
+        """Тест миграции: таблица секционирована, строки попадают в секции своего месяца"""
+        self.assertTrue(PayoutPartitionService.is_partitioned())
+        with connection.schema_editor() as schema_editor:
+            # Повторный запуск миграции ничего не меняет
+            PayoutPartitionService.partition_table(schema_editor)
+        with patch('api_payouts.redis_client.get_redis_connection'):
+            PayoutPartitionService.ensure_partitions(months_ahead=2)
+
+        current = PayoutPartitionService.month_start(timezone.now())
+        next_month = PayoutPartitionService.next_month(current)
+        # Дальше любых созданных заранее секций
+        far = date(current.year + 5, 1, 1)
+        expected = {
+            # Текущий месяц покрыт секцией legacy: ее граница - начало следующего месяца на момент миграции
+            timezone.now() - timedelta(days=400): PayoutPartitionService.LEGACY,
+            PayoutPartitionService.bound(next_month): PayoutPartitionService.partition_name(next_month),
+            PayoutPartitionService.bound(far): PayoutPartitionService.DEFAULT,
+        }
+        for created_at, partition in expected.items():
+            payout = Payout.objects.create(
+                amount=Decimal('100.00'), currency=Currency.RUB, recipient_details={'card_number': '5555555555554444'},
+            )
+            Payout.objects.filter(id=payout.id).update(created_at=created_at)
+            with connection.cursor() as cursor:
+                cursor.execute(f"SELECT tableoid::regclass::text FROM {PayoutPartitionService.TABLE} WHERE id = %s",
+                               [payout.id])
+                self.assertEqual(cursor.fetchone()[0], partition)
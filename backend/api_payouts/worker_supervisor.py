@@ -0,0 +1,309 @@
+import logging
+import math
+import signal
+import subprocess
+import sys
+import threading
+import time
+
+from celery import current_app
+from django.conf import settings
+
+from .metrics import PayoutMetrics
+from .routing import queue_depth
+
+logger = logging.getLogger(__name__)
+
+
+class ScalingPolicy:
+    """
+    Политика масштабирования пула воркеров по глубине очередей и задержке
+
+    Нужное число воркеров - глубина очередей, деленная на target_depth
+    (сообщений на воркер). Если средняя задержка от публикации до начала
+    обработки выше max_latency_ms, пул растет независимо от глубины.
+    Рост - сразу, не больше step воркеров за шаг; уменьшение - только после
+    scale_down_after секунд непрерывно низкой нагрузки, тоже по step
+    """
+
+    OPTIONS = ('min_workers', 'max_workers', 'target_depth', 'max_latency_ms', 'step', 'scale_down_after')
+
+    def __init__(self, min_workers=1, max_workers=4, target_depth=100, max_latency_ms=5000, step=1,
+                 scale_down_after=60):
+        if min_workers > max_workers:
+            raise ValueError(f"min_workers ({min_workers}) больше max_workers ({max_workers})")
+        self.min_workers = min_workers
+        self.max_workers = max_workers
+        self.target_depth = target_depth
+        self.max_latency_ms = max_latency_ms
+        self.step = step
+        self.scale_down_after = scale_down_after
+        self._idle_since = None
+
+    def desired(self, current: int, depth, latency_ms, now: float) -> int:
+        """Число воркеров на следующий шаг; depth и latency_ms могут быть None (нет данных)"""
+        target = math.ceil(depth / self.target_depth) if depth else 0
+        if latency_ms is not None and latency_ms > self.max_latency_ms:
+            target = max(target, current + self.step)
+        elif depth is None:
+            # Брокер недоступен: держим текущий размер
+            target = current
+        target = min(max(target, self.min_workers), self.max_workers)
+
+        if target >= current:
+            self._idle_since = None
+            return min(target, current + self.step)
+        if self._idle_since is None:
+            self._idle_since = now
+            return current
+        if now - self._idle_since < self.scale_down_after:
+            return current
+        # Следующее уменьшение - снова после scale_down_after
+        self._idle_since = now
+        return max(target, current - self.step)
+
+
+class WorkerProcess:
+    """Процесс воркера Celery под наблюдением супервизора"""
+
+    def __init__(self, index, process, started_at):
+        self.index = index
+        self.process = process
+        self.started_at = started_at
+        self.draining_since = None
+
+    @property
+    def pid(self):
+        return self.process.pid
+
+    def exit_code(self):
+        return self.process.poll()
+
+
+class WorkerPool:
+    """Группа одинаковых воркеров Celery на общих очередях"""
+
+    POOLS = ('prefork', 'threads')
+
+    def __init__(self, name, queues, pool='prefork', concurrency=4, prefetch_multiplier=None,
+                 max_tasks_per_child=None, policy=None):
+        if pool not in self.POOLS:
+            raise ValueError(f"Пул воркеров '{pool}' не поддерживается: {', '.join(self.POOLS)}")
+        self.name = name
+        self.queues = list(queues)
+        self.pool = pool
+        self.concurrency = concurrency
+        self.prefetch_multiplier = prefetch_multiplier
+        self.max_tasks_per_child = max_tasks_per_child
+        self.policy = policy or ScalingPolicy()
+        self.workers = []
+        self.restart_delay = 0.0
+        self.restart_at = 0.0
+        self.metrics = PayoutMetrics(f'supervisor:{name}')
+        self._consumed = None
+
+    @classmethod
+    def from_settings(cls, name, config) -> 'WorkerPool':
+        config = dict(config)
+        policy = ScalingPolicy(**{
+            **settings.PAYOUT_SUPERVISOR_POLICY,
+            **{key: config.pop(key) for key in list(config) if key in ScalingPolicy.OPTIONS},
+        })
+        return cls(name, policy=policy, **config)
+
+    @property
+    def active(self) -> list:
+        return [worker for worker in self.workers if worker.draining_since is None]
+
+    def command(self, index) -> list:
+        command = [
+            sys.executable, '-m', 'celery', '-A', 'backend', 'worker', '--loglevel=info',
+            f'--pool={self.pool}', f'--concurrency={self.concurrency}',
+            '-Q', ','.join(self.queues), '-n', f'{self.name}-{index}@%h',
+        ]
+        if self.prefetch_multiplier is not None:
+            command.append(f'--prefetch-multiplier={self.prefetch_multiplier}')
+        if self.max_tasks_per_child is not None and self.pool == 'prefork':
+            command.append(f'--max-tasks-per-child={self.max_tasks_per_child}')
+        return command
+
+    def free_index(self) -> int:
+        """Наименьший свободный номер: имена воркеров стабильны между перезапусками"""
+        used = {worker.index for worker in self.workers}
+        return next(index for index in range(len(used) + 1) if index not in used)
+
+    def latency_ms(self):
+        """Средняя задержка очередей пула с прошлого опроса; None, если ничего не обработано"""
+        consumed = latency_total = 0
+        for queue in self.queues:
+            metrics = PayoutMetrics(f'queue:{queue}').snapshot()
+            consumed += int(metrics.get('consumed', 0))
+            latency_total += int(metrics.get('latency_ms_total', 0))
+        previous, self._consumed = self._consumed, (consumed, latency_total)
+        if previous is None or consumed <= previous[0]:
+            return None
+        return (latency_total - previous[1]) / (consumed - previous[0])
+
+
+class WorkerSupervisor:
+    """
+    Супервизор воркеров Celery: пулы процессов с масштабированием по очередям
+
+    Для каждого пула из PAYOUT_SUPERVISOR_POOLS запускает процессы
+    `celery worker` (prefork или threads) и раз в interval секунд:
+    перезапускает упавшие (с нарастающей паузой, если процесс падает сразу
+    после старта), читает глубину очередей и задержку, просит у ScalingPolicy
+    нужное число воркеров и добавляет или останавливает лишние. Остановка -
+    теплая (SIGTERM: воркер дорабатывает начатые задачи), через drain_timeout
+    процесс завершается принудительно - неподтвержденные задачи (acks_late)
+    брокер выдаст снова. Решения пишутся в лог и метрики supervisor:<пул>
+    """
+
+    # Процесс, проживший меньше, считается упавшим на старте
+    MIN_UPTIME = 10.0
+    MAX_RESTART_DELAY = 60.0
+
+    def __init__(self, pools=None, interval=None, drain_timeout=None, app=None, spawn=None):
+        configs = settings.PAYOUT_SUPERVISOR_POOLS
+        names = pools or list(configs)
+        unknown = [name for name in names if name not in configs]
+        if unknown:
+            raise ValueError(f"Неизвестные пулы воркеров: {', '.join(unknown)}")
+        self.pools = [WorkerPool.from_settings(name, configs[name]) for name in names]
+        self.interval = interval or settings.PAYOUT_SUPERVISOR_INTERVAL
+        self.drain_timeout = drain_timeout or settings.PAYOUT_SUPERVISOR_DRAIN_TIMEOUT
+        self.app = app or current_app
+        self.spawn = spawn or (lambda command: subprocess.Popen(command, cwd=settings.BASE_DIR))
+        self._stopping = threading.Event()
+
+    def stop(self, *args) -> None:
+        self._stopping.set()
+
+    def run(self) -> None:
+        for sig in (signal.SIGINT, signal.SIGTERM):
+            signal.signal(sig, self.stop)
+        logger.info(f"Супервизор воркеров: пулы {', '.join(pool.name for pool in self.pools)}")
+        try:
+            while not self._stopping.is_set():
+                self.tick()
+                self._stopping.wait(self.interval)
+        finally:
+            self.shutdown()
+
+    def tick(self, now=None) -> dict:
+        """Один шаг наблюдения и масштабирования; возвращает состояние пулов"""
+        now = time.monotonic() if now is None else now
+        depths = self._depths()
+        status = {}
+        for pool in self.pools:
+            restarts = self._reap(pool, now)
+            depth = self._pool_depth(pool, depths)
+            latency_ms = pool.latency_ms()
+            current = len(pool.active)
+            desired = pool.policy.desired(current, depth, latency_ms, now)
+            self._scale(pool, desired, now)
+            status[pool.name] = {
+                'workers': len(pool.active),
+                'desired': desired,
+                'draining': len(pool.workers) - len(pool.active),
+                'depth': depth,
+                'latency_ms': latency_ms,
+            }
+            if desired != current:
+                logger.info(
+                    f"Пул {pool.name}: воркеров {current} -> {desired} (глубина {depth}, задержка {latency_ms} мс)"
+                )
+            pool.metrics.record(
+                counters={
+                    'restarts': restarts,
+                    'scaled_up': max(0, desired - current),
+                    'scaled_down': max(0, current - desired),
+                },
+                gauges={key: '' if value is None else value for key, value in status[pool.name].items()},
+            )
+        return status
+
+    def shutdown(self) -> None:
+        """Теплая остановка всех воркеров, по истечении drain_timeout - принудительная"""
+        logger.info("Супервизор воркеров: остановка")
+        now = time.monotonic()
+        for pool in self.pools:
+            for worker in pool.active:
+                self._drain(pool, worker, now)
+        deadline = now + self.drain_timeout
+        while any(pool.workers for pool in self.pools) and time.monotonic() < deadline:
+            for pool in self.pools:
+                pool.workers = [worker for worker in pool.workers if worker.exit_code() is None]
+            time.sleep(0.2)
+        for pool in self.pools:
+            for worker in pool.workers:
+                logger.warning(f"Воркер {pool.name}-{worker.index} не остановился за {self.drain_timeout} с")
+                worker.process.kill()
+            pool.workers = []
+
+    def _start(self, pool, now):
+        index = pool.free_index()
+        worker = WorkerProcess(index, self.spawn(pool.command(index)), now)
+        pool.workers.append(worker)
+        logger.info(f"Запущен воркер {pool.name}-{index} (PID {worker.pid})")
+
+    def _drain(self, pool, worker, now):
+        worker.draining_since = now
+        worker.process.send_signal(signal.SIGTERM)
+        logger.info(f"Останавливается воркер {pool.name}-{worker.index} (PID {worker.pid})")
+
+    def _scale(self, pool, desired, now):
+        active = pool.active
+        if len(active) > desired:
+            # Останавливаются самые новые: у старых прогреты соединения и кеши
+            for worker in sorted(active, key=lambda worker: worker.started_at)[desired:]:
+                self._drain(pool, worker, now)
+            return
+        if len(active) < desired and now >= pool.restart_at:
+            for _ in range(desired - len(active)):
+                self._start(pool, now)
+
+    def _reap(self, pool, now) -> int:
+        """Убрать завершившиеся процессы; упавшие будут перезапущены в _scale. Возвращает число падений"""
+        crashed = 0
+        alive = []
+        for worker in pool.workers:
+            code = worker.exit_code()
+            if worker.draining_since is not None:
+                if code is None and now - worker.draining_since >= self.drain_timeout:
+                    logger.warning(f"Воркер {pool.name}-{worker.index} не остановился за {self.drain_timeout} с")
+                    worker.process.kill()
+                    worker.process.wait()
+                    continue
+                if code is None:
+                    alive.append(worker)
+                continue
+            if code is None:
+                alive.append(worker)
+                continue
+
+            crashed += 1
+            logger.error(f"Воркер {pool.name}-{worker.index} (PID {worker.pid}) завершился с кодом {code}")
+            if now - worker.started_at < self.MIN_UPTIME:
+                pool.restart_delay = min(max(pool.restart_delay * 2, 1.0), self.MAX_RESTART_DELAY)
+                pool.restart_at = now + pool.restart_delay
+                logger.warning(f"Пул {pool.name}: перезапуск через {pool.restart_delay:.0f} с")
+            else:
+                pool.restart_delay = 0.0
+        pool.workers = alive
+        return crashed
+
+    def _depths(self) -> dict:
+        queues = {queue for pool in self.pools for queue in pool.queues}
+        try:
+            with self.app.connection_for_read() as connection:
+                channel = connection.default_channel
+                return {queue: queue_depth(channel, queue) for queue in queues}
+        except Exception as exc:
+            logger.warning(f"Не удалось получить глубину очередей: {exc}")
+            return {}
+
+    @staticmethod
+    def _pool_depth(pool, depths):
+        known = [depths[queue] for queue in pool.queues if depths.get(queue) is not None]
+        return sum(known) if known else None
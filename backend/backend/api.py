@@ -4,6 +4,7 @@ from ninja import NinjaAPI
 from ninja.errors import ValidationError
 
 from api_payouts.api import router as api_app_payment_router
+from api_payouts.api import metrics_router as api_app_metrics_router
 
 
 api = NinjaAPI(
@@ -15,6 +16,7 @@ api = NinjaAPI(
 )
 
 api.add_router("/payouts/", api_app_payment_router)
+api.add_router("/payouts-metrics/", api_app_metrics_router)
 
 
 @api.exception_handler(ValidationError)
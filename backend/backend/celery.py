@@ -1,6 +1,7 @@
 import os
 from celery import Celery
 from celery.schedules import crontab
+from kombu import Queue
 
 os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
 
@@ -22,6 +23,54 @@ app.conf.update(
     task_time_limit=30 * 60,
     worker_concurrency=4,
     task_track_started=True,
+    # Результаты и состояния задач (PROGRESS, STARTED) живут час: итог выплаты хранится в ее строке
+    result_expires=60 * 60,
+    task_queues=(
+        Queue('celery'),
+        Queue('payouts.urgent'),
+        Queue('payouts.default'),
+        Queue('payouts.bulk'),
+    ),
+    task_routes=('api_payouts.routing.route_payout_task',),
 )
 
+app.conf.beat_schedule = {
+    'dispatch-due-payouts': {
+        'task': 'api_payouts.tasks.dispatch_due_payouts',
+        'schedule': 5.0,
+    },
+    'dispatch-fair-payouts': {
+        'task': 'api_payouts.tasks.dispatch_fair_payouts',
+        'schedule': 1.0,
+    },
+    'process-payout-batch': {
+        'task': 'api_payouts.tasks.payout_batch_task',
+        'schedule': 2.0,
+    },
+    'flush-submit-batches': {
+        'task': 'api_payouts.tasks.flush_submit_batches',
+        'schedule': 1.0,
+    },
+    'consolidate-ledger': {
+        'task': 'api_payouts.tasks.consolidate_ledger',
+        'schedule': crontab(minute='*'),
+    },
+    'prune-task-results': {
+        'task': 'api_payouts.tasks.prune_task_results',
+        'schedule': crontab(minute='*/10'),
+    },
+    'reconcile-settlement': {
+        'task': 'api_payouts.tasks.reconcile_settlement',
+        'schedule': crontab(hour=6, minute=0),
+    },
+    'ensure-payout-partitions': {
+        'task': 'api_payouts.tasks.ensure_payout_partitions',
+        'schedule': crontab(hour=3, minute=0),
+    },
+    'reap-stuck-payouts': {
+        'task': 'api_payouts.tasks.reap_stuck_payouts',
+        'schedule': crontab(minute='*'),
+    },
+}
+
 app.autodiscover_tasks()
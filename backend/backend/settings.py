@@ -180,4 +180,152 @@ CACHES = {
             "CLIENT_CLASS": "django_redis.client.DefaultClient",
         }
     }
-}
\ No newline at end of file
+}
+
+# Payouts processing
+
+# Коалесцирование записей прогресса задач в result backend
+PAYOUT_PROGRESS_MIN_INTERVAL = env.float('PAYOUT_PROGRESS_MIN_INTERVAL', default=1.0)
+PAYOUT_PROGRESS_MIN_DELTA = env.float('PAYOUT_PROGRESS_MIN_DELTA', default=0.5)
+PAYOUT_PROGRESS_DISABLED_QUEUES = env.list('PAYOUT_PROGRESS_DISABLED_QUEUES', default=[])
+
+# Аренда (lease) выплаты в Redis на время обработки, секунды
+PAYOUT_LEASE_TTL = env.int('PAYOUT_LEASE_TTL', default=60)
+
+# Планировщик отложенных выплат (execute_at)
+PAYOUT_SCHEDULER_BATCH_SIZE = env.int('PAYOUT_SCHEDULER_BATCH_SIZE', default=500)
+PAYOUT_SCHEDULER_MAX_BATCHES = env.int('PAYOUT_SCHEDULER_MAX_BATCHES', default=20)
+
+# Возврат выплат, зависших в статусе 'processing'
+PAYOUT_STUCK_PROCESSING_TIMEOUT = env.int('PAYOUT_STUCK_PROCESSING_TIMEOUT', default=10 * 60)
+PAYOUT_REAPER_CHUNK_SIZE = env.int('PAYOUT_REAPER_CHUNK_SIZE', default=500)
+PAYOUT_REAPER_MAX_CHUNKS = env.int('PAYOUT_REAPER_MAX_CHUNKS', default=20)
+PAYOUT_REAPER_MAX_REAPS = env.int('PAYOUT_REAPER_MAX_REAPS', default=3)
+
+# Срок хранения контрольных точек этапов обработки, секунды
+PAYOUT_CHECKPOINT_TTL = env.int('PAYOUT_CHECKPOINT_TTL', default=24 * 60 * 60)
+
+# Имитация задержек этапов обработки (см. LatencySimulator)
+PAYOUT_LATENCY_SIMULATION = env.bool('PAYOUT_LATENCY_SIMULATION', default=False)
+# Например: {'default': {'distribution': 'uniform', 'low': 0.05, 'high': 0.2},
+#            'submit': {'distribution': 'lognormal', 'mu': -1.5, 'sigma': 0.5}}
+# Без настройки этап ждет объявленную длительность (duration)
+PAYOUT_STAGE_LATENCY = {}
+
+# Режим запуска обработки: 'task' - задача на каждую выплату, 'batch' - пакетный воркер
+PAYOUT_PROCESSING_MODE = env.str('PAYOUT_PROCESSING_MODE', default='task')
+PAYOUT_BATCH_SIZE = env.int('PAYOUT_BATCH_SIZE', default=100)
+PAYOUT_BATCH_WORKERS = env.int('PAYOUT_BATCH_WORKERS', default=8)
+PAYOUT_BATCH_MAX_BATCHES = env.int('PAYOUT_BATCH_MAX_BATCHES', default=10)
+
+# Маршрутизация выплат по очередям: пороги сумм по валютам
+PAYOUT_ROUTING_URGENT_AMOUNT = {'RUB': 1_000_000, 'USD': 10_000, 'EUR': 10_000}
+PAYOUT_ROUTING_BULK_AMOUNT = {'RUB': 10_000, 'USD': 100, 'EUR': 100}
+
+# Справедливая диспетчеризация по мерчантам (per-tenant очереди в Redis)
+PAYOUT_FAIR_SCHEDULING = env.bool('PAYOUT_FAIR_SCHEDULING', default=False)
+PAYOUT_FAIR_QUANTUM = env.int('PAYOUT_FAIR_QUANTUM', default=10)
+PAYOUT_FAIR_TENANT_CONCURRENCY = env.int('PAYOUT_FAIR_TENANT_CONCURRENCY', default=50)
+PAYOUT_FAIR_INFLIGHT_TTL = env.int('PAYOUT_FAIR_INFLIGHT_TTL', default=10 * 60)
+PAYOUT_FAIR_MAX_ROUNDS = env.int('PAYOUT_FAIR_MAX_ROUNDS', default=50)
+# Переопределения по мерчантам: {'<merchant_id>': {'concurrency': 5, 'weight': 2}}
+PAYOUT_FAIR_TENANT_LIMITS = {}
+
+# Предохранитель (circuit breaker) отправки в платежную систему
+PAYOUT_BREAKER_FAILURE_THRESHOLD = env.int('PAYOUT_BREAKER_FAILURE_THRESHOLD', default=5)
+PAYOUT_BREAKER_WINDOW = env.int('PAYOUT_BREAKER_WINDOW', default=60)
+PAYOUT_BREAKER_COOLDOWN = env.int('PAYOUT_BREAKER_COOLDOWN', default=30)
+PAYOUT_BREAKER_PROBE_TIMEOUT = env.int('PAYOUT_BREAKER_PROBE_TIMEOUT', default=30)
+
+# Клиент платежной системы: 'simulated' - имитация задержки, 'http' - HTTP API провайдера
+PAYOUT_GATEWAY = env.str('PAYOUT_GATEWAY', default='simulated')
+PAYOUT_GATEWAY_URL = env.str('PAYOUT_GATEWAY_URL', default='http://127.0.0.1:8090')
+PAYOUT_GATEWAY_POOL_SIZE = env.int('PAYOUT_GATEWAY_POOL_SIZE', default=20)
+PAYOUT_GATEWAY_CONNECT_TIMEOUT = env.float('PAYOUT_GATEWAY_CONNECT_TIMEOUT', default=2.0)
+PAYOUT_GATEWAY_READ_TIMEOUT = env.float('PAYOUT_GATEWAY_READ_TIMEOUT', default=10.0)
+
+# Пакетная отправка в платежную систему: пачки по провайдеру и валюте
+PAYOUT_SUBMIT_BATCHING = env.bool('PAYOUT_SUBMIT_BATCHING', default=False)
+PAYOUT_SUBMIT_BATCH_SIZE = env.int('PAYOUT_SUBMIT_BATCH_SIZE', default=200)
+PAYOUT_SUBMIT_BATCH_MAX_AGE = env.float('PAYOUT_SUBMIT_BATCH_MAX_AGE', default=2.0)
+# Аренда выплаты, ждущей в пачке: сборщик зависших и повторная доставка ее не трогают
+PAYOUT_SUBMIT_BATCH_LEASE_TTL = env.int('PAYOUT_SUBMIT_BATCH_LEASE_TTL', default=600)
+
+# Сведение выплат одному получателю (netting): окно удержания в секундах, 0 - выключено
+PAYOUT_NETTING_WINDOW = env.int('PAYOUT_NETTING_WINDOW', default=0)
+PAYOUT_NETTING_MAX_GROUPS = env.int('PAYOUT_NETTING_MAX_GROUPS', default=200)
+
+# Лимит суммы одного перевода у провайдера: крупные выплаты делятся на части
+PAYOUT_TRANSFER_CAPS = {'RUB': 600_000, 'USD': 10_000, 'EUR': 10_000}
+
+# Книга учета: резерв средств на счетах финансирования мерчантов
+PAYOUT_LEDGER_ENABLED = env.bool('PAYOUT_LEDGER_ENABLED', default=False)
+# Количество шардов нового счета финансирования (резервы распределяются по шардам)
+PAYOUT_LEDGER_SHARDS = env.int('PAYOUT_LEDGER_SHARDS', default=8)
+
+# Лимиты частоты выплат (скользящие окна в Redis), пусто - без лимитов. Например:
+# {'RUB': {'card': {'hour': {'count': 10, 'amount': 300_000}, 'day': {'count': 30, 'amount': 1_000_000}},
+#          'merchant': {'hour': {'count': 5_000}, 'day': {'amount': 50_000_000}}}}
+PAYOUT_VELOCITY_LIMITS = {}
+
+# Выявление дубликатов при создании: окно в секундах (0 - выключено) и размер фильтра Блума.
+# 2^24 бит (2 МБ на поколение) и 7 хешей - ~1% ложных срабатываний на 1,5 млн выплат за окно
+PAYOUT_DUPLICATE_WINDOW = env.int('PAYOUT_DUPLICATE_WINDOW', default=0)
+PAYOUT_DUPLICATE_BLOOM_BITS = env.int('PAYOUT_DUPLICATE_BLOOM_BITS', default=2 ** 24)
+PAYOUT_DUPLICATE_BLOOM_HASHES = env.int('PAYOUT_DUPLICATE_BLOOM_HASHES', default=7)
+
+# Курсы валют для выплат из счета в другой валюте: источник 'static' (таблица ниже) или 'http'
+PAYOUT_FX_SOURCE = env.str('PAYOUT_FX_SOURCE', default='static')
+PAYOUT_FX_SOURCE_URL = env.str('PAYOUT_FX_SOURCE_URL', default='http://127.0.0.1:8090')
+# Стоимость единицы валюты в общей расчетной единице (кросс-курсы считаются из таблицы)
+PAYOUT_FX_RATES = {'RUB': '1', 'USD': '92.50', 'EUR': '100.50'}
+# Время жизни курсов в кеше (с) и доля ttl, после которой курсы обновляются в фоне
+PAYOUT_FX_CACHE_TTL = env.int('PAYOUT_FX_CACHE_TTL', default=300)
+PAYOUT_FX_REFRESH_AHEAD = env.float('PAYOUT_FX_REFRESH_AHEAD', default=0.8)
+
+# Асинхронный воркер (manage.py run_async_worker): очереди и число одновременно обрабатываемых выплат
+PAYOUT_ASYNC_WORKER_QUEUES = env.list('PAYOUT_ASYNC_WORKER_QUEUES', default=['payouts.default'])
+PAYOUT_ASYNC_WORKER_CONCURRENCY = env.int('PAYOUT_ASYNC_WORKER_CONCURRENCY', default=100)
+
+# Очистка result backend от результатов без срока жизни: размер порции SCAN и предел ключей за запуск
+# (следующий запуск продолжает обход с сохраненного курсора)
+PAYOUT_RESULT_PRUNE_BATCH = env.int('PAYOUT_RESULT_PRUNE_BATCH', default=1000)
+PAYOUT_RESULT_PRUNE_MAX_KEYS = env.int('PAYOUT_RESULT_PRUNE_MAX_KEYS', default=200_000)
+
+# Супервизор воркеров (run_celery.py): пулы процессов celery worker и политика масштабирования.
+# В пуле можно переопределить поля политики: min_workers, max_workers, target_depth (сообщений
+# на воркер), max_latency_ms, step, scale_down_after (с)
+PAYOUT_SUPERVISOR_POOLS = {
+    'default': {'queues': ['celery', 'payouts.default'], 'pool': 'prefork', 'concurrency': 4,
+                'max_workers': 4},
+    'urgent': {'queues': ['payouts.urgent'], 'pool': 'prefork', 'concurrency': 4, 'prefetch_multiplier': 1,
+               'max_workers': 2, 'max_latency_ms': 1000},
+    'bulk': {'queues': ['payouts.bulk'], 'pool': 'threads', 'concurrency': 16, 'prefetch_multiplier': 16,
+             'min_workers': 0, 'max_workers': 4, 'target_depth': 1000},
+}
+PAYOUT_SUPERVISOR_POLICY = {'min_workers': 1, 'max_workers': 4, 'target_depth': 100, 'max_latency_ms': 5000,
+                            'step': 1, 'scale_down_after': 60}
+PAYOUT_SUPERVISOR_INTERVAL = env.float('PAYOUT_SUPERVISOR_INTERVAL', default=5.0)
+PAYOUT_SUPERVISOR_DRAIN_TIMEOUT = env.float('PAYOUT_SUPERVISOR_DRAIN_TIMEOUT', default=120.0)
+
+# Сверка с файлами расчетов платежной системы (CSV: payout_id, amount, currency, status, отсортирован по payout_id).
+# Каталог пуст - ежедневная сверка выключена; контрольная точка пишется каждые N сверенных записей
+PAYOUT_SETTLEMENT_DIR = env.str('PAYOUT_SETTLEMENT_DIR', default='')
+PAYOUT_SETTLEMENT_FILE_PATTERN = env.str('PAYOUT_SETTLEMENT_FILE_PATTERN', default='settlement-{date}.csv')
+PAYOUT_RECONCILIATION_CHECKPOINT_EVERY = env.int('PAYOUT_RECONCILIATION_CHECKPOINT_EVERY', default=10_000)
+PAYOUT_RECONCILIATION_CHUNK_SIZE = env.int('PAYOUT_RECONCILIATION_CHUNK_SIZE', default=2000)
+# Статусы файла расчетов -> статусы выплат
+PAYOUT_SETTLEMENT_STATUSES = {
+    'settled': 'completed',
+    'completed': 'completed',
+    'failed': 'failed',
+    'rejected': 'failed',
+    'returned': 'failed',
+    'pending': 'processing',
+}
+
+# Секционирование таблицы выплат по месяцам created_at (PostgreSQL): на сколько месяцев вперед
+# создавать секции; окно списка выплат по умолчанию в днях (0 - без ограничения; имеет смысл
+# только для секционированной таблицы - отсекает старые секции)
+PAYOUT_PARTITION_MONTHS_AHEAD = env.int('PAYOUT_PARTITION_MONTHS_AHEAD', default=3)
+PAYOUT_LIST_WINDOW_DAYS = env.int('PAYOUT_LIST_WINDOW_DAYS', default=0)
@@ -1,12 +1,15 @@
-import multiprocessing
-import subprocess
-import time
+import argparse
+import logging
+import os
 
-""" 
-//run celery Windows
+import django
+
+"""
+//run celery Windows (одиночный воркер без супервизора)
 celery -A backend worker --loglevel=info --pool=solo
-//or 
-run_celery.py
+//run supervisor: пулы воркеров из PAYOUT_SUPERVISOR_POOLS с автомасштабированием
+python run_celery.py
+python run_celery.py --pools default,urgent
 ////
 //run task
 python manage.py shell
@@ -14,36 +17,23 @@ from app.tasks import cleanup_sessions
 cleanup_sessions.delay()
 """
 
-def run_celery_worker():
-    """Функция для запуска в отдельном процессе"""
-    try:
-        subprocess.call([
-            'celery', '-A', 'backend', 'worker',
-            '--loglevel=info',
-            '--pool=solo',
-            '--concurrency=4'
-        ])
-    except KeyboardInterrupt:
-        print("Worker остановлен")
 
+def main():
+    parser = argparse.ArgumentParser(description='Супервизор воркеров Celery')
+    parser.add_argument('--pools', default=None, help='Пулы через запятую (по умолчанию все из настроек)')
+    parser.add_argument('--interval', type=float, default=None, help='Период опроса очередей, с')
+    options = parser.parse_args()
 
-def start_worker_in_process():
-    """Запуск worker в отдельном процессе"""
-    process = multiprocessing.Process(target=run_celery_worker)
-    process.start()
-    print(f"Worker запущен в процессе с PID: {process.pid}")
-    return process
+    os.environ.setdefault('DJANGO_SETTINGS_MODULE', 'backend.settings')
+    django.setup()
+    logging.basicConfig(level=logging.INFO, format='%(asctime)s %(levelname)s %(name)s: %(message)s')
 
+    from backend.celery import app
+    from api_payouts.worker_supervisor import WorkerSupervisor
 
+    pools = options.pools.split(',') if options.pools else None
+    WorkerSupervisor(pools=pools, interval=options.interval, app=app).run()
 
-if __name__ == "__main__":
-    worker_process = start_worker_in_process()
 
-
-    try:
-        while True:
-            time.sleep(1)
-    except KeyboardInterrupt:
-        print("Останавливаем worker...")
-        worker_process.terminate()
-        worker_process.join()
\ No newline at end of file
+if __name__ == "__main__":
+    main()